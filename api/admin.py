@@ -1,5 +1,20 @@
 from django.contrib import admin
-from .models import Categoria, Curso, ConfiguracaoIA, Interacao
+from django.contrib.admin.views.main import ORDER_VAR
+from . import full_text
+from .models import Categoria, Curso, ConfiguracaoIA, Conversa, Interacao, ItemLote, Lote, MaterialCurso
+
+class BuscaTextualAdmin(admin.ModelAdmin):
+    """
+    Busca do admin pelo índice de busca textual (ver full_text.py), ordenada
+    por relevância quando nenhuma coluna foi escolhida para ordenar.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term:
+            resultado = full_text.buscar(queryset, search_term, ordenar=ORDER_VAR not in request.GET)
+            if resultado is not None:
+                return resultado, False
+        return super().get_search_results(request, queryset, search_term)
 
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
@@ -8,23 +23,63 @@ class CategoriaAdmin(admin.ModelAdmin):
     list_filter = ('data_criacao',)
 
 @admin.register(Curso)
-class CursoAdmin(admin.ModelAdmin):
+class CursoAdmin(BuscaTextualAdmin):
     list_display = ('titulo', 'categoria', 'nivel', 'carga_horaria', 'ativo', 'data_publicacao')
+    list_select_related = ('categoria',)
     search_fields = ('titulo', 'descricao', 'categoria__nome')
     list_filter = ('nivel', 'ativo', 'categoria', 'data_publicacao')
     date_hierarchy = 'data_publicacao'
 
 @admin.register(ConfiguracaoIA)
 class ConfiguracaoIAAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'modelo', 'temperatura', 'max_tokens', 'ativo', 'data_criacao')
+    list_display = ('nome', 'provedor', 'modelo', 'temperatura', 'max_tokens', 'peso', 'hedge_ativo', 'ativo', 'data_criacao')
     search_fields = ('nome', 'descricao', 'modelo')
-    list_filter = ('modelo', 'ativo', 'data_criacao')
+    list_filter = ('provedor', 'modelo', 'ativo', 'data_criacao')
+    date_hierarchy = 'data_criacao'
+
+@admin.register(Conversa)
+class ConversaAdmin(admin.ModelAdmin):
+    list_display = ('id', 'curso', 'usuario', 'interacoes_resumidas', 'data_atualizacao')
+    list_select_related = ('curso', 'usuario')
+    search_fields = ('resumo', 'curso__titulo', 'usuario__username')
+    list_filter = ('curso', 'data_criacao')
     date_hierarchy = 'data_criacao'
+    readonly_fields = ('chave', 'resumo', 'interacoes_resumidas', 'data_criacao', 'data_atualizacao')
 
 @admin.register(Interacao)
-class InteracaoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'curso', 'configuracao_ia', 'tokens_utilizados', 'data_criacao')
+class InteracaoAdmin(BuscaTextualAdmin):
+    list_display = ('id', 'curso', 'configuracao_ia', 'resultado', 'cache', 'tokens_utilizados',
+                    'latencia_total', 'data_criacao')
+    list_select_related = ('curso', 'configuracao_ia')
     search_fields = ('pergunta', 'resposta', 'curso__titulo')
-    list_filter = ('curso', 'configuracao_ia', 'data_criacao')
+    list_filter = ('curso', 'configuracao_ia', 'resultado', 'cache', 'data_criacao')
     date_hierarchy = 'data_criacao'
-    readonly_fields = ('pergunta', 'resposta', 'tokens_utilizados', 'data_criacao')
+    readonly_fields = ('pergunta', 'resposta', 'tokens_utilizados', 'tokens_prompt', 'tokens_resposta',
+                       'tokens_descartados', 'resultado', 'cache', 'provedor', 'modelo', 'latencia_total',
+                       'latencia_provedor', 'latencia_primeiro_token', 'data_criacao')
+
+class ItemLoteInline(admin.TabularInline):
+    model = ItemLote
+    fields = ('request_id', 'curso', 'pergunta', 'status', 'interacao', 'erro')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = True
+
+@admin.register(Lote)
+class LoteAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'curso', 'status', 'total', 'concluidos', 'falhas', 'data_criacao')
+    list_select_related = ('curso',)
+    search_fields = ('nome', 'curso__titulo')
+    list_filter = ('status', 'curso', 'data_criacao')
+    date_hierarchy = 'data_criacao'
+    readonly_fields = ('status', 'total', 'concluidos', 'falhas', 'erro', 'sinal_vida', 'data_criacao', 'data_atualizacao')
+    inlines = [ItemLoteInline]
+
+@admin.register(MaterialCurso)
+class MaterialCursoAdmin(admin.ModelAdmin):
+    list_display = ('titulo', 'curso', 'data_atualizacao')
+    list_select_related = ('curso',)
+    search_fields = ('titulo', 'conteudo', 'curso__titulo')
+    list_filter = ('curso', 'data_atualizacao')
+    readonly_fields = ('data_criacao', 'data_atualizacao')
@@ -0,0 +1,370 @@
+"""
+Cache de respostas para perguntas repetidas sobre um mesmo curso.
+
+O nível exato usa como chave o curso (com a versão dele, trocada a cada
+alteração), a configuração de IA, a pergunta normalizada e o hash do
+contexto. O nível de similaridade (opcional) reutiliza respostas de
+perguntas parafraseadas, comparando-as por TF-IDF com as
+HISTORICO_SIMILARIDADE interações mais recentes do curso. Só perguntas
+sem contexto do cliente e sem histórico de conversa usam a similaridade
+(os trechos dos materiais do curso, recuperados a partir da própria
+pergunta, não a impedem); o índice é carregado só das interações marcadas
+com sem_contexto.
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'ATIVO': True,
+    'BACKEND': 'memoria',
+    'ALIAS': 'default',
+    'TTL': 60 * 60 * 24,
+    'MAX_ENTRADAS': 5000,
+    'SIMILARIDADE': False,
+    'LIMIAR_SIMILARIDADE': 0.85,
+    'HISTORICO_SIMILARIDADE': 1000,
+}
+
+_RE_NAO_PALAVRA = re.compile(r"[^\w\s]")
+_RE_ESPACOS = re.compile(r"\s+")
+
+# Palavras muito frequentes que não ajudam a distinguir perguntas
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por pelo pela
+para com sem que e ou se como qual quais quando onde me te lhe eu voce isso
+isto esse essa este esta ao aos sobre mais muito ja nao sim e ser ter
+""".split())
+
+
+def normalizar_pergunta(texto):
+    """
+    Normaliza a pergunta para comparação: minúsculas, sem acentos, sem
+    pontuação e com espaços simples.
+    """
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = _RE_NAO_PALAVRA.sub(" ", texto)
+    return _RE_ESPACOS.sub(" ", texto).strip()
+
+
+def _hash(texto):
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def _versao_config(config):
+    return int(config.data_atualizacao.timestamp()) if config.data_atualizacao else 0
+
+
+class MemoryCacheBackend:
+    """
+    Backend em memória do processo, com expiração (TTL) e descarte LRU.
+    """
+
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is None:
+                return None
+            expira_em, valor = entrada
+            if expira_em < time.monotonic():
+                del self._dados[chave]
+                return None
+            self._dados.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_entradas:
+                self._dados.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Backend sobre o framework de cache do Django (compartilhado entre
+    processos quando o cache configurado é Redis, Memcached ou banco).
+    A política de descarte é a do próprio cache configurado.
+    """
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def get(self, chave):
+        return self.cache.get(chave)
+
+    def set(self, chave, valor):
+        self.cache.set(chave, valor, self.ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class SimilarityIndex:
+    """
+    Índice TF-IDF das perguntas já respondidas de um curso com uma
+    configuração de IA. Guarda até `max_documentos` perguntas; acima disso,
+    as mais antigas saem (FIFO).
+    """
+
+    def __init__(self, max_documentos=1000):
+        self.max_documentos = max_documentos
+        self._documentos = OrderedDict()
+        self._termos = {}
+        self._df = Counter()
+        self._proximo = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tokenizar(texto):
+        return [t for t in normalizar_pergunta(texto).split() if t not in STOPWORDS]
+
+    def add(self, pergunta, entrada):
+        termos = Counter(self._tokenizar(pergunta))
+        if not termos:
+            return
+        with self._lock:
+            indice = self._proximo
+            self._proximo += 1
+            self._documentos[indice] = (termos, entrada)
+            for termo in termos:
+                self._df[termo] += 1
+                self._termos.setdefault(termo, set()).add(indice)
+            while len(self._documentos) > self.max_documentos:
+                self._descartar_mais_antigo()
+
+    def _descartar_mais_antigo(self):
+        indice, (termos, _) = self._documentos.popitem(last=False)
+        for termo in termos:
+            self._df[termo] -= 1
+            documentos = self._termos[termo]
+            documentos.discard(indice)
+            if not documentos:
+                del self._termos[termo]
+                del self._df[termo]
+
+    def _idf(self, termo, total):
+        return math.log((1 + total) / (1 + self._df[termo])) + 1
+
+    def _vetor(self, termos, total):
+        return {t: f * self._idf(t, total) for t, f in termos.items()}
+
+    def buscar(self, pergunta, limiar):
+        """
+        Retorna (similaridade, entrada) da pergunta mais parecida, se a
+        similaridade do cosseno atingir o limiar.
+        """
+        termos = Counter(self._tokenizar(pergunta))
+        if not termos:
+            return None
+
+        with self._lock:
+            total = len(self._documentos)
+            candidatos = {i for t in termos for i in self._termos.get(t, ())}
+            if not candidatos:
+                return None
+
+            consulta = self._vetor(termos, total)
+            norma_consulta = math.sqrt(sum(v * v for v in consulta.values()))
+            melhor = None
+            for i in candidatos:
+                doc_termos, entrada = self._documentos[i]
+                doc = self._vetor(doc_termos, total)
+                produto = sum(v * doc.get(t, 0.0) for t, v in consulta.items())
+                norma_doc = math.sqrt(sum(v * v for v in doc.values()))
+                similaridade = produto / (norma_consulta * norma_doc)
+                if melhor is None or similaridade > melhor[0]:
+                    melhor = (similaridade, entrada)
+
+        if melhor and melhor[0] >= limiar:
+            return melhor
+        return None
+
+    def __len__(self):
+        return len(self._documentos)
+
+
+class AnswerCache:
+    """
+    Cache de respostas do endpoint perguntar, com contadores de acertos.
+    """
+
+    def __init__(self, backend, similaridade=False, limiar=0.85, historico=1000):
+        self.backend = backend
+        self.similaridade = similaridade
+        self.limiar = limiar
+        self.historico = historico
+        self._indices = {}
+        # Invalidações por curso, para não guardar um índice carregado antes da última
+        self._geracoes = Counter()
+        self._indices_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(CONFIG_PADRAO, **getattr(settings, 'CACHE_RESPOSTAS', {}))
+        if not conf['ATIVO']:
+            return None
+        if conf['BACKEND'] == 'django':
+            backend = DjangoCacheBackend(conf['ALIAS'], conf['TTL'])
+        else:
+            backend = MemoryCacheBackend(conf['MAX_ENTRADAS'], conf['TTL'])
+        return cls(
+            backend,
+            similaridade=conf['SIMILARIDADE'],
+            limiar=conf['LIMIAR_SIMILARIDADE'],
+            historico=conf['HISTORICO_SIMILARIDADE'],
+        )
+
+    def _chave_versao(self, curso_id):
+        return f"resposta:versao:{curso_id}"
+
+    def chave(self, curso_id, config, pergunta, contexto=""):
+        # A versão do curso fica no próprio backend: no backend do Django, vale para todos os processos
+        return "resposta:{}.{}:{}.{}:{}:{}".format(
+            curso_id, self.backend.get(self._chave_versao(curso_id)) or 0,
+            config.pk, _versao_config(config),
+            _hash(normalizar_pergunta(pergunta)), _hash(contexto or ""),
+        )
+
+    def get(self, curso_id, config, pergunta, contexto="", sem_contexto=None):
+        """
+        Procura uma resposta em cache. Retorna a entrada, com o campo
+        "cache" indicando o nível do acerto ("exato" ou "similar"), ou None.
+        `sem_contexto` indica que a pergunta não tem contexto do cliente nem
+        histórico (por padrão, que `contexto` é vazio) e decide se a
+        similaridade é usada.
+        """
+        entrada = self.backend.get(self.chave(curso_id, config, pergunta, contexto))
+        if entrada is not None:
+            self._registrar("exato", entrada)
+            return dict(entrada, cache="exato")
+
+        # O contexto do cliente e o histórico mudam a resposta, por isso só perguntas sem eles usam similaridade
+        if self._usa_similaridade(contexto, sem_contexto):
+            resultado = self._indice(curso_id, config).buscar(pergunta, self.limiar)
+            if resultado is not None:
+                similaridade, entrada = resultado
+                logger.debug("Resposta similar encontrada em cache (%.2f)", similaridade)
+                self._registrar("similar", entrada)
+                return dict(entrada, cache="similar")
+
+        self._registrar(None, None)
+        return None
+
+    def set(self, curso_id, config, pergunta, resposta, contexto="", tokens=0, latencia=0.0,
+            sem_contexto=None):
+        entrada = {"resposta": resposta, "tokens": tokens, "latencia": latencia}
+        self.backend.set(self.chave(curso_id, config, pergunta, contexto), entrada)
+        if self._usa_similaridade(contexto, sem_contexto):
+            self._indice(curso_id, config).add(pergunta, entrada)
+
+    def _usa_similaridade(self, contexto, sem_contexto):
+        return self.similaridade and (not contexto if sem_contexto is None else sem_contexto)
+
+    def _indice(self, curso_id, config):
+        """
+        Retorna o índice de similaridade do curso, construindo-o a partir das
+        interações anteriores na primeira consulta (só as respondidas pelo
+        provedor sem contexto do cliente nem histórico: respostas simuladas,
+        interrompidas ou geradas para outro contexto não são reutilizadas).
+        A consulta ao banco é feita fora do lock.
+        """
+        chave = (curso_id, config.pk, _versao_config(config))
+        with self._indices_lock:
+            indice = self._indices.get(chave)
+            if indice is not None:
+                return indice
+            geracao = self._geracoes[curso_id]
+
+        from .models import Interacao
+
+        indice = SimilarityIndex(self.historico)
+        interacoes = list(
+            Interacao.objects
+            .filter(curso_id=curso_id, configuracao_ia_id=config.pk, resultado='ok', sem_contexto=True)
+            .order_by('-data_criacao')
+            .values_list('pergunta', 'resposta', 'tokens_utilizados')[:self.historico]
+        )
+        # Da mais antiga para a mais recente, que é a ordem de descarte do índice
+        for pergunta, resposta, tokens in reversed(interacoes):
+            indice.add(pergunta, {"resposta": resposta, "tokens": tokens, "latencia": 0.0})
+
+        with self._indices_lock:
+            if self._geracoes[curso_id] != geracao:
+                # O curso mudou durante a carga: o índice serve só a esta consulta
+                return indice
+            indice = self._indices.setdefault(chave, indice)
+        logger.debug("Índice de similaridade do curso %s criado com %s perguntas", curso_id, len(indice))
+        return indice
+
+    def invalidate_curso(self, curso_id):
+        """
+        Descarta as respostas exatas (trocando a versão do curso na chave) e
+        o índice de similaridade do curso.
+        """
+        self.backend.set(self._chave_versao(curso_id), uuid.uuid4().hex[:12])
+        with self._indices_lock:
+            self._geracoes[curso_id] += 1
+            for chave in [c for c in self._indices if c[0] == curso_id]:
+                del self._indices[chave]
+
+    def clear(self):
+        self.backend.clear()
+        with self._indices_lock:
+            self._indices.clear()
+
+    def _registrar(self, nivel, entrada):
+        with self._stats_lock:
+            if nivel is None:
+                self._stats["misses"] += 1
+                return
+            self._stats[f"hits_{nivel}"] += 1
+            self._stats["tokens_economizados"] += entrada.get("tokens", 0)
+            self._stats["segundos_economizados"] += entrada.get("latencia", 0.0)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {
+                "hits_exato": 0,
+                "hits_similar": 0,
+                "misses": 0,
+                "tokens_economizados": 0,
+                "segundos_economizados": 0.0,
+            }
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        consultas = stats["hits_exato"] + stats["hits_similar"] + stats["misses"]
+        stats["taxa_acerto"] = (
+            (stats["hits_exato"] + stats["hits_similar"]) / consultas if consultas else 0.0
+        )
+        return stats
+
+
+answer_cache = AnswerCache.from_settings()
@@ -0,0 +1,313 @@
+"""
+Processamento em lote de perguntas (ex.: pré-geração de respostas de FAQ).
+
+As perguntas vêm de um arquivo JSONL, uma por linha, no formato:
+
+    {"request_id": "faq-1", "pergunta": "...", "curso_id": 3, "contexto": "..."}
+
+Apenas a pergunta é obrigatória ("body" também é aceito, no formato do
+requests.jsonl); sem "curso_id" vale o curso do lote e sem "request_id" vale
+o número da linha. Os itens são respondidos com concorrência limitada pela
+mesma camada do endpoint perguntar (cache, roteador, limites de taxa) e as
+interações são gravadas com bulk_create em blocos. Cada item guarda o seu
+estado, de modo que um lote interrompido é retomado a partir dos itens
+pendentes.
+
+Enquanto processa, o lote renova o seu sinal de vida a cada INTERVALO_SINAL
+segundos. Um lote 'processando' sem sinal há mais de LOTE_ABANDONADO
+segundos (o processo morreu no meio) pode ser retomado pela API ou pelo
+comando processar_lote; com sinal recente, nenhum dos dois o processa.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import full_text
+from .langchain_utils import agerar_resposta
+from .models import ConfiguracaoIA, Curso, Interacao, ItemLote, Lote
+from .rate_limit import LimiteExcedido, OrcamentoExcedido
+from .router import router
+
+logger = logging.getLogger(__name__)
+
+# Itens gravados por transação
+TAMANHO_BLOCO = 50
+
+# Tentativas de um item recusado pelo limite de taxa antes de marcá-lo com erro
+TENTATIVAS_LIMITE = 5
+
+# Segundos entre as renovações do sinal de vida e sem sinal até o lote ser considerado abandonado
+INTERVALO_SINAL = 30
+LOTE_ABANDONADO = 120
+
+
+def ler_jsonl(linhas):
+    """
+    Converte as linhas de um arquivo JSONL em itens de lote. Levanta
+    ValueError indicando a linha com problema.
+    """
+    itens = []
+    vistos = set()
+    for numero, linha in enumerate(linhas, start=1):
+        if isinstance(linha, bytes):
+            linha = linha.decode("utf-8")
+        linha = linha.strip()
+        if not linha:
+            continue
+        try:
+            dados = json.loads(linha)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Linha {numero}: JSON inválido ({e.msg}).")
+        itens.append(_item(dados, numero, vistos))
+    return itens
+
+
+def _item(dados, numero, vistos):
+    if not isinstance(dados, dict):
+        raise ValueError(f"Linha {numero}: cada linha deve ser um objeto JSON.")
+    pergunta = dados.get("pergunta") or dados.get("body")
+    if not pergunta:
+        raise ValueError(f"Linha {numero}: campo 'pergunta' ausente.")
+    request_id = str(dados.get("request_id") or numero)
+    if request_id in vistos:
+        raise ValueError(f"Linha {numero}: request_id '{request_id}' repetido.")
+    vistos.add(request_id)
+    return {
+        "request_id": request_id,
+        "pergunta": pergunta,
+        "curso_id": dados.get("curso_id"),
+        "contexto": dados.get("contexto") or "",
+    }
+
+
+def criar_lote(nome, curso, itens, configuracao_ia=None, usuario=None, concorrencia=8, lote=None):
+    """
+    Cria um lote com os itens informados. Com `lote`, acrescenta ao lote
+    existente apenas os itens cujo request_id ainda não está nele.
+    """
+    cursos = set(
+        Curso.objects.filter(id__in={i["curso_id"] for i in itens if i["curso_id"]})
+        .values_list('id', flat=True)
+    )
+    for item in itens:
+        if item["curso_id"] and item["curso_id"] not in cursos:
+            raise ValueError(f"Item '{item['request_id']}': curso {item['curso_id']} não encontrado.")
+
+    with transaction.atomic():
+        if lote is None:
+            lote = Lote.objects.create(
+                nome=nome, curso=curso, configuracao_ia=configuracao_ia,
+                usuario=usuario, concorrencia=concorrencia
+            )
+        ItemLote.objects.bulk_create(
+            [
+                ItemLote(
+                    lote=lote, request_id=item["request_id"], curso_id=item["curso_id"] or lote.curso_id,
+                    pergunta=item["pergunta"], contexto=item["contexto"]
+                )
+                for item in itens
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        lote.total = lote.itens.count()
+        lote.save(update_fields=['total', 'data_atualizacao'])
+    return lote
+
+
+async def _responder(item, configs, lote):
+    """
+    Responde um item. Em limite de taxa, aguarda e tenta de novo, por até
+    TENTATIVAS_LIMITE vezes; o orçamento esgotado interrompe o lote.
+    Respostas simuladas não são gravadas: o item fica com erro para ser
+    repetido depois.
+    """
+    inicio = time.time()
+    for tentativa in range(1, TENTATIVAS_LIMITE + 1):
+        try:
+            geracao = await agerar_resposta(
+                item.curso, router.ordenar(configs, lote.configuracao_ia_id),
+                item.pergunta, item.contexto, usuario_id=lote.usuario_id
+            )
+        except OrcamentoExcedido:
+            raise
+        except LimiteExcedido as e:
+            if tentativa == TENTATIVAS_LIMITE:
+                logger.warning("Item %s do lote %s recusado pelo limite de taxa %s vezes",
+                               item.request_id, lote.id, tentativa)
+                return {"erro": f"Limite de taxa excedido após {tentativa} tentativas: {e}"}
+            await asyncio.sleep(e.retry_after or 1)
+            continue
+        except Exception as e:
+            logger.error("Erro no item %s do lote %s: %s", item.request_id, lote.id, e)
+            return {"erro": str(e)}
+        if geracao["simulada"]:
+            return {"erro": "Nenhum provedor respondeu."}
+        return dict(geracao, latencia_total=time.time() - inicio)
+
+
+def _gravar_bloco(lote, bloco):
+    """
+    Grava as interações de um bloco de itens respondidos e atualiza o
+    estado dos itens e os contadores do lote na mesma transação.
+    """
+    novas = []
+    for item, resultado in bloco:
+        if "erro" in resultado:
+            item.status, item.erro = 'erro', resultado["erro"]
+            continue
+        interacao = Interacao(
+            curso=item.curso,
+            configuracao_ia=resultado["config"],
+            pergunta=item.pergunta,
+            resposta=resultado["resposta"],
+            tokens_utilizados=resultado["tokens_prompt"] + resultado["tokens_resposta"],
+            tokens_prompt=resultado["tokens_prompt"],
+            tokens_resposta=resultado["tokens_resposta"],
+            tokens_descartados=resultado["tokens_descartados"],
+            cache=resultado["cache"] or '',
+            provedor=resultado["config"].provedor,
+            modelo=resultado["config"].modelo,
+            latencia_total=resultado["latencia_total"],
+            latencia_provedor=resultado["latencia_provedor"],
+            sem_contexto=resultado["sem_contexto"],
+        )
+        item.status, item.erro = 'concluido', ''
+        novas.append((item, interacao))
+
+    with transaction.atomic():
+        Interacao.objects.bulk_create([interacao for _, interacao in novas])
+        full_text.indexar([interacao for _, interacao in novas])
+        for item, interacao in novas:
+            item.interacao_id = interacao.pk
+        ItemLote.objects.bulk_update([item for item, _ in bloco], ['status', 'erro', 'interacao'])
+        contagem = lote.itens.aggregate(
+            concluidos=Count('id', filter=Q(status='concluido')),
+            falhas=Count('id', filter=Q(status='erro')),
+        )
+        Lote.objects.filter(id=lote.id).update(**contagem)
+
+
+async def aprocessar_lote(lote_id, concorrencia=None, repetir_erros=False, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Processa os itens pendentes do lote (e os com erro, com repetir_erros)
+    com até `concorrencia` perguntas em andamento ao mesmo tempo.
+    """
+    lote = await Lote.objects.aget(id=lote_id)
+    concorrencia = concorrencia or lote.concorrencia
+    status_itens = ['pendente', 'erro'] if repetir_erros else ['pendente']
+    itens = [
+        item async for item in
+        lote.itens.filter(status__in=status_itens).select_related('curso__categoria')
+    ]
+    configs = [c async for c in ConfiguracaoIA.objects.filter(ativo=True)]
+
+    if not configs:
+        await Lote.objects.filter(id=lote.id).aupdate(
+            status='interrompido', erro="Nenhuma configuração de IA ativa encontrada."
+        )
+        return
+    await Lote.objects.filter(id=lote.id).aupdate(status='processando', erro='', sinal_vida=timezone.now())
+    logger.info("Processando %s itens do lote %s com concorrência %s", len(itens), lote.id, concorrencia)
+
+    fila = asyncio.Queue()
+    for item in itens:
+        fila.put_nowait(item)
+    respondidos = []
+    gravacao = asyncio.Lock()
+
+    async def gravar():
+        async with gravacao:
+            if respondidos:
+                bloco = respondidos[:]
+                respondidos.clear()
+                await sync_to_async(_gravar_bloco)(lote, bloco)
+
+    async def sinalizar():
+        while True:
+            await asyncio.sleep(INTERVALO_SINAL)
+            await Lote.objects.filter(id=lote.id).aupdate(sinal_vida=timezone.now())
+
+    async def trabalhador():
+        while not fila.empty():
+            item = fila.get_nowait()
+            respondidos.append((item, await _responder(item, configs, lote)))
+            if len(respondidos) >= tamanho_bloco:
+                await gravar()
+
+    tarefas = [asyncio.ensure_future(trabalhador()) for _ in range(min(concorrencia, len(itens)) or 1)]
+    sinal = asyncio.ensure_future(sinalizar())
+    status, erro = 'concluido', ''
+    try:
+        await asyncio.gather(*tarefas)
+    except OrcamentoExcedido as e:
+        status, erro = 'interrompido', str(e)
+    except asyncio.CancelledError:
+        status, erro = 'interrompido', "Processamento interrompido."
+        raise
+    except Exception as e:
+        # Ex.: o banco recusou um bloco; os itens não gravados continuam pendentes
+        logger.error("Erro ao processar o lote %s: %s", lote.id, e)
+        status, erro = 'erro', str(e)
+    finally:
+        for tarefa in tarefas + [sinal]:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, sinal, return_exceptions=True)
+        # Gravar o que já foi respondido antes de encerrar, inclusive na interrupção
+        try:
+            await gravar()
+        except Exception as e:
+            logger.error("Erro ao gravar os itens do lote %s: %s", lote.id, e)
+            status, erro = 'erro', str(e)
+        await Lote.objects.filter(id=lote.id).aupdate(status=status, erro=erro)
+        logger.info("Lote %s %s", lote.id, status)
+
+
+def processar_lote(lote_id, **kwargs):
+    """
+    Versão síncrona de aprocessar_lote, para o comando de gerenciamento e
+    para a thread iniciada pela API.
+    """
+    try:
+        asyncio.run(aprocessar_lote(lote_id, **kwargs))
+    finally:
+        close_old_connections()
+
+
+def reservar_lote(lote_id, repetir_erros=False):
+    """
+    Marca o lote como em processamento, se nenhum outro processo o estiver
+    processando. Um lote em processamento sem sinal de vida há mais de
+    LOTE_ABANDONADO segundos é retomado; um concluído, só com repetir_erros.
+    Retorna False se o lote está em processamento (com sinal recente) ou
+    concluído.
+    """
+    agora = timezone.now()
+    abandonado = Q(status='processando') & (
+        Q(sinal_vida__isnull=True) | Q(sinal_vida__lt=agora - timedelta(seconds=LOTE_ABANDONADO))
+    )
+    retomaveis = ['pendente', 'interrompido', 'erro'] + (['concluido'] if repetir_erros else [])
+    return bool(
+        Lote.objects.filter(Q(status__in=retomaveis) | abandonado, id=lote_id)
+        .update(status='processando', sinal_vida=agora)
+    )
+
+
+def iniciar_processamento(lote):
+    """
+    Reserva o lote (ver reservar_lote) e o processa em uma thread de fundo.
+    Retorna False se o lote está em processamento (com sinal recente) ou
+    concluído.
+    """
+    if not reservar_lote(lote.id):
+        return False
+    threading.Thread(target=processar_lote, args=(lote.id,), name=f"lote-{lote.id}", daemon=True).start()
+    return True
@@ -0,0 +1,127 @@
+"""
+Cache HTTP das listagens e detalhes do catálogo (cursos e categorias).
+
+O catálogo inteiro tem uma versão, guardada no cache do Django e trocada
+pelos signals de Curso e Categoria (ver signals.py) a cada save ou
+exclusão. A versão entra na chave das páginas em cache e no ETag, e o
+instante da troca vira o Last-Modified: uma requisição com If-None-Match
+(ou If-Modified-Since) ainda válido recebe 304 sem consultar o banco nem
+passar pelos serializers, e as páginas de versões antigas deixam de ser
+lidas e expiram pelo TTL.
+
+Com mais de um worker, CACHE_CATALOGO['ALIAS'] deve apontar para um cache
+compartilhado; caso contrário cada processo tem a sua versão e as mudanças
+feitas em um worker não invalidam as páginas dos outros.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+CONFIG_PADRAO = {
+    'ATIVO': True,
+    'ALIAS': 'default',
+    'TTL': 60 * 10,
+}
+
+CHAVE_VERSAO = "catalogo:versao"
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'CACHE_CATALOGO', {}))
+
+
+def _cache():
+    return caches[_config()['ALIAS']]
+
+
+def _nova_versao(modificado):
+    # O Last-Modified tem resolução de segundos
+    return uuid.uuid4().hex[:16], modificado.replace(microsecond=0)
+
+
+def versao_atual():
+    """
+    Retorna (versão, modificado) do catálogo. Sem versão no cache (primeiro
+    acesso ou descarte), começa uma nova, modificada agora.
+    """
+    cache = _cache()
+    estado = cache.get(CHAVE_VERSAO)
+    if estado is None:
+        estado = _nova_versao(timezone.now())
+        # Outro worker pode ter criado a versão ao mesmo tempo: vale a dele
+        if not cache.add(CHAVE_VERSAO, estado, timeout=None):
+            estado = cache.get(CHAVE_VERSAO) or estado
+    return estado
+
+
+def invalidar():
+    """
+    Troca a versão do catálogo: ETags e páginas em cache anteriores deixam de valer.
+    """
+    _cache().set(CHAVE_VERSAO, _nova_versao(timezone.now()), timeout=None)
+
+
+def _chave_pagina(request, versao, recurso):
+    # A URL absoluta cobre os parâmetros e o host dos links de paginação
+    identificacao = f"{recurso}|{request.accepted_media_type}|{request.build_absolute_uri()}"
+    return f"catalogo:{versao}:{hashlib.sha1(identificacao.encode()).hexdigest()}"
+
+
+def _nao_modificado(request, etag, modificado):
+    """
+    Avalia If-None-Match (comparação fraca) ou, na falta dele, If-Modified-Since.
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return "*" in etags or etag.removeprefix("W/") in {e.removeprefix("W/") for e in etags}
+    desde = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return desde is not None and int(modificado.timestamp()) <= desde
+
+
+class CatalogoCacheMixin:
+    """
+    Para ViewSets do catálogo: as ações list e retrieve respondem com ETag
+    e Last-Modified, devolvem 304 às requisições condicionais ainda válidas
+    e reaproveitam os dados serializados da página em cache. As permissões
+    e a negociação de conteúdo continuam valendo (rodam antes da ação).
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self._com_cache(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._com_cache(super().retrieve, request, *args, **kwargs)
+
+    def _com_cache(self, acao, request, *args, **kwargs):
+        config = _config()
+        if not config['ATIVO']:
+            return acao(request, *args, **kwargs)
+
+        versao, modificado = versao_atual()
+        chave = _chave_pagina(request, versao, self.basename)
+        etag = f'W/"{hashlib.sha1(chave.encode()).hexdigest()[:32]}"'
+        if _nao_modificado(request, etag, modificado):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = _cache()
+            dados = cache.get(chave)
+            if dados is not None:
+                response = Response(dados)
+            else:
+                response = acao(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(chave, response.data, config['TTL'])
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(modificado.timestamp())
+        # O cliente pode guardar a resposta, mas deve revalidá-la a cada uso
+        response["Cache-Control"] = "no-cache"
+        return response
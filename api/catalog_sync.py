@@ -0,0 +1,194 @@
+"""
+Sincronização em massa do catálogo (categorias e cursos) vinda de um
+sistema externo, como o LMS.
+
+Cada item é identificado pela `chave_externa`: os que já existem são
+atualizados e os demais, criados. Os itens chegam já validados pelos
+serializers de sincronização (sem consultas por linha); aqui as categorias
+referenciadas pelos cursos são resolvidas em uma consulta, os registros
+existentes são lidos em outra e a gravação é feita com bulk_create e
+bulk_update em uma única transação. Itens sem nenhuma mudança não são
+regravados. A criação é um upsert (INSERT ... ON CONFLICT DO UPDATE): se
+uma sincronização simultânea criou a mesma chave depois da leitura, o
+registro dela é atualizado em vez de a requisição falhar na restrição
+unique.
+
+Como bulk_create e bulk_update não disparam os signals, o índice de busca
+textual é atualizado aqui e os caches que dependem do catálogo (cache HTTP,
+blocos do prompt e índice de perguntas similares) são invalidados depois
+do commit.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import catalog_cache, full_text
+from .answer_cache import answer_cache
+from .course_prompt import prefixos
+from .models import Categoria, Curso
+
+CONFIG_PADRAO = {
+    'MAX_ITENS': 5000,
+    'TAMANHO_BLOCO': 500,
+}
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'SINCRONIZACAO_CATALOGO', {}))
+
+
+def max_itens():
+    """
+    Máximo de itens por requisição de sincronização.
+    """
+    return _config()['MAX_ITENS']
+
+
+def _verificar_chaves(itens):
+    vistas, repetidas = set(), set()
+    for item in itens:
+        chave = item['chave_externa']
+        (repetidas if chave in vistas else vistas).add(chave)
+    if repetidas:
+        raise ValueError(f"Chaves externas repetidas: {', '.join(sorted(repetidas))}.")
+
+
+def _diferente(model, obj, campo, valor):
+    field = model._meta.get_field(campo)
+    if field.is_relation:
+        # Compara pelo id, sem carregar o objeto relacionado
+        return getattr(obj, field.attname) != valor.pk
+    return getattr(obj, campo) != valor
+
+
+def _gravar(model, itens, campos_por_item):
+    """
+    Cria ou atualiza os registros de `model` pela chave_externa. Retorna
+    (criados, alterados, ids), com os objetos criados e alterados e o id de
+    cada chave externa.
+    """
+    tamanho_bloco = _config()['TAMANHO_BLOCO']
+    existentes = model.objects.select_for_update().in_bulk(
+        [item['chave_externa'] for item in itens], field_name='chave_externa'
+    )
+    criados, alterados, campos_alterados = [], [], set()
+    for item in itens:
+        campos = campos_por_item(item)
+        obj = existentes.get(item['chave_externa'])
+        if obj is None:
+            criados.append((model(chave_externa=item['chave_externa'], **campos), frozenset(campos)))
+            continue
+        mudancas = {campo for campo, valor in campos.items() if _diferente(model, obj, campo, valor)}
+        # Atribui também os valores iguais: os relacionados ficam em cache para a indexação
+        for campo, valor in campos.items():
+            setattr(obj, campo, valor)
+        if mudancas:
+            alterados.append(obj)
+            campos_alterados |= mudancas
+
+    # Agrupa pelos campos informados: no conflito, só eles são sobrescritos
+    grupos = {}
+    for obj, campos in criados:
+        grupos.setdefault(campos, []).append(obj)
+    auto_now = [campo.name for campo in model._meta.fields if getattr(campo, 'auto_now', False)]
+    for campos, objs in grupos.items():
+        model.objects.bulk_create(
+            objs, batch_size=tamanho_bloco, update_conflicts=True,
+            unique_fields=['chave_externa'], update_fields=sorted(campos) + auto_now,
+        )
+    criados = [obj for obj, _ in criados]
+    if alterados:
+        if any(campo.name == 'data_atualizacao' for campo in model._meta.fields):
+            # bulk_update não aplica o auto_now
+            agora = timezone.now()
+            for obj in alterados:
+                obj.data_atualizacao = agora
+            campos_alterados.add('data_atualizacao')
+        model.objects.bulk_update(alterados, sorted(campos_alterados), batch_size=tamanho_bloco)
+
+    if any(obj.pk is None for obj in criados):
+        # Bancos sem RETURNING não preenchem o id no bulk_create
+        novos = dict(model.objects.filter(
+            chave_externa__in=[obj.chave_externa for obj in criados]
+        ).values_list('chave_externa', 'pk'))
+        for obj in criados:
+            obj.pk = novos[obj.chave_externa]
+    ids = {chave: obj.pk for chave, obj in existentes.items()}
+    ids.update((obj.chave_externa, obj.pk) for obj in criados)
+    return criados, alterados, ids
+
+
+def _resumo(itens, criados, alterados, ids):
+    return {
+        'criados': len(criados),
+        'atualizados': len(alterados),
+        'inalterados': len(itens) - len(criados) - len(alterados),
+        'ids': ids,
+    }
+
+
+def _invalidar_caches(cursos_alterados):
+    catalog_cache.invalidar()
+
+    def depois_do_commit():
+        catalog_cache.invalidar()
+        for curso_id in cursos_alterados:
+            prefixos.invalidar(curso_id)
+            if answer_cache is not None:
+                answer_cache.invalidate_curso(curso_id)
+
+    transaction.on_commit(depois_do_commit)
+
+
+def sincronizar_categorias(itens):
+    """
+    Cria ou atualiza categorias; cada item tem chave_externa, nome e,
+    opcionalmente, descricao. Levanta ValueError se há chaves repetidas.
+    """
+    _verificar_chaves(itens)
+    with transaction.atomic():
+        criadas, alteradas, ids = _gravar(
+            Categoria, itens, lambda item: {campo: item[campo] for campo in ('nome', 'descricao') if campo in item}
+        )
+        # O nome da categoria faz parte do índice e do bloco do prompt dos cursos
+        cursos_afetados = []
+        if alteradas:
+            cursos = Curso.objects.filter(categoria__in=alteradas)
+            full_text.reindexar(cursos)
+            cursos_afetados = list(cursos.values_list('id', flat=True))
+        _invalidar_caches(cursos_afetados)
+    return _resumo(itens, criadas, alteradas, ids)
+
+
+def sincronizar_cursos(itens):
+    """
+    Cria ou atualiza cursos; cada item tem chave_externa, os campos do curso
+    e a categoria, pelo id (`categoria`) ou pela chave externa
+    (`categoria_externa`). Levanta ValueError se há chaves repetidas ou
+    categorias inexistentes.
+    """
+    _verificar_chaves(itens)
+    ids_categorias = {item['categoria'] for item in itens if item.get('categoria') is not None}
+    chaves_categorias = {item['categoria_externa'] for item in itens if item.get('categoria_externa') is not None}
+    categorias = list(Categoria.objects.filter(Q(pk__in=ids_categorias) | Q(chave_externa__in=chaves_categorias)))
+    por_id = {categoria.pk: categoria for categoria in categorias}
+    por_chave = {categoria.chave_externa: categoria for categoria in categorias if categoria.chave_externa}
+    faltando = [str(i) for i in sorted(ids_categorias - set(por_id))] + sorted(chaves_categorias - set(por_chave))
+    if faltando:
+        raise ValueError(f"Categorias não encontradas: {', '.join(faltando)}.")
+
+    def campos(item):
+        valores = {campo: valor for campo, valor in item.items()
+                   if campo not in ('chave_externa', 'categoria', 'categoria_externa')}
+        if item.get('categoria') is not None:
+            valores['categoria'] = por_id[item['categoria']]
+        else:
+            valores['categoria'] = por_chave[item['categoria_externa']]
+        return valores
+
+    with transaction.atomic():
+        criados, alterados, ids = _gravar(Curso, itens, campos)
+        full_text.indexar(criados + alterados)
+        _invalidar_caches([curso.pk for curso in alterados])
+    return _resumo(itens, criados, alterados, ids)
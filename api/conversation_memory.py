@@ -0,0 +1,238 @@
+"""
+Histórico de conversa persistido por sessão do aluno.
+
+O histórico enviado ao modelo tem tamanho limitado: as últimas interações da
+conversa entram na íntegra e as mais antigas são condensadas em um resumo
+acumulado, salvo na própria Conversa, de modo que o prompt não cresce com o
+número de turnos.
+
+A conversa é identificada por uma chave aleatória (UUID), e não pelo id.
+Uma pergunta sem conversa_id não cria a conversa: a chave devolvida é o
+UUID da interação, e a conversa só é gravada quando o aluno a continua.
+
+Com RESUMO_LLM, o resumo é reescrito pelo modelo em uma thread de fundo,
+depois do commit, fora do caminho da requisição.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Conversa, Interacao
+from .write_behind import write_behind
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'JANELA': 4,
+    'MAX_CARACTERES_TURNO': 1000,
+    'MAX_CARACTERES_RESUMO': 1500,
+    'RESUMO_LLM': False,
+}
+
+TEMPLATE_RESUMO = """Resumo atual da conversa:
+{resumo}
+
+Novos turnos:
+{turnos}
+
+Atualize o resumo em português, em no máximo {limite} caracteres, mantendo
+apenas os tópicos e as dúvidas do aluno que forem úteis para as próximas respostas.
+Resumo atualizado:"""
+
+
+# Resumos com o modelo em andamento, por conversa
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resumo-conversa")
+_em_andamento = set()
+_em_andamento_lock = threading.Lock()
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'HISTORICO_CONVERSA', {}))
+
+
+def _truncar(texto, limite):
+    texto = texto.strip()
+    return texto if len(texto) <= limite else texto[:limite].rstrip() + "..."
+
+
+def obter_conversa(curso, conversa_id=None, usuario_id=None):
+    """
+    Retorna a conversa com a chave `conversa_id`, ou None para uma pergunta
+    sem ela: a conversa só é criada quando o aluno continua, a partir da
+    interação que a abriu. Levanta Conversa.DoesNotExist se a conversa não
+    existe, é de outro curso ou pertence a outro usuário (as de alunos
+    anônimos não têm dono e valem para quem tiver a chave).
+    """
+    if not conversa_id:
+        return None
+    try:
+        chave = uuid.UUID(str(conversa_id))
+    except ValueError:
+        raise Conversa.DoesNotExist
+    conversa = Conversa.objects.filter(chave=chave, curso=curso).first() or _abrir_conversa(curso, chave, usuario_id)
+    if conversa.usuario_id is not None and conversa.usuario_id != usuario_id:
+        raise Conversa.DoesNotExist
+    return conversa
+
+
+def _abrir_conversa(curso, chave, usuario_id):
+    """
+    Cria a conversa aberta pela interação `chave` (a primeira pergunta, sem
+    conversa) e a vincula a ela, esteja gravada ou na gravação adiada.
+    """
+    pendente = write_behind.pendente(chave) if write_behind is not None else None
+    if pendente is not None:
+        abertura = pendente.curso_id == curso.id and pendente.conversa_id is None
+    else:
+        abertura = Interacao.objects.filter(uuid=chave, curso=curso, conversa__isnull=True).exists()
+    if not abertura:
+        raise Conversa.DoesNotExist
+    conversa, _ = Conversa.objects.get_or_create(chave=chave, curso=curso, defaults={'usuario_id': usuario_id})
+    if write_behind is not None:
+        write_behind.vincular(chave, conversa.id)
+    # Também quando a interação foi gravada entre a consulta e a vinculação
+    Interacao.objects.filter(uuid=chave, conversa__isnull=True).update(conversa=conversa)
+    return conversa
+
+
+def formatar_turnos(turnos, limite):
+    return "\n".join(
+        f"Aluno: {_truncar(pergunta, limite)}\nAssistente: {_truncar(resposta, limite)}"
+        for pergunta, resposta in turnos
+    )
+
+
+def carregar_historico(conversa):
+    """
+    Monta o histórico para o prompt: o resumo dos turnos antigos seguido das
+    últimas interações da conversa, da mais antiga para a mais recente.
+    """
+    if conversa is None:
+        return ""
+
+    conf = _config()
+    gravados = list(
+        conversa.interacoes
+        .order_by('-data_criacao', '-id')
+        .values_list('pergunta', 'resposta', 'uuid')[:conf['JANELA']]
+    )
+    gravados.reverse()
+    turnos = [(pergunta, resposta) for pergunta, resposta, _ in gravados]
+    if write_behind is not None:
+        # Turnos da gravação adiada que ainda não chegaram ao banco
+        vistos = {uuid for _, _, uuid in gravados}
+        turnos += [
+            (i.pergunta, i.resposta) for i in write_behind.pendentes(conversa.id) if i.uuid not in vistos
+        ]
+        turnos = turnos[-conf['JANELA']:]
+
+    partes = []
+    if conversa.resumo:
+        partes.append(f"Resumo da conversa anterior: {conversa.resumo}")
+    if turnos:
+        partes.append(formatar_turnos(turnos, conf['MAX_CARACTERES_TURNO']))
+    return "\n".join(partes)
+
+
+def agendar_resumo(conversa, llm=None):
+    """
+    Atualiza o resumo da conversa depois de um turno. Com RESUMO_LLM ativo e
+    um LLM disponível, a chamada ao modelo é feita em uma thread de fundo
+    após o commit; sem ele, o resumo simples é atualizado na hora.
+    """
+    if conversa is None:
+        return
+    if not (_config()['RESUMO_LLM'] and llm is not None):
+        atualizar_resumo(conversa)
+        return
+    with _em_andamento_lock:
+        if conversa.id in _em_andamento:
+            # O resumo em andamento é refeito no próximo turno, se ainda faltar algum
+            return
+        _em_andamento.add(conversa.id)
+    try:
+        transaction.on_commit(lambda: _executor.submit(_resumir_em_fundo, conversa.id, llm))
+    except Exception:
+        with _em_andamento_lock:
+            _em_andamento.discard(conversa.id)
+        raise
+
+
+def _resumir_em_fundo(conversa_id, llm):
+    try:
+        conversa = Conversa.objects.filter(id=conversa_id).first()
+        if conversa is not None:
+            atualizar_resumo(conversa, llm)
+    except Exception as e:
+        logger.error("Erro ao resumir a conversa %s: %s", conversa_id, e)
+    finally:
+        with _em_andamento_lock:
+            _em_andamento.discard(conversa_id)
+        close_old_connections()
+
+
+def atualizar_resumo(conversa, llm=None):
+    """
+    Condensa no resumo da conversa os turnos que saíram da janela de
+    histórico. Com RESUMO_LLM ativo e um LLM disponível, o resumo é reescrito
+    pelo modelo; caso contrário, guarda as perguntas dos turnos antigos.
+
+    O resumo parte dos valores gravados no banco e só é salvo se nenhum
+    outro turno o tiver atualizado nesse meio tempo, de modo que turnos
+    simultâneos não resumem as mesmas interações duas vezes.
+    """
+    if conversa is None:
+        return
+
+    conf = _config()
+    atual = Conversa.objects.filter(id=conversa.id).values('resumo', 'interacoes_resumidas').first()
+    if atual is None:
+        return
+    conversa.resumo, conversa.interacoes_resumidas = atual['resumo'], atual['interacoes_resumidas']
+    total = conversa.interacoes.count()
+    excedentes = total - conf['JANELA'] - conversa.interacoes_resumidas
+    if excedentes <= 0:
+        return
+
+    inicio = conversa.interacoes_resumidas
+    turnos = list(
+        conversa.interacoes
+        .order_by('data_criacao', 'id')
+        .values_list('pergunta', 'resposta')[inicio:inicio + excedentes]
+    )
+    limite = conf['MAX_CARACTERES_RESUMO']
+
+    resumo = None
+    if conf['RESUMO_LLM'] and llm is not None:
+        try:
+            mensagem = llm.invoke(TEMPLATE_RESUMO.format(
+                resumo=conversa.resumo or "(vazio)",
+                turnos=formatar_turnos(turnos, conf['MAX_CARACTERES_TURNO']),
+                limite=limite,
+            ))
+            resumo = mensagem.content.strip()
+        except Exception as e:
+            logger.error("Erro ao resumir a conversa %s: %s", conversa.id, e)
+
+    if resumo is None:
+        novos = "; ".join(_truncar(pergunta, 200) for pergunta, _ in turnos)
+        if conversa.resumo:
+            resumo = f"{conversa.resumo}; {novos}"
+        else:
+            resumo = f"Perguntas anteriores do aluno: {novos}"
+
+    # Manter o trecho mais recente quando o resumo passa do limite
+    resumo = resumo[-limite:]
+    atualizada = Conversa.objects.filter(id=conversa.id, interacoes_resumidas=inicio).update(
+        resumo=resumo, interacoes_resumidas=inicio + len(turnos), data_atualizacao=timezone.now()
+    )
+    if not atualizada:
+        logger.debug("Resumo da conversa %s já atualizado por outro turno", conversa.id)
+        return
+    conversa.resumo = resumo
+    conversa.interacoes_resumidas = inicio + len(turnos)
@@ -0,0 +1,138 @@
+"""
+Prompt das perguntas sobre um curso.
+
+O prompt tem duas mensagens: a de sistema, com o bloco fixo do curso (papel
+do assistente, dados do curso e instruções), e a do aluno, com o contexto, o
+histórico e a pergunta. O bloco do curso é renderizado uma vez por curso e
+guardado em memória até o curso ou a categoria mudar (ver signals.py), de
+modo que a cada requisição só a mensagem do aluno é formatada.
+
+Como o bloco do curso vem sempre primeiro e é idêntico entre as perguntas do
+mesmo curso, os provedores com cache de prefixo (OpenAI e DeepSeek) cobram
+menos pelos tokens dele a partir da segunda pergunta.
+"""
+import threading
+
+from langchain.prompts import ChatPromptTemplate
+
+from .models import Curso
+from .tokens import contar_tokens
+
+TEMPLATE_SISTEMA = """Você é um assistente de aprendizado para o curso: {titulo}.
+
+Informações sobre o curso:
+- Título: {titulo}
+- Descrição: {descricao}
+- Nível: {nivel}
+- Categoria: {categoria}
+
+Sua resposta deve ser educativa, clara e útil. Forneça exemplos quando apropriado."""
+
+TEMPLATE_PERGUNTA = """Contexto adicional: {contexto}
+
+Histórico da conversa:
+{chat_history}
+
+Pergunta do aluno: {pergunta}
+
+Resposta:"""
+
+NIVEIS = dict(Curso.NIVEL_CHOICES)
+
+PROMPT_CURSO = ChatPromptTemplate.from_messages([
+    ("system", "{prefixo_curso}"),
+    ("human", TEMPLATE_PERGUNTA),
+])
+
+
+class PrefixCache:
+    """
+    Bloco de sistema renderizado de cada curso e a contagem de tokens dele
+    por modelo. Uma entrada também é refeita quando a data de atualização
+    do curso ou o nome da categoria carregados diferem dos usados nela (por
+    exemplo, se o curso foi alterado por outro processo). As contagens
+    ficam por curso e são descartadas junto com o bloco, de modo que o
+    cache tem no máximo uma entrada por curso e modelo.
+    """
+
+    def __init__(self):
+        self._prefixos = {}
+        # curso_id -> {modelo: (texto do bloco, tokens)}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def texto(self, curso):
+        """
+        Bloco do curso (com a categoria já carregada).
+        """
+        chave = (curso.data_atualizacao, curso.categoria.nome)
+        entrada = self._prefixos.get(curso.pk)
+        if entrada is not None and entrada[0] == chave:
+            return entrada[1]
+
+        texto = TEMPLATE_SISTEMA.format(
+            titulo=curso.titulo,
+            descricao=curso.descricao,
+            nivel=NIVEIS.get(curso.nivel, ""),
+            categoria=curso.categoria.nome,
+        )
+        with self._lock:
+            self._descartar(curso.pk)
+            self._prefixos[curso.pk] = (chave, texto)
+        return texto
+
+    def tokens(self, curso_id, texto, modelo):
+        """
+        Tokens do bloco do curso no tokenizador do modelo. A contagem guarda
+        o texto usado e é refeita se o bloco recebido for outro.
+        """
+        entrada = self._tokens.get(curso_id, {}).get(modelo)
+        if entrada is not None and entrada[0] == texto:
+            return entrada[1]
+        tokens = contar_tokens(texto, modelo)
+        with self._lock:
+            self._tokens.setdefault(curso_id, {})[modelo] = (texto, tokens)
+        return tokens
+
+    def _descartar(self, curso_id):
+        self._prefixos.pop(curso_id, None)
+        self._tokens.pop(curso_id, None)
+
+    def invalidar(self, curso_id=None):
+        """
+        Descarta o bloco do curso informado, ou de todos os cursos.
+        """
+        with self._lock:
+            if curso_id is None:
+                self._prefixos.clear()
+                self._tokens.clear()
+            else:
+                self._descartar(curso_id)
+
+
+prefixos = PrefixCache()
+
+
+def montar_inputs(curso, pergunta, contexto, historico=""):
+    """
+    Variáveis do PROMPT_CURSO para uma pergunta sobre o curso.
+    """
+    return {
+        # Não faz parte do prompt: identifica o bloco na contagem de tokens
+        "curso_id": curso.pk,
+        "prefixo_curso": prefixos.texto(curso),
+        "contexto": contexto,
+        "chat_history": historico,
+        "pergunta": pergunta,
+    }
+
+
+def contar_tokens_prompt(inputs, modelo):
+    """
+    Tokens do prompt completo: o bloco do curso (contado uma vez por curso
+    e modelo) mais a mensagem do aluno.
+    """
+    mensagem = TEMPLATE_PERGUNTA.format(
+        contexto=inputs["contexto"], chat_history=inputs["chat_history"], pergunta=inputs["pergunta"]
+    )
+    return prefixos.tokens(inputs["curso_id"], inputs["prefixo_curso"], modelo) + contar_tokens(mensagem, modelo)
@@ -0,0 +1,162 @@
+"""
+Caminho rápido das listagens grandes (cursos e interações).
+
+Em vez de instanciar o ModelSerializer para cada linha, a listagem busca só
+as colunas necessárias com .values() e monta os dicionários com um
+mapeador compilado uma vez a partir do próprio serializer: para cada campo,
+o nome de saída, o lookup do .values() e a conversão (só nos campos cuja
+representação difere do valor do banco, como datas e UUIDs). A saída é a
+mesma do serializer.
+
+Os parâmetros ?fields= e ?exclude= (nomes separados por vírgula) escolhem
+os campos da resposta, também no detalhe e no caminho normal; nas
+interações, ?exclude=resposta evita ler a coluna mais pesada.
+"""
+import functools
+
+from django.conf import settings
+from rest_framework import permissions, serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import empty
+from rest_framework.relations import PrimaryKeyRelatedField, RelatedField
+from rest_framework.response import Response
+
+CONFIG_PADRAO = {
+    'ATIVO': True,
+}
+
+# Campos cuja representação é o próprio valor vindo do .values()
+DIRETOS = (
+    serializers.IntegerField, serializers.FloatField, serializers.BooleanField,
+    serializers.CharField, serializers.ChoiceField, serializers.ReadOnlyField,
+    PrimaryKeyRelatedField,
+)
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'SERIALIZACAO_RAPIDA', {}))
+
+
+class MapeadorValores:
+    """
+    Converte linhas de .values() na representação do serializer. Aceita
+    campos de modelo, campos de relacionamentos (source 'curso.titulo') e
+    chaves estrangeiras como id; levanta ValueError para os demais
+    (serializers aninhados, SerializerMethodField etc.).
+    """
+
+    def __init__(self, serializer_class):
+        campos = []
+        for campo in serializer_class()._readable_fields:
+            suportado = not isinstance(campo, (serializers.BaseSerializer, serializers.SerializerMethodField)) and (
+                not isinstance(campo, RelatedField) or isinstance(campo, PrimaryKeyRelatedField)
+            )
+            if not suportado or campo.source == '*':
+                raise ValueError(f"{serializer_class.__name__}.{campo.field_name}: campo não suportado pelo mapeador.")
+            conversao = None if isinstance(campo, DIRETOS) else campo.to_representation
+            # Como no serializer, o campo de um relacionamento nulo é omitido
+            # (SkipField), a menos que aceite nulo ou tenha valor padrão
+            relacao = None
+            if len(campo.source_attrs) > 1 and not (campo.required or campo.allow_null or campo.default is not empty):
+                relacao = campo.source_attrs[0]
+            campos.append((campo.field_name, '__'.join(campo.source_attrs), conversao, relacao))
+        self.campos = tuple(campos)
+        self.nomes = tuple(campo[0] for campo in campos)
+
+    def lookups(self, nomes):
+        lookups = []
+        for nome, lookup, _, relacao in self.campos:
+            if nome in nomes:
+                lookups.extend(item for item in (lookup, relacao) if item and item not in lookups)
+        return lookups
+
+    def mapear(self, linhas, nomes):
+        campos = [campo for campo in self.campos if campo[0] in nomes]
+        if all(conversao is None and relacao is None for _, _, conversao, relacao in campos):
+            diretos = [(nome, lookup) for nome, lookup, _, _ in campos]
+            return [{nome: linha[lookup] for nome, lookup in diretos} for linha in linhas]
+
+        resultado = []
+        for linha in linhas:
+            item = {}
+            for nome, lookup, conversao, relacao in campos:
+                if relacao is not None and linha[relacao] is None:
+                    continue
+                valor = linha[lookup]
+                item[nome] = conversao(valor) if conversao is not None and valor is not None else valor
+            resultado.append(item)
+        return resultado
+
+
+@functools.lru_cache(maxsize=None)
+def mapeador(serializer_class):
+    return MapeadorValores(serializer_class)
+
+
+def selecionar_campos(disponiveis, fields=None, exclude=None):
+    """
+    Nomes de `disponiveis` escolhidos por `fields` e `exclude` (nomes
+    separados por vírgula), na ordem de `disponiveis`, ou None sem nenhum
+    dos dois. Levanta ValueError com nomes desconhecidos.
+    """
+    if not fields and not exclude:
+        return None
+    pedidos = {nome.strip() for nome in (fields or '').split(',') if nome.strip()}
+    excluidos = {nome.strip() for nome in (exclude or '').split(',') if nome.strip()}
+    desconhecidos = (pedidos | excluidos) - set(disponiveis)
+    if desconhecidos:
+        raise ValueError(f"Campos desconhecidos: {', '.join(sorted(desconhecidos))}.")
+    return tuple(nome for nome in disponiveis if (not pedidos or nome in pedidos) and nome not in excluidos)
+
+
+def campos_pedidos(request, disponiveis):
+    """
+    selecionar_campos com ?fields= e ?exclude=; nomes desconhecidos são um
+    erro de validação (HTTP 400).
+    """
+    try:
+        return selecionar_campos(
+            disponiveis, request.query_params.get('fields'), request.query_params.get('exclude')
+        )
+    except ValueError as e:
+        raise ValidationError({'fields': str(e)})
+
+
+class ListaRapidaMixin:
+    """
+    Para ViewSets com listagens grandes: a ação list usa o caminho rápido
+    (.values() e MapeadorValores) e as leituras aceitam ?fields= e ?exclude=.
+    Com SERIALIZACAO_RAPIDA['ATIVO'] = False, a listagem volta ao serializer.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.request.method in permissions.SAFE_METHODS:
+            campos = getattr(serializer, 'child', serializer).fields
+            nomes = campos_pedidos(self.request, [campo.field_name for campo in campos.values() if not campo.write_only])
+            if nomes is not None:
+                for nome in list(campos):
+                    if nome not in nomes:
+                        campos.pop(nome)
+        return serializer
+
+    def list(self, request, *args, **kwargs):
+        if not _config()['ATIVO']:
+            return super().list(request, *args, **kwargs)
+
+        mapa = mapeador(self.get_serializer_class())
+        nomes = campos_pedidos(request, mapa.nomes) or mapa.nomes
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = mapa.lookups(nomes)
+        # A paginação por cursor lê o primeiro campo da ordenação de cada linha
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        if get_ordering is not None:
+            ordenacao = get_ordering(request, queryset, self)[0].lstrip('-')
+            if ordenacao not in lookups:
+                lookups.append(ordenacao)
+
+        linhas = queryset.values(*lookups)
+        pagina = self.paginate_queryset(linhas)
+        if pagina is not None:
+            return self.get_paginated_response(mapa.mapear(pagina, nomes))
+        return Response(mapa.mapear(linhas, nomes))
@@ -0,0 +1,21 @@
+from rest_framework import filters
+
+from . import full_text
+
+
+class BuscaTextualFilter(filters.SearchFilter):
+    """
+    SearchFilter que usa o índice de busca textual do modelo (ver
+    full_text.py), com os resultados ordenados por relevância. Sem índice
+    para o modelo ou para o banco, usa as search_fields com icontains.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        termo = request.query_params.get(self.search_param, '').strip()
+        if not termo:
+            return queryset
+        # Com ?ordering=, a ordenação pedida prevalece sobre a relevância
+        resultado = full_text.buscar(queryset, termo, ordenar=not request.query_params.get('ordering'))
+        if resultado is None:
+            return super().filter_queryset(request, queryset, view)
+        return resultado
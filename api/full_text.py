@@ -0,0 +1,351 @@
+"""
+Busca textual com índice invertido para interações e cursos.
+
+Cada modelo indexado tem uma tabela de busca à parte, mantida a cada save
+e delete (ver signals.py) e nas gravações em massa:
+
+- SQLite: tabela virtual FTS5, com os textos reduzidos aos radicais em
+  português por um stemmer local (as mesmas regras valem para a consulta)
+  e relevância por BM25;
+- PostgreSQL: tabela com um tsvector da configuração 'portuguese' e índice
+  GIN, consultada com websearch_to_tsquery e ordenada por ts_rank.
+
+Em outros bancos, ou com BUSCA_TEXTUAL['ATIVO'] = False, a busca volta ao
+`icontains` do SearchFilter.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .answer_cache import STOPWORDS, normalizar_pergunta
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'ATIVO': True,
+}
+
+# Peso de cada classe de coluna no BM25 do SQLite (no PostgreSQL, setweight)
+PESOS_BM25 = {'A': 4.0, 'B': 1.0}
+
+
+# Stemmer de português: versão reduzida do RSLP (Orengo e Huyck), aplicada a
+# palavras já sem acentos. As regras são testadas em ordem e vale a primeira
+# cujo sufixo casa e deixa um radical com o tamanho mínimo.
+
+_REGRAS_PLURAL = [("oes", "ao", 3), ("aes", "ao", 3), ("ais", "al", 2), ("eis", "el", 2),
+                  ("ois", "ol", 2), ("les", "l", 3), ("res", "r", 3), ("ns", "m", 2), ("s", "", 3)]
+_REGRAS_FEMININO = [("ona", "ao", 3), ("ora", "or", 3), ("osa", "oso", 3), ("iva", "ivo", 3),
+                    ("ica", "ico", 3), ("ada", "ado", 2), ("ida", "ido", 3), ("eira", "eiro", 3)]
+_SUFIXOS_ADVERBIO = [("mente", 4)]
+_SUFIXOS_NOME = [("amento", 3), ("imento", 3), ("idade", 4), ("acao", 3), ("icao", 3), ("encia", 3),
+                 ("ancia", 3), ("ismo", 3), ("ista", 3), ("avel", 2), ("ivel", 3), ("ador", 3),
+                 ("edor", 3), ("idor", 3), ("eza", 3), ("oso", 3), ("ivo", 3), ("ico", 3)]
+_SUFIXOS_VERBO = [("ariam", 2), ("eriam", 2), ("iriam", 2), ("assem", 2), ("essem", 2), ("issem", 2),
+                  ("aram", 2), ("eram", 2), ("iram", 2), ("avam", 2), ("arem", 2), ("erem", 2),
+                  ("irem", 2), ("asse", 2), ("esse", 2), ("isse", 2), ("ando", 2), ("endo", 3),
+                  ("indo", 3), ("ado", 2), ("ido", 3), ("ava", 2), ("ar", 2), ("er", 2), ("ir", 3),
+                  ("ou", 3), ("ei", 3), ("am", 2), ("em", 2), ("ia", 3)]
+_VOGAIS_FINAIS = ("a", "e", "o")
+
+_RE_TERMO = re.compile(r"\w+")
+
+
+def _aplicar(palavra, regras):
+    for sufixo, troca, minimo in regras:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= minimo:
+            return palavra[:-len(sufixo)] + troca, True
+    return palavra, False
+
+
+def _remover(palavra, sufixos):
+    return _aplicar(palavra, [(sufixo, "", minimo) for sufixo, minimo in sufixos])
+
+
+def radical(palavra):
+    """
+    Radical de uma palavra em português já normalizada (minúsculas, sem
+    acentos). Palavras curtas ou com dígitos ficam como estão.
+    """
+    if len(palavra) <= 3 or not palavra.isalpha():
+        return palavra
+    if palavra.endswith("s") and not palavra.endswith(("ss", "us", "is")):
+        palavra, _ = _aplicar(palavra, _REGRAS_PLURAL)
+    if palavra.endswith("a"):
+        palavra, _ = _aplicar(palavra, _REGRAS_FEMININO)
+    palavra, _ = _remover(palavra, _SUFIXOS_ADVERBIO)
+    palavra, removido = _remover(palavra, _SUFIXOS_NOME)
+    if not removido:
+        palavra, removido = _remover(palavra, _SUFIXOS_VERBO)
+    if not removido and palavra.endswith(_VOGAIS_FINAIS) and len(palavra) > 3:
+        palavra = palavra[:-1]
+    return palavra
+
+
+def termos(texto):
+    """
+    Radicais dos termos relevantes do texto, na ordem em que aparecem.
+    """
+    return [radical(t) for t in _RE_TERMO.findall(normalizar_pergunta(texto or "")) if t not in STOPWORDS]
+
+
+class Indice:
+    """
+    Definição do índice de um modelo: a tabela de busca, as colunas com a
+    classe de peso (A pesa mais que B) e os relacionamentos cujos índices
+    também são consultados (ex.: o título do curso de uma interação).
+    """
+
+    def __init__(self, tabela, colunas, relacionados=None):
+        self.tabela = tabela
+        self.colunas = colunas
+        self.relacionados = relacionados or {}
+
+    @property
+    def select_related(self):
+        return sorted({caminho.rsplit(".", 1)[0] for caminho, _ in self.colunas if "." in caminho})
+
+    def textos(self, obj):
+        valores = []
+        for caminho, _ in self.colunas:
+            valor = obj
+            for atributo in caminho.split("."):
+                valor = getattr(valor, atributo, None) if valor is not None else None
+            valores.append(valor or "")
+        return valores
+
+
+INDICES = {
+    'api.curso': Indice(
+        'api_curso_busca',
+        [('titulo', 'A'), ('categoria.nome', 'A'), ('descricao', 'B')],
+    ),
+    'api.interacao': Indice(
+        'api_interacao_busca',
+        [('pergunta', 'A'), ('resposta', 'B')],
+        relacionados={'curso_id': 'api.curso'},
+    ),
+}
+
+
+class SQLiteFTS5Backend:
+    """
+    Tabelas virtuais FTS5 com os radicais dos textos; o rowid é o id do registro.
+    """
+
+    def criar(self, cursor, indice):
+        colunas = ", ".join(f"c{i}" for i in range(len(indice.colunas)))
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {indice.tabela} USING fts5("
+            f"{colunas}, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def remover(self, cursor, indice):
+        cursor.execute(f"DROP TABLE IF EXISTS {indice.tabela}")
+
+    def gravar(self, cursor, indice, linhas):
+        colunas = ", ".join(f"c{i}" for i in range(len(indice.colunas)))
+        marcadores = ", ".join(["%s"] * (len(indice.colunas) + 1))
+        cursor.executemany(f"DELETE FROM {indice.tabela} WHERE rowid = %s", [(pk,) for pk, _ in linhas])
+        cursor.executemany(
+            f"INSERT INTO {indice.tabela} (rowid, {colunas}) VALUES ({marcadores})",
+            [(pk, *(" ".join(termos(texto)) for texto in textos)) for pk, textos in linhas],
+        )
+
+    def apagar(self, cursor, indice, pks):
+        cursor.executemany(f"DELETE FROM {indice.tabela} WHERE rowid = %s", [(pk,) for pk in pks])
+
+    def consulta(self, termo):
+        # Cada radical vira um prefixo entre aspas (sem operadores do FTS5): todos devem aparecer
+        radicais = termos(termo)
+        return " ".join(f'"{r}"*' for r in radicais) if radicais else None
+
+    def ids(self, indice, consulta):
+        return f"SELECT rowid FROM {indice.tabela} WHERE {indice.tabela} MATCH %s", [consulta]
+
+    def relevancia(self, indice, consulta, coluna_pk):
+        pesos = ", ".join(str(PESOS_BM25[peso]) for _, peso in indice.colunas)
+        # bm25 é negativo e menor para os melhores resultados
+        return (
+            f"SELECT -bm25({indice.tabela}, {pesos}) FROM {indice.tabela} "
+            f"WHERE {indice.tabela} MATCH %s AND rowid = {coluna_pk}",
+            [consulta],
+        )
+
+
+class PostgresBackend:
+    """
+    Tabelas com tsvector em português (pesos A e B) e índice GIN.
+    """
+
+    def criar(self, cursor, indice):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {indice.tabela} (id bigint PRIMARY KEY, documento tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {indice.tabela}_documento ON {indice.tabela} USING GIN (documento)"
+        )
+
+    def remover(self, cursor, indice):
+        cursor.execute(f"DROP TABLE IF EXISTS {indice.tabela}")
+
+    def gravar(self, cursor, indice, linhas):
+        documento = " || ".join(
+            f"setweight(to_tsvector('portuguese', %s), '{peso}')" for _, peso in indice.colunas
+        )
+        cursor.executemany(
+            f"INSERT INTO {indice.tabela} (id, documento) VALUES (%s, {documento}) "
+            f"ON CONFLICT (id) DO UPDATE SET documento = EXCLUDED.documento",
+            [(pk, *textos) for pk, textos in linhas],
+        )
+
+    def apagar(self, cursor, indice, pks):
+        cursor.executemany(f"DELETE FROM {indice.tabela} WHERE id = %s", [(pk,) for pk in pks])
+
+    def consulta(self, termo):
+        return termo.strip() or None
+
+    def ids(self, indice, consulta):
+        return (
+            f"SELECT id FROM {indice.tabela} WHERE documento @@ websearch_to_tsquery('portuguese', %s)",
+            [consulta],
+        )
+
+    def relevancia(self, indice, consulta, coluna_pk):
+        return (
+            f"SELECT ts_rank(documento, websearch_to_tsquery('portuguese', %s)) "
+            f"FROM {indice.tabela} WHERE id = {coluna_pk}",
+            [consulta],
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteFTS5Backend(),
+    'postgresql': PostgresBackend(),
+}
+
+
+def backend(connection):
+    """
+    Backend de busca para a conexão, ou None se a busca textual estiver
+    desativada ou o banco não for suportado.
+    """
+    conf = dict(CONFIG_PADRAO, **getattr(settings, 'BUSCA_TEXTUAL', {}))
+    if not conf['ATIVO']:
+        return None
+    return BACKENDS.get(connection.vendor)
+
+
+def indice(model):
+    return INDICES.get(model._meta.label_lower)
+
+
+def disponivel(model, using='default'):
+    return indice(model) is not None and backend(connections[using]) is not None
+
+
+def criar_tabelas(connection):
+    atual = BACKENDS.get(connection.vendor)
+    if atual is None:
+        return
+    with connection.cursor() as cursor:
+        for definicao in INDICES.values():
+            atual.criar(cursor, definicao)
+
+
+def remover_tabelas(connection):
+    atual = BACKENDS.get(connection.vendor)
+    if atual is None:
+        return
+    with connection.cursor() as cursor:
+        for definicao in INDICES.values():
+            atual.remover(cursor, definicao)
+
+
+def indexar(objs, using='default'):
+    """
+    Grava no índice os textos dos objetos (todos do mesmo modelo). Deve ser
+    chamado pelos caminhos que gravam sem save(), como bulk_create.
+    """
+    objs = [obj for obj in objs if obj.pk is not None]
+    if not objs:
+        return
+    definicao = indice(type(objs[0]))
+    connection = connections[using]
+    atual = backend(connection)
+    if definicao is None or atual is None:
+        return
+    with connection.cursor() as cursor:
+        atual.gravar(cursor, definicao, [(obj.pk, definicao.textos(obj)) for obj in objs])
+
+
+def desindexar(model, pks, using='default'):
+    """
+    Retira do índice os registros de `model` excluídos. Chamado pelo
+    post_delete (ver signals.py); caminhos que apagam com SQL direto, sem
+    passar pelo Collector do Django, devem chamá-lo também.
+    """
+    definicao = indice(model)
+    connection = connections[using]
+    atual = backend(connection)
+    if definicao is None or atual is None or not pks:
+        return
+    with connection.cursor() as cursor:
+        atual.apagar(cursor, definicao, pks)
+
+
+def reindexar(queryset, tamanho_bloco=1000):
+    """
+    Reconstrói o índice dos registros do queryset, em blocos. Retorna
+    quantos registros foram indexados.
+    """
+    definicao = indice(queryset.model)
+    if definicao is None:
+        return 0
+    queryset = queryset.select_related(*definicao.select_related).order_by('pk')
+    total = 0
+    bloco = []
+    for obj in queryset.iterator(chunk_size=tamanho_bloco):
+        bloco.append(obj)
+        if len(bloco) >= tamanho_bloco:
+            indexar(bloco, using=queryset.db)
+            total += len(bloco)
+            bloco = []
+    indexar(bloco, using=queryset.db)
+    return total + len(bloco)
+
+
+def buscar(queryset, termo, ordenar=True):
+    """
+    Filtra o queryset pelos registros que contêm os termos buscados e anota
+    a `relevancia` de cada um (maior é melhor). Com `ordenar`, ordena pela
+    relevância. Retorna None se a busca textual não está disponível para o
+    modelo (quem chama deve recorrer ao icontains).
+    """
+    definicao = indice(queryset.model)
+    atual = backend(connections[queryset.db])
+    if definicao is None or atual is None:
+        return None
+    consulta = atual.consulta(termo)
+    if consulta is None:
+        return queryset
+
+    model = queryset.model
+    qn = connections[queryset.db].ops.quote_name
+    coluna_pk = f"{qn(model._meta.db_table)}.{qn(model._meta.pk.column)}"
+
+    filtro = Q(pk__in=RawSQL(*atual.ids(definicao, consulta)))
+    for campo, relacionado in definicao.relacionados.items():
+        filtro |= Q(**{f"{campo}__in": RawSQL(*atual.ids(INDICES[relacionado], consulta))})
+
+    # Registros encontrados só pelo relacionamento ficam com relevância 0
+    relevancia = RawSQL(*atual.relevancia(definicao, consulta, coluna_pk), output_field=FloatField())
+    queryset = queryset.filter(filtro).annotate(relevancia=Coalesce(relevancia, 0.0))
+    if ordenar:
+        queryset = queryset.order_by('-relevancia', '-pk')
+    return queryset
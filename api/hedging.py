@@ -0,0 +1,211 @@
+"""
+Requisições com hedge para reduzir a latência de cauda das chamadas ao LLM.
+
+Com o hedge ativo na configuração, a chamada é feita em streaming e, se o
+primeiro token não chegar dentro do atraso calculado pelo roteador (um
+percentil das latências recentes), a mesma pergunta é enviada a outra
+configuração (ou de novo à mesma). Vence a chamada que produzir o primeiro
+token antes; a outra é cancelada e os tokens que ela consumiu são
+registrados como descartados.
+
+Para medir o ganho na latência de cauda, uma amostra (HEDGE_AMOSTRAGEM) das
+chamadas originais que perderam para o hedge só é cancelada depois do seu
+primeiro token, o que mostra quanto elas teriam levado sem o hedge.
+
+O caminho síncrono executa as chamadas com hedge em um event loop de fundo,
+compartilhado pelo processo, para poder cancelar a chamada perdedora.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .router import router
+from .tokens import contar_tokens
+
+logger = logging.getLogger(__name__)
+
+_FIM = object()
+
+CONFIG_PADRAO = {
+    'HEDGE_AMOSTRAGEM': 0.1,
+    'HEDGE_OBSERVACAO_MAXIMA': 30,
+}
+
+_loop = None
+_loop_lock = threading.Lock()
+
+# Referências às observações em andamento, para que as tasks não sejam
+# coletadas pelo garbage collector antes de terminar
+_observacoes = set()
+
+
+class _Concorrente:
+    """
+    Uma das chamadas em disputa: consome o stream em uma task e sinaliza o
+    primeiro trecho com texto.
+    """
+
+    def __init__(self, config, stream):
+        self.config = config
+        self.inicio = time.monotonic()
+        self.primeiro = asyncio.get_running_loop().create_future()
+        self.fila = asyncio.Queue()
+        self.partes = []
+        self.task = asyncio.ensure_future(self._consumir(stream))
+
+    async def _consumir(self, stream):
+        try:
+            async for chunk in stream:
+                if chunk.content:
+                    self.partes.append(chunk.content)
+                    self._sinalizar()
+                await self.fila.put(chunk)
+            self._sinalizar()
+            await self.fila.put(_FIM)
+        except Exception as e:
+            if not self.primeiro.done():
+                self.primeiro.set_exception(e)
+            await self.fila.put(e)
+
+    def _sinalizar(self):
+        if not self.primeiro.done():
+            self.primeiro.set_result(time.monotonic() - self.inicio)
+
+    def decorrido(self):
+        return time.monotonic() - self.inicio
+
+
+async def astream_com_hedge(criar_stream, config, alternativa, areservar, tokens_prompt, estado):
+    """
+    Gera os trechos da resposta da chamada vencedora.
+
+    criar_stream(config) retorna o stream da cadeia para a configuração e
+    areservar(config) reserva capacidade para o hedge (retorna False se não
+    houver). Em `estado` ficam a configuração vencedora e os tokens
+    descartados com a chamada cancelada.
+    """
+    atraso = router.atraso_hedge(config)
+    primario = _Concorrente(config, criar_stream(config))
+    concorrentes = [primario]
+    try:
+        await asyncio.wait([primario.primeiro], timeout=atraso)
+        if not primario.primeiro.done() and await areservar(alternativa):
+            logger.info("Primeiro token não chegou em %.2fs, disparando hedge na configuração %s", atraso, alternativa.pk)
+            concorrentes.append(_Concorrente(alternativa, criar_stream(alternativa)))
+
+        # Vence o primeiro concorrente a produzir texto; erros só contam se todos falharem
+        vencedor = None
+        pendentes = {c.primeiro: c for c in concorrentes}
+        while vencedor is None and pendentes:
+            prontos, _ = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+            for futuro in prontos:
+                concorrente = pendentes.pop(futuro)
+                if futuro.exception() is None and vencedor is None:
+                    vencedor = concorrente
+        if vencedor is None:
+            raise primario.primeiro.exception()
+
+        conf = dict(CONFIG_PADRAO, **getattr(settings, 'ROTEAMENTO', {}))
+        observar = (vencedor is not primario and not primario.primeiro.done()
+                    and random.random() < conf['HEDGE_AMOSTRAGEM'])
+
+        tokens_descartados = 0
+        for perdedor in concorrentes:
+            if perdedor is vencedor:
+                continue
+            if not (observar and perdedor is primario):
+                perdedor.task.cancel()
+            # Chamadas que falharam não são cobradas; as canceladas, sim
+            if not (perdedor.primeiro.done() and perdedor.primeiro.exception() is not None):
+                tokens_descartados += tokens_prompt + contar_tokens("".join(perdedor.partes), perdedor.config.modelo)
+
+        efetiva = vencedor.primeiro.result() + (vencedor.inicio - primario.inicio)
+        if vencedor is primario:
+            router.registrar_primeiro_token(config, efetiva)
+            router.registrar_hedge(config, len(concorrentes) > 1, False, efetiva, efetiva, tokens_descartados)
+        else:
+            router.registrar_primeiro_token(vencedor.config, vencedor.primeiro.result())
+            if observar:
+                concorrentes.remove(primario)
+                observacao = asyncio.ensure_future(_observar(primario, efetiva, tokens_descartados,
+                                                             conf['HEDGE_OBSERVACAO_MAXIMA']))
+                _observacoes.add(observacao)
+                observacao.add_done_callback(_observacoes.discard)
+            else:
+                # Sem observação, só se sabe que a chamada original levaria mais que isto
+                router.registrar_primeiro_token(config, primario.decorrido())
+                router.registrar_hedge(config, True, True, efetiva, None, tokens_descartados)
+
+        estado["config"] = vencedor.config
+        estado["tokens_descartados"] = estado.get("tokens_descartados", 0) + tokens_descartados
+
+        while True:
+            item = await vencedor.fila.get()
+            if item is _FIM:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Cancelar o que ainda estiver em andamento (inclusive quando o cliente desiste)
+        for concorrente in concorrentes:
+            concorrente.task.cancel()
+
+
+async def _observar(primario, efetiva, tokens_descartados, limite):
+    """
+    Aguarda o primeiro token da chamada original que perdeu para o hedge e
+    só então a cancela, registrando quanto ela teria levado.
+    """
+    try:
+        await asyncio.wait_for(asyncio.shield(primario.primeiro), timeout=limite)
+    except Exception:
+        pass
+    finally:
+        primario.task.cancel()
+
+    if primario.primeiro.done() and primario.primeiro.exception() is None:
+        primaria = primario.primeiro.result()
+    else:
+        primaria = primario.decorrido()
+    router.registrar_primeiro_token(primario.config, primaria)
+    router.registrar_hedge(primario.config, True, True, efetiva, primaria, tokens_descartados)
+
+
+def _loop_de_fundo():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="hedge-loop", daemon=True).start()
+        return _loop
+
+
+def executar(coro):
+    """
+    Executa uma corrotina no event loop de fundo e aguarda o resultado.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _loop_de_fundo()).result()
+
+
+async def _proximo(stream):
+    return await stream.__anext__()
+
+
+def iterar(stream):
+    """
+    Consome um gerador assíncrono a partir de código síncrono, pelo event
+    loop de fundo. Fechar o iterador fecha o gerador (cancelando as chamadas).
+    """
+    try:
+        while True:
+            try:
+                yield executar(_proximo(stream))
+            except StopAsyncIteration:
+                return
+    finally:
+        executar(stream.aclose())
@@ -0,0 +1,129 @@
+"""
+Exportação do histórico de interações em NDJSON ou CSV, em streaming.
+
+As interações são lidas em ordem de id com .values().iterator(chunk_size)
+(cursor do lado do servidor no PostgreSQL) e codificadas em blocos de
+TAMANHO_BLOCO linhas, de modo que a memória usada não depende do tamanho
+do histórico. Os campos e seus valores são os da API (InteracaoSerializer),
+montados pelo mapeador de fast_serialization.py.
+
+Usado pelo endpoint interacoes/exportar e pelo comando exportar_interacoes.
+"""
+import csv
+import io
+from datetime import datetime, time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .fast_serialization import mapeador
+from .renderers import codificar_json
+from .serializers import InteracaoSerializer
+
+CONFIG_PADRAO = {
+    'TAMANHO_BLOCO': 2000,
+}
+
+FORMATOS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'EXPORTACAO_INTERACOES', {}))
+
+
+def campos_disponiveis():
+    return mapeador(InteracaoSerializer).nomes
+
+
+def ler_data(valor, fim=False):
+    """
+    Converte "AAAA-MM-DD" ou uma data e hora ISO 8601 em datetime com fuso;
+    uma data sem hora vale pelo início do dia (ou pelo fim, com `fim`).
+    Levanta ValueError se o valor é inválido.
+    """
+    momento = parse_datetime(valor)
+    if momento is None:
+        dia = parse_date(valor)
+        if dia is None:
+            raise ValueError(f"Data inválida: {valor!r}.")
+        momento = datetime.combine(dia, time.max if fim else time.min)
+    if timezone.is_naive(momento):
+        momento = timezone.make_aware(momento)
+    return momento
+
+
+def filtrar(queryset, curso=None, configuracao=None, desde=None, ate=None):
+    """
+    Aplica os filtros da exportação: curso, configuração de IA e intervalo
+    de data_criacao (datetimes, inclusivos).
+    """
+    if curso is not None:
+        queryset = queryset.filter(curso_id=curso)
+    if configuracao is not None:
+        queryset = queryset.filter(configuracao_ia_id=configuracao)
+    if desde is not None:
+        queryset = queryset.filter(data_criacao__gte=desde)
+    if ate is not None:
+        queryset = queryset.filter(data_criacao__lte=ate)
+    return queryset
+
+
+def _blocos(linhas, tamanho):
+    bloco = []
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def exportar(queryset, formato='ndjson', campos=None):
+    """
+    Gera o conteúdo da exportação em blocos de bytes. `campos` restringe e
+    ordena as colunas (por padrão, todos os campos da API).
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato!r} (use {', '.join(FORMATOS)}).")
+    mapa = mapeador(InteracaoSerializer)
+    nomes = campos or mapa.nomes
+    tamanho = _config()['TAMANHO_BLOCO']
+    linhas = queryset.order_by('id').values(*mapa.lookups(nomes)).iterator(chunk_size=tamanho)
+
+    if formato == 'ndjson':
+        for bloco in _blocos(linhas, tamanho):
+            yield b"".join(codificar_json(item) + b"\n" for item in mapa.mapear(bloco, nomes))
+        return
+
+    saida = io.StringIO()
+    # Campos omitidos pela API (relacionamento nulo) ficam vazios
+    escritor = csv.DictWriter(saida, fieldnames=nomes, restval='')
+    escritor.writeheader()
+    for bloco in _blocos(linhas, tamanho):
+        escritor.writerows(mapa.mapear(bloco, nomes))
+        yield saida.getvalue().encode()
+        saida.seek(0)
+        saida.truncate()
+    if saida.tell():
+        # Só o cabeçalho, sem nenhuma interação
+        yield saida.getvalue().encode()
+
+
+async def exportar_async(blocos):
+    """
+    Adapta o gerador de exportar para o ASGI, que acumularia um iterador
+    síncrono inteiro na memória antes de enviar. Os blocos são lidos sempre
+    na mesma thread, onde fica o cursor do banco.
+    """
+    proximo = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (bloco := await proximo(blocos, None)) is not None:
+            yield bloco
+    finally:
+        await sync_to_async(blocos.close, thread_sensitive=True)()
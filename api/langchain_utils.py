@@ -1,31 +1,41 @@
 import os
 import time
 import logging
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_deepseek import ChatDeepSeek
-from langchain.memory import ConversationBufferMemory
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
-from .models import ConfiguracaoIA, Curso, Interacao
+from . import metrics
+from .answer_cache import answer_cache
+from .retrieval import acontexto_com_materiais, contexto_com_materiais
+from .course_prompt import PROMPT_CURSO, contar_tokens_prompt, montar_inputs
+from .conversation_memory import agendar_resumo, carregar_historico, obter_conversa
+from .hedging import astream_com_hedge, executar, iterar
+from .llm_pool import LLMClientPool, get_http_client
+from .models import ConfiguracaoIA, Conversa, Curso, Interacao
+from .rate_limit import (
+    LimiteExcedido, OrcamentoExcedido, aadquirir, adquirir, ajustar_orcamento, devolver, reservar_orcamento
+)
+from .router import erro_recuperavel, router
+from .tokens import contar_tokens, uso_da_mensagem
+from .write_behind import write_behind
 
-# Configurar logging
-logging.basicConfig(level=logging.DEBUG)
+# O nível e o formato dos logs vêm de settings.LOGGING
 logger = logging.getLogger(__name__)
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
-def get_llm_from_config(config):
+def get_llm_from_config(config, http_async_client=None):
     """
     Cria uma instância de LLM com base na configuração fornecida.
+    `http_async_client` é o cliente HTTP do event loop (ver llm_pool.py).
     """
-    logger.debug(f"Inicializando LLM com provedor: {config.provedor}, modelo: {config.modelo}")
+    logger.debug("Inicializando LLM com provedor: %s, modelo: %s", config.provedor, config.modelo)
     
     if config.provedor == 'deepseek':
         # Usar a chave da configuração ou a chave do ambiente para DeepSeek
         api_key = config.chave_api or os.getenv("DEEPSEEK_API_KEY")
-        logger.debug(f"Usando API key DeepSeek (primeiros 5 caracteres): {api_key[:5]}...")
         
         # Criar o modelo LLM DeepSeek
         try:
@@ -36,16 +46,20 @@ def get_llm_from_config(config):
                 max_tokens=config.max_tokens,
                 api_key=api_key,
                 request_timeout=60,  # Aumentando o timeout para 60 segundos
+                max_retries=0,  # As novas tentativas são feitas pelo roteador (router.py)
+                http_client=get_http_client(),
+                http_async_client=http_async_client,
+                # Sem stream_usage: o ChatDeepSeek o repassaria ao provedor como parâmetro
+                # desconhecido. No streaming, o uso é contado localmente (ver tokens.py)
             )
             logger.debug("ChatDeepSeek inicializado com sucesso")
             return llm
         except Exception as e:
-            logger.error(f"Erro ao inicializar DeepSeek: {str(e)}")
+            logger.error("Erro ao inicializar DeepSeek: %s", e)
             return None
     else:  # OpenAI como fallback
         # Usar a chave da configuração ou a chave do ambiente para OpenAI
         api_key = config.chave_api or os.getenv("OPENAI_API_KEY")
-        logger.debug(f"Usando API key OpenAI (primeiros 5 caracteres): {api_key[:5] if api_key else 'Não definida'}...")
         
         # Criar o modelo LLM OpenAI
         try:
@@ -56,13 +70,45 @@ def get_llm_from_config(config):
                 max_tokens=config.max_tokens,
                 api_key=api_key,
                 request_timeout=60,  # Aumentando o timeout para 60 segundos
+                max_retries=0,  # As novas tentativas são feitas pelo roteador (router.py)
+                http_client=get_http_client(),
+                http_async_client=http_async_client,
+                stream_usage=True,  # Uso de tokens também nas respostas em streaming
             )
             logger.debug("ChatOpenAI inicializado com sucesso")
             return llm
         except Exception as e:
-            logger.error(f"Erro ao inicializar OpenAI: {str(e)}")
+            logger.error("Erro ao inicializar OpenAI: %s", e)
             return None
 
+# Pool de clientes LLM reutilizados entre requisições
+llm_pool = LLMClientPool(get_llm_from_config)
+
+def _ordenar_configs(configs, configuracao_id):
+    if not configs:
+        logger.warning("Nenhuma configuração ativa encontrada.")
+    elif configuracao_id and not any(c.pk == int(configuracao_id) for c in configs):
+        logger.warning("Configuração ID %s não encontrada ou inativa.", configuracao_id)
+    return router.ordenar(configs, int(configuracao_id) if configuracao_id else None)
+
+def get_configs(configuracao_id=None):
+    """
+    Retorna as configurações ativas na ordem em que serão tentadas: a
+    configuração solicitada primeiro (se ativa) e as demais conforme o
+    roteador. Retorna uma lista vazia se não houver nenhuma.
+    """
+    with metrics.etapas.medir("configuracoes"):
+        configs = list(ConfiguracaoIA.objects.filter(ativo=True))
+    return _ordenar_configs(configs, configuracao_id)
+
+async def aget_configs(configuracao_id=None):
+    """
+    Versão assíncrona de get_configs.
+    """
+    with metrics.etapas.medir("configuracoes"):
+        configs = [c async for c in ConfiguracaoIA.objects.filter(ativo=True)]
+    return _ordenar_configs(configs, configuracao_id)
+
 def create_chain_for_course(curso, config=None):
     """
     Cria uma cadeia LangChain para um curso específico.
@@ -73,288 +119,1040 @@ def create_chain_for_course(curso, config=None):
         if not config:
             raise ValueError("Nenhuma configuração de IA ativa encontrada.")
     
-    # Obter o LLM
-    llm = get_llm_from_config(config)
-    if llm is None:
-        raise ValueError(f"Não foi possível inicializar o modelo de IA com o provedor {config.provedor}.")
+    # Obter o LLM do pool de clientes
+    with metrics.etapas.medir("cadeia"):
+        llm = llm_pool.get(config)
+        if llm is None:
+            raise ValueError(f"Não foi possível inicializar o modelo de IA com o provedor {config.provedor}.")
+        
+        return _build_chain(llm)
+
+async def acreate_chain_for_course(curso, config):
+    """
+    Versão assíncrona de create_chain_for_course, usando o cliente LLM do
+    event loop corrente.
+    """
+    with metrics.etapas.medir("cadeia"):
+        llm = llm_pool.get_async(config)
+        if llm is None:
+            raise ValueError(f"Não foi possível inicializar o modelo de IA com o provedor {config.provedor}.")
+        
+        return _build_chain(llm)
+
+def _build_chain(llm):
+    """
+    Monta a cadeia (prompt | llm) sobre um cliente LLM já inicializado. O
+    histórico da conversa é carregado do banco e passado nos inputs
+    (chat_history). A cadeia devolve a mensagem do modelo, com o uso de
+    tokens informado pelo provedor, e também pode ser executada em streaming.
+    """
+    return PROMPT_CURSO | llm
+
+def _build_inputs(curso, pergunta, contexto, historico=""):
+    """
+    Prepara as variáveis do prompt para um curso (com categoria já carregada).
+    O bloco do curso vem do cache por curso (ver course_prompt.py).
+    """
+    return montar_inputs(curso, pergunta, contexto, historico)
+
+def _uso_tokens(mensagem, config, inputs, resposta):
+    """
+    Retorna (tokens_prompt, tokens_resposta): o uso informado pelo provedor
+    ou, se ausente, a contagem com o tokenizador local do modelo.
+    """
+    uso = uso_da_mensagem(mensagem)
+    if uso is not None:
+        return uso
+    return (
+        contar_tokens_prompt(inputs, config.modelo),
+        contar_tokens(resposta, config.modelo)
+    )
+
+def _uso_simulado(pergunta, resposta):
+    # Respostas simuladas não passam pelo provedor: contar localmente
+    return contar_tokens(pergunta), contar_tokens(resposta)
+
+def _uso_stream(mensagem, config, inputs, pergunta, resposta):
+    """
+    Uso de tokens de uma resposta em streaming. O provedor informa o uso no
+    último trecho; respostas interrompidas são contadas localmente.
+    """
+    if mensagem is None:
+        return _uso_simulado(pergunta, resposta)
+    return _uso_tokens(mensagem, config, inputs, resposta)
+
+def _contexto_cache(contexto, historico):
+    # O histórico da conversa também determina a resposta, por isso entra na chave do cache
+    return f"{contexto}\n{historico}" if historico else contexto
+
+def _sem_contexto(contexto, historico):
+    # Sem contexto do cliente nem histórico, a resposta só depende da pergunta (e dos materiais do curso)
+    return not contexto and not historico
+
+def _buscar_cache(curso, config, pergunta, contexto, sem_contexto=False):
+    """
+    Procura no cache uma resposta já gerada para a pergunta. `contexto` é a
+    chave completa (ver _contexto_cache); `sem_contexto` (ver _sem_contexto)
+    decide se perguntas parecidas também valem.
+    """
+    if answer_cache is None:
+        return None
+    entrada = answer_cache.get(curso.id, config, pergunta, contexto, sem_contexto)
+    metrics.cache.inc(entrada["cache"] if entrada else "falha")
+    return entrada
+
+def _salvar_cache(curso, config, pergunta, contexto, sem_contexto, resposta, tokens_utilizados, latencia):
+    if answer_cache is not None:
+        answer_cache.set(curso.id, config, pergunta, resposta, contexto,
+                         tokens=tokens_utilizados, latencia=latencia, sem_contexto=sem_contexto)
+
+def _tokens_prompt_estimados(config, inputs):
+    return contar_tokens_prompt(inputs, config.modelo)
+
+def _reservar_capacidade(curso, config, usuario_id, inputs, estado, esperar=True):
+    """
+    Reserva nos orçamentos diários e no limite de taxa da configuração o
+    prompt mais o máximo de tokens da resposta, aguardando capacidade no
+    limite. Com esperar=False, recusa na hora se não houver capacidade (para
+    passar à próxima configuração do roteador). A reserva fica em `estado`
+    para _conciliar ajustá-la ao consumo real.
+    """
+    tokens = _tokens_prompt_estimados(config, inputs) + config.max_tokens
+    chaves = reservar_orcamento(curso, usuario_id, tokens)
+    try:
+        adquirir(config, tokens, None if esperar else 0)
+    except LimiteExcedido:
+        ajustar_orcamento(chaves, -tokens)
+        raise
+    estado["reservas"].append((config, tokens, chaves))
+
+async def _areservar_capacidade(curso, config, usuario_id, inputs, estado, esperar=True):
+    """
+    Versão assíncrona de _reservar_capacidade.
+    """
+    tokens = _tokens_prompt_estimados(config, inputs) + config.max_tokens
+    chaves = await sync_to_async(reservar_orcamento)(curso, usuario_id, tokens)
+    try:
+        await aadquirir(config, tokens, None if esperar else 0)
+    except LimiteExcedido:
+        await sync_to_async(ajustar_orcamento)(chaves, -tokens)
+        raise
+    estado["reservas"].append((config, tokens, chaves))
+
+def _conciliar(estado, tokens_consumidos):
+    """
+    Ajusta as reservas da pergunta ao consumo real: a configuração que
+    respondeu usou os tokens consumidos menos os descartados por hedge, que
+    são atribuídos às demais reservas (tentativas que falharam não são
+    cobradas). O que sobrar volta para os buckets e para os orçamentos.
+    """
+    reservas, estado["reservas"] = estado["reservas"], []
+    descartados = estado["tokens_descartados"]
+    respondidos = tokens_consumidos - descartados
+    for config, reservados, chaves in reservas:
+        if respondidos and config.pk == estado["config"].pk:
+            usados, respondidos = respondidos, 0
+        else:
+            usados = min(reservados, descartados)
+            descartados -= usados
+        devolver(config, reservados, usados)
+        ajustar_orcamento(chaves, usados - reservados)
+    if reservas and (respondidos or descartados):
+        # Consumo acima do estimado fica no orçamento da última reserva
+        ajustar_orcamento(reservas[-1][2], respondidos + descartados)
+
+def _ahedge(curso, configs, config, usuario_id, inputs, estado):
+    """
+    Stream da cadeia com hedge (ver hedging.py): se a configuração não
+    produzir o primeiro token dentro do atraso, a pergunta também é enviada à
+    próxima configuração do pool (ou de novo à mesma, se for a única).
+    """
+    alternativa = next((c for c in configs if c.pk != config.pk), config)
+    
+    def criar_stream(c):
+        with metrics.etapas.medir("cadeia"):
+            llm = llm_pool.get_async(c)
+            if llm is None:
+                raise ValueError(f"Não foi possível inicializar o modelo de IA com o provedor {c.provedor}.")
+            chain = _build_chain(llm)
+        return chain.astream(inputs)
     
-    # Criar um template de prompt para o curso
-    template = """
-    Você é um assistente de aprendizado para o curso: {curso_titulo}.
+    async def areservar(c):
+        if not router.permite(c):
+            return False
+        try:
+            await _areservar_capacidade(curso, c, usuario_id, inputs, estado, esperar=False)
+            return True
+        except LimiteExcedido:
+            return False
     
-    Informações sobre o curso:
-    - Título: {curso_titulo}
-    - Descrição: {curso_descricao}
-    - Nível: {curso_nivel}
-    - Categoria: {curso_categoria}
+    return astream_com_hedge(criar_stream, config, alternativa, areservar,
+                             _tokens_prompt_estimados(config, inputs), estado)
+
+async def _ainvocar_hedge(curso, configs, config, usuario_id, inputs, estado):
+    mensagem = None
+    async for chunk in _ahedge(curso, configs, config, usuario_id, inputs, estado):
+        mensagem = chunk if mensagem is None else mensagem + chunk
+    return mensagem
+
+def _novo_estado(configs):
+    return {"config": configs[0] if configs else None, "mensagem": None,
+            "latencia": None, "primeiro_token": None, "tokens_descartados": 0, "reservas": []}
+
+def _registrar_erro(config, erro, descartadas):
+    """
+    Registra a falha de uma tentativa: erros transitórios contam no circuit
+    breaker do provedor; os demais descartam a configuração nesta pergunta.
+    """
+    if erro_recuperavel(erro):
+        router.registrar_falha(config, erro)
+    else:
+        logger.error("Erro ao executar a cadeia com a configuração %s: %s", config.pk, erro)
+        descartadas.add(config.pk)
+
+def _esperar(plano, i, descartadas):
+    # Só aguarda na fila do limite de taxa a última tentativa que ainda pode ser feita
+    return not any(c.pk not in descartadas and router.disponivel(c) for c in plano[i + 1:])
+
+class _Tentativas:
+    """
+    Plano de tentativas do roteador para uma pergunta, compartilhado pelas
+    versões síncronas e assíncronas de _invocar e _stream: a iteração gera
+    (config, esperar) para cada configuração ainda disponível, e os métodos
+    registram o resultado de cada tentativa.
+    """
+
+    def __init__(self, configs):
+        self.plano = router.plano(configs)
+        self.descartadas = set()
+        self.ultimo_erro = None
+
+    def __iter__(self):
+        for i, config in enumerate(self.plano):
+            if config.pk in self.descartadas or not router.permite(config):
+                continue
+            yield config, _esperar(self.plano, i, self.descartadas)
+
+    def sem_capacidade(self, erro):
+        # Recusada pelo limite de taxa: vale o primeiro, se nenhuma outra tentativa for feita
+        self.ultimo_erro = self.ultimo_erro or erro
+
+    def falhou(self, config, erro):
+        _registrar_erro(config, erro, self.descartadas)
+        self.ultimo_erro = erro
+
+    def respondeu(self, estado, inicio):
+        estado["latencia"] = time.time() - inicio
+        router.registrar_sucesso(estado["config"], estado["latencia"])
+        metrics.latencia_provedor.observar(estado["latencia"], estado["config"].provedor, estado["config"].modelo)
+
+    def esgotadas(self):
+        """
+        Fim do plano sem resposta: levanta LimiteExcedido se nenhuma
+        tentativa pôde ser feita por falta de capacidade.
+        """
+        if isinstance(self.ultimo_erro, LimiteExcedido):
+            raise self.ultimo_erro
+        logger.error("Nenhuma configuração respondeu após %s tentativas", len(self.plano))
+
+    def erro_do_stream(self):
+        return self.ultimo_erro or ValueError("Nenhum provedor disponível no momento.")
+
+def _acumular(estado, chunk, inicio):
+    """
+    Junta o trecho à mensagem em `estado` e registra o tempo até o primeiro
+    trecho com texto.
+    """
+    estado["mensagem"] = chunk if estado["mensagem"] is None else estado["mensagem"] + chunk
+    if chunk.content and estado["primeiro_token"] is None:
+        estado["primeiro_token"] = time.time() - inicio
+        metrics.primeiro_token.observar(estado["primeiro_token"], estado["config"].provedor, estado["config"].modelo)
+
+def _invocar(curso, configs, usuario_id, inputs, estado):
+    """
+    Executa a cadeia seguindo o plano de tentativas do roteador: em erros a
+    pergunta passa para a próxima configuração. Os transitórios (timeout,
+    conexão, 429, 5xx) contam no circuit breaker; nos demais (credencial,
+    modelo inválido), a configuração é pulada no resto do plano.
+
+    Retorna a mensagem do modelo, ou None se nenhuma configuração respondeu;
+    a configuração que respondeu, a latência e os tokens descartados por
+    hedge ficam em `estado`. Levanta LimiteExcedido se nenhuma tentativa
+    pôde ser feita por falta de capacidade.
+    """
+    tentativas = _Tentativas(configs)
+    for config, esperar in tentativas:
+        try:
+            _reservar_capacidade(curso, config, usuario_id, inputs, estado, esperar)
+        except OrcamentoExcedido:
+            raise
+        except LimiteExcedido as e:
+            tentativas.sem_capacidade(e)
+            continue
+        
+        estado["config"] = config
+        inicio = time.time()
+        try:
+            if config.hedge_ativo:
+                mensagem = executar(_ainvocar_hedge(curso, configs, config, usuario_id, inputs, estado))
+            else:
+                mensagem = create_chain_for_course(curso, config).invoke(inputs)
+        except Exception as e:
+            tentativas.falhou(config, e)
+            continue
+        
+        tentativas.respondeu(estado, inicio)
+        return mensagem
     
-    Contexto adicional: {contexto}
+    tentativas.esgotadas()
+    return None
+
+async def _ainvocar(curso, configs, usuario_id, inputs, estado):
+    """
+    Versão assíncrona de _invocar.
+    """
+    tentativas = _Tentativas(configs)
+    for config, esperar in tentativas:
+        try:
+            await _areservar_capacidade(curso, config, usuario_id, inputs, estado, esperar)
+        except OrcamentoExcedido:
+            raise
+        except LimiteExcedido as e:
+            tentativas.sem_capacidade(e)
+            continue
+        
+        estado["config"] = config
+        inicio = time.time()
+        try:
+            if config.hedge_ativo:
+                mensagem = await _ainvocar_hedge(curso, configs, config, usuario_id, inputs, estado)
+            else:
+                chain = await acreate_chain_for_course(curso, config)
+                mensagem = await chain.ainvoke(inputs)
+        except Exception as e:
+            tentativas.falhou(config, e)
+            continue
+        
+        tentativas.respondeu(estado, inicio)
+        return mensagem
     
-    Histórico da conversa:
-    {chat_history}
+    tentativas.esgotadas()
+    return None
+
+def _stream(curso, configs, usuario_id, inputs, estado):
+    """
+    Versão em streaming de _invocar: gera os trechos da resposta. A troca de
+    configuração só acontece antes do primeiro trecho com texto; depois dele,
+    o erro é repassado ao chamador. A mensagem acumulada também fica em
+    `estado`.
+    """
+    tentativas = _Tentativas(configs)
+    for config, esperar in tentativas:
+        try:
+            _reservar_capacidade(curso, config, usuario_id, inputs, estado, esperar)
+        except OrcamentoExcedido:
+            raise
+        except LimiteExcedido as e:
+            tentativas.sem_capacidade(e)
+            continue
+        
+        estado["config"] = config
+        estado["mensagem"] = None
+        inicio = time.time()
+        try:
+            if config.hedge_ativo:
+                chunks = iterar(_ahedge(curso, configs, config, usuario_id, inputs, estado))
+            else:
+                chunks = create_chain_for_course(curso, config).stream(inputs)
+            for chunk in chunks:
+                _acumular(estado, chunk, inicio)
+                yield chunk
+        except Exception as e:
+            tentativas.falhou(config, e)
+            if estado["primeiro_token"] is not None:
+                raise
+            continue
+        
+        tentativas.respondeu(estado, inicio)
+        return
     
-    Pergunta do aluno: {pergunta}
+    estado["mensagem"] = None
+    raise tentativas.erro_do_stream()
+
+async def _astream(curso, configs, usuario_id, inputs, estado):
+    """
+    Versão assíncrona de _stream.
+    """
+    tentativas = _Tentativas(configs)
+    for config, esperar in tentativas:
+        try:
+            await _areservar_capacidade(curso, config, usuario_id, inputs, estado, esperar)
+        except OrcamentoExcedido:
+            raise
+        except LimiteExcedido as e:
+            tentativas.sem_capacidade(e)
+            continue
+        
+        estado["config"] = config
+        estado["mensagem"] = None
+        inicio = time.time()
+        try:
+            if config.hedge_ativo:
+                chunks = _ahedge(curso, configs, config, usuario_id, inputs, estado)
+            else:
+                chain = await acreate_chain_for_course(curso, config)
+                chunks = chain.astream(inputs)
+            async for chunk in chunks:
+                _acumular(estado, chunk, inicio)
+                yield chunk
+        except Exception as e:
+            tentativas.falhou(config, e)
+            if estado["primeiro_token"] is not None:
+                raise
+            continue
+        
+        tentativas.respondeu(estado, inicio)
+        return
     
-    Sua resposta deve ser educativa, clara e útil. Forneça exemplos quando apropriado.
-    Resposta:
+    estado["mensagem"] = None
+    raise tentativas.erro_do_stream()
+
+def _erro_limite(e):
+    logger.warning("Requisição recusada por limite: %s", e)
+    return {"error": str(e), "status": 429, "retry_after": e.retry_after}
+
+def _erro_pergunta(e, curso_id, conversa_id, origem):
     """
+    Converte as exceções de process_question e aprocess_question no
+    dicionário de erro devolvido às views.
+    """
+    if isinstance(e, Curso.DoesNotExist):
+        logger.error("Curso ID %s não encontrado", curso_id)
+        return {"error": "Curso não encontrado."}
+    if isinstance(e, Conversa.DoesNotExist):
+        logger.error("Conversa ID %s não encontrada no curso %s", conversa_id, curso_id)
+        return {"error": "Conversa não encontrada."}
+    if isinstance(e, LimiteExcedido):
+        return _erro_limite(e)
+    logger.error("Erro não tratado em %s: %s", origem, e)
+    return {"error": str(e)}
+
+def _desempenho(inicio, resultado="ok", cache=None, latencia_provedor=None, latencia_primeiro_token=None):
+    """
+    Campos de desempenho da interação: o resultado, o nível do acerto de
+    cache e as latências (a total é contada a partir de `inicio`).
+    """
+    return {
+        "resultado": resultado,
+        "cache": cache or "",
+        "latencia_total": time.time() - inicio,
+        "latencia_provedor": latencia_provedor,
+        "latencia_primeiro_token": latencia_primeiro_token,
+    }
+
+def _geracao(config, resposta, tokens_prompt=0, tokens_resposta=0, tokens_descartados=0, cache=None,
+             simulada=False, latencia_provedor=None, sem_contexto=False):
+    """
+    Resposta gerada para uma pergunta, ainda sem a interação (ver
+    agerar_resposta).
+    """
+    return {"config": config, "resposta": resposta, "tokens_prompt": tokens_prompt,
+            "tokens_resposta": tokens_resposta, "tokens_descartados": tokens_descartados,
+            "cache": cache, "simulada": simulada, "latencia_provedor": latencia_provedor,
+            "sem_contexto": sem_contexto}
+
+def _geracao_simulada(curso, pergunta):
+    # Sem configuração ativa, nenhum provedor é chamado
+    logger.info("Usando modo de resposta simulada devido à falta de configuração.")
+    resposta = get_resposta_simulada(curso, pergunta)
+    return _geracao(None, resposta, *_uso_simulado(pergunta, resposta), simulada=True)
+
+def _geracao_do_cache(config, cache_entry, sem_contexto):
+    logger.debug("Resposta obtida do cache (%s)", cache_entry["cache"])
+    return _geracao(config, cache_entry["resposta"], cache=cache_entry["cache"], sem_contexto=sem_contexto)
+
+def _concluir_geracao(curso, pergunta, contexto_cache, sem_contexto, inputs, mensagem, estado):
+    """
+    Fecha a geração depois de executar a cadeia: conta os tokens, guarda no
+    cache e desconta dos orçamentos apenas as respostas geradas pelo
+    provedor (e os tokens das chamadas canceladas por hedge), devolvendo o
+    resto da reserva.
+    """
+    config, latencia = estado["config"], estado["latencia"]
+    if mensagem is not None:
+        logger.debug("Cadeia executada em %.2f segundos com a configuração %s", latencia, config.nome)
+        resposta = mensagem.content
+        tokens_prompt, tokens_resposta = _uso_tokens(mensagem, config, inputs, resposta)
+    else:
+        logger.debug("Usando resposta simulada devido a erro na execução")
+        resposta = get_resposta_simulada(curso, pergunta)
+        tokens_prompt, tokens_resposta = _uso_simulado(pergunta, resposta)
     
-    # Criar o prompt
-    prompt = PromptTemplate(
-        input_variables=["curso_titulo", "curso_descricao", "curso_nivel", 
-                         "curso_categoria", "contexto", "chat_history", "pergunta"],
-        template=template
+    tokens_consumidos = estado["tokens_descartados"]
+    if latencia is not None:
+        _salvar_cache(curso, config, pergunta, contexto_cache, sem_contexto, resposta,
+                      tokens_prompt + tokens_resposta, latencia)
+        tokens_consumidos += tokens_prompt + tokens_resposta
+    _conciliar(estado, tokens_consumidos)
+    return _geracao(config, resposta, tokens_prompt, tokens_resposta, estado["tokens_descartados"],
+                    simulada=mensagem is None, latencia_provedor=latencia, sem_contexto=sem_contexto)
+
+def _campos_interacao(geracao, inicio, resultado=None, latencia_primeiro_token=None):
+    """
+    Argumentos de _salvar_interacao para uma geração: tokens e desempenho.
+    """
+    if resultado is None:
+        resultado = "simulada" if geracao["simulada"] else "ok"
+    return dict(
+        tokens_prompt=geracao["tokens_prompt"],
+        tokens_resposta=geracao["tokens_resposta"],
+        tokens_descartados=geracao["tokens_descartados"],
+        sem_contexto=geracao["sem_contexto"],
+        **_desempenho(inicio, resultado, geracao["cache"], geracao["latencia_provedor"], latencia_primeiro_token)
+    )
+
+def _nova_interacao(curso, config, conversa, pergunta, resposta, tokens_prompt, tokens_resposta,
+                    tokens_descartados, sem_contexto, desempenho):
+    # Nas respostas simuladas, nenhum provedor respondeu
+    respondeu = config is not None and desempenho.get("resultado", "ok") != "simulada"
+    return Interacao(
+        curso=curso,
+        configuracao_ia=config,
+        conversa=conversa,
+        pergunta=pergunta,
+        resposta=resposta,
+        tokens_utilizados=tokens_prompt + tokens_resposta,
+        tokens_prompt=tokens_prompt,
+        tokens_resposta=tokens_resposta,
+        tokens_descartados=tokens_descartados,
+        provedor=config.provedor if respondeu else "",
+        modelo=config.modelo if respondeu else "",
+        sem_contexto=sem_contexto,
+        **desempenho
     )
+
+def _registrar_interacao(interacao, config):
+    """
+    Métricas de tokens e um registro estruturado por interação, com os
+    campos de desempenho (o dicionário só é montado se o nível INFO estiver
+    ativo).
+    """
+    metrics.registrar_tokens(config, interacao.tokens_prompt, interacao.tokens_resposta,
+                             interacao.tokens_descartados)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Interação registrada", extra={
+            "curso_id": interacao.curso_id,
+            "configuracao_id": interacao.configuracao_ia_id,
+            "conversa_id": interacao.conversa_id,
+            "interacao_uuid": str(interacao.uuid),
+            "resultado": interacao.resultado,
+            "cache": interacao.cache or None,
+            "provedor": interacao.provedor or None,
+            "modelo": interacao.modelo or None,
+            "tokens": interacao.tokens_utilizados,
+            "latencia_total": interacao.latencia_total,
+            "latencia_provedor": interacao.latencia_provedor,
+            "latencia_primeiro_token": interacao.latencia_primeiro_token,
+        })
+
+def _salvar_interacao(curso, config, conversa, pergunta, resposta, tokens_prompt=0, tokens_resposta=0,
+                      tokens_descartados=0, sem_contexto=False, **desempenho):
+    """
+    Salva a interação (ou a coloca na fila da gravação adiada) e condensa no
+    resumo da conversa os turnos que saíram da janela de histórico.
+    `desempenho` são os campos de _desempenho.
+    """
+    interacao = _nova_interacao(curso, config, conversa, pergunta, resposta, tokens_prompt, tokens_resposta,
+                                tokens_descartados, sem_contexto, desempenho)
+    with metrics.etapas.medir("gravacao"):
+        if write_behind is not None:
+            write_behind.adicionar(interacao)
+        else:
+            interacao.save()
+    _registrar_interacao(interacao, config)
+    agendar_resumo(conversa, llm_pool.get(config) if config else None)
+    return interacao
+
+async def _asalvar_interacao(curso, config, conversa, pergunta, resposta, tokens_prompt=0, tokens_resposta=0,
+                             tokens_descartados=0, sem_contexto=False, **desempenho):
+    """
+    Versão assíncrona de _salvar_interacao.
+    """
+    interacao = _nova_interacao(curso, config, conversa, pergunta, resposta, tokens_prompt, tokens_resposta,
+                                tokens_descartados, sem_contexto, desempenho)
+    with metrics.etapas.medir("gravacao"):
+        if write_behind is not None:
+            write_behind.adicionar(interacao)
+        else:
+            await interacao.asave()
+    _registrar_interacao(interacao, config)
+    await sync_to_async(agendar_resumo)(conversa, llm_pool.get(config) if config else None)
+    return interacao
+
+def _resultado(interacao, conversa, cache_hit=False, **extra):
+    """
+    Monta o retorno de process_question a partir da interação salva.
+    """
+    return dict({
+        "resposta": interacao.resposta,
+        # Na gravação adiada, a interação ainda não tem id: vale o UUID
+        "interacao_id": interacao.id if interacao.id is not None else str(interacao.uuid),
+        "interacao_uuid": str(interacao.uuid),
+        # Sem conversa (primeira pergunta), a chave para continuar é o UUID da interação
+        "conversa_id": str(conversa.chave if conversa is not None else interacao.uuid),
+        "tokens_utilizados": interacao.tokens_utilizados,
+        "tokens_prompt": interacao.tokens_prompt,
+        "tokens_resposta": interacao.tokens_resposta,
+        "cache_hit": cache_hit
+    }, **extra)
+
+def _resultado_da_geracao(interacao, conversa, geracao):
+    # Sem configuração ativa, o retorno indica o modo simulado
+    extra = {"modo": "simulado"} if geracao["config"] is None else {}
+    return _resultado(interacao, conversa, cache_hit=geracao["cache"] is not None, **extra)
+
+def get_resposta_simulada(curso, pergunta):
+    """Função auxiliar para gerar resposta simulada mais elaborada"""
+    logger.debug("Gerando resposta simulada...")
+    metrics.simuladas.inc()
+    pergunta_lower = pergunta.lower()
+
+    # Respostas simuladas baseadas em palavras-chave na pergunta
+    if "python" in pergunta_lower and ("conceitos" in pergunta_lower or "básicos" in pergunta_lower or "aprender" in pergunta_lower):
+        return """
+        Para começar a aprender Python, você deve focar nos seguintes conceitos básicos:
+
+        1. **Sintaxe básica**: Como escrever comandos Python corretamente
+        2. **Variáveis e tipos de dados**: Inteiros, floats, strings, booleanos, listas, tuplas, dicionários
+        3. **Operadores**: Aritméticos, de comparação, lógicos
+        4. **Estruturas de controle**: if/else, loops (for, while)
+        5. **Funções**: Como definir e chamar funções, argumentos, retorno
+        6. **Manipulação de strings**: Métodos de string, formatação
+        7. **Trabalhando com listas e dicionários**: Métodos e operações comuns
+        8. **Manipulação de arquivos**: Leitura e escrita em arquivos
+        9. **Tratamento de exceções**: try/except
+        10. **Módulos e pacotes**: Como importar e usar bibliotecas
+
+        No curso '{}', você aprenderá esses conceitos fundamentais através de explicações claras e exercícios práticos. É recomendado praticar código todos os dias e trabalhar em pequenos projetos para fixar o conhecimento.
+        """.format(curso.titulo)
+
+    elif "função" in pergunta_lower or "funções" in pergunta_lower:
+        return """
+        Funções em Python são blocos de código reutilizáveis que realizam tarefas específicas. Elas ajudam a organizar seu código e evitar repetição.
+
+        Para definir uma função em Python:
+
+        ```python
+        def nome_da_funcao(parametro1, parametro2):
+            # Corpo da função
+            resultado = parametro1 + parametro2
+            return resultado
+        ```
+
+        Características importantes das funções em Python:
+        - Usamos a palavra-chave `def` para defini-las
+        - Podem receber parâmetros (dados de entrada)
+        - Podem retornar valores com a palavra-chave `return`
+        - Podem ter parâmetros opcionais com valores padrão
+        - Podem ser documentadas com docstrings
+
+        No curso '{}', você aprenderá como escrever funções eficientes e quando usá-las apropriadamente.
+        """.format(curso.titulo)
+
+    elif "loop" in pergunta_lower or "for" in pergunta_lower or "while" in pergunta_lower:
+        return """
+        Loops em Python permitem executar um bloco de código várias vezes. Os dois tipos principais são:
+
+        **Loop for**: Usado para iterar sobre uma sequência (lista, tupla, string, etc.)
+        ```python
+        for item in lista:
+            print(item)
+        ```
+
+        **Loop while**: Executa enquanto uma condição for verdadeira
+        ```python
+        contador = 0
+        while contador < 5:
+            print(contador)
+            contador += 1
+        ```
+
+        Recursos adicionais:
+        - `range()`: Gera sequências numéricas para loops
+        - `break`: Sai imediatamente do loop
+        - `continue`: Pula para a próxima iteração
+        - Compreensão de lista: `[x*2 for x in lista]`
+
+        No curso '{}', exploramos estes conceitos com exercícios práticos para fixação.
+        """.format(curso.titulo)
+
+    elif "lista" in pergunta_lower or "dicionário" in pergunta_lower or "estrutura" in pergunta_lower:
+        return """
+        Python tem várias estruturas de dados importantes:
+
+        **Listas**: Coleções ordenadas e mutáveis
+        ```python
+        frutas = ['maçã', 'banana', 'laranja']
+        frutas.append('uva')  # Adiciona item
+        ```
+
+        **Tuplas**: Coleções ordenadas e imutáveis
+        ```python
+        coordenadas = (10, 20)
+        ```
+
+        **Dicionários**: Pares de chave-valor
+        ```python
+        pessoa = {
+            'nome': 'João',
+            'idade': 30,
+            'profissão': 'desenvolvedor'
+        }
+        ```
+
+        **Conjuntos (Sets)**: Coleções não ordenadas de itens únicos
+        ```python
+        cores = {'vermelho', 'verde', 'azul'}
+        ```
+
+        Cada estrutura tem seu próprio conjunto de métodos e casos de uso ideais, que são detalhados no curso '{}'.
+        """.format(curso.titulo)
+
+    else:
+        # Resposta genérica para outras perguntas
+        return f"""
+        Esta é uma resposta simulada para sua pergunta sobre '{pergunta}'.
+
+        No curso '{curso.titulo}', abordamos esse e outros tópicos relacionados. 
+        A descrição do curso menciona:
+
+        "{curso.descricao[:300]}..."
+
+        Para obter respostas mais precisas e detalhadas, seria necessário configurar uma integração com um modelo de IA como o DeepSeek ou OpenAI através do painel administrativo.
+        """
+
+def _gerar_resposta(curso, configs, pergunta, contexto="", historico="", usuario_id=None):
+    """
+    Gera a resposta de uma pergunta sem salvar a interação. Versão síncrona
+    de agerar_resposta.
+    """
+    # Trechos dos materiais do curso relevantes para a pergunta (também entram na chave do cache)
+    sem_contexto = _sem_contexto(contexto, historico)
+    contexto = contexto_com_materiais(curso, pergunta, contexto)
     
-    # Criar memória para manter o histórico da conversa
-    memory = ConversationBufferMemory(memory_key="chat_history", input_key="pergunta")
+    # Reutilizar a resposta de uma pergunta igual ou parecida, se houver
+    contexto_cache = _contexto_cache(contexto, historico)
+    cache_entry = _buscar_cache(curso, configs[0], pergunta, contexto_cache, sem_contexto)
+    if cache_entry:
+        return _geracao_do_cache(configs[0], cache_entry, sem_contexto)
     
-    # Criar a cadeia
-    chain = LLMChain(
-        llm=llm,
-        prompt=prompt,
-        memory=memory,
-        verbose=True
-    )
+    inputs = _build_inputs(curso, pergunta, contexto, historico)
     
-    return chain
+    # Executar a cadeia, passando para a próxima configuração em erros transitórios
+    # (respeitando os orçamentos diários e o limite de taxa de cada provedor)
+    estado = _novo_estado(configs)
+    try:
+        mensagem = _invocar(curso, configs, usuario_id, inputs, estado)
+    except LimiteExcedido:
+        _conciliar(estado, estado["tokens_descartados"])
+        raise
+    return _concluir_geracao(curso, pergunta, contexto_cache, sem_contexto, inputs, mensagem, estado)
 
-def process_question(curso_id, pergunta, configuracao_id=None, contexto=""):
+async def agerar_resposta(curso, configs, pergunta, contexto="", historico="", usuario_id=None):
     """
-    Processa uma pergunta usando LangChain e salva a interação.
+    Gera a resposta de uma pergunta sem salvar a interação: procura no cache,
+    executa a cadeia pelo roteador (com failover e hedge) e desconta o
+    consumo dos orçamentos. `configs` é a lista ordenada de aget_configs e
+    não pode ser vazia.
+    
+    Retorna um dicionário com a configuração usada, a resposta, os tokens,
+    o nível do acerto de cache ("exato", "similar" ou None), se a resposta
+    é simulada (todos os provedores falharam), a latência do provedor e se
+    a pergunta veio sem contexto. Levanta LimiteExcedido se não houver
+    capacidade.
+    """
+    sem_contexto = _sem_contexto(contexto, historico)
+    contexto = await acontexto_com_materiais(curso, pergunta, contexto)
+    
+    contexto_cache = _contexto_cache(contexto, historico)
+    cache_entry = await sync_to_async(_buscar_cache)(curso, configs[0], pergunta, contexto_cache, sem_contexto)
+    if cache_entry:
+        return _geracao_do_cache(configs[0], cache_entry, sem_contexto)
+    
+    inputs = _build_inputs(curso, pergunta, contexto, historico)
+    
+    estado = _novo_estado(configs)
+    try:
+        mensagem = await _ainvocar(curso, configs, usuario_id, inputs, estado)
+    except LimiteExcedido:
+        await sync_to_async(_conciliar)(estado, estado["tokens_descartados"])
+        raise
+    return await sync_to_async(_concluir_geracao)(
+        curso, pergunta, contexto_cache, sem_contexto, inputs, mensagem, estado
+    )
+
+@metrics.medir_pergunta("sincrono")
+def process_question(curso_id, pergunta, configuracao_id=None, contexto="", conversa_id=None, usuario_id=None):
+    """
+    Processa uma pergunta usando LangChain e salva a interação na conversa
+    informada (ou sem conversa, na primeira pergunta).
     """
     start_time = time.time()
-    logger.debug(f"Iniciando process_question para curso_id: {curso_id}, pergunta: {pergunta[:50]}...")
+    logger.debug("Iniciando process_question para curso_id: %s, pergunta: %s...", curso_id, pergunta[:50])
     
-    def get_resposta_simulada(curso, pergunta):
-        """Função auxiliar para gerar resposta simulada mais elaborada"""
-        logger.debug("Gerando resposta simulada...")
-        pergunta_lower = pergunta.lower()
-        
-        # Respostas simuladas baseadas em palavras-chave na pergunta
-        if "python" in pergunta_lower and ("conceitos" in pergunta_lower or "básicos" in pergunta_lower or "aprender" in pergunta_lower):
-            return """
-            Para começar a aprender Python, você deve focar nos seguintes conceitos básicos:
-
-            1. **Sintaxe básica**: Como escrever comandos Python corretamente
-            2. **Variáveis e tipos de dados**: Inteiros, floats, strings, booleanos, listas, tuplas, dicionários
-            3. **Operadores**: Aritméticos, de comparação, lógicos
-            4. **Estruturas de controle**: if/else, loops (for, while)
-            5. **Funções**: Como definir e chamar funções, argumentos, retorno
-            6. **Manipulação de strings**: Métodos de string, formatação
-            7. **Trabalhando com listas e dicionários**: Métodos e operações comuns
-            8. **Manipulação de arquivos**: Leitura e escrita em arquivos
-            9. **Tratamento de exceções**: try/except
-            10. **Módulos e pacotes**: Como importar e usar bibliotecas
-
-            No curso '{}', você aprenderá esses conceitos fundamentais através de explicações claras e exercícios práticos. É recomendado praticar código todos os dias e trabalhar em pequenos projetos para fixar o conhecimento.
-            """.format(curso.titulo)
-        
-        elif "função" in pergunta_lower or "funções" in pergunta_lower:
-            return """
-            Funções em Python são blocos de código reutilizáveis que realizam tarefas específicas. Elas ajudam a organizar seu código e evitar repetição.
-
-            Para definir uma função em Python:
-
-            ```python
-            def nome_da_funcao(parametro1, parametro2):
-                # Corpo da função
-                resultado = parametro1 + parametro2
-                return resultado
-            ```
-
-            Características importantes das funções em Python:
-            - Usamos a palavra-chave `def` para defini-las
-            - Podem receber parâmetros (dados de entrada)
-            - Podem retornar valores com a palavra-chave `return`
-            - Podem ter parâmetros opcionais com valores padrão
-            - Podem ser documentadas com docstrings
-
-            No curso '{}', você aprenderá como escrever funções eficientes e quando usá-las apropriadamente.
-            """.format(curso.titulo)
+    try:
+        # Obter o curso
+        curso = Curso.objects.select_related('categoria').get(id=curso_id)
         
-        elif "loop" in pergunta_lower or "for" in pergunta_lower or "while" in pergunta_lower:
-            return """
-            Loops em Python permitem executar um bloco de código várias vezes. Os dois tipos principais são:
-
-            **Loop for**: Usado para iterar sobre uma sequência (lista, tupla, string, etc.)
-            ```python
-            for item in lista:
-                print(item)
-            ```
-
-            **Loop while**: Executa enquanto uma condição for verdadeira
-            ```python
-            contador = 0
-            while contador < 5:
-                print(contador)
-                contador += 1
-            ```
-
-            Recursos adicionais:
-            - `range()`: Gera sequências numéricas para loops
-            - `break`: Sai imediatamente do loop
-            - `continue`: Pula para a próxima iteração
-            - Compreensão de lista: `[x*2 for x in lista]`
-
-            No curso '{}', exploramos estes conceitos com exercícios práticos para fixação.
-            """.format(curso.titulo)
+        # Obter as configurações ativas, na ordem do roteador
+        configs = get_configs(configuracao_id)
         
-        elif "lista" in pergunta_lower or "dicionário" in pergunta_lower or "estrutura" in pergunta_lower:
-            return """
-            Python tem várias estruturas de dados importantes:
-
-            **Listas**: Coleções ordenadas e mutáveis
-            ```python
-            frutas = ['maçã', 'banana', 'laranja']
-            frutas.append('uva')  # Adiciona item
-            ```
-
-            **Tuplas**: Coleções ordenadas e imutáveis
-            ```python
-            coordenadas = (10, 20)
-            ```
-
-            **Dicionários**: Pares de chave-valor
-            ```python
-            pessoa = {
-                'nome': 'João',
-                'idade': 30,
-                'profissão': 'desenvolvedor'
-            }
-            ```
-
-            **Conjuntos (Sets)**: Coleções não ordenadas de itens únicos
-            ```python
-            cores = {'vermelho', 'verde', 'azul'}
-            ```
-
-            Cada estrutura tem seu próprio conjunto de métodos e casos de uso ideais, que são detalhados no curso '{}'.
-            """.format(curso.titulo)
+        # Obter a conversa e o histórico limitado (últimos turnos + resumo)
+        conversa = obter_conversa(curso, conversa_id, usuario_id)
+        historico = carregar_historico(conversa)
         
+        # Se não houver configuração ativa, usar resposta simulada
+        if configs:
+            geracao = _gerar_resposta(curso, configs, pergunta, contexto, historico, usuario_id)
         else:
-            # Resposta genérica para outras perguntas
-            return f"""
-            Esta é uma resposta simulada para sua pergunta sobre '{pergunta}'.
-            
-            No curso '{curso.titulo}', abordamos esse e outros tópicos relacionados. 
-            A descrição do curso menciona:
-            
-            "{curso.descricao[:300]}..."
-            
-            Para obter respostas mais precisas e detalhadas, seria necessário configurar uma integração com um modelo de IA como o DeepSeek ou OpenAI através do painel administrativo.
-            """
-    
-    try:
-        # Obter o curso
-        logger.debug(f"Tentando obter curso com ID {curso_id}...")
-        curso = Curso.objects.get(id=curso_id)
-        logger.debug(f"Curso encontrado: {curso.titulo}")
+            geracao = _geracao_simulada(curso, pergunta)
         
-        # Obter a configuração
-        config = None
-        if configuracao_id:
-            try:
-                logger.debug(f"Tentando obter configuração com ID {configuracao_id}...")
-                config = ConfiguracaoIA.objects.get(id=configuracao_id, ativo=True)
-                logger.debug(f"Configuração encontrada: {config.nome}")
-            except ConfiguracaoIA.DoesNotExist:
-                logger.warning(f"Configuração ID {configuracao_id} não encontrada ou inativa.")
-                pass
+        interacao = _salvar_interacao(curso, geracao["config"], conversa, pergunta, geracao["resposta"],
+                                      **_campos_interacao(geracao, start_time))
         
-        if not config:
-            logger.debug("Tentando obter primeira configuração ativa...")
-            config = ConfiguracaoIA.objects.filter(ativo=True).first()
-            if config:
-                logger.debug(f"Configuração ativa encontrada: {config.nome}")
-            else:
-                logger.warning("Nenhuma configuração ativa encontrada.")
+        logger.debug("process_question concluído em %.2f segundos", time.time() - start_time)
         
-        # Se não houver configuração ou se a configuração for inválida, usar resposta simulada
-        if not config:
-            logger.info("Usando modo de resposta simulada devido à falta de configuração.")
-            resposta = get_resposta_simulada(curso, pergunta)
-            
-            # Estimar tokens (simplificado)
-            tokens_utilizados = len(pergunta.split()) + len(resposta.split())
-            
-            # Salvar a interação com configuração nula
-            interacao = Interacao.objects.create(
-                curso=curso,
-                configuracao_ia=None,
-                pergunta=pergunta,
-                resposta=resposta,
-                tokens_utilizados=tokens_utilizados
-            )
-            
-            elapsed_time = time.time() - start_time
-            logger.debug(f"Resposta simulada gerada em {elapsed_time:.2f} segundos")
-            
-            return {
-                "resposta": resposta,
-                "interacao_id": interacao.id,
-                "tokens_utilizados": tokens_utilizados,
-                "modo": "simulado"
-            }
+        return _resultado_da_geracao(interacao, conversa, geracao)
         
-        try:
-            # Tentar criar e executar a cadeia
-            logger.debug("Criando cadeia para o curso...")
-            chain_start_time = time.time()
-            chain = create_chain_for_course(curso, config)
-            logger.debug(f"Cadeia criada em {time.time() - chain_start_time:.2f} segundos")
-            
-            # Preparar os inputs
-            nivel_texto = dict(Curso.NIVEL_CHOICES).get(curso.nivel, "")
-            inputs = {
-                "curso_titulo": curso.titulo,
-                "curso_descricao": curso.descricao,
-                "curso_nivel": nivel_texto,
-                "curso_categoria": curso.categoria.nome,
-                "contexto": contexto,
-                "pergunta": pergunta
-            }
-            
-            # Executar a cadeia
-            logger.debug("Executando a cadeia com a pergunta...")
-            invoke_start_time = time.time()
-            result = chain.invoke(inputs)
-            invoke_time = time.time() - invoke_start_time
-            logger.debug(f"Cadeia executada em {invoke_time:.2f} segundos")
-            
-            resposta = result.get("text", "")
-            logger.debug(f"Resposta obtida com {len(resposta)} caracteres")
-            
-        except Exception as e:
-            logger.error(f"Erro ao executar a cadeia: {str(e)}")
-            resposta = get_resposta_simulada(curso, pergunta)
-            logger.debug("Usando resposta simulada devido a erro na execução")
+    except Exception as e:
+        return _erro_pergunta(e, curso_id, conversa_id, "process_question")
+
+@metrics.medir_pergunta("assincrono")
+async def aprocess_question(curso_id, pergunta, configuracao_id=None, contexto="", conversa_id=None, usuario_id=None):
+    """
+    Versão assíncrona de process_question: as consultas usam o ORM assíncrono
+    e a chamada ao provedor não bloqueia uma thread enquanto aguarda a resposta.
+    """
+    start_time = time.time()
+    logger.debug("Iniciando aprocess_question para curso_id: %s, pergunta: %s...", curso_id, pergunta[:50])
+    
+    try:
+        curso = await Curso.objects.select_related('categoria').aget(id=curso_id)
+        configs = await aget_configs(configuracao_id)
+        conversa = await sync_to_async(obter_conversa)(curso, conversa_id, usuario_id)
+        historico = await sync_to_async(carregar_historico)(conversa)
         
-        # Estimar tokens (simplificado)
-        tokens_utilizados = len(pergunta.split()) + len(resposta.split())
+        if configs:
+            geracao = await agerar_resposta(curso, configs, pergunta, contexto, historico, usuario_id)
+        else:
+            geracao = _geracao_simulada(curso, pergunta)
         
-        # Salvar a interação
-        logger.debug("Salvando interação no banco de dados...")
-        interacao = Interacao.objects.create(
-            curso=curso,
-            configuracao_ia=config,
-            pergunta=pergunta,
-            resposta=resposta,
-            tokens_utilizados=tokens_utilizados
-        )
+        interacao = await _asalvar_interacao(curso, geracao["config"], conversa, pergunta, geracao["resposta"],
+                                             **_campos_interacao(geracao, start_time))
         
-        elapsed_time = time.time() - start_time
-        logger.debug(f"process_question concluído em {elapsed_time:.2f} segundos")
+        logger.debug("aprocess_question concluído em %.2f segundos", time.time() - start_time)
         
-        return {
-            "resposta": resposta,
-            "interacao_id": interacao.id,
-            "tokens_utilizados": tokens_utilizados
-        }
+        return _resultado_da_geracao(interacao, conversa, geracao)
         
-    except Curso.DoesNotExist:
-        logger.error(f"Curso ID {curso_id} não encontrado")
-        return {"error": "Curso não encontrado."}
     except Exception as e:
-        logger.error(f"Erro não tratado em process_question: {str(e)}")
-        return {"error": str(e)} 
\ No newline at end of file
+        return _erro_pergunta(e, curso_id, conversa_id, "aprocess_question")
+
+class _PerguntaEmStream:
+    """
+    Estado de uma pergunta respondida em streaming, compartilhado por
+    stream_question e astream_question: os trechos já emitidos, o resultado
+    e a geração salva na interação no fim. Os métodos devolvem os eventos
+    (evento, dados) a emitir; as chamadas ao banco e ao provedor ficam nas
+    duas funções.
+    """
+
+    def __init__(self, curso, configs, pergunta, contexto, historico):
+        self.curso = curso
+        self.configs = configs
+        self.pergunta = pergunta
+        self.historico = historico
+        self.sem_contexto = _sem_contexto(contexto, historico)
+        self.estado = _novo_estado(configs)
+        self.partes = []
+        self.cache_entry = None
+        self.recusada = False
+        # Resultado da interação; None até o stream terminar (cancelado pelo cliente se continuar None)
+        self.resultado = None
+
+    def preparar(self, contexto):
+        """
+        Procura a resposta no cache e monta os inputs. `contexto` já inclui
+        os trechos dos materiais do curso.
+        """
+        self.contexto_cache = _contexto_cache(contexto, self.historico)
+        if self.configs:
+            self.cache_entry = _buscar_cache(self.curso, self.configs[0], self.pergunta, self.contexto_cache,
+                                             self.sem_contexto)
+        self.inputs = _build_inputs(self.curso, self.pergunta, contexto, self.historico)
+
+    def _completa(self, resposta, resultado):
+        self.partes.append(resposta)
+        self.resultado = resultado
+        return "token", {"texto": resposta}
+
+    def sem_provedor(self):
+        """
+        Evento com a resposta inteira quando ela não vem do provedor
+        (simulada ou do cache), ou None se a cadeia deve ser executada.
+        """
+        if not self.configs:
+            logger.info("Usando modo de resposta simulada devido à falta de configuração.")
+            return self._completa(get_resposta_simulada(self.curso, self.pergunta), "simulada")
+        if self.cache_entry:
+            return self._completa(self.cache_entry["resposta"], "ok")
+        return None
+
+    def trecho(self, chunk):
+        if chunk.content:
+            self.partes.append(chunk.content)
+            return "token", {"texto": chunk.content}
+        return None
+
+    def falha(self, erro):
+        if isinstance(erro, LimiteExcedido):
+            # Nenhuma configuração tinha capacidade: recusar sem salvar a interação
+            self.recusada = True
+            return "erro", _erro_limite(erro)
+        logger.error("Erro durante o streaming da resposta: %s", erro)
+        if self.partes:
+            self.resultado = "erro"
+            return "erro", {"error": str(erro)}
+        return self._completa(get_resposta_simulada(self.curso, self.pergunta), "simulada")
+
+    def concluir(self):
+        """
+        Conta os tokens, guarda a resposta no cache e concilia as reservas.
+        Retorna a geração a salvar, ou None se a pergunta foi recusada.
+        """
+        estado = self.estado
+        if self.recusada:
+            _conciliar(estado, estado["tokens_descartados"])
+            return None
+        config, mensagem = estado["config"], estado["mensagem"]
+        resposta = "".join(self.partes)
+        if self.cache_entry:
+            tokens_prompt, tokens_resposta = 0, 0
+        else:
+            tokens_prompt, tokens_resposta = _uso_stream(mensagem, config, self.inputs, self.pergunta, resposta)
+        if estado["latencia"] is not None:
+            _salvar_cache(self.curso, config, self.pergunta, self.contexto_cache, self.sem_contexto, resposta,
+                          tokens_prompt + tokens_resposta, estado["latencia"])
+        tokens_consumidos = estado["tokens_descartados"]
+        if mensagem is not None:
+            tokens_consumidos += tokens_prompt + tokens_resposta
+        _conciliar(estado, tokens_consumidos)
+        return _geracao(config, resposta, tokens_prompt, tokens_resposta, estado["tokens_descartados"],
+                        cache=self.cache_entry and self.cache_entry["cache"],
+                        latencia_provedor=estado["latencia"], sem_contexto=self.sem_contexto)
+
+    def campos_interacao(self, geracao, inicio):
+        return _campos_interacao(geracao, inicio, self.resultado or "cancelada", self.estado["primeiro_token"])
+
+    def fim(self, interacao, conversa):
+        resultado = _resultado(interacao, conversa, cache_hit=bool(self.cache_entry))
+        del resultado["resposta"]
+        return "fim", resultado
+
+@metrics.medir_pergunta("stream")
+def stream_question(curso_id, pergunta, configuracao_id=None, contexto="", conversa_id=None, usuario_id=None):
+    """
+    Processa uma pergunta emitindo a resposta em partes, à medida que o
+    provedor gera os tokens.
+    
+    Gera tuplas (evento, dados): eventos "token" com cada trecho da resposta,
+    "erro" se o provedor falhar no meio da geração e, por fim, "fim" com o ID
+    da interação. A interação é salva quando o stream termina ou, com a
+    resposta parcial, quando o cliente desconecta antes do fim.
+    """
+    start_time = time.time()
+    try:
+        curso = Curso.objects.select_related('categoria').get(id=curso_id)
+    except Curso.DoesNotExist:
+        # Excluído depois da verificação da view: os cabeçalhos já foram enviados
+        yield "erro", {"error": "Curso não encontrado."}
+        return
+    try:
+        conversa = obter_conversa(curso, conversa_id, usuario_id)
+    except Conversa.DoesNotExist:
+        yield "erro", {"error": "Conversa não encontrada."}
+        return
+    historico = carregar_historico(conversa)
+    configs = get_configs(configuracao_id)
+    stream = _PerguntaEmStream(curso, configs, pergunta, contexto, historico)
+    if configs:
+        contexto = contexto_com_materiais(curso, pergunta, contexto)
+    stream.preparar(contexto)
+    
+    try:
+        evento = stream.sem_provedor()
+        if evento:
+            yield evento
+        else:
+            try:
+                for chunk in _stream(curso, configs, usuario_id, stream.inputs, stream.estado):
+                    evento = stream.trecho(chunk)
+                    if evento:
+                        yield evento
+                stream.resultado = "ok"
+            except Exception as e:
+                yield stream.falha(e)
+    finally:
+        # Salvar a interação (também quando o cliente cancela o stream)
+        geracao = stream.concluir()
+        if geracao is not None:
+            interacao = _salvar_interacao(curso, geracao["config"], conversa, pergunta, geracao["resposta"],
+                                          **stream.campos_interacao(geracao, start_time))
+    
+    if geracao is not None:
+        yield stream.fim(interacao, conversa)
+
+@metrics.medir_pergunta("stream")
+async def astream_question(curso_id, pergunta, configuracao_id=None, contexto="", conversa_id=None, usuario_id=None):
+    """
+    Versão assíncrona de stream_question.
+    """
+    start_time = time.time()
+    try:
+        curso = await Curso.objects.select_related('categoria').aget(id=curso_id)
+    except Curso.DoesNotExist:
+        yield "erro", {"error": "Curso não encontrado."}
+        return
+    try:
+        conversa = await sync_to_async(obter_conversa)(curso, conversa_id, usuario_id)
+    except Conversa.DoesNotExist:
+        yield "erro", {"error": "Conversa não encontrada."}
+        return
+    historico = await sync_to_async(carregar_historico)(conversa)
+    configs = await aget_configs(configuracao_id)
+    stream = _PerguntaEmStream(curso, configs, pergunta, contexto, historico)
+    if configs:
+        contexto = await acontexto_com_materiais(curso, pergunta, contexto)
+    await sync_to_async(stream.preparar)(contexto)
+    
+    try:
+        evento = stream.sem_provedor()
+        if evento:
+            yield evento
+        else:
+            try:
+                async for chunk in _astream(curso, configs, usuario_id, stream.inputs, stream.estado):
+                    evento = stream.trecho(chunk)
+                    if evento:
+                        yield evento
+                stream.resultado = "ok"
+            except Exception as e:
+                yield stream.falha(e)
+    finally:
+        # Salvar a interação (também quando o cliente cancela o stream)
+        geracao = await sync_to_async(stream.concluir)()
+        if geracao is not None:
+            interacao = await _asalvar_interacao(curso, geracao["config"], conversa, pergunta, geracao["resposta"],
+                                                 **stream.campos_interacao(geracao, start_time))
+    
+    if geracao is not None:
+        yield stream.fim(interacao, conversa)
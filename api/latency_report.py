@@ -0,0 +1,87 @@
+"""
+Percentis de latência e resultados das interações gravadas, por
+configuração de IA ou por curso, para comparar as configurações no tráfego
+real (ver o endpoint interacoes/desempenho).
+
+Os percentis são calculados em Python (o SQLite não tem função de
+percentil), percorrendo as interações da janela pedida com um iterator. As
+latências dos acertos de cache não entram nos percentis, que medem as
+respostas geradas; os acertos aparecem contados à parte.
+"""
+from django.db.models.functions import TruncDay, TruncHour
+
+from .router import percentil
+
+# Campos de saída e de consulta do grupo: (id, nome)
+AGRUPAMENTOS = {
+    'configuracao': (('configuracao_ia', 'configuracao_ia_id'), ('configuracao_nome', 'configuracao_ia__nome')),
+    'curso': (('curso', 'curso_id'), ('curso_titulo', 'curso__titulo')),
+}
+
+INTERVALOS = {
+    'hora': TruncHour,
+    'dia': TruncDay,
+}
+
+LATENCIAS = ('latencia_total', 'latencia_provedor', 'latencia_primeiro_token')
+
+PERCENTIS = (50, 95, 99)
+
+
+def _percentis(amostras):
+    resumo = {f"p{p}": percentil(amostras, p) for p in PERCENTIS}
+    resumo["amostras"] = len(amostras)
+    return resumo
+
+
+def resumo_desempenho(queryset, agrupar='configuracao', intervalo=None):
+    """
+    Resume as interações do queryset por grupo (AGRUPAMENTOS) e, com
+    `intervalo` ('hora' ou 'dia'), também por janela de tempo. Retorna uma
+    lista de dicionários com o total de interações, as contagens por
+    resultado, os acertos de cache e os percentis de cada latência.
+    """
+    (campo_id, consulta_id), (campo_nome, consulta_nome) = AGRUPAMENTOS[agrupar]
+    campos = [consulta_id, consulta_nome, 'resultado', 'cache', *LATENCIAS]
+    if intervalo:
+        queryset = queryset.annotate(janela=INTERVALOS[intervalo]('data_criacao'))
+        campos.append('janela')
+
+    grupos = {}
+    for linha in queryset.order_by().values_list(*campos).iterator(chunk_size=2000):
+        grupo_id, nome, resultado, cache = linha[:4]
+        janela = linha[-1] if intervalo else None
+        grupo = grupos.get((janela, grupo_id))
+        if grupo is None:
+            grupo = grupos[(janela, grupo_id)] = {
+                "nome": nome, "interacoes": 0, "resultados": {}, "acertos_cache": 0,
+                "latencias": {latencia: [] for latencia in LATENCIAS},
+            }
+        grupo["interacoes"] += 1
+        grupo["resultados"][resultado] = grupo["resultados"].get(resultado, 0) + 1
+        if cache:
+            grupo["acertos_cache"] += 1
+            continue
+        for latencia, valor in zip(LATENCIAS, linha[4:4 + len(LATENCIAS)]):
+            if valor is not None:
+                grupo["latencias"][latencia].append(valor)
+
+    def ordem(chave):
+        # Por janela e id; o grupo sem id (respostas sem configuração) vem por último
+        janela, grupo_id = chave
+        return janela or 0, grupo_id is None, grupo_id or 0
+
+    resumo = []
+    for (janela, grupo_id), grupo in sorted(grupos.items(), key=lambda g: ordem(g[0])):
+        item = {campo_id: grupo_id, campo_nome: grupo["nome"]}
+        if intervalo:
+            item["janela"] = janela
+        item.update(
+            interacoes=grupo["interacoes"],
+            resultados=grupo["resultados"],
+            acertos_cache=grupo["acertos_cache"],
+        )
+        for latencia, amostras in grupo["latencias"].items():
+            item[latencia] = _percentis(amostras)
+        resumo.append(item)
+    return resumo
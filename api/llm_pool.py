@@ -0,0 +1,153 @@
+"""
+Pool de clientes LLM compartilhado pelo processo.
+
+Os clientes são reutilizados entre requisições, mantendo abertas as conexões
+HTTP keep-alive com os provedores, e são descartados quando a ConfiguracaoIA
+correspondente é alterada ou excluída.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Limites do pool de conexões HTTP compartilhado entre os clientes LLM
+HTTP_MAX_CONEXOES = 100
+HTTP_MAX_KEEPALIVE = 20
+HTTP_KEEPALIVE_EXPIRY = 60.0
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def _limites_http():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONEXOES,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client():
+    """
+    Retorna o cliente HTTP síncrono compartilhado (criado sob demanda).
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(limits=_limites_http())
+    return _http_client
+
+
+async def _fechar_no_encerramento(http_client):
+    """
+    Gerador assíncrono que fica suspenso enquanto o event loop vive. O
+    loop.shutdown_asyncgens() do encerramento (chamado por asyncio.run e pelo
+    async_to_sync) o fecha, e o finally fecha o cliente HTTP do loop.
+    """
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+
+
+class _RegistroLoop:
+    """
+    Clientes LLM de um event loop e o cliente HTTP assíncrono que eles
+    compartilham, fechado quando o loop é encerrado.
+    """
+
+    def __init__(self):
+        self.clientes = {}
+        self.http_client = httpx.AsyncClient(limits=_limites_http())
+        # Iniciar o gerador no loop corrente o registra para o shutdown_asyncgens;
+        # a referência forte é necessária porque o loop só guarda uma referência fraca
+        self.encerramento = _fechar_no_encerramento(self.http_client)
+        try:
+            self.encerramento.asend(None).send(None)
+        except StopIteration:
+            pass
+
+
+class LLMClientPool:
+    """
+    Registro thread-safe de clientes LLM, indexado pelo id da configuração e
+    pela sua data_atualizacao.
+
+    Uma configuração salva com nova data_atualizacao nunca reaproveita o
+    cliente antigo, mesmo em processos que não receberam o sinal de
+    invalidação.
+
+    Os clientes assíncronos ficam presos ao event loop em que abriram suas
+    conexões, por isso cada loop tem o seu próprio registro, com um cliente
+    HTTP compartilhado que é fechado no encerramento do loop.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._clientes = {}
+        self._clientes_async = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, config):
+        """
+        Retorna o cliente LLM da configuração, criando-o se necessário.
+        """
+        return self._obter(self._clientes, config)
+
+    def get_async(self, config):
+        """
+        Retorna o cliente LLM da configuração para uso no event loop corrente.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            registro = self._clientes_async.get(loop)
+            if registro is None:
+                registro = self._clientes_async[loop] = _RegistroLoop()
+        return self._obter(registro.clientes, config, http_async_client=registro.http_client)
+
+    def _obter(self, clientes, config, **kwargs):
+        if config.pk is None:
+            # Configurações não persistidas não entram no pool
+            return self._factory(config, **kwargs)
+
+        versao = config.data_atualizacao
+        with self._lock:
+            entrada = clientes.get(config.pk)
+            if entrada is not None and entrada[0] == versao:
+                return entrada[1]
+
+            logger.debug("Criando cliente LLM para a configuração %s", config.pk)
+            llm = self._factory(config, **kwargs)
+            if llm is not None:
+                clientes[config.pk] = (versao, llm)
+            else:
+                clientes.pop(config.pk, None)
+            return llm
+
+    def invalidate(self, config_id):
+        """
+        Remove do pool os clientes de uma configuração.
+        """
+        with self._lock:
+            removido = self._clientes.pop(config_id, None) is not None
+            for registro in self._clientes_async.values():
+                removido = registro.clientes.pop(config_id, None) is not None or removido
+        if removido:
+            logger.debug("Cliente LLM da configuração %s invalidado", config_id)
+
+    def clear(self):
+        """
+        Remove todos os clientes do pool.
+        """
+        with self._lock:
+            self._clientes.clear()
+            for registro in self._clientes_async.values():
+                registro.clientes.clear()
+
+    def __len__(self):
+        return len(self._clientes)
@@ -0,0 +1,149 @@
+"""
+Provedor LLM falso, compatível com a API de chat da OpenAI, usado pelos
+comandos de benchmark para medir a aplicação sem depender da rede.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(tamanho) or b"{}")
+
+        time.sleep(self.server.latencia)
+        self.server.chamadas += 1
+
+        if self.server.status != 200:
+            corpo = json.dumps({"error": {"message": "Erro do provedor falso.", "type": "server_error"}}).encode()
+            self.send_response(self.server.status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+            return
+
+        if payload.get("stream"):
+            try:
+                self._stream(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # O cliente cancelou o stream
+                pass
+            return
+
+        corpo = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.server.resposta},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(payload),
+        }).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _stream(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        palavras = self.server.resposta.split(" ")
+        for i, palavra in enumerate(palavras):
+            texto = palavra if i == 0 else " " + palavra
+            self._chunk({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": texto}, "finish_reason": None}],
+            })
+            time.sleep(self.server.latencia_token)
+
+        self._chunk({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+        if payload.get("stream_options", {}).get("include_usage"):
+            self._chunk({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [],
+                "usage": self._usage(payload),
+            })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _usage(self, payload):
+        # Contagem aproximada, suficiente para os benchmarks
+        prompt = sum(len(str(m.get("content", ""))) for m in payload.get("messages", [])) // 4
+        resposta = len(self.server.resposta) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": resposta, "total_tokens": prompt + resposta}
+
+    def _chunk(self, dados):
+        self._write_chunk(f"data: {json.dumps(dados)}\n\n".encode())
+
+    def _write_chunk(self, dados):
+        self.wfile.write(f"{len(dados):x}\r\n".encode() + dados + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeProvider:
+    """
+    Servidor HTTP local que responde às chamadas de chat após uma latência fixa.
+    Com "stream" na requisição, emite a resposta palavra a palavra, esperando
+    latencia_token segundos entre as palavras. Com status diferente de 200,
+    responde com erro (ex.: 500 para um provedor fora do ar; o status pode
+    ser trocado durante o uso em provedor.server.status).
+
+    Uso:
+        with FakeProvider(latencia=0.5) as provedor:
+            os.environ["OPENAI_API_BASE"] = provedor.base_url
+    """
+
+    def __init__(self, latencia=0.5, resposta="Resposta do provedor falso.", latencia_token=0.0, status=200):
+        self.server = FakeProviderServer(("127.0.0.1", 0), FakeProviderHandler)
+        self.server.status = status
+        self.server.chamadas = 0
+        self.server.latencia = latencia
+        self.server.resposta = resposta
+        self.server.latencia_token = latencia_token
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
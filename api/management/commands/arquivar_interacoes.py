@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from api import retention
+from api.models import Interacao, SegmentoArquivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Move as interações mais antigas que RETENCAO_INTERACOES['DIAS'] (ou "
+        "--dias) para o arquivo comprimido, em blocos com uma transação curta "
+        "cada. Rode periodicamente, por exemplo pelo cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int,
+                            help='Arquivar as interações criadas há mais de N dias.')
+        parser.add_argument('--bloco', type=int,
+                            help='Interações por segmento (e por transação).')
+        parser.add_argument('--pausa', type=float,
+                            help='Pausa, em segundos, entre os blocos.')
+        parser.add_argument('--max-blocos', type=int,
+                            help='Parar depois de N blocos (o restante fica para a próxima execução).')
+
+    def handle(self, *args, **options):
+        total = retention.arquivar(
+            dias=options['dias'], tamanho_bloco=options['bloco'],
+            pausa=options['pausa'], max_blocos=options['max_blocos'],
+        )
+        arquivo = SegmentoArquivo.objects.aggregate(
+            interacoes=Sum('quantidade'), original=Sum('tamanho_original'), comprimido=Sum(Length('dados'))
+        )
+        self.stdout.write(self.style.SUCCESS(f"{total} interações arquivadas."))
+        self.stdout.write(
+            f"Tabela de interações: {Interacao.objects.count()}; arquivo: {arquivo['interacoes'] or 0} "
+            f"({(arquivo['original'] or 0) / 1e6:.1f} MB em {(arquivo['comprimido'] or 0) / 1e6:.1f} MB comprimidos)."
+        )
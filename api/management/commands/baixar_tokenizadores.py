@@ -0,0 +1,22 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Baixa os vocabulários do tiktoken para CONTAGEM_TOKENS['DIRETORIO_CACHE'], "
+        "de onde o servidor os carrega na inicialização (rode no build ou deploy, "
+        "com acesso à rede)."
+    )
+
+    def handle(self, *args, **options):
+        carregadas = tokens.carregar_tokenizadores(baixar=True)
+        faltando = [nome for nome, carregada in carregadas.items() if not carregada]
+        if faltando:
+            raise CommandError(f"Vocabulários não baixados: {', '.join(faltando)}.")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(carregadas)} vocabulários em {os.environ.get('TIKTOKEN_CACHE_DIR', 'cache padrão do tiktoken')}."
+        ))
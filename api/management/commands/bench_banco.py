@@ -0,0 +1,135 @@
+import contextlib
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.langchain_utils import process_question
+from api.models import Categoria, ConfiguracaoIA, Curso, Interacao
+from api.views import CursoViewSet, InteracaoViewSet
+
+from ._fake_provider import FakeProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a vazão do banco configurado (perfil BANCO) com perguntas "
+        "concorrentes (escritas), listagens de cursos e interações (leituras) "
+        "e as duas ao mesmo tempo, usando um provedor de IA falso local. "
+        "Rode uma vez para cada perfil e compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=200,
+                            help='Total de requisições por modo.')
+        parser.add_argument('--workers', type=int, default=16,
+                            help='Threads concorrentes.')
+        parser.add_argument('--latencia', type=float, default=0.0,
+                            help='Latência simulada do provedor, em segundos.')
+        parser.add_argument('--linhas', type=int, default=5000,
+                            help='Interações pré-existentes no curso de benchmark.')
+
+    def handle(self, *args, **options):
+        total, workers = options['requisicoes'], options['workers']
+        self.stdout.write(f"Banco: {self._descrever_banco()}")
+
+        with FakeProvider(latencia=options['latencia']) as provedor:
+            os.environ['OPENAI_API_BASE'] = provedor.base_url
+
+            categoria = Categoria.objects.create(nome='Benchmark')
+            curso = Curso.objects.create(
+                titulo='Curso de benchmark', descricao='Curso temporário.',
+                categoria=categoria, carga_horaria=1
+            )
+            config = ConfiguracaoIA.objects.create(
+                nome='Benchmark', provedor='openai', modelo='gpt-3.5-turbo',
+                chave_api='sk-benchmark'
+            )
+            usuario = User.objects.create_user('benchmark-banco')
+            Interacao.objects.bulk_create(
+                [Interacao(curso=curso, pergunta=f"Pergunta {i}", resposta="Resposta") for i in range(options['linhas'])],
+                batch_size=1000,
+            )
+
+            try:
+                # Silenciar os logs e a saída verbosa das cadeias durante as medições
+                logging.disable(logging.CRITICAL)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    escrita = self._medir(workers, [self._perguntar(curso, config)] * total)
+                    leitura = self._medir(workers, [self._listar(curso, usuario)] * total)
+                    misto = self._medir(
+                        workers, [self._perguntar(curso, config), self._listar(curso, usuario)] * (total // 2)
+                    )
+            finally:
+                logging.disable(logging.NOTSET)
+                categoria.delete()
+                config.delete()
+                usuario.delete()
+
+        self.stdout.write(f"{total} requisições por modo, {workers} threads, latência do provedor {options['latencia']:.2f}s")
+        for nome, (segundos, erros) in (("perguntar", escrita), ("listagens", leitura), ("misto", misto)):
+            linha = f"{nome:<10} {segundos:6.2f}s  {total / segundos:7.1f} req/s"
+            if erros:
+                linha += f"  {len(erros)} erros (ex.: {erros[0]})"
+            self.stdout.write(linha)
+
+    def _descrever_banco(self):
+        conf = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                journal = cursor.fetchone()[0]
+                cursor.execute("PRAGMA synchronous")
+                synchronous = cursor.fetchone()[0]
+            return (
+                f"sqlite ({conf['NAME']}), journal_mode={journal}, synchronous={synchronous}, "
+                f"timeout={conf['OPTIONS'].get('timeout', 5)}s, CONN_MAX_AGE={conf['CONN_MAX_AGE']}"
+            )
+        pool = conf['OPTIONS'].get('pool')
+        return f"{connection.vendor} ({conf['HOST']}/{conf['NAME']}), " + (
+            f"pool={pool}" if pool else f"CONN_MAX_AGE={conf['CONN_MAX_AGE']}"
+        )
+
+    def _perguntar(self, curso, config):
+        def perguntar():
+            resultado = process_question(curso.id, "Pergunta de benchmark", configuracao_id=config.id)
+            if 'error' in resultado:
+                raise RuntimeError(resultado['error'])
+        return perguntar
+
+    def _listar(self, curso, usuario):
+        fabrica = APIRequestFactory(SERVER_NAME='localhost')
+        listar_interacoes = InteracaoViewSet.as_view({'get': 'list'})
+        listar_cursos = CursoViewSet.as_view({'get': 'list'})
+
+        def listar():
+            request = fabrica.get('/api/interacoes/', {'curso': curso.id})
+            force_authenticate(request, usuario)
+            for view, request in ((listar_interacoes, request), (listar_cursos, fabrica.get('/api/cursos/'))):
+                response = view(request)
+                response.render()
+                if response.status_code != 200:
+                    raise RuntimeError(f"HTTP {response.status_code}")
+        return listar
+
+    def _medir(self, workers, tarefas):
+        erros = []
+
+        def executar(tarefa):
+            try:
+                tarefa()
+            except Exception as e:
+                erros.append(str(e))
+            finally:
+                close_old_connections()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(executar, tarefas))
+        return time.perf_counter() - start, erros
@@ -0,0 +1,104 @@
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.langchain_utils import aprocess_question, process_question
+from api.models import Categoria, ConfiguracaoIA, Curso
+
+from ._fake_provider import FakeProvider
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a vazão de perguntas concorrentes no caminho síncrono "
+        "(process_question em um pool de threads) e no assíncrono "
+        "(aprocess_question), usando um provedor de IA falso local."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=200,
+                            help='Total de perguntas por modo.')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Threads do modo síncrono (equivalente aos workers do servidor).')
+        parser.add_argument('--concorrencia', type=int, default=200,
+                            help='Perguntas simultâneas no modo assíncrono.')
+        parser.add_argument('--latencia', type=float, default=0.5,
+                            help='Latência simulada do provedor, em segundos.')
+
+    def handle(self, *args, **options):
+        total = options['requisicoes']
+
+        with FakeProvider(latencia=options['latencia']) as provedor:
+            os.environ['OPENAI_API_BASE'] = provedor.base_url
+
+            categoria = Categoria.objects.create(nome='Benchmark')
+            curso = Curso.objects.create(
+                titulo='Curso de benchmark', descricao='Curso temporário.',
+                categoria=categoria, carga_horaria=1
+            )
+            config = ConfiguracaoIA.objects.create(
+                nome='Benchmark', provedor='openai', modelo='gpt-3.5-turbo',
+                chave_api='sk-benchmark'
+            )
+
+            try:
+                # Silenciar os logs e a saída verbosa das cadeias durante as medições
+                logging.disable(logging.CRITICAL)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    sync_time = self._run_sync(curso, config, total, options['workers'])
+                    async_time = asyncio.run(
+                        self._run_async(curso, config, total, options['concorrencia'])
+                    )
+            finally:
+                logging.disable(logging.NOTSET)
+                categoria.delete()
+                config.delete()
+
+        self.stdout.write(f"Latência do provedor: {options['latencia']:.2f}s, {total} perguntas por modo")
+        self.stdout.write(
+            f"Síncrono  ({options['workers']} threads): {sync_time:.2f}s, "
+            f"{total / sync_time:.1f} req/s"
+        )
+        self.stdout.write(
+            f"Assíncrono ({options['concorrencia']} simultâneas): {async_time:.2f}s, "
+            f"{total / async_time:.1f} req/s"
+        )
+
+    def _run_sync(self, curso, config, total, workers):
+        def perguntar(i):
+            try:
+                return process_question(curso.id, f"Pergunta {i}", configuracao_id=config.id)
+            finally:
+                close_old_connections()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            resultados = list(executor.map(perguntar, range(total)))
+        elapsed = time.perf_counter() - start
+        self._check(resultados)
+        return elapsed
+
+    async def _run_async(self, curso, config, total, concorrencia):
+        semaforo = asyncio.Semaphore(concorrencia)
+
+        async def perguntar(i):
+            async with semaforo:
+                return await aprocess_question(curso.id, f"Pergunta {i}", configuracao_id=config.id)
+
+        start = time.perf_counter()
+        resultados = await asyncio.gather(*(perguntar(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+        self._check(resultados)
+        return elapsed
+
+    def _check(self, resultados):
+        erros = [r['error'] for r in resultados if 'error' in r]
+        if erros:
+            self.stderr.write(f"{len(erros)} perguntas falharam: {erros[0]}")
@@ -0,0 +1,82 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serialization import mapeador
+from api.models import Categoria, ConfiguracaoIA, Curso, Interacao
+from api.renderers import JSONRapidoRenderer, orjson
+from api.serializers import InteracaoSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a vazão (linhas/s) da montagem das páginas de interações, da "
+        "consulta ao JSON: serializer linha a linha com o JSONRenderer do DRF "
+        "(caminho anterior), .values() com o mapeador e, por fim, com o "
+        "renderer orjson e sem a coluna resposta (?exclude=resposta)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--linhas', type=int, default=2000,
+                            help='Interações criadas para o benchmark.')
+        parser.add_argument('--pagina', type=int, default=200,
+                            help='Linhas por página medida.')
+        parser.add_argument('--repeticoes', type=int, default=20,
+                            help='Páginas montadas por modo.')
+        parser.add_argument('--tamanho-resposta', type=int, default=2000,
+                            help='Caracteres de cada resposta.')
+
+    def handle(self, *args, **options):
+        categoria = Categoria.objects.create(nome='Benchmark')
+        curso = Curso.objects.create(
+            titulo='Curso de benchmark', descricao='Curso temporário.', categoria=categoria, carga_horaria=1
+        )
+        config = ConfiguracaoIA.objects.create(nome='Benchmark', chave_api='sk-benchmark')
+        resposta = ("Resposta de benchmark com acentuação. " * (options['tamanho_resposta'] // 38 + 1))[:options['tamanho_resposta']]
+        Interacao.objects.bulk_create(
+            [Interacao(curso=curso, configuracao_ia=config, pergunta=f"Pergunta {i}", resposta=resposta,
+                       latencia_total=0.5, provedor='openai', modelo='gpt-4o-mini')
+             for i in range(options['linhas'])],
+            batch_size=1000,
+        )
+
+        queryset = Interacao.objects.filter(curso=curso).select_related('curso', 'configuracao_ia').order_by('-data_criacao', '-id')
+        pagina = options['pagina']
+        mapa = mapeador(InteracaoSerializer)
+        sem_resposta = tuple(nome for nome in mapa.nomes if nome != 'resposta')
+
+        def serializer(renderer):
+            return lambda: renderer.render(InteracaoSerializer(queryset[:pagina], many=True).data)
+
+        def valores(renderer, nomes=mapa.nomes):
+            return lambda: renderer.render(mapa.mapear(queryset.values(*mapa.lookups(nomes))[:pagina], nomes))
+
+        modos = [
+            ("serializer + json", serializer(JSONRenderer())),
+            ("values + json", valores(JSONRenderer())),
+        ]
+        if orjson is not None:
+            modos += [
+                ("serializer + orjson", serializer(JSONRapidoRenderer())),
+                ("values + orjson", valores(JSONRapidoRenderer())),
+                ("values + orjson, exclude=resposta", valores(JSONRapidoRenderer(), sem_resposta)),
+            ]
+        else:
+            self.stdout.write("orjson não instalado: medindo só o renderer padrão.")
+            modos.append(("values + json, exclude=resposta", valores(JSONRenderer(), sem_resposta)))
+
+        try:
+            self.stdout.write(f"{options['repeticoes']} páginas de {pagina} linhas por modo")
+            base = None
+            for nome, montar in modos:
+                montar()  # aquecimento
+                inicio = time.perf_counter()
+                for _ in range(options['repeticoes']):
+                    montar()
+                vazao = options['repeticoes'] * pagina / (time.perf_counter() - inicio)
+                base = base or vazao
+                self.stdout.write(f"{nome:<36} {vazao:10.0f} linhas/s  {vazao / base:5.1f}x")
+        finally:
+            categoria.delete()
+            config.delete()
@@ -0,0 +1,55 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.fast_serialization import selecionar_campos
+from api.interaction_export import FORMATOS, campos_disponiveis, exportar, filtrar, ler_data
+from api.models import Interacao
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta o histórico de interações em NDJSON ou CSV, em streaming "
+        "(memória constante), para um arquivo ou para a saída padrão."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=list(FORMATOS), default='ndjson')
+        parser.add_argument('--saida', help='Arquivo de saída (padrão: saída padrão).')
+        parser.add_argument('--curso', type=int, help='Só as interações deste curso.')
+        parser.add_argument('--configuracao', type=int, help='Só as interações desta configuração de IA.')
+        parser.add_argument('--desde', help='Data ou data e hora ISO 8601 inicial (inclusiva).')
+        parser.add_argument('--ate', help='Data ou data e hora ISO 8601 final (inclusiva).')
+        parser.add_argument('--fields', help='Campos exportados, separados por vírgula.')
+        parser.add_argument('--exclude', help='Campos omitidos, separados por vírgula (ex.: resposta).')
+
+    def handle(self, *args, **options):
+        try:
+            queryset = filtrar(
+                Interacao.objects.all(), curso=options['curso'], configuracao=options['configuracao'],
+                desde=ler_data(options['desde']) if options['desde'] else None,
+                ate=ler_data(options['ate'], fim=True) if options['ate'] else None,
+            )
+            campos = selecionar_campos(campos_disponiveis(), options['fields'], options['exclude'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        inicio = time.perf_counter()
+        destino = open(options['saida'], 'wb') if options['saida'] else sys.stdout.buffer
+        total = 0
+        try:
+            for bloco in exportar(queryset, options['formato'], campos):
+                destino.write(bloco)
+                total += len(bloco)
+        finally:
+            if options['saida']:
+                destino.close()
+            else:
+                destino.flush()
+
+        if options['saida']:
+            segundos = time.perf_counter() - inicio
+            self.stdout.write(self.style.SUCCESS(
+                f"{options['saida']}: {total / 1e6:.1f} MB em {segundos:.1f}s."
+            ))
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import retrieval
+from api.models import Curso, MaterialCurso
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa arquivos de texto como materiais de um curso ou, sem "
+        "arquivos, refaz os trechos e embeddings dos materiais existentes "
+        "(por exemplo, depois de mudar MATERIAIS_CURSO['DIMENSOES'])."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivos', nargs='*',
+                            help='Arquivos de texto; o nome do arquivo vira o título do material.')
+        parser.add_argument('--curso', type=int,
+                            help='Curso dos materiais (obrigatório ao importar arquivos).')
+
+    def handle(self, *args, **options):
+        curso_id, arquivos = options['curso'], options['arquivos']
+        if arquivos:
+            if curso_id is None:
+                raise CommandError("Informe o curso com --curso para importar arquivos.")
+            try:
+                curso = Curso.objects.get(id=curso_id)
+            except Curso.DoesNotExist:
+                raise CommandError(f"Curso {curso_id} não encontrado.")
+            for caminho in map(Path, arquivos):
+                # O save dispara a indexação (ver signals.py)
+                material, criado = MaterialCurso.objects.update_or_create(
+                    curso=curso, titulo=caminho.stem,
+                    defaults={'conteudo': caminho.read_text(encoding='utf-8')},
+                )
+                acao = "importado" if criado else "atualizado"
+                self.stdout.write(self.style.SUCCESS(
+                    f"{caminho.name}: {acao}, {material.trechos.count()} trechos."
+                ))
+            return
+
+        materiais = MaterialCurso.objects.all()
+        if curso_id is not None:
+            materiais = materiais.filter(curso_id=curso_id)
+        total = sum(retrieval.indexar_material(material) for material in materiais.iterator())
+        self.stdout.write(self.style.SUCCESS(f"{total} trechos indexados."))
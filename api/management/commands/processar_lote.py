@@ -0,0 +1,108 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.batch_jobs import criar_lote, ler_jsonl, processar_lote, reservar_lote
+from api.models import ConfiguracaoIA, Curso, Lote
+
+
+class Command(BaseCommand):
+    help = (
+        "Responde em lote as perguntas de um arquivo JSONL (uma pergunta por "
+        "linha) com concorrência limitada. Executar de novo o mesmo arquivo, "
+        "ou usar --lote, retoma um lote interrompido a partir dos itens pendentes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', nargs='?',
+                            help='Arquivo JSONL com as perguntas.')
+        parser.add_argument('--curso', type=int,
+                            help='Curso padrão dos itens sem curso_id.')
+        parser.add_argument('--configuracao', type=int,
+                            help='Configuração de IA preferida (as demais ativas servem de failover).')
+        parser.add_argument('--nome',
+                            help='Nome do lote (padrão: nome do arquivo).')
+        parser.add_argument('--lote', type=int,
+                            help='Retoma o lote informado em vez de ler um arquivo.')
+        parser.add_argument('--concorrencia', type=int,
+                            help='Perguntas em andamento ao mesmo tempo (padrão: a do lote, 8).')
+        parser.add_argument('--repetir-erros', action='store_true',
+                            help='Também repete os itens que terminaram com erro.')
+
+    def handle(self, *args, **options):
+        if options['lote']:
+            try:
+                lote = Lote.objects.get(id=options['lote'])
+            except Lote.DoesNotExist:
+                raise CommandError(f"Lote {options['lote']} não encontrado.")
+        elif options['arquivo']:
+            lote = self._criar_ou_retomar(options)
+        else:
+            raise CommandError("Informe o arquivo JSONL ou --lote.")
+
+        if options['concorrencia']:
+            lote.concorrencia = options['concorrencia']
+            lote.save(update_fields=['concorrencia', 'data_atualizacao'])
+
+        if not reservar_lote(lote.id, repetir_erros=options['repetir_erros']):
+            lote.refresh_from_db()
+            raise CommandError(
+                f"O lote {lote.id} está {lote.get_status_display().lower()}"
+                + (" em outro processo." if lote.status == 'processando' else ".")
+            )
+
+        self.stdout.write(f"Lote {lote.id} ({lote.nome}): {lote.total} itens, concorrência {lote.concorrencia}")
+        try:
+            processar_lote(lote.id, repetir_erros=options['repetir_erros'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(
+                f"Interrompido. Execute 'processar_lote --lote {lote.id}' para retomar."
+            ))
+            return
+
+        lote.refresh_from_db()
+        estilo = self.style.SUCCESS if lote.status == 'concluido' else self.style.WARNING
+        self.stdout.write(estilo(
+            f"Lote {lote.id} {lote.get_status_display().lower()}: "
+            f"{lote.concluidos} respondidos, {lote.falhas} com erro de {lote.total}."
+        ))
+        if lote.erro:
+            self.stdout.write(self.style.WARNING(lote.erro))
+
+    def _criar_ou_retomar(self, options):
+        if not options['curso']:
+            raise CommandError("Informe o curso padrão com --curso.")
+        try:
+            curso = Curso.objects.get(id=options['curso'])
+        except Curso.DoesNotExist:
+            raise CommandError(f"Curso {options['curso']} não encontrado.")
+
+        configuracao = None
+        if options['configuracao']:
+            configuracao = ConfiguracaoIA.objects.filter(id=options['configuracao']).first()
+            if configuracao is None:
+                raise CommandError(f"Configuração {options['configuracao']} não encontrada.")
+
+        try:
+            with open(options['arquivo'], encoding='utf-8') as arquivo:
+                itens = ler_jsonl(arquivo)
+        except OSError as e:
+            raise CommandError(f"Não foi possível ler o arquivo: {e}")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        nome = options['nome'] or os.path.basename(options['arquivo'])
+        # Um lote não concluído com o mesmo nome é retomado (e recebe os itens novos do arquivo)
+        existente = (
+            Lote.objects.filter(nome=nome, curso=curso)
+            .exclude(status='concluido')
+            .order_by('-data_criacao')
+            .first()
+        )
+        try:
+            return criar_lote(
+                nome, curso, itens, configuracao_ia=configuracao,
+                concorrencia=options['concorrencia'] or 8, lote=existente
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api import full_text
+from api.models import Curso, Interacao
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstrói o índice de busca textual de cursos e interações (por "
+        "exemplo, depois de importar dados sem passar pelo save)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recriar', action='store_true',
+                            help='Apaga e recria as tabelas de busca antes de indexar.')
+
+    def handle(self, *args, **options):
+        if full_text.backend(connection) is None:
+            self.stdout.write(self.style.WARNING(
+                f"Busca textual desativada ou sem suporte no banco '{connection.vendor}'."
+            ))
+            return
+        if options['recriar']:
+            full_text.remover_tabelas(connection)
+        full_text.criar_tabelas(connection)
+        for model in (Curso, Interacao):
+            total = full_text.reindexar(model.objects.all())
+            self.stdout.write(self.style.SUCCESS(f"{total} registros de {model._meta.verbose_name_plural} indexados."))
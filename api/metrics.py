@@ -0,0 +1,261 @@
+"""
+Métricas do pipeline de perguntas no formato de exposição do Prometheus.
+
+As métricas ficam na memória do processo (como as estatísticas do roteador
+e do cache): com vários workers, cada processo expõe as suas. O endpoint
+/metrics (ver views.py) devolve o texto gerado por `registro.expor()`.
+
+Histogramas (em segundos):
+- cognicursos_pergunta_segundos{modo}: pergunta inteira, por modo
+  (sincrono, assincrono, stream);
+- cognicursos_etapa_segundos{etapa}: configuracoes (busca das configurações
+  ativas), cadeia (montagem da cadeia) e gravacao (gravação da interação,
+  ou a entrada na fila da gravação adiada);
+- cognicursos_provedor_segundos{provedor,modelo}: chamada ao provedor;
+- cognicursos_primeiro_token_segundos{provedor,modelo}: tempo até o
+  primeiro token nas respostas em streaming.
+
+Contadores: acertos e falhas do cache de respostas, respostas simuladas e
+tokens por provedor, modelo e tipo.
+"""
+import functools
+import hmac
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+CONFIG_PADRAO = {
+    'ATIVO': True,
+    'TOKEN': None,
+    'IPS_PERMITIDOS': (),
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+}
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'METRICAS', {}))
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=""):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """
+    Contador monotônico, com uma série por combinação de rótulos.
+    """
+    tipo = "counter"
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, quantidade=1):
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + quantidade
+
+    def valor(self, *valores):
+        return self._series.get(valores, 0)
+
+    def linhas(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        for valores, total in series:
+            yield f"{self.nome}{_rotulos(self.rotulos, valores)} {_numero(total)}"
+
+
+class Histograma:
+    """
+    Histograma com buckets cumulativos, soma e contagem por combinação de rótulos.
+    """
+    tipo = "histogram"
+
+    def __init__(self, nome, descricao, rotulos=(), buckets=None):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets or CONFIG_PADRAO['BUCKETS']))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                # Contagens por bucket (a última é o +Inf), soma
+                serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][bisect_left(self.buckets, valor)] += 1
+            serie[1] += valor
+
+    def contagem(self, *valores):
+        serie = self._series.get(valores)
+        return sum(serie[0]) if serie else 0
+
+    @contextmanager
+    def medir(self, *valores):
+        """
+        Observa a duração do bloco (também se ele levantar uma exceção).
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, *valores)
+
+    def linhas(self):
+        with self._lock:
+            series = sorted((valores, list(contagens), soma) for valores, (contagens, soma) in self._series.items())
+        for valores, contagens, soma in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float("inf"),), contagens):
+                acumulado += contagem
+                rotulos = _rotulos(self.rotulos, valores, f'le="{_numero(limite)}"')
+                yield f"{self.nome}_bucket{rotulos} {acumulado}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, valores)} {_numero(soma)}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, valores)} {acumulado}"
+
+
+class Registro:
+    """
+    Conjunto das métricas expostas pelo processo.
+    """
+
+    def __init__(self):
+        self._metricas = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def expor(self):
+        """
+        Texto no formato de exposição do Prometheus (versão 0.0.4).
+        """
+        linhas = []
+        for metrica in self._metricas:
+            linhas.append(f"# HELP {metrica.nome} {metrica.descricao}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas.extend(metrica.linhas())
+        return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
+_buckets = _config()['BUCKETS']
+
+duracao_pergunta = registro.registrar(Histograma(
+    "cognicursos_pergunta_segundos", "Duração das perguntas, por modo (sincrono, assincrono, stream).",
+    ("modo",), _buckets,
+))
+etapas = registro.registrar(Histograma(
+    "cognicursos_etapa_segundos", "Duração das etapas do processamento de uma pergunta.",
+    ("etapa",), _buckets,
+))
+latencia_provedor = registro.registrar(Histograma(
+    "cognicursos_provedor_segundos", "Duração das chamadas bem-sucedidas ao provedor de IA.",
+    ("provedor", "modelo"), _buckets,
+))
+primeiro_token = registro.registrar(Histograma(
+    "cognicursos_primeiro_token_segundos", "Tempo até o primeiro token das respostas em streaming.",
+    ("provedor", "modelo"), _buckets,
+))
+cache = registro.registrar(Contador(
+    "cognicursos_cache_respostas_total", "Consultas ao cache de respostas, por resultado (exato, similar, falha).",
+    ("resultado",),
+))
+simuladas = registro.registrar(Contador(
+    "cognicursos_respostas_simuladas_total", "Respostas simuladas (sem configuração ativa ou com falha dos provedores).",
+))
+tokens = registro.registrar(Contador(
+    "cognicursos_tokens_total", "Tokens das interações, por provedor, modelo e tipo (prompt, resposta, descartados).",
+    ("provedor", "modelo", "tipo"),
+))
+
+
+def registrar_tokens(config, tokens_prompt, tokens_resposta, tokens_descartados=0):
+    """
+    Soma os tokens de uma interação; sem configuração (resposta simulada),
+    o provedor e o modelo ficam como "simulado".
+    """
+    provedor, modelo = (config.provedor, config.modelo) if config is not None else ("simulado", "simulado")
+    for tipo, quantidade in (("prompt", tokens_prompt), ("resposta", tokens_resposta),
+                             ("descartados", tokens_descartados)):
+        if quantidade:
+            tokens.inc(provedor, modelo, tipo, quantidade=quantidade)
+
+
+def medir_pergunta(modo):
+    """
+    Decorador que observa a duração de cada pergunta em
+    cognicursos_pergunta_segundos. Aceita funções e geradores, síncronos ou
+    assíncronos; nos geradores (streaming), a duração vai até o fim do stream.
+    """
+    def decorador(funcao):
+        if inspect.isasyncgenfunction(funcao):
+            @functools.wraps(funcao)
+            async def envoltorio(*args, **kwargs):
+                gerador = funcao(*args, **kwargs)
+                with duracao_pergunta.medir(modo):
+                    try:
+                        async for item in gerador:
+                            yield item
+                    finally:
+                        # Repassar o cancelamento do cliente (o gerador salva a resposta parcial)
+                        await gerador.aclose()
+        elif inspect.isgeneratorfunction(funcao):
+            @functools.wraps(funcao)
+            def envoltorio(*args, **kwargs):
+                with duracao_pergunta.medir(modo):
+                    return (yield from funcao(*args, **kwargs))
+        elif inspect.iscoroutinefunction(funcao):
+            @functools.wraps(funcao)
+            async def envoltorio(*args, **kwargs):
+                with duracao_pergunta.medir(modo):
+                    return await funcao(*args, **kwargs)
+        else:
+            @functools.wraps(funcao)
+            def envoltorio(*args, **kwargs):
+                with duracao_pergunta.medir(modo):
+                    return funcao(*args, **kwargs)
+        return envoltorio
+    return decorador
+
+
+def ativo():
+    return _config()['ATIVO']
+
+
+def autorizado(request):
+    """
+    Com METRICAS['TOKEN'] definido, o /metrics exige "Authorization: Bearer <token>".
+    Sem token, fica aberto só com DEBUG; fora dele, exige um usuário staff
+    logado ou um IP de METRICAS['IPS_PERMITIDOS'].
+    """
+    config = _config()
+    if config['TOKEN']:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {config['TOKEN']}")
+    if settings.DEBUG:
+        return True
+    usuario = getattr(request, "user", None)
+    if usuario is not None and usuario.is_staff:
+        return True
+    return request.META.get("REMOTE_ADDR") in config['IPS_PERMITIDOS']
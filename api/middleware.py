@@ -0,0 +1,90 @@
+import re
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .structured_logging import definir_request_id, limpar_request_id
+
+# IDs recebidos de um proxy ou do cliente são aceitos se forem curtos e sem caracteres especiais
+REQUEST_ID_VALIDO = re.compile(r"^[A-Za-z0-9._-]{1,100}$")
+
+
+def _com_request_id(conteudo, valor):
+    # Cada parte é gerada com o ID definido, e o ID é desfeito antes do yield:
+    # o contexto nunca fica com o ID entre uma parte e outra
+    iterador = iter(conteudo)
+    while True:
+        token = definir_request_id(valor)
+        try:
+            parte = next(iterador)
+        except StopIteration:
+            return
+        finally:
+            limpar_request_id(token)
+        yield parte
+
+
+async def _com_request_id_async(conteudo, valor):
+    iterador = aiter(conteudo)
+    while True:
+        token = definir_request_id(valor)
+        try:
+            parte = await anext(iterador)
+        except StopAsyncIteration:
+            return
+        finally:
+            limpar_request_id(token)
+        yield parte
+
+
+class RequestIdMiddleware:
+    """
+    Atribui a cada requisição um ID (o do cabeçalho X-Request-ID, se
+    válido, ou um novo), usado nos registros de log dela e devolvido no
+    cabeçalho X-Request-ID da resposta. Funciona em WSGI e ASGI.
+
+    O ID vale só durante a requisição: é desfeito ao fim dela, para não
+    passar à próxima requisição atendida pela mesma thread. Nas respostas em
+    streaming, o conteúdo (gerado depois) volta a ter o ID a cada parte. O
+    registro das respostas 4xx/5xx pelo django.request, feito depois do
+    middleware, lê o ID de request.request_id (ver structured_logging.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _iniciar(self, request):
+        recebido = request.headers.get("X-Request-ID", "")
+        request.request_id = recebido if REQUEST_ID_VALIDO.match(recebido) else uuid.uuid4().hex
+        return definir_request_id(request.request_id)
+
+    def _finalizar(self, request, response):
+        response["X-Request-ID"] = request.request_id
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _com_request_id_async(response.streaming_content, request.request_id)
+            else:
+                response.streaming_content = _com_request_id(response.streaming_content, request.request_id)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._iniciar(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            limpar_request_id(token)
+        return self._finalizar(request, response)
+
+    async def __acall__(self, request):
+        token = self._iniciar(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            limpar_request_id(token)
+        return self._finalizar(request, response)
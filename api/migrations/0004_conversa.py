@@ -0,0 +1,68 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_configuracaoia_provedor_alter_configuracaoia_modelo"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Conversa",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resumo", models.TextField(blank=True, default="")),
+                ("interacoes_resumidas", models.PositiveIntegerField(default=0)),
+                ("data_criacao", models.DateTimeField(auto_now_add=True)),
+                ("data_atualizacao", models.DateTimeField(auto_now=True)),
+                (
+                    "curso",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="conversas",
+                        to="api.curso",
+                    ),
+                ),
+                (
+                    "usuario",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="conversas",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Conversa",
+                "verbose_name_plural": "Conversas",
+                "ordering": ["-data_atualizacao"],
+            },
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="conversa",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="interacoes",
+                to="api.conversa",
+            ),
+        ),
+    ]
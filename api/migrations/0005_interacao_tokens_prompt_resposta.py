@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_conversa"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="interacao",
+            name="tokens_prompt",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="tokens_resposta",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_interacao_tokens_prompt_resposta"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="configuracaoia",
+            name="limite_requisicoes_minuto",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="configuracaoia",
+            name="limite_tokens_minuto",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="curso",
+            name="orcamento_tokens_diario",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_limites_e_orcamentos"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="configuracaoia",
+            name="peso",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
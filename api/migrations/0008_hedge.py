@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_configuracaoia_peso"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="configuracaoia",
+            name="hedge_ativo",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="configuracaoia",
+            name="hedge_percentil",
+            field=models.PositiveSmallIntegerField(default=95),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="tokens_descartados",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
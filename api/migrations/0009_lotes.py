@@ -0,0 +1,146 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_hedge"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Lote",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("nome", models.CharField(max_length=200)),
+                ("concorrencia", models.PositiveSmallIntegerField(default=8)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pendente", "Pendente"),
+                            ("processando", "Processando"),
+                            ("interrompido", "Interrompido"),
+                            ("concluido", "Concluído"),
+                        ],
+                        default="pendente",
+                        max_length=20,
+                    ),
+                ),
+                ("total", models.PositiveIntegerField(default=0)),
+                ("concluidos", models.PositiveIntegerField(default=0)),
+                ("falhas", models.PositiveIntegerField(default=0)),
+                ("erro", models.TextField(blank=True, default="")),
+                ("data_criacao", models.DateTimeField(auto_now_add=True)),
+                ("data_atualizacao", models.DateTimeField(auto_now=True)),
+                (
+                    "configuracao_ia",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="lotes",
+                        to="api.configuracaoia",
+                    ),
+                ),
+                (
+                    "curso",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lotes",
+                        to="api.curso",
+                    ),
+                ),
+                (
+                    "usuario",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="lotes",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Lote de perguntas",
+                "verbose_name_plural": "Lotes de perguntas",
+                "ordering": ["-data_criacao"],
+            },
+        ),
+        migrations.CreateModel(
+            name="ItemLote",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("request_id", models.CharField(max_length=100)),
+                ("pergunta", models.TextField()),
+                ("contexto", models.TextField(blank=True, default="")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pendente", "Pendente"),
+                            ("concluido", "Concluído"),
+                            ("erro", "Erro"),
+                        ],
+                        default="pendente",
+                        max_length=20,
+                    ),
+                ),
+                ("erro", models.TextField(blank=True, default="")),
+                (
+                    "curso",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="itens_lote",
+                        to="api.curso",
+                    ),
+                ),
+                (
+                    "interacao",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="itens_lote",
+                        to="api.interacao",
+                    ),
+                ),
+                (
+                    "lote",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="itens",
+                        to="api.lote",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Item de lote",
+                "verbose_name_plural": "Itens de lote",
+                "ordering": ["id"],
+                "unique_together": {("lote", "request_id")},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_lotes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="curso",
+            index=models.Index(
+                fields=["-data_publicacao", "-id"], name="curso_publicacao_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="curso",
+            index=models.Index(
+                fields=["ativo", "categoria", "nivel"], name="curso_ativo_categoria_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="interacao",
+            index=models.Index(
+                fields=["-data_criacao", "-id"], name="interacao_data_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="interacao",
+            index=models.Index(
+                fields=["curso", "-data_criacao", "-id"],
+                name="interacao_curso_data_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,150 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# O SQL e o stemmer ficam copiados aqui (e não importados de api.full_text)
+# para que a migração continue igual quando o índice mudar em versões futuras.
+
+SQLITE_TABELAS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS api_curso_busca USING fts5("
+    "c0, c1, c2, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS api_interacao_busca USING fts5("
+    "c0, c1, tokenize='unicode61 remove_diacritics 2')",
+]
+
+POSTGRES_TABELAS = [
+    "CREATE TABLE IF NOT EXISTS api_curso_busca (id bigint PRIMARY KEY, documento tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS api_curso_busca_documento ON api_curso_busca USING GIN (documento)",
+    "CREATE TABLE IF NOT EXISTS api_interacao_busca (id bigint PRIMARY KEY, documento tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS api_interacao_busca_documento ON api_interacao_busca USING GIN (documento)",
+    "INSERT INTO api_curso_busca (id, documento) "
+    "SELECT c.id, "
+    "setweight(to_tsvector('portuguese', coalesce(c.titulo, '')), 'A') || "
+    "setweight(to_tsvector('portuguese', coalesce(cat.nome, '')), 'A') || "
+    "setweight(to_tsvector('portuguese', coalesce(c.descricao, '')), 'B') "
+    "FROM api_curso c LEFT JOIN api_categoria cat ON cat.id = c.categoria_id "
+    "ON CONFLICT (id) DO NOTHING",
+    "INSERT INTO api_interacao_busca (id, documento) "
+    "SELECT i.id, "
+    "setweight(to_tsvector('portuguese', coalesce(i.pergunta, '')), 'A') || "
+    "setweight(to_tsvector('portuguese', coalesce(i.resposta, '')), 'B') "
+    "FROM api_interacao i "
+    "ON CONFLICT (id) DO NOTHING",
+]
+
+
+STOPWORDS = frozenset("""
+a o as os um uma uns umas de do da dos das em no na nos nas por pelo pela
+para com sem que e ou se como qual quais quando onde me te lhe eu voce isso
+isto esse essa este esta ao aos sobre mais muito ja nao sim e ser ter
+""".split())
+
+REGRAS_PLURAL = [("oes", "ao", 3), ("aes", "ao", 3), ("ais", "al", 2), ("eis", "el", 2),
+                 ("ois", "ol", 2), ("les", "l", 3), ("res", "r", 3), ("ns", "m", 2), ("s", "", 3)]
+REGRAS_FEMININO = [("ona", "ao", 3), ("ora", "or", 3), ("osa", "oso", 3), ("iva", "ivo", 3),
+                   ("ica", "ico", 3), ("ada", "ado", 2), ("ida", "ido", 3), ("eira", "eiro", 3)]
+SUFIXOS_ADVERBIO = [("mente", "", 4)]
+SUFIXOS_NOME = [(s, "", m) for s, m in [
+    ("amento", 3), ("imento", 3), ("idade", 4), ("acao", 3), ("icao", 3), ("encia", 3),
+    ("ancia", 3), ("ismo", 3), ("ista", 3), ("avel", 2), ("ivel", 3), ("ador", 3),
+    ("edor", 3), ("idor", 3), ("eza", 3), ("oso", 3), ("ivo", 3), ("ico", 3),
+]]
+SUFIXOS_VERBO = [(s, "", m) for s, m in [
+    ("ariam", 2), ("eriam", 2), ("iriam", 2), ("assem", 2), ("essem", 2), ("issem", 2),
+    ("aram", 2), ("eram", 2), ("iram", 2), ("avam", 2), ("arem", 2), ("erem", 2),
+    ("irem", 2), ("asse", 2), ("esse", 2), ("isse", 2), ("ando", 2), ("endo", 3),
+    ("indo", 3), ("ado", 2), ("ido", 3), ("ava", 2), ("ar", 2), ("er", 2), ("ir", 3),
+    ("ou", 3), ("ei", 3), ("am", 2), ("em", 2), ("ia", 3),
+]]
+
+
+def aplicar(palavra, regras):
+    for sufixo, troca, minimo in regras:
+        if palavra.endswith(sufixo) and len(palavra) - len(sufixo) >= minimo:
+            return palavra[:-len(sufixo)] + troca, True
+    return palavra, False
+
+
+def radical(palavra):
+    if len(palavra) <= 3 or not palavra.isalpha():
+        return palavra
+    if palavra.endswith("s") and not palavra.endswith(("ss", "us", "is")):
+        palavra, _ = aplicar(palavra, REGRAS_PLURAL)
+    if palavra.endswith("a"):
+        palavra, _ = aplicar(palavra, REGRAS_FEMININO)
+    palavra, _ = aplicar(palavra, SUFIXOS_ADVERBIO)
+    palavra, removido = aplicar(palavra, SUFIXOS_NOME)
+    if not removido:
+        palavra, removido = aplicar(palavra, SUFIXOS_VERBO)
+    if not removido and palavra.endswith(("a", "e", "o")) and len(palavra) > 3:
+        palavra = palavra[:-1]
+    return palavra
+
+
+def termos(texto):
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(radical(t) for t in re.findall(r"\w+", texto) if t not in STOPWORDS)
+
+
+def indexar_existentes(apps, schema_editor, tamanho_bloco=1000):
+    """
+    No SQLite os textos são indexados pelos radicais calculados em Python,
+    então os registros existentes entram no índice aqui, em blocos.
+    """
+    Curso = apps.get_model("api", "Curso")
+    Interacao = apps.get_model("api", "Interacao")
+    using = schema_editor.connection.alias
+    fontes = [
+        ("api_curso_busca", Curso.objects.using(using).values_list("id", "titulo", "categoria__nome", "descricao")),
+        ("api_interacao_busca", Interacao.objects.using(using).values_list("id", "pergunta", "resposta")),
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        for tabela, linhas in fontes:
+            bloco = []
+            for pk, *textos in linhas.order_by("id").iterator(chunk_size=tamanho_bloco):
+                bloco.append((pk, *(termos(texto) for texto in textos)))
+                if len(bloco) >= tamanho_bloco:
+                    gravar_bloco(cursor, tabela, bloco)
+                    bloco = []
+            gravar_bloco(cursor, tabela, bloco)
+
+
+def gravar_bloco(cursor, tabela, bloco):
+    if not bloco:
+        return
+    colunas = ", ".join(f"c{i}" for i in range(len(bloco[0]) - 1))
+    marcadores = ", ".join(["%s"] * len(bloco[0]))
+    cursor.executemany(f"DELETE FROM {tabela} WHERE rowid = %s", [(linha[0],) for linha in bloco])
+    cursor.executemany(f"INSERT INTO {tabela} (rowid, {colunas}) VALUES ({marcadores})", bloco)
+
+
+def criar_indices(apps, schema_editor):
+    comandos = {
+        "sqlite": SQLITE_TABELAS,
+        "postgresql": POSTGRES_TABELAS,
+    }.get(schema_editor.connection.vendor, [])
+    for sql in comandos:
+        schema_editor.execute(sql)
+    if schema_editor.connection.vendor == "sqlite":
+        indexar_existentes(apps, schema_editor)
+
+
+def remover_indices(apps, schema_editor):
+    if schema_editor.connection.vendor not in ("sqlite", "postgresql"):
+        return
+    for tabela in ("api_curso_busca", "api_interacao_busca"):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {tabela}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_indices_paginacao"),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indices, remover_indices),
+    ]
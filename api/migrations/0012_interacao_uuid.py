@@ -0,0 +1,42 @@
+import uuid
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def gerar_uuids(apps, schema_editor):
+    Interacao = apps.get_model("api", "Interacao")
+    bloco = []
+    for interacao in Interacao.objects.filter(uuid__isnull=True).only("id").iterator(chunk_size=1000):
+        interacao.uuid = uuid.uuid4()
+        bloco.append(interacao)
+        if len(bloco) >= 1000:
+            Interacao.objects.bulk_update(bloco, ["uuid"], batch_size=1000)
+            bloco = []
+    Interacao.objects.bulk_update(bloco, ["uuid"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_busca_textual"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="interacao",
+            name="uuid",
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(gerar_uuids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="interacao",
+            name="uuid",
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="interacao",
+            name="data_criacao",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
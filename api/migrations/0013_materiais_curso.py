@@ -0,0 +1,83 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_interacao_uuid"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MaterialCurso",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("titulo", models.CharField(max_length=200)),
+                ("conteudo", models.TextField()),
+                ("data_criacao", models.DateTimeField(auto_now_add=True)),
+                ("data_atualizacao", models.DateTimeField(auto_now=True)),
+                (
+                    "curso",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="materiais",
+                        to="api.curso",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Material do curso",
+                "verbose_name_plural": "Materiais dos cursos",
+                "ordering": ["curso", "titulo"],
+            },
+        ),
+        migrations.CreateModel(
+            name="TrechoMaterial",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ordem", models.PositiveIntegerField()),
+                ("texto", models.TextField()),
+                ("vetor", models.BinaryField()),
+                (
+                    "curso",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trechos_material",
+                        to="api.curso",
+                    ),
+                ),
+                (
+                    "material",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trechos",
+                        to="api.materialcurso",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Trecho de material",
+                "verbose_name_plural": "Trechos de material",
+                "ordering": ["material", "ordem"],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_materiais_curso"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="interacao",
+            name="cache",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("", "Sem cache"),
+                    ("exato", "Pergunta igual"),
+                    ("similar", "Pergunta similar"),
+                ],
+                default="",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="latencia_primeiro_token",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="latencia_provedor",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="latencia_total",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="modelo",
+            field=models.CharField(blank=True, default="", max_length=50),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="provedor",
+            field=models.CharField(blank=True, default="", max_length=20),
+        ),
+        migrations.AddField(
+            model_name="interacao",
+            name="resultado",
+            field=models.CharField(
+                choices=[
+                    ("ok", "Resposta do provedor"),
+                    ("simulada", "Resposta simulada"),
+                    ("erro", "Interrompida por erro"),
+                    ("cancelada", "Cancelada pelo cliente"),
+                ],
+                default="ok",
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="interacao",
+            index=models.Index(
+                fields=["configuracao_ia", "-data_criacao"],
+                name="interacao_config_data_idx",
+            ),
+        ),
+    ]
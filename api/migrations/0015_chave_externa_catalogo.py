@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_desempenho_interacao"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="categoria",
+            name="chave_externa",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name="curso",
+            name="chave_externa",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_chave_externa_catalogo"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SegmentoArquivo",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("compressao", models.CharField(default="zlib", max_length=10)),
+                ("dados", models.BinaryField()),
+                ("quantidade", models.PositiveIntegerField()),
+                ("tamanho_original", models.PositiveBigIntegerField()),
+                ("data_inicial", models.DateTimeField()),
+                ("data_final", models.DateTimeField()),
+                ("data_criacao", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "Segmento do arquivo",
+                "verbose_name_plural": "Segmentos do arquivo",
+                "ordering": ["id"],
+            },
+        ),
+        migrations.CreateModel(
+            name="InteracaoArquivada",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("interacao_id", models.BigIntegerField(unique=True)),
+                ("uuid", models.UUIDField(unique=True)),
+                ("data_criacao", models.DateTimeField(db_index=True)),
+                ("posicao", models.PositiveIntegerField()),
+                (
+                    "curso",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="interacoes_arquivadas",
+                        to="api.curso",
+                    ),
+                ),
+                (
+                    "segmento",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="interacoes",
+                        to="api.segmentoarquivo",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Interação arquivada",
+                "verbose_name_plural": "Interações arquivadas",
+                "ordering": ["interacao_id"],
+            },
+        ),
+    ]
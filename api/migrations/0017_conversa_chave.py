@@ -0,0 +1,36 @@
+import uuid
+
+from django.db import migrations, models
+
+
+def gerar_chaves(apps, schema_editor):
+    Conversa = apps.get_model("api", "Conversa")
+    bloco = []
+    for conversa in Conversa.objects.filter(chave__isnull=True).only("id").iterator(chunk_size=1000):
+        conversa.chave = uuid.uuid4()
+        bloco.append(conversa)
+        if len(bloco) >= 1000:
+            Conversa.objects.bulk_update(bloco, ["chave"])
+            bloco = []
+    Conversa.objects.bulk_update(bloco, ["chave"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_arquivo_interacoes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversa",
+            name="chave",
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(gerar_chaves, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="conversa",
+            name="chave",
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_conversa_chave"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lote",
+            name="sinal_vida",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
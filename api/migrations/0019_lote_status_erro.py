@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_lote_sinal_vida"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="lote",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pendente", "Pendente"),
+                    ("processando", "Processando"),
+                    ("interrompido", "Interrompido"),
+                    ("concluido", "Concluído"),
+                    ("erro", "Erro"),
+                ],
+                default="pendente",
+                max_length=20,
+            ),
+        ),
+    ]
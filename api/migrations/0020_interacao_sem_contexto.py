@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_lote_status_erro"),
+    ]
+
+    operations = [
+        # As interações anteriores ficam False: o contexto delas não foi gravado,
+        # por isso não entram no índice de similaridade do cache de respostas
+        migrations.AddField(
+            model_name="interacao",
+            name="sem_contexto",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,4 +1,8 @@
+import uuid
+
+from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -6,6 +10,8 @@ class Categoria(models.Model):
     nome = models.CharField(max_length=100)
     descricao = models.TextField(blank=True, null=True)
     data_criacao = models.DateTimeField(auto_now_add=True)
+    # Identificador no sistema de origem (LMS), usado na sincronização em massa
+    chave_externa = models.CharField(max_length=100, unique=True, null=True, blank=True)
     
     def __str__(self):
         return self.nome
@@ -30,6 +36,9 @@ class Curso(models.Model):
     nivel = models.CharField(max_length=1, choices=NIVEL_CHOICES, default='B')
     carga_horaria = models.PositiveIntegerField()
     ativo = models.BooleanField(default=True)
+    orcamento_tokens_diario = models.PositiveIntegerField(null=True, blank=True)
+    # Identificador no sistema de origem (LMS), usado na sincronização em massa
+    chave_externa = models.CharField(max_length=100, unique=True, null=True, blank=True)
     
     def __str__(self):
         return self.titulo
@@ -38,6 +47,10 @@ class Curso(models.Model):
         verbose_name = 'Curso'
         verbose_name_plural = 'Cursos'
         ordering = ['-data_publicacao']
+        indexes = [
+            models.Index(fields=['-data_publicacao', '-id'], name='curso_publicacao_idx'),
+            models.Index(fields=['ativo', 'categoria', 'nivel'], name='curso_ativo_categoria_idx'),
+        ]
 
 class ConfiguracaoIA(models.Model):
     MODELO_CHOICES = (
@@ -65,6 +78,11 @@ class ConfiguracaoIA(models.Model):
     max_tokens = models.PositiveIntegerField(default=1000)
     chave_api = models.CharField(max_length=255)
     ativo = models.BooleanField(default=True)
+    limite_requisicoes_minuto = models.PositiveIntegerField(null=True, blank=True)
+    limite_tokens_minuto = models.PositiveIntegerField(null=True, blank=True)
+    peso = models.PositiveIntegerField(default=1)  # Peso na escolha entre as configurações ativas
+    hedge_ativo = models.BooleanField(default=False)  # Repetir a chamada se o primeiro token demorar
+    hedge_percentil = models.PositiveSmallIntegerField(default=95)  # Percentil da latência que dispara o hedge
     data_criacao = models.DateTimeField(auto_now_add=True)
     data_atualizacao = models.DateTimeField(auto_now=True)
     
@@ -76,13 +94,61 @@ class ConfiguracaoIA(models.Model):
         verbose_name_plural = 'Configurações de IA'
         ordering = ['nome']
 
+class Conversa(models.Model):
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='conversas')
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='conversas')
+    resumo = models.TextField(blank=True, default='')
+    interacoes_resumidas = models.PositiveIntegerField(default=0)
+    # Identificador devolvido ao aluno (conversa_id): o UUID da interação que abriu a conversa
+    chave = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Conversa {self.id} - {self.curso.titulo}"
+    
+    class Meta:
+        verbose_name = 'Conversa'
+        verbose_name_plural = 'Conversas'
+        ordering = ['-data_atualizacao']
+
 class Interacao(models.Model):
+    RESULTADO_CHOICES = (
+        ('ok', 'Resposta do provedor'),
+        ('simulada', 'Resposta simulada'),
+        ('erro', 'Interrompida por erro'),
+        ('cancelada', 'Cancelada pelo cliente'),
+    )
+    CACHE_CHOICES = (
+        ('', 'Sem cache'),
+        ('exato', 'Pergunta igual'),
+        ('similar', 'Pergunta similar'),
+    )
+    
     curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='interacoes')
     configuracao_ia = models.ForeignKey(ConfiguracaoIA, on_delete=models.SET_NULL, null=True, related_name='interacoes')
+    conversa = models.ForeignKey(Conversa, on_delete=models.SET_NULL, null=True, blank=True, related_name='interacoes')
     pergunta = models.TextField()
     resposta = models.TextField()
     tokens_utilizados = models.PositiveIntegerField(default=0)
-    data_criacao = models.DateTimeField(auto_now_add=True)
+    tokens_prompt = models.PositiveIntegerField(default=0)
+    tokens_resposta = models.PositiveIntegerField(default=0)
+    tokens_descartados = models.PositiveIntegerField(default=0)  # Consumidos pela chamada cancelada no hedge
+    resultado = models.CharField(max_length=10, choices=RESULTADO_CHOICES, default='ok')
+    cache = models.CharField(max_length=10, choices=CACHE_CHOICES, default='', blank=True)
+    # Provedor e modelo que responderam (a configuração pode mudar depois)
+    provedor = models.CharField(max_length=20, blank=True, default='')
+    modelo = models.CharField(max_length=50, blank=True, default='')
+    # Latências em segundos: da pergunta inteira, da chamada ao provedor e até o primeiro token (streaming)
+    latencia_total = models.FloatField(null=True, blank=True)
+    latencia_provedor = models.FloatField(null=True, blank=True)
+    latencia_primeiro_token = models.FloatField(null=True, blank=True)
+    # Pergunta sem contexto do cliente nem histórico: a resposta pode servir a perguntas parecidas (ver answer_cache.py)
+    sem_contexto = models.BooleanField(default=False)
+    # Identificador atribuído na criação, antes de a interação ir para o banco (ver write_behind.py)
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # Definida na criação (e não no INSERT), para valer também na gravação adiada
+    data_criacao = models.DateTimeField(default=timezone.now, editable=False)
     
     def __str__(self):
         return f"Interação {self.id} - {self.curso.titulo}"
@@ -91,3 +157,136 @@ class Interacao(models.Model):
         verbose_name = 'Interação'
         verbose_name_plural = 'Interações'
         ordering = ['-data_criacao']
+        indexes = [
+            models.Index(fields=['-data_criacao', '-id'], name='interacao_data_idx'),
+            models.Index(fields=['curso', '-data_criacao', '-id'], name='interacao_curso_data_idx'),
+            models.Index(fields=['configuracao_ia', '-data_criacao'], name='interacao_config_data_idx'),
+        ]
+
+class Lote(models.Model):
+    STATUS_CHOICES = (
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('interrompido', 'Interrompido'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    )
+    
+    nome = models.CharField(max_length=200)
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='lotes')  # Curso padrão dos itens
+    configuracao_ia = models.ForeignKey(ConfiguracaoIA, on_delete=models.SET_NULL, null=True, blank=True, related_name='lotes')
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='lotes')
+    concorrencia = models.PositiveSmallIntegerField(default=8)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
+    total = models.PositiveIntegerField(default=0)
+    concluidos = models.PositiveIntegerField(default=0)
+    falhas = models.PositiveIntegerField(default=0)
+    erro = models.TextField(blank=True, default='')
+    sinal_vida = models.DateTimeField(null=True, blank=True)  # Renovado durante o processamento (ver batch_jobs.py)
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.nome
+    
+    class Meta:
+        verbose_name = 'Lote de perguntas'
+        verbose_name_plural = 'Lotes de perguntas'
+        ordering = ['-data_criacao']
+
+class ItemLote(models.Model):
+    STATUS_CHOICES = (
+        ('pendente', 'Pendente'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    )
+    
+    lote = models.ForeignKey(Lote, on_delete=models.CASCADE, related_name='itens')
+    request_id = models.CharField(max_length=100)  # Identificador da linha no arquivo, usado para retomar
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='itens_lote')
+    pergunta = models.TextField()
+    contexto = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
+    interacao = models.ForeignKey(Interacao, on_delete=models.SET_NULL, null=True, blank=True, related_name='itens_lote')
+    erro = models.TextField(blank=True, default='')
+    
+    def __str__(self):
+        return f"{self.lote.nome} - {self.request_id}"
+    
+    class Meta:
+        verbose_name = 'Item de lote'
+        verbose_name_plural = 'Itens de lote'
+        ordering = ['id']
+        unique_together = ['lote', 'request_id']
+
+class MaterialCurso(models.Model):
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='materiais')
+    titulo = models.CharField(max_length=200)
+    conteudo = models.TextField()
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.curso.titulo} - {self.titulo}"
+    
+    class Meta:
+        verbose_name = 'Material do curso'
+        verbose_name_plural = 'Materiais dos cursos'
+        ordering = ['curso', 'titulo']
+
+class TrechoMaterial(models.Model):
+    material = models.ForeignKey(MaterialCurso, on_delete=models.CASCADE, related_name='trechos')
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='trechos_material')  # Índice carregado por curso
+    ordem = models.PositiveIntegerField()
+    texto = models.TextField()
+    vetor = models.BinaryField()  # Embedding em float32 (ver retrieval.py)
+    
+    def __str__(self):
+        return f"{self.material.titulo} #{self.ordem}"
+    
+    class Meta:
+        verbose_name = 'Trecho de material'
+        verbose_name_plural = 'Trechos de material'
+        ordering = ['material', 'ordem']
+
+class SegmentoArquivo(models.Model):
+    """
+    Bloco de interações antigas retiradas da tabela Interacao: uma linha
+    JSON por interação (a representação da API), comprimidas juntas (ver
+    retention.py).
+    """
+    compressao = models.CharField(max_length=10, default='zlib')
+    dados = models.BinaryField()
+    quantidade = models.PositiveIntegerField()
+    tamanho_original = models.PositiveBigIntegerField()  # Em bytes, antes da compressão
+    data_inicial = models.DateTimeField()  # data_criacao da interação mais antiga do segmento
+    data_final = models.DateTimeField()
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Segmento {self.id} ({self.quantidade} interações)"
+    
+    class Meta:
+        verbose_name = 'Segmento do arquivo'
+        verbose_name_plural = 'Segmentos do arquivo'
+        ordering = ['id']
+
+class InteracaoArquivada(models.Model):
+    """
+    Índice das interações arquivadas: onde encontrar cada uma, pelo id ou
+    pelo UUID originais.
+    """
+    interacao_id = models.BigIntegerField(unique=True)
+    uuid = models.UUIDField(unique=True)
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='interacoes_arquivadas')
+    data_criacao = models.DateTimeField(db_index=True)
+    segmento = models.ForeignKey(SegmentoArquivo, on_delete=models.CASCADE, related_name='interacoes')
+    posicao = models.PositiveIntegerField()  # Linha no segmento, a partir de 0
+    
+    def __str__(self):
+        return f"Interação arquivada {self.interacao_id}"
+    
+    class Meta:
+        verbose_name = 'Interação arquivada'
+        verbose_name_plural = 'Interações arquivadas'
+        ordering = ['interacao_id']
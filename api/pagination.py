@@ -0,0 +1,33 @@
+"""
+Paginação por cursor (keyset) para as tabelas grandes.
+
+Em vez de OFFSET, a próxima página é buscada a partir da última linha da
+anterior (WHERE data_criacao < ...), de modo que qualquer página custa o
+mesmo que a primeira quando há um índice na ordenação. A resposta traz os
+links `next` e `previous` com o cursor codificado, mas não o total de
+registros (o COUNT(*) também percorreria a tabela inteira).
+
+Nos resultados de uma busca textual, o cursor segue a relevância.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class RelevanciaCursorPagination(CursorPagination):
+    """
+    Ordena pela relevância quando o queryset vem de uma busca textual sem
+    ordenação explícita (ver filters.BuscaTextualFilter).
+    """
+
+    def get_ordering(self, request, queryset, view):
+        if 'relevancia' in queryset.query.annotations and not request.query_params.get('ordering'):
+            return ('-relevancia', '-id')
+        return super().get_ordering(request, queryset, view)
+
+
+class InteracaoCursorPagination(RelevanciaCursorPagination):
+    # O id desempata interações criadas no mesmo instante
+    ordering = ('-data_criacao', '-id')
+
+
+class CursoCursorPagination(RelevanciaCursorPagination):
+    ordering = ('-data_publicacao', '-id')
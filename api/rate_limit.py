@@ -0,0 +1,242 @@
+"""
+Limites de taxa por ConfiguracaoIA e orçamentos diários de tokens.
+
+Cada configuração tem um token bucket de requisições e outro de tokens por
+minuto, guardados no cache do Django para serem compartilhados entre os
+workers (use um cache compartilhado, como Redis, Memcached ou banco, quando
+houver mais de um processo). Quando não há capacidade, a requisição aguarda
+na fila por até ESPERA_MAXIMA segundos antes de ser recusada.
+
+Cada tentativa reserva o prompt mais o máximo de tokens da resposta, tanto
+no bucket da configuração quanto nos orçamentos diários (com cache.incr,
+atômico entre os workers). Depois da chamada, a reserva é ajustada ao
+consumo real: o que não foi usado volta para o bucket e para o orçamento.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'ALIAS': 'default',
+    'ESPERA_MAXIMA': 10,
+    'ESPERA_TRAVA': 2.0,
+    'ORCAMENTO_DIARIO_USUARIO': None,
+}
+
+# Contadores diários ficam no cache por dois dias (cobre a virada do dia)
+TTL_ORCAMENTO = 60 * 60 * 48
+
+
+class LimiteExcedido(Exception):
+    """
+    A capacidade do provedor não foi liberada dentro da espera máxima.
+    """
+
+    def __init__(self, mensagem, retry_after=None):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+class OrcamentoExcedido(LimiteExcedido):
+    """
+    O orçamento diário de tokens do curso ou do usuário foi atingido.
+    """
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'LIMITE_TAXA', {}))
+
+
+def _cache():
+    return caches[_config()['ALIAS']]
+
+
+@contextmanager
+def _lock(cache, chave):
+    """
+    Trava simples baseada em cache.add, para atualizar o estado do bucket
+    sem condição de corrida entre workers. Se a trava não for obtida em
+    ESPERA_TRAVA segundos, levanta LimiteExcedido em vez de seguir sem ela.
+    """
+    chave_lock = f"{chave}:lock"
+    limite = time.monotonic() + _config()['ESPERA_TRAVA']
+    while not cache.add(chave_lock, 1, timeout=5):
+        if time.monotonic() >= limite:
+            logger.warning("Trava %s ocupada; recusando a requisição", chave_lock)
+            raise LimiteExcedido("Limite de requisições ocupado. Tente novamente em instantes.", retry_after=1)
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        cache.delete(chave_lock)
+
+
+def _chave_bucket(config):
+    return f"limite:config:{config.pk}"
+
+
+def reservar(config, tokens):
+    """
+    Tenta reservar uma requisição e `tokens` tokens nos buckets da
+    configuração. Retorna 0 se a reserva foi feita ou, caso contrário, quantos
+    segundos esperar até haver capacidade.
+    """
+    rpm = config.limite_requisicoes_minuto
+    tpm = config.limite_tokens_minuto
+    if not rpm and not tpm:
+        return 0
+
+    cache = _cache()
+    chave = _chave_bucket(config)
+    with _lock(cache, chave):
+        agora = time.time()
+        estado = cache.get(chave) or {"requisicoes": rpm or 0, "tokens": tpm or 0, "instante": agora}
+        decorrido = max(0.0, agora - estado["instante"])
+
+        # Reabastecer os buckets proporcionalmente ao tempo decorrido
+        espera = 0.0
+        if rpm:
+            estado["requisicoes"] = min(rpm, estado["requisicoes"] + decorrido * rpm / 60)
+            if estado["requisicoes"] < 1:
+                espera = max(espera, (1 - estado["requisicoes"]) * 60 / rpm)
+        if tpm:
+            # Uma requisição maior que o bucket inteiro só precisa do bucket cheio
+            tokens = min(tokens, tpm)
+            estado["tokens"] = min(tpm, estado["tokens"] + decorrido * tpm / 60)
+            if estado["tokens"] < tokens:
+                espera = max(espera, (tokens - estado["tokens"]) * 60 / tpm)
+
+        if espera == 0:
+            if rpm:
+                estado["requisicoes"] -= 1
+            if tpm:
+                estado["tokens"] -= tokens
+        estado["instante"] = agora
+        cache.set(chave, estado, timeout=120)
+    return espera
+
+
+def devolver(config, reservados, usados):
+    """
+    Devolve ao bucket de tokens da configuração a parte não usada de uma
+    reserva de `reservados` tokens.
+    """
+    tpm = config.limite_tokens_minuto
+    if not tpm:
+        return
+    sobra = min(reservados, tpm) - usados
+    if sobra <= 0:
+        return
+    cache = _cache()
+    chave = _chave_bucket(config)
+    try:
+        with _lock(cache, chave):
+            estado = cache.get(chave)
+            if estado is None:
+                return
+            estado["tokens"] = min(tpm, estado["tokens"] + sobra)
+            cache.set(chave, estado, timeout=120)
+    except LimiteExcedido:
+        # Sem a trava, a sobra fica perdida até o bucket se reabastecer
+        logger.warning("Não foi possível devolver %s tokens ao limite da configuração %s", sobra, config.pk)
+
+
+def adquirir(config, tokens, espera_maxima=None):
+    """
+    Aguarda (por até ESPERA_MAXIMA segundos, ou `espera_maxima` se informada)
+    capacidade para uma requisição de `tokens` tokens. Levanta LimiteExcedido
+    se a espera se esgotar.
+    """
+    if espera_maxima is None:
+        espera_maxima = _config()['ESPERA_MAXIMA']
+    limite = time.monotonic() + espera_maxima
+    while True:
+        espera = reservar(config, tokens)
+        if espera == 0:
+            return
+        if time.monotonic() + espera > limite:
+            raise LimiteExcedido(
+                f"Limite de requisições da configuração {config.nome} atingido. Tente novamente em instantes.",
+                retry_after=int(espera) + 1
+            )
+        logger.debug("Aguardando %.2fs pelo limite da configuração %s", espera, config.pk)
+        time.sleep(espera)
+
+
+async def aadquirir(config, tokens, espera_maxima=None):
+    """
+    Versão assíncrona de adquirir: a espera não bloqueia o event loop.
+    """
+    if espera_maxima is None:
+        espera_maxima = _config()['ESPERA_MAXIMA']
+    limite = time.monotonic() + espera_maxima
+    while True:
+        espera = await sync_to_async(reservar)(config, tokens)
+        if espera == 0:
+            return
+        if time.monotonic() + espera > limite:
+            raise LimiteExcedido(
+                f"Limite de requisições da configuração {config.nome} atingido. Tente novamente em instantes.",
+                retry_after=int(espera) + 1
+            )
+        await asyncio.sleep(espera)
+
+
+def _chave_orcamento(tipo, objeto_id):
+    return f"orcamento:{tipo}:{objeto_id}:{date.today().isoformat()}"
+
+
+def _incrementar(cache, chave, tokens):
+    cache.add(chave, 0, timeout=TTL_ORCAMENTO)
+    try:
+        return cache.incr(chave, tokens)
+    except ValueError:
+        # O contador expirou entre o add e o incr
+        cache.set(chave, max(tokens, 0), timeout=TTL_ORCAMENTO)
+        return max(tokens, 0)
+
+
+def reservar_orcamento(curso, usuario_id, tokens):
+    """
+    Reserva `tokens` tokens nos orçamentos diários do curso e do usuário,
+    somando-os aos contadores com cache.incr. Se a soma ultrapassar algum
+    limite, desfaz a reserva e levanta OrcamentoExcedido.
+
+    Retorna as chaves dos contadores reservados, que ajustar_orcamento
+    recebe depois da chamada (a reserva fica no dia em que foi feita).
+    """
+    cache = _cache()
+    limites = [("curso", curso.pk, curso.orcamento_tokens_diario)]
+    if usuario_id:
+        limites.append(("usuario", usuario_id, _config()['ORCAMENTO_DIARIO_USUARIO']))
+
+    chaves = []
+    for tipo, objeto_id, limite in limites:
+        chave = _chave_orcamento(tipo, objeto_id)
+        consumido = _incrementar(cache, chave, tokens)
+        chaves.append(chave)
+        if limite and consumido > limite:
+            ajustar_orcamento(chaves, -tokens)
+            nome = "do curso" if tipo == "curso" else "do usuário"
+            raise OrcamentoExcedido(f"Orçamento diário de tokens {nome} atingido.")
+    return chaves
+
+
+def ajustar_orcamento(chaves, tokens):
+    """
+    Soma `tokens` (negativo para devolver) aos contadores diários
+    reservados por reservar_orcamento.
+    """
+    if not tokens:
+        return
+    cache = _cache()
+    for chave in chaves:
+        _incrementar(cache, chave, tokens)
@@ -0,0 +1,44 @@
+"""
+Renderer JSON da API.
+
+Com o orjson instalado (pip install orjson), as respostas são codificadas
+por ele, mais rápido que pelo json da biblioteca padrão; sem ele, vale o
+JSONRenderer do DRF. Datas, Decimal e os demais tipos que o orjson não
+trata como o DRF passam pelo encoder do DRF, de modo que a saída é a mesma
+nos dois casos.
+"""
+import json
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson é opcional
+    orjson = None
+
+if orjson is not None:
+    OPCOES_ORJSON = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+_encoder = encoders.JSONEncoder()
+
+
+def codificar_json(dados):
+    """
+    JSON compacto, em bytes UTF-8, com o orjson quando disponível.
+    """
+    if orjson is not None:
+        return orjson.dumps(dados, default=_encoder.default, option=OPCOES_ORJSON)
+    return json.dumps(dados, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class JSONRapidoRenderer(renderers.JSONRenderer):
+    """
+    JSONRenderer que usa o orjson quando disponível. Pedidos com indentação
+    (Accept: application/json; indent=4) continuam com o json padrão.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return codificar_json(data)
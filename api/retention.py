@@ -0,0 +1,168 @@
+"""
+Retenção das interações: as criadas há mais de RETENCAO_INTERACOES['DIAS']
+dias saem da tabela Interacao para o arquivo, de modo que o tamanho da
+tabela (e o custo das buscas, listagens e do admin sobre ela) não cresce
+com o histórico.
+
+O arquivo guarda as interações em segmentos de até TAMANHO_BLOCO linhas
+JSON (a representação da API, a mesma da exportação) comprimidas com zlib,
+e um índice com o id, o UUID, o curso e a data de cada uma, pelo qual o
+detalhe de uma interação arquivada continua disponível em
+GET /api/interacoes/{id}/. Cada segmento é gravado, e as interações dele
+excluídas, em uma transação curta: a tabela principal nunca fica travada
+por mais que um bloco. Rode o comando arquivar_interacoes periodicamente
+(por exemplo, pelo cron).
+
+As interações arquivadas saem também do índice de busca textual, das
+listagens, da exportação e do histórico das conversas. Como o resumo das
+conversas avança pela posição das interações (interacoes_resumidas), o
+contador é reduzido, na mesma transação, pelas interações arquivadas.
+"""
+import json
+import logging
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .answer_cache import answer_cache
+from .fast_serialization import mapeador
+from .models import Conversa, Interacao, InteracaoArquivada, SegmentoArquivo
+from .renderers import codificar_json
+from .serializers import InteracaoSerializer
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'DIAS': 180,
+    'TAMANHO_BLOCO': 1000,
+    # Pausa, em segundos, entre os blocos (deixa as gravações do tráfego passarem)
+    'PAUSA': 0.1,
+    'NIVEL_COMPRESSAO': 6,
+}
+
+DESCOMPRESSORES = {
+    'zlib': zlib.decompress,
+}
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'RETENCAO_INTERACOES', {}))
+
+
+def arquivar_bloco(limite, tamanho_bloco=None):
+    """
+    Move para um novo segmento até `tamanho_bloco` interações criadas antes
+    de `limite`, as mais antigas primeiro. Retorna quantas foram arquivadas.
+    """
+    config = _config()
+    tamanho_bloco = tamanho_bloco or config['TAMANHO_BLOCO']
+    mapa = mapeador(InteracaoSerializer)
+
+    with transaction.atomic():
+        # No PostgreSQL, dois arquivamentos simultâneos pegam blocos diferentes
+        ids = list(
+            Interacao.objects.select_for_update(skip_locked=True)
+            .filter(data_criacao__lt=limite).order_by('id')
+            .values_list('id', flat=True)[:tamanho_bloco]
+        )
+        if not ids:
+            return 0
+        linhas = list(Interacao.objects.filter(id__in=ids).order_by('id').values(*mapa.lookups(mapa.nomes)))
+        conteudo = b"".join(codificar_json(item) + b"\n" for item in mapa.mapear(linhas, mapa.nomes))
+        datas = [linha['data_criacao'] for linha in linhas]
+        segmento = SegmentoArquivo.objects.create(
+            compressao='zlib',
+            dados=zlib.compress(conteudo, config['NIVEL_COMPRESSAO']),
+            quantidade=len(linhas),
+            tamanho_original=len(conteudo),
+            data_inicial=min(datas),
+            data_final=max(datas),
+        )
+        InteracaoArquivada.objects.bulk_create([
+            InteracaoArquivada(
+                interacao_id=linha['id'], uuid=linha['uuid'], curso_id=linha['curso'],
+                data_criacao=linha['data_criacao'], segmento=segmento, posicao=posicao,
+            )
+            for posicao, linha in enumerate(linhas)
+        ])
+        _descontar_resumidas(ids)
+        # Os itens de lote que apontavam para as interações ficam sem elas
+        # (SET_NULL); o post_delete retira cada uma do índice de busca
+        Interacao.objects.filter(id__in=ids).only('id').delete()
+
+        cursos = {linha['curso'] for linha in linhas}
+        if answer_cache is not None:
+            transaction.on_commit(lambda: [answer_cache.invalidate_curso(curso_id) for curso_id in cursos])
+
+    logger.info(
+        "Segmento %s: %s interações arquivadas (%s -> %s bytes)",
+        segmento.id, len(linhas), len(conteudo), len(segmento.dados),
+    )
+    return len(ids)
+
+
+def _descontar_resumidas(ids):
+    """
+    Desconta de interacoes_resumidas as interações de cada conversa que
+    serão arquivadas (as mais antigas dela), para que atualizar_resumo
+    continue a partir do turno certo.
+    """
+    por_quantidade = {}
+    contagens = (
+        Interacao.objects.filter(id__in=ids, conversa__isnull=False)
+        .values('conversa').annotate(quantidade=Count('id'))
+    )
+    for linha in contagens:
+        por_quantidade.setdefault(linha['quantidade'], []).append(linha['conversa'])
+    for quantidade, conversas in por_quantidade.items():
+        Conversa.objects.filter(id__in=conversas).update(
+            interacoes_resumidas=Greatest(F('interacoes_resumidas') - quantidade, 0)
+        )
+
+
+def arquivar(dias=None, tamanho_bloco=None, pausa=None, max_blocos=None):
+    """
+    Arquiva, bloco a bloco, as interações criadas há mais de `dias` dias (o
+    limite é fixado no início). Retorna o total arquivado.
+    """
+    config = _config()
+    dias = config['DIAS'] if dias is None else dias
+    tamanho_bloco = tamanho_bloco or config['TAMANHO_BLOCO']
+    pausa = config['PAUSA'] if pausa is None else pausa
+    limite = timezone.now() - timedelta(days=dias)
+
+    total = blocos = 0
+    while max_blocos is None or blocos < max_blocos:
+        arquivadas = arquivar_bloco(limite, tamanho_bloco)
+        total += arquivadas
+        blocos += 1
+        if arquivadas < tamanho_bloco:
+            break
+        if pausa:
+            time.sleep(pausa)
+    return total
+
+
+def buscar(chave):
+    """
+    Representação (a mesma da API) da interação arquivada com o id ou o
+    UUID `chave`, ou None se ela não está no arquivo.
+    """
+    chave = str(chave)
+    try:
+        filtro = {'interacao_id': int(chave)} if chave.isdigit() else {'uuid': uuid.UUID(chave)}
+    except ValueError:
+        return None
+    arquivada = InteracaoArquivada.objects.select_related('segmento').filter(**filtro).first()
+    if arquivada is None:
+        return None
+    segmento = arquivada.segmento
+    conteudo = DESCOMPRESSORES[segmento.compressao](bytes(segmento.dados))
+    return json.loads(conteudo.split(b"\n")[arquivada.posicao])
@@ -0,0 +1,235 @@
+"""
+Contexto recuperado dos materiais do curso (RAG).
+
+Os materiais de cada curso (MaterialCurso) são divididos em trechos com
+sobreposição e cada trecho recebe um embedding, gravado em TrechoMaterial
+(no próprio banco, um índice por curso). A cada pergunta, os TOP_K trechos
+mais similares entram no início do {contexto} do prompt, no lugar de o
+cliente reenviar o material inteiro a cada requisição.
+
+O embedding é local e não depende de bibliotecas externas: os radicais dos
+termos (o mesmo stemmer da busca textual) e os pares de radicais vizinhos
+são espalhados por hashing em um vetor de DIMENSOES posições, com peso
+sublinear na frequência, e o vetor é normalizado. A similaridade é o
+produto interno. Os vetores de cada curso ficam em memória após a primeira
+pergunta, até um material do curso mudar (ver signals.py) ou TTL_INDICE
+segundos se passarem (alterações feitas por outros processos).
+"""
+import hashlib
+import logging
+import math
+import operator
+import threading
+import time
+from array import array
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .full_text import termos
+from .models import TrechoMaterial
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'ATIVO': True,
+    'DIMENSOES': 256,
+    'TAMANHO_TRECHO': 800,
+    'SOBREPOSICAO': 150,
+    'TOP_K': 4,
+    'SIMILARIDADE_MINIMA': 0.1,
+    'MAX_CARACTERES': 3000,
+    'TTL_INDICE': 300,
+}
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'MATERIAIS_CURSO', {}))
+
+
+def dividir(texto, tamanho, sobreposicao):
+    """
+    Divide o texto em trechos de até `tamanho` caracteres, quebrando de
+    preferência entre parágrafos ou frases, com `sobreposicao` caracteres
+    repetidos entre trechos vizinhos.
+    """
+    texto = texto.strip()
+    trechos = []
+    inicio = 0
+    while inicio < len(texto):
+        fim = min(inicio + tamanho, len(texto))
+        if fim < len(texto):
+            # Recuar até o fim de um parágrafo, frase ou palavra na segunda metade do trecho
+            for separador in ("\n\n", ". ", "\n", " "):
+                corte = texto.rfind(separador, inicio + tamanho // 2, fim)
+                if corte != -1:
+                    fim = corte + len(separador)
+                    break
+        trecho = texto[inicio:fim].strip()
+        if trecho:
+            trechos.append(trecho)
+        if fim >= len(texto):
+            break
+        # O próximo trecho começa na primeira palavra inteira da sobreposição
+        proximo = fim - sobreposicao
+        espaco = texto.find(" ", proximo, fim)
+        inicio = max(espaco + 1 if espaco != -1 else proximo, inicio + 1)
+    return trechos
+
+
+def _posicao(termo, dimensoes):
+    codigo = int.from_bytes(hashlib.blake2b(termo.encode("utf-8"), digest_size=8).digest(), "little")
+    return codigo % dimensoes, 1.0 if codigo >> 63 else -1.0
+
+
+def embutir(texto, dimensoes):
+    """
+    Embedding do texto por hashing dos radicais e dos pares de radicais
+    vizinhos, normalizado (norma 1, ou vetor nulo se não houver termos).
+    """
+    radicais = termos(texto)
+    contagem = Counter(radicais)
+    contagem.update(f"{a} {b}" for a, b in zip(radicais, radicais[1:]))
+    vetor = array('f', bytes(4 * dimensoes))
+    for termo, frequencia in contagem.items():
+        posicao, sinal = _posicao(termo, dimensoes)
+        vetor[posicao] += sinal * (1.0 + math.log(frequencia))
+    norma = math.sqrt(sum(v * v for v in vetor))
+    if norma:
+        for i in range(dimensoes):
+            vetor[i] /= norma
+    return vetor
+
+
+def indexar_material(material):
+    """
+    Refaz os trechos e embeddings de um material.
+    """
+    conf = _config()
+    trechos = [
+        TrechoMaterial(
+            material=material, curso_id=material.curso_id, ordem=ordem, texto=texto,
+            vetor=embutir(f"{material.titulo}\n{texto}", conf['DIMENSOES']).tobytes(),
+        )
+        for ordem, texto in enumerate(dividir(material.conteudo, conf['TAMANHO_TRECHO'], conf['SOBREPOSICAO']))
+    ]
+    with transaction.atomic():
+        TrechoMaterial.objects.filter(material=material).delete()
+        TrechoMaterial.objects.bulk_create(trechos, batch_size=500)
+    indice.invalidar(material.curso_id)
+    return len(trechos)
+
+
+class IndiceCursos:
+    """
+    Vetores dos trechos de cada curso em memória, carregados do banco na
+    primeira pergunta sobre o curso.
+    """
+
+    def __init__(self):
+        self._cursos = {}
+        self._lock = threading.Lock()
+
+    def _valido(self, curso_id, ttl):
+        entrada = self._cursos.get(curso_id)
+        if entrada is not None and time.monotonic() - entrada[0] < ttl:
+            return entrada[1]
+        return None
+
+    def _carregar(self, curso_id, dimensoes):
+        trechos = []
+        for titulo, texto, vetor in (
+            TrechoMaterial.objects.filter(curso_id=curso_id)
+            .values_list('material__titulo', 'texto', 'vetor')
+            .iterator()
+        ):
+            vetor = array('f', bytes(vetor))
+            if len(vetor) != dimensoes:
+                # Indexado com outra configuração de DIMENSOES: rode indexar_materiais
+                continue
+            trechos.append((titulo, texto, vetor))
+        with self._lock:
+            self._cursos[curso_id] = (time.monotonic(), trechos)
+        return trechos
+
+    def trechos(self, curso_id):
+        conf = _config()
+        trechos = self._valido(curso_id, conf['TTL_INDICE'])
+        return trechos if trechos is not None else self._carregar(curso_id, conf['DIMENSOES'])
+
+    async def atrechos(self, curso_id):
+        conf = _config()
+        trechos = self._valido(curso_id, conf['TTL_INDICE'])
+        if trechos is None:
+            trechos = await sync_to_async(self._carregar)(curso_id, conf['DIMENSOES'])
+        return trechos
+
+    def invalidar(self, curso_id):
+        with self._lock:
+            self._cursos.pop(curso_id, None)
+
+
+indice = IndiceCursos()
+
+
+def _ranquear(trechos, pergunta, k=None):
+    conf = _config()
+    if not trechos:
+        return []
+    consulta = embutir(pergunta, conf['DIMENSOES'])
+    pontuados = [
+        (sum(map(operator.mul, consulta, vetor)), titulo, texto) for titulo, texto, vetor in trechos
+    ]
+    pontuados.sort(key=lambda p: p[0], reverse=True)
+    return [p for p in pontuados[:k or conf['TOP_K']] if p[0] >= conf['SIMILARIDADE_MINIMA']]
+
+
+def recuperar(curso_id, pergunta, k=None):
+    """
+    Trechos mais similares à pergunta: lista de (similaridade, título do
+    material, texto), da mais para a menos similar.
+    """
+    return _ranquear(indice.trechos(curso_id), pergunta, k)
+
+
+async def arecuperar(curso_id, pergunta, k=None):
+    """
+    Versão assíncrona de recuperar.
+    """
+    return _ranquear(await indice.atrechos(curso_id), pergunta, k)
+
+
+def _montar(recuperados, contexto):
+    limite = _config()['MAX_CARACTERES']
+    partes = []
+    usados = 0
+    for _, titulo, texto in recuperados:
+        if usados + len(texto) > limite:
+            break
+        partes.append(f"[{titulo}] {texto}")
+        usados += len(texto)
+    if not partes:
+        return contexto
+    materiais = "Trechos dos materiais do curso:\n" + "\n\n".join(partes)
+    return f"{materiais}\n\n{contexto}" if contexto else materiais
+
+
+def contexto_com_materiais(curso, pergunta, contexto=""):
+    """
+    O contexto do prompt: os trechos dos materiais do curso relevantes para
+    a pergunta, seguidos do contexto enviado pelo cliente.
+    """
+    if not _config()['ATIVO']:
+        return contexto
+    return _montar(recuperar(curso.id, pergunta), contexto)
+
+
+async def acontexto_com_materiais(curso, pergunta, contexto=""):
+    """
+    Versão assíncrona de contexto_com_materiais.
+    """
+    if not _config()['ATIVO']:
+        return contexto
+    return _montar(await arecuperar(curso.id, pergunta), contexto)
@@ -0,0 +1,304 @@
+"""
+Roteamento das perguntas entre as configurações de IA ativas.
+
+Todas as configurações ativas formam um pool: a escolha é ponderada pelo
+peso de cada configuração e pela média móvel exponencial (EWMA) das suas
+latências recentes, cada provedor tem um circuit breaker, e um erro faz a
+pergunta ser repetida na próxima configuração antes de recorrer à resposta
+simulada. Só os erros transitórios (timeout, conexão, limite (429) ou 5xx)
+contam no circuit breaker.
+
+O roteador também guarda as latências até o primeiro token de cada
+configuração, usadas para decidir quando disparar um hedge (ver hedging.py),
+e as métricas dos hedges disparados.
+"""
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+import openai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'TENTATIVAS': 3,
+    'ALFA_EWMA': 0.2,
+    'FALHAS_PARA_ABRIR': 5,
+    'SEGUNDOS_ABERTO': 30,
+    'AMOSTRAS_LATENCIA': 500,
+    'HEDGE_AMOSTRAS_MINIMAS': 20,
+    'HEDGE_ATRASO_PADRAO': 2.0,
+}
+
+ERROS_RECUPERAVEIS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    TimeoutError,
+)
+
+
+def erro_recuperavel(erro):
+    """
+    Indica se o erro é transitório (timeout, falha de conexão, 429 ou 5xx):
+    conta no circuit breaker e a mesma configuração pode ser tentada de novo.
+    """
+    if isinstance(erro, ERROS_RECUPERAVEIS):
+        return True
+    return isinstance(erro, openai.APIStatusError) and erro.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um provedor: abre após falhas consecutivas e, passado
+    o tempo de espera, deixa passar uma requisição de teste (meio-aberto) por
+    janela de espera até que uma delas tenha sucesso.
+    """
+
+    def __init__(self, falhas_para_abrir, segundos_aberto):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.segundos_aberto = segundos_aberto
+        self.falhas = 0
+        self.aberto_ate = None
+
+    @property
+    def estado(self):
+        if self.aberto_ate is None:
+            return "fechado"
+        if time.monotonic() < self.aberto_ate:
+            return "aberto"
+        return "meio-aberto"
+
+    def permite(self):
+        estado = self.estado
+        if estado == "fechado":
+            return True
+        if estado == "meio-aberto":
+            # Requisição de teste: as demais esperam mais uma janela
+            self.aberto_ate = time.monotonic() + self.segundos_aberto
+            return True
+        return False
+
+    def sucesso(self):
+        self.falhas = 0
+        self.aberto_ate = None
+
+    def falha(self):
+        self.falhas += 1
+        if self.aberto_ate is not None or self.falhas >= self.falhas_para_abrir:
+            self.aberto_ate = time.monotonic() + self.segundos_aberto
+
+
+def percentil(amostras, p):
+    """
+    Percentil p (0-100) de uma coleção de amostras, pelo método do posto mais próximo.
+    """
+    if not amostras:
+        return None
+    ordenadas = sorted(amostras)
+    indice = max(math.ceil(p / 100 * len(ordenadas)) - 1, 0)
+    return ordenadas[min(indice, len(ordenadas) - 1)]
+
+
+class HedgeStats:
+    """
+    Métricas dos hedges de uma configuração: quantas chamadas dispararam um
+    hedge, quantas o hedge venceu, e as latências até o primeiro token
+    entregue (efetiva) e da chamada original (primária). A latência primária
+    de uma chamada cancelada só é conhecida na amostra observada até o
+    primeiro token (ver hedging.py); nas demais, não é registrada.
+    """
+
+    def __init__(self, amostras):
+        self.chamadas = 0
+        self.hedges = 0
+        self.vitorias_hedge = 0
+        self.tokens_descartados = 0
+        self.efetivas = deque(maxlen=amostras)
+        self.primarias = deque(maxlen=amostras)
+
+    def resumo(self):
+        resumo = {
+            "chamadas": self.chamadas,
+            "hedges": self.hedges,
+            "taxa_hedge": self.hedges / self.chamadas if self.chamadas else 0.0,
+            "vitorias_hedge": self.vitorias_hedge,
+            "tokens_descartados": self.tokens_descartados,
+        }
+        for p in (50, 95, 99):
+            efetiva = percentil(self.efetivas, p)
+            primaria = percentil(self.primarias, p)
+            resumo[f"p{p}_efetiva"] = efetiva
+            resumo[f"p{p}_primaria"] = primaria
+            resumo[f"p{p}_reducao"] = primaria - efetiva if None not in (efetiva, primaria) else None
+        return resumo
+
+
+class ProviderRouter:
+    """
+    Estado do roteamento no processo: latências por configuração e circuit
+    breakers por provedor.
+    """
+
+    def __init__(self, tentativas=3, alfa=0.2, falhas_para_abrir=5, segundos_aberto=30,
+                 amostras=500, hedge_amostras_minimas=20, hedge_atraso_padrao=2.0):
+        self.tentativas = tentativas
+        self.alfa = alfa
+        self.falhas_para_abrir = falhas_para_abrir
+        self.segundos_aberto = segundos_aberto
+        self.amostras = amostras
+        self.hedge_amostras_minimas = hedge_amostras_minimas
+        self.hedge_atraso_padrao = hedge_atraso_padrao
+        self._latencias = {}
+        self._primeiro_token = {}
+        self._hedges = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(CONFIG_PADRAO, **getattr(settings, 'ROTEAMENTO', {}))
+        return cls(
+            tentativas=conf['TENTATIVAS'],
+            alfa=conf['ALFA_EWMA'],
+            falhas_para_abrir=conf['FALHAS_PARA_ABRIR'],
+            segundos_aberto=conf['SEGUNDOS_ABERTO'],
+            amostras=conf['AMOSTRAS_LATENCIA'],
+            hedge_amostras_minimas=conf['HEDGE_AMOSTRAS_MINIMAS'],
+            hedge_atraso_padrao=conf['HEDGE_ATRASO_PADRAO'],
+        )
+
+    def _breaker(self, provedor):
+        breaker = self._breakers.get(provedor)
+        if breaker is None:
+            breaker = self._breakers[provedor] = CircuitBreaker(
+                self.falhas_para_abrir, self.segundos_aberto
+            )
+        return breaker
+
+    def latencia(self, config):
+        return self._latencias.get(config.pk)
+
+    def ordenar(self, configs, preferida_id=None):
+        """
+        Ordena as configurações para a próxima pergunta: a preferida primeiro
+        e as demais por sorteio ponderado por peso / latência. Configurações
+        com o circuit breaker aberto vão para o fim da fila (e são puladas
+        nas tentativas enquanto o circuito estiver aberto).
+        """
+        with self._lock:
+            conhecidas = [l for l in self._latencias.values() if l]
+            padrao = sum(conhecidas) / len(conhecidas) if conhecidas else 1.0
+
+            def chave(config):
+                pontuacao = max(config.peso, 1) / (self._latencias.get(config.pk) or padrao)
+                return random.random() ** (1.0 / pontuacao)
+
+            ordenadas = sorted(configs, key=chave, reverse=True)
+            ordenadas.sort(key=lambda c: (self._breaker(c.provedor).estado == "aberto", c.pk != preferida_id))
+        return ordenadas
+
+    def permite(self, config):
+        """
+        Indica se o circuit breaker do provedor deixa a tentativa passar.
+        """
+        with self._lock:
+            return self._breaker(config.provedor).permite()
+
+    def disponivel(self, config):
+        """
+        Indica se o circuit breaker do provedor não está aberto, sem consumir
+        a requisição de teste do estado meio-aberto.
+        """
+        with self._lock:
+            return self._breaker(config.provedor).estado != "aberto"
+
+    def plano(self, configs):
+        """
+        Sequência de tentativas: percorre as configurações em ordem, voltando
+        ao início se houver menos configurações que tentativas.
+        """
+        if not configs:
+            return []
+        return [configs[i % len(configs)] for i in range(max(self.tentativas, 1))]
+
+    def registrar_sucesso(self, config, latencia):
+        with self._lock:
+            anterior = self._latencias.get(config.pk)
+            self._latencias[config.pk] = (
+                latencia if anterior is None else self.alfa * latencia + (1 - self.alfa) * anterior
+            )
+            self._breaker(config.provedor).sucesso()
+
+    def registrar_falha(self, config, erro):
+        with self._lock:
+            self._breaker(config.provedor).falha()
+        logger.warning("Falha na configuração %s (%s): %s", config.pk, config.provedor, erro)
+
+    def registrar_primeiro_token(self, config, latencia):
+        with self._lock:
+            amostras = self._primeiro_token.get(config.pk)
+            if amostras is None:
+                amostras = self._primeiro_token[config.pk] = deque(maxlen=self.amostras)
+            amostras.append(latencia)
+
+    def atraso_hedge(self, config):
+        """
+        Quanto esperar pelo primeiro token antes de disparar um hedge: o
+        percentil hedge_percentil das latências recentes da configuração, ou
+        HEDGE_ATRASO_PADRAO enquanto não houver amostras suficientes.
+        """
+        with self._lock:
+            amostras = list(self._primeiro_token.get(config.pk, ()))
+        if len(amostras) < self.hedge_amostras_minimas:
+            return self.hedge_atraso_padrao
+        return percentil(amostras, config.hedge_percentil)
+
+    def registrar_hedge(self, config, disparado, venceu_hedge, efetiva, primaria, tokens_descartados=0):
+        with self._lock:
+            stats = self._hedges.get(config.pk)
+            if stats is None:
+                stats = self._hedges[config.pk] = HedgeStats(self.amostras)
+            stats.chamadas += 1
+            stats.hedges += int(disparado)
+            stats.vitorias_hedge += int(venceu_hedge)
+            stats.tokens_descartados += tokens_descartados
+            stats.efetivas.append(efetiva)
+            if primaria is not None:
+                stats.primarias.append(primaria)
+
+    def clear(self):
+        """
+        Descarta as latências, os circuit breakers e as métricas de hedge.
+        """
+        with self._lock:
+            self._latencias.clear()
+            self._primeiro_token.clear()
+            self._hedges.clear()
+            self._breakers.clear()
+
+    def estado(self):
+        """
+        Resumo do estado do roteamento (latências EWMA, circuit breakers e
+        métricas de hedge por configuração).
+        """
+        with self._lock:
+            return {
+                "latencias": dict(self._latencias),
+                "circuitos": {
+                    provedor: {"estado": b.estado, "falhas": b.falhas}
+                    for provedor, b in self._breakers.items()
+                },
+                "hedge": {pk: stats.resumo() for pk, stats in self._hedges.items()},
+            }
+
+
+router = ProviderRouter.from_settings()
@@ -1,6 +1,9 @@
+import json
+
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Categoria, Curso, ConfiguracaoIA, Interacao
+from .batch_jobs import criar_lote, ler_jsonl
+from .models import Categoria, Curso, ConfiguracaoIA, Interacao, ItemLote, Lote, MaterialCurso
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -10,7 +13,7 @@ class UserSerializer(serializers.ModelSerializer):
 class CategoriaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Categoria
-        fields = ['id', 'nome', 'descricao', 'data_criacao']
+        fields = ['id', 'nome', 'descricao', 'chave_externa', 'data_criacao']
 
 class CursoSerializer(serializers.ModelSerializer):
     categoria_nome = serializers.ReadOnlyField(source='categoria.nome')
@@ -20,16 +23,54 @@ class CursoSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'titulo', 'descricao', 'data_publicacao', 
             'data_atualizacao', 'categoria', 'categoria_nome', 
-            'nivel', 'carga_horaria', 'ativo'
+            'nivel', 'carga_horaria', 'ativo', 'orcamento_tokens_diario',
+            'chave_externa'
         ]
 
+class CategoriaSincronizacaoSerializer(serializers.ModelSerializer):
+    """
+    Item da sincronização em massa de categorias (ver catalog_sync.py). A
+    unicidade da chave_externa é resolvida no upsert, sem consulta por item.
+    """
+    class Meta:
+        model = Categoria
+        fields = ['chave_externa', 'nome', 'descricao']
+        extra_kwargs = {
+            'chave_externa': {'required': True, 'allow_null': False, 'allow_blank': False, 'validators': []},
+        }
+
+class CursoSincronizacaoSerializer(serializers.ModelSerializer):
+    """
+    Item da sincronização em massa de cursos. A categoria vem pelo id
+    (`categoria`) ou pela chave externa (`categoria_externa`) e é resolvida
+    para todos os itens de uma vez, sem consulta por item.
+    """
+    categoria = serializers.IntegerField(required=False)
+    categoria_externa = serializers.CharField(max_length=100, required=False)
+    
+    class Meta:
+        model = Curso
+        fields = [
+            'chave_externa', 'titulo', 'descricao', 'categoria', 'categoria_externa',
+            'nivel', 'carga_horaria', 'ativo', 'orcamento_tokens_diario'
+        ]
+        extra_kwargs = {
+            'chave_externa': {'required': True, 'allow_null': False, 'allow_blank': False, 'validators': []},
+        }
+    
+    def validate(self, data):
+        if ('categoria' in data) == ('categoria_externa' in data):
+            raise serializers.ValidationError("Informe a categoria pelo id ('categoria') ou pela chave externa ('categoria_externa').")
+        return data
+
 class ConfiguracaoIASerializer(serializers.ModelSerializer):
     class Meta:
         model = ConfiguracaoIA
         fields = [
             'id', 'nome', 'descricao', 'provedor', 'modelo', 'temperatura', 
-            'max_tokens', 'chave_api', 'ativo', 'data_criacao', 
-            'data_atualizacao'
+            'max_tokens', 'chave_api', 'ativo', 'limite_requisicoes_minuto',
+            'limite_tokens_minuto', 'peso', 'hedge_ativo', 'hedge_percentil',
+            'data_criacao', 'data_atualizacao'
         ]
         extra_kwargs = {
             'chave_api': {'write_only': True}  # Não retorna a chave API nas respostas
@@ -42,13 +83,74 @@ class InteracaoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Interacao
         fields = [
-            'id', 'curso', 'curso_titulo', 'configuracao_ia', 
-            'configuracao_nome', 'pergunta', 'resposta', 
-            'tokens_utilizados', 'data_criacao'
+            'id', 'uuid', 'curso', 'curso_titulo', 'configuracao_ia', 
+            'configuracao_nome', 'conversa', 'pergunta', 'resposta', 
+            'tokens_utilizados', 'tokens_prompt', 'tokens_resposta',
+            'tokens_descartados', 'resultado', 'cache', 'provedor', 'modelo',
+            'latencia_total', 'latencia_provedor', 'latencia_primeiro_token',
+            'data_criacao'
         ]
 
+class MaterialCursoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MaterialCurso
+        fields = ['id', 'curso', 'titulo', 'conteudo', 'data_criacao', 'data_atualizacao']
+
 class PerguntaSerializer(serializers.Serializer):
     curso_id = serializers.IntegerField(required=False)
     configuracao_id = serializers.IntegerField(required=False)
+    conversa_id = serializers.UUIDField(required=False)
     pergunta = serializers.CharField(max_length=2000)
-    contexto = serializers.CharField(max_length=5000, required=False) 
\ No newline at end of file
+    contexto = serializers.CharField(max_length=5000, required=False)
+    stream = serializers.BooleanField(required=False, default=False) 
+class ItemLoteSerializer(serializers.ModelSerializer):
+    resposta = serializers.ReadOnlyField(source='interacao.resposta')
+    
+    class Meta:
+        model = ItemLote
+        fields = ['id', 'request_id', 'curso', 'pergunta', 'contexto', 'status', 'interacao', 'resposta', 'erro']
+
+class LoteSerializer(serializers.ModelSerializer):
+    itens = serializers.ListField(child=serializers.DictField(), write_only=True, required=False)
+    arquivo = serializers.FileField(write_only=True, required=False)
+    
+    class Meta:
+        model = Lote
+        fields = [
+            'id', 'nome', 'curso', 'configuracao_ia', 'concorrencia', 'status',
+            'total', 'concluidos', 'falhas', 'erro', 'itens', 'arquivo',
+            'sinal_vida', 'data_criacao', 'data_atualizacao'
+        ]
+        read_only_fields = ['status', 'total', 'concluidos', 'falhas', 'erro', 'sinal_vida']
+    
+    def validate(self, data):
+        """
+        Converte as perguntas (lista "itens" ou arquivo JSONL) em itens de lote.
+        """
+        arquivo = data.pop('arquivo', None)
+        itens = data.pop('itens', None)
+        if self.instance is not None:
+            return data
+        try:
+            if arquivo is not None:
+                data['itens'] = ler_jsonl(arquivo)
+            elif itens:
+                data['itens'] = ler_jsonl(json.dumps(item) for item in itens)
+            else:
+                raise serializers.ValidationError("Envie as perguntas em 'itens' ou em um arquivo JSONL ('arquivo').")
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        if not data['itens']:
+            raise serializers.ValidationError("Nenhuma pergunta encontrada.")
+        return data
+    
+    def create(self, validated_data):
+        try:
+            return criar_lote(
+                validated_data['nome'], validated_data['curso'], validated_data['itens'],
+                configuracao_ia=validated_data.get('configuracao_ia'),
+                usuario=validated_data.get('usuario'),
+                concorrencia=validated_data.get('concorrencia', 8)
+            )
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog_cache, full_text, retrieval
+from .answer_cache import answer_cache
+from .course_prompt import prefixos
+from .models import Categoria, ConfiguracaoIA, Curso, Interacao, MaterialCurso
+
+
+@receiver([post_save, post_delete], sender=ConfiguracaoIA)
+def invalidar_cliente_llm(sender, instance, **kwargs):
+    """
+    Descarta o cliente LLM em pool quando a configuração muda ou é excluída.
+    """
+    from .langchain_utils import llm_pool
+
+    llm_pool.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Curso)
+def invalidar_indice_similaridade(sender, instance, **kwargs):
+    """
+    Descarta as respostas em cache e o índice de perguntas similares quando
+    o curso muda.
+    """
+    if answer_cache is not None:
+        answer_cache.invalidate_curso(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Curso)
+def invalidar_prefixo_prompt(sender, instance, **kwargs):
+    """
+    Descarta o bloco do curso em cache no prompt quando o curso muda.
+    """
+    prefixos.invalidar(instance.pk)
+
+
+@receiver(post_save, sender=Categoria)
+def invalidar_prefixos_da_categoria(sender, instance, created=False, **kwargs):
+    """
+    O nome da categoria faz parte do bloco de cada curso no prompt.
+    """
+    if not created:
+        for curso_id in instance.cursos.values_list('id', flat=True):
+            prefixos.invalidar(curso_id)
+
+
+@receiver([post_save, post_delete], sender=Curso)
+@receiver([post_save, post_delete], sender=Categoria)
+def invalidar_catalogo(sender, instance, using='default', **kwargs):
+    """
+    Troca a versão do cache HTTP do catálogo. Troca de novo no commit: uma
+    leitura feita antes dele pode ter guardado os dados antigos na versão nova.
+    """
+    catalog_cache.invalidar()
+    transaction.on_commit(catalog_cache.invalidar, using=using)
+
+
+@receiver(post_save, sender=Curso)
+@receiver(post_save, sender=Interacao)
+def indexar_busca(sender, instance, raw=False, using='default', **kwargs):
+    """
+    Mantém o índice de busca textual atualizado a cada save.
+    """
+    if not raw:
+        full_text.indexar([instance], using=using)
+
+
+@receiver(post_delete, sender=Curso)
+@receiver(post_delete, sender=Interacao)
+def desindexar_busca(sender, instance, using='default', **kwargs):
+    """
+    Retira do índice de busca textual os registros excluídos (inclusive os
+    excluídos em cascata ou por queryset.delete()).
+    """
+    full_text.desindexar(sender, [instance.pk], using=using)
+
+
+@receiver(post_save, sender=Categoria)
+def reindexar_cursos_da_categoria(sender, instance, raw=False, created=False, **kwargs):
+    """
+    O nome da categoria faz parte do índice dos cursos.
+    """
+    if not raw and not created:
+        full_text.reindexar(instance.cursos.all())
+
+
+@receiver(post_save, sender=MaterialCurso)
+def indexar_material(sender, instance, raw=False, **kwargs):
+    """
+    Refaz os trechos e embeddings do material a cada save. As respostas
+    exatas em cache têm os trechos na chave; o índice de perguntas similares
+    do curso é descartado.
+    """
+    if not raw:
+        retrieval.indexar_material(instance)
+        if answer_cache is not None:
+            answer_cache.invalidate_curso(instance.curso_id)
+
+
+@receiver(post_delete, sender=MaterialCurso)
+def descartar_material(sender, instance, **kwargs):
+    """
+    Os trechos são excluídos em cascata; falta descartar o índice em memória.
+    """
+    retrieval.indice.invalidar(instance.curso_id)
+    if answer_cache is not None:
+        answer_cache.invalidate_curso(instance.curso_id)
+
+
+@receiver(connection_created)
+def configurar_sqlite(sender, connection, **kwargs):
+    """
+    Aplica SQLITE_PRAGMAS (modo WAL, synchronous etc.) às novas conexões SQLite.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, valor in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {valor}")
@@ -0,0 +1,93 @@
+"""
+Logging estruturado da API: uma linha JSON por registro, com o ID da
+requisição (ver middleware.py) e amostragem dos registros de baixa
+severidade. Configurado em settings.LOGGING.
+
+Os registros usam formatação preguiçosa (logger.debug("... %s", valor)):
+com o nível desativado, a mensagem nunca é montada. Campos extras passados
+em `extra=` saem como chaves do JSON.
+"""
+import contextvars
+import json
+import logging
+import random
+import zlib
+from datetime import datetime, timezone
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+# Atributos de todo LogRecord; os demais vieram de `extra=`
+_ATRIBUTOS_PADRAO = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "request_id"}
+
+
+def definir_request_id(valor):
+    """
+    Associa os registros seguintes do contexto atual (thread ou tarefa) ao
+    ID. Retorna o token para desfazer a associação com limpar_request_id.
+    """
+    return request_id.set(valor)
+
+
+def limpar_request_id(token):
+    """
+    Volta o contexto ao ID que tinha antes de definir_request_id.
+    """
+    request_id.reset(token)
+
+
+def _request_id(record):
+    # O django.request registra as respostas 4xx/5xx depois que o middleware
+    # desfez o ID do contexto, mas passa a requisição no registro
+    return request_id.get() or getattr(getattr(record, "request", None), "request_id", None)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Acrescenta o ID da requisição corrente ao registro (ou "-" fora de requisições).
+    """
+
+    def filter(self, record):
+        record.request_id = _request_id(record) or "-"
+        return True
+
+
+class AmostragemFilter(logging.Filter):
+    """
+    Deixa passar só uma fração (`taxa`) dos registros até `nivel` (por
+    padrão, INFO); avisos e erros passam sempre. A decisão é por requisição:
+    os registros de uma requisição amostrada passam todos.
+    """
+
+    def __init__(self, taxa=1.0, nivel="INFO"):
+        super().__init__()
+        self.taxa = float(taxa)
+        self.nivel = logging.getLevelName(nivel) if isinstance(nivel, str) else nivel
+
+    def filter(self, record):
+        if self.taxa >= 1 or record.levelno > self.nivel:
+            return True
+        rid = _request_id(record)
+        if rid is None:
+            return random.random() < self.taxa
+        return zlib.crc32(rid.encode()) / 2 ** 32 < self.taxa
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formata o registro como um objeto JSON em uma linha.
+    """
+
+    def format(self, record):
+        dados = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None) or _request_id(record),
+        }
+        for chave, valor in record.__dict__.items():
+            if chave not in _ATRIBUTOS_PADRAO:
+                dados[chave] = valor
+        if record.exc_info:
+            dados["exc"] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
@@ -1,3 +1,1966 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from langchain_core.messages import AIMessage
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import (
+    batch_jobs, catalog_cache, full_text, langchain_utils, metrics, rate_limit, retention, retrieval, tokens, views
+)
+from .answer_cache import AnswerCache, MemoryCacheBackend
+from . import conversation_memory
+from .conversation_memory import atualizar_resumo, carregar_historico, obter_conversa
+from .renderers import JSONRapidoRenderer
+from .course_prompt import PROMPT_CURSO, montar_inputs, prefixos
+from .interaction_export import exportar, exportar_async
+from .structured_logging import (
+    AmostragemFilter, JSONFormatter, RequestIdFilter, definir_request_id, limpar_request_id, request_id
+)
+from .langchain_utils import llm_pool, process_question, stream_question
+from .middleware import RequestIdMiddleware
+from .management.commands._fake_provider import FakeProvider
+from .router import CircuitBreaker, ProviderRouter, router
+from .models import (
+    Categoria, ConfiguracaoIA, Conversa, Curso, Interacao, InteracaoArquivada, ItemLote, Lote, MaterialCurso,
+    SegmentoArquivo,
+)
+from .write_behind import InteracaoBuffer
+
+
+@contextmanager
+def provedor_falso(latencia=0, variavel='OPENAI_API_BASE', **kwargs):
+    """
+    Sobe o provedor falso (ver _fake_provider.py) e aponta para ele a URL do
+    provedor em `variavel` (OPENAI_API_BASE ou DEEPSEEK_API_BASE). O pool de
+    clientes é limpo antes, já que as configurações criadas em setUpTestData
+    mantêm o mesmo id entre os testes e o cliente guardado apontaria para o
+    provedor falso de um teste anterior.
+    """
+    with FakeProvider(latencia=latencia, **kwargs) as provedor, \
+            mock.patch.dict(os.environ, {variavel: provedor.base_url}):
+        llm_pool.clear()
+        yield provedor
+
+
+def criar_configuracao(**campos):
+    """
+    Configuração de IA ativa do provedor OpenAI, respondida pelo provedor
+    falso dentro de provedor_falso().
+    """
+    return ConfiguracaoIA.objects.create(**dict(
+        {'nome': 'Fake', 'provedor': 'openai', 'modelo': 'gpt-4o-mini', 'chave_api': 'sk-teste'}, **campos
+    ))
+
+
+class CursoTestCase(TestCase):
+    """
+    Base dos testes sobre um curso: a categoria e o curso são criados uma
+    vez por classe.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nome='Programação')
+        cls.curso = Curso.objects.create(titulo='Python', descricao='d', categoria=cls.categoria, carga_horaria=1)
+
+
+class CursoConfiguradoTestCase(CursoTestCase):
+    """
+    CursoTestCase com uma configuração de IA ativa (ver criar_configuracao).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.config = criar_configuracao()
+
+
+class PoolClientesLLMTestCase(CursoConfiguradoTestCase):
+    """
+    Os clientes LLM são reutilizados entre as perguntas e descartados quando
+    a configuração muda.
+    """
+
+    def setUp(self):
+        llm_pool.clear()
+
+    def test_cliente_reutilizado_entre_perguntas(self):
+        with provedor_falso(), \
+                mock.patch.object(llm_pool, '_factory', wraps=llm_pool._factory) as fabrica:
+            for pergunta in ('Primeira pergunta do pool', 'Segunda pergunta do pool'):
+                self.assertEqual(process_question(self.curso.id, pergunta)['resposta'], 'Resposta do provedor falso.')
+        self.assertEqual(fabrica.call_count, 1)
+        self.assertEqual(len(llm_pool), 1)
+
+    def test_configuracao_alterada_descarta_cliente(self):
+        cliente = llm_pool.get(self.config)
+        self.assertIs(llm_pool.get(self.config), cliente)
+        self.config.temperatura = 0.2
+        self.config.save()
+        self.assertIsNot(llm_pool.get(self.config), cliente)
+        self.config.delete()
+        self.assertEqual(len(llm_pool), 0)
+
+    def test_cliente_por_event_loop(self):
+        async def obter():
+            return llm_pool.get_async(self.config), llm_pool.get_async(self.config)
+
+        primeiro, mesmo_loop = asyncio.run(obter())
+        outro_loop, _ = asyncio.run(obter())
+        self.assertIs(primeiro, mesmo_loop)
+        self.assertIsNot(primeiro, outro_loop)
+
+    def test_cliente_http_fechado_com_o_loop(self):
+        async def obter():
+            return llm_pool.get_async(self.config).http_async_client
+
+        for http_client in (asyncio.run(obter()), async_to_sync(obter)()):
+            self.assertTrue(http_client.is_closed)
+
+
+class PerguntarAsyncTestCase(CursoTestCase):
+    """
+    O endpoint perguntar-async responde pelo caminho assíncrono (ORM
+    assíncrono, cliente LLM do event loop e limite de taxa sem bloqueio).
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.url = f'/api/cursos/{self.curso.id}/perguntar-async/'
+
+    async def _perguntar(self, dados):
+        return await self.async_client.post(self.url, dados, content_type='application/json')
+
+    async def test_resposta_do_provedor(self):
+        await sync_to_async(criar_configuracao)()
+        with provedor_falso():
+            response = await self._perguntar({'pergunta': 'Pergunta pelo endpoint assíncrono'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['resposta'], 'Resposta do provedor falso.')
+        interacao = await Interacao.objects.aget()
+        self.assertEqual((interacao.resultado, interacao.provedor), ('ok', 'openai'))
+        self.assertGreater(interacao.tokens_prompt, 0)
+
+    async def test_requisicoes_invalidas(self):
+        self.assertEqual((await self._perguntar({})).status_code, 400)
+        response = await self.async_client.post(self.url, 'não é JSON', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.post('/api/cursos/999/perguntar-async/', {'pergunta': 'P'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(LIMITE_TAXA={'ESPERA_MAXIMA': 0})
+    async def test_limite_de_taxa(self):
+        await sync_to_async(criar_configuracao)(limite_requisicoes_minuto=1)
+        with provedor_falso():
+            self.assertEqual((await self._perguntar({'pergunta': 'Primeira pergunta'})).status_code, 200)
+            response = await self._perguntar({'pergunta': 'Segunda pergunta'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(await Interacao.objects.acount(), 1)
+
+
+class StreamingSSETestCase(CursoConfiguradoTestCase):
+    """
+    Com stream=true, o endpoint perguntar emite a resposta em eventos
+    Server-Sent Events: "token" com cada trecho e "fim" com a interação.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def _eventos(self, corpo):
+        self.assertTrue(corpo.endswith('\n\n'))
+        eventos = []
+        for quadro in corpo.split('\n\n')[:-1]:
+            evento, dados = quadro.split('\n')
+            self.assertTrue(evento.startswith('event: ') and dados.startswith('data: '))
+            eventos.append((evento[len('event: '):], json.loads(dados[len('data: '):])))
+        return eventos
+
+    def test_formato_dos_eventos(self):
+        self.assertEqual(views._sse_format('token', {'texto': 'função'}),
+                         'event: token\ndata: {"texto": "função"}\n\n')
+
+    def test_stream_sincrono(self):
+        with provedor_falso(resposta='Uma resposta em partes'):
+            response = APIClient().post(f'/api/cursos/{self.curso.id}/perguntar/',
+                                        {'pergunta': 'Pergunta em streaming', 'stream': True}, format='json')
+            corpo = b''.join(response.streaming_content).decode()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual((response['Cache-Control'], response['X-Accel-Buffering']), ('no-cache', 'no'))
+
+        eventos = self._eventos(corpo)
+        tokens = [dados['texto'] for evento, dados in eventos if evento == 'token']
+        self.assertEqual(tokens, ['Uma', ' resposta', ' em', ' partes'])
+        evento, fim = eventos[-1]
+        self.assertEqual(evento, 'fim')
+        self.assertNotIn('resposta', fim)
+        interacao = Interacao.objects.get()
+        self.assertEqual(fim['interacao_uuid'], str(interacao.uuid))
+        self.assertEqual(fim['interacao_id'], interacao.id)
+        self.assertEqual(interacao.resposta, 'Uma resposta em partes')
+
+    async def test_stream_assincrono(self):
+        with provedor_falso(resposta='Uma resposta em partes'):
+            response = await self.async_client.post(
+                f'/api/cursos/{self.curso.id}/perguntar-async/',
+                {'pergunta': 'Pergunta em streaming assíncrono', 'stream': True}, content_type='application/json'
+            )
+            corpo = b''.join([parte async for parte in response.streaming_content]).decode()
+        eventos = self._eventos(corpo)
+        self.assertEqual(''.join(d['texto'] for e, d in eventos if e == 'token'), 'Uma resposta em partes')
+        self.assertEqual(eventos[-1][0], 'fim')
+
+    async def test_stream_sob_asgi(self):
+        # O endpoint síncrono sob ASGI devolve um iterador assíncrono, sem juntar a resposta antes de enviar
+        with provedor_falso(resposta='Uma resposta em partes'):
+            response = await self.async_client.post(
+                f'/api/cursos/{self.curso.id}/perguntar/',
+                {'pergunta': 'Pergunta em streaming sob ASGI', 'stream': True}, content_type='application/json'
+            )
+            self.assertTrue(response.is_async)
+            corpo = b''.join([parte async for parte in response.streaming_content]).decode()
+        eventos = self._eventos(corpo)
+        self.assertEqual(''.join(d['texto'] for e, d in eventos if e == 'token'), 'Uma resposta em partes')
+        self.assertEqual(eventos[-1][0], 'fim')
+
+    def test_stream_de_curso_excluido(self):
+        eventos = list(stream_question(self.curso.id + 100, 'Pergunta sobre um curso excluído'))
+        self.assertEqual(eventos, [('erro', {'error': 'Curso não encontrado.'})])
+
+    async def test_stream_assincrono_de_curso_excluido(self):
+        eventos = [e async for e in langchain_utils.astream_question(self.curso.id + 100, 'Pergunta sobre um curso excluído')]
+        self.assertEqual(eventos, [('erro', {'error': 'Curso não encontrado.'})])
+
+    @override_settings(LIMITE_TAXA={'ESPERA_MAXIMA': 0})
+    def test_stream_recusado_pelo_limite(self):
+        ConfiguracaoIA.objects.filter(id=self.config.id).update(ativo=False)
+        criar_configuracao(nome='Limitada', limite_requisicoes_minuto=1)
+        with provedor_falso():
+            list(stream_question(self.curso.id, 'Primeira pergunta em streaming'))
+            eventos = list(stream_question(self.curso.id, 'Segunda pergunta em streaming'))
+        self.assertEqual(len(eventos), 1)
+        evento, dados = eventos[0]
+        self.assertEqual((evento, dados['status']), ('erro', 429))
+        self.assertEqual(Interacao.objects.count(), 1)
+
+
+class CacheRespostasTestCase(CursoConfiguradoTestCase):
+    """
+    O cache de respostas descarta as respostas de um curso alterado e o
+    índice de similaridade tem tamanho limitado.
+    """
+
+    def setUp(self):
+        self.cache = AnswerCache(MemoryCacheBackend(100, 60), similaridade=True, historico=3)
+
+    def test_alterar_curso_descarta_respostas_exatas(self):
+        self.cache.set(self.curso.id, self.config, 'O que é Python?', 'Uma linguagem.')
+        self.assertEqual(self.cache.get(self.curso.id, self.config, 'o que é python')['cache'], 'exato')
+
+        self.cache.invalidate_curso(self.curso.id)
+        self.assertIsNone(self.cache.backend.get(self.cache.chave(self.curso.id, self.config, 'O que é Python?')))
+        self.cache.set(self.curso.id, self.config, 'O que é Python?', 'Uma linguagem de programação.')
+        self.assertEqual(self.cache.get(self.curso.id, self.config, 'O que é Python?')['resposta'],
+                         'Uma linguagem de programação.')
+
+    def test_indice_de_similaridade_limitado(self):
+        perguntas = ['listas encadeadas python', 'dicionarios aninhados python', 'decoradores funcoes python',
+                     'geradores preguicosos python', 'excecoes personalizadas python']
+        for i, pergunta in enumerate(perguntas):
+            Interacao.objects.create(curso=self.curso, configuracao_ia=self.config, pergunta=pergunta, resposta=f'R{i}',
+                                     sem_contexto=True, data_criacao=timezone.now() - timedelta(minutes=10 - i))
+        indice = self.cache._indice(self.curso.id, self.config)
+        # Só as três mais recentes são carregadas
+        self.assertEqual(len(indice), 3)
+        self.assertIsNone(indice.buscar('listas encadeadas', 0.5))
+
+        for i in range(5):
+            indice.add(f'pergunta nova numero {i}', {'resposta': f'N{i}'})
+        self.assertEqual(len(indice), 3)
+        self.assertIsNone(indice.buscar('excecoes personalizadas python', 0.5))
+        self.assertEqual(indice.buscar('pergunta nova numero 4', 0.9)[1]['resposta'], 'N4')
+        self.assertEqual(set(indice._df), {'pergunta', 'nova', 'numero', '2', '3', '4'})
+
+    def test_indice_so_com_respostas_sem_contexto(self):
+        Interacao.objects.create(curso=self.curso, configuracao_ia=self.config, pergunta='listas encadeadas python',
+                                 resposta='Resposta para o contexto colado por outro aluno')
+        Interacao.objects.create(curso=self.curso, configuracao_ia=self.config, pergunta='decoradores funcoes python',
+                                 resposta='Resposta geral', sem_contexto=True)
+        self.assertIsNone(self.cache.get(self.curso.id, self.config, 'listas encadeadas em python'))
+        self.assertEqual(self.cache.get(self.curso.id, self.config, 'decoradores de funcoes python')['cache'], 'similar')
+        # Com contexto do cliente ou histórico, a similaridade não é usada nem alimentada
+        self.assertIsNone(self.cache.get(self.curso.id, self.config, 'decoradores de funcoes python', 'Histórico',
+                                         sem_contexto=False))
+        self.cache.set(self.curso.id, self.config, 'geradores preguicosos python', 'R', 'Histórico', sem_contexto=False)
+        self.assertEqual(len(self.cache._indice(self.curso.id, self.config)), 1)
+
+
+class ConversaTestCase(CursoTestCase):
+    """
+    A conversa é criada só quando o aluno continua, identificada por uma
+    chave aleatória, e só o dono a continua.
+    """
+
+    def setUp(self):
+        self.url = f'/api/cursos/{self.curso.id}/perguntar/'
+        self.aluno = User.objects.create_user('aluno')
+        self.client = APIClient()
+        self.client.force_authenticate(self.aluno)
+
+    def test_conversa_criada_ao_continuar(self):
+        primeira = self.client.post(self.url, {'pergunta': 'O que é uma função?'}, format='json').data
+        self.assertEqual(primeira['conversa_id'], primeira['interacao_uuid'])
+        self.assertFalse(Conversa.objects.exists())
+
+        segunda = self.client.post(
+            self.url, {'pergunta': 'E um loop?', 'conversa_id': primeira['conversa_id']}, format='json'
+        ).data
+        terceira = self.client.post(
+            self.url, {'pergunta': 'E uma classe?', 'conversa_id': segunda['conversa_id']}, format='json'
+        ).data
+        conversa = Conversa.objects.get()
+        self.assertEqual(str(conversa.chave), primeira['conversa_id'])
+        self.assertEqual(terceira['conversa_id'], primeira['conversa_id'])
+        self.assertEqual(conversa.usuario, self.aluno)
+        self.assertEqual(conversa.interacoes.count(), 3)
+        self.assertIn('O que é uma função?', carregar_historico(conversa))
+
+    def test_conversa_de_outro_usuario(self):
+        chave = self.client.post(self.url, {'pergunta': 'O que é uma função?'}, format='json').data['conversa_id']
+        self.client.post(self.url, {'pergunta': 'E um loop?', 'conversa_id': chave}, format='json')
+
+        outro = APIClient()
+        outro.force_authenticate(User.objects.create_user('outro'))
+        for cliente in (outro, APIClient()):
+            response = cliente.post(self.url, {'pergunta': 'Qual o resumo?', 'conversa_id': chave}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['error'], 'Conversa não encontrada.')
+        self.assertEqual(Conversa.objects.get().interacoes.count(), 2)
+
+        # Chaves que não abriram nenhuma conversa, ou de outro curso, não são encontradas
+        response = self.client.post(self.url, {'pergunta': 'P', 'conversa_id': str(uuid.uuid4())}, format='json')
+        self.assertEqual(response.status_code, 400)
+        outro_curso = Curso.objects.create(titulo='Java', descricao='d', categoria=self.curso.categoria, carga_horaria=1)
+        response = self.client.post(
+            f'/api/cursos/{outro_curso.id}/perguntar/', {'pergunta': 'P', 'conversa_id': chave}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(HISTORICO_CONVERSA={'JANELA': 1, 'RESUMO_LLM': True})
+    def test_resumo_llm_fora_da_requisicao(self):
+        conversa = Conversa.objects.create(curso=self.curso)
+        for pergunta in ('O que é uma função?', 'E um loop?'):
+            conversa.interacoes.create(curso=self.curso, pergunta=pergunta, resposta='R')
+        llm = mock.Mock()
+        llm.invoke.return_value = AIMessage(content='O aluno perguntou sobre funções.')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            conversation_memory.agendar_resumo(conversa, llm)
+            # Um segundo turno enquanto o primeiro resumo está pendente não agenda outro
+            conversation_memory.agendar_resumo(conversa, llm)
+        llm.invoke.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+
+        with mock.patch.object(conversation_memory, '_executor') as executor:
+            executor.submit.side_effect = lambda funcao, *args: funcao(*args)
+            callbacks[0]()
+        conversa.refresh_from_db()
+        self.assertEqual((conversa.resumo, conversa.interacoes_resumidas), ('O aluno perguntou sobre funções.', 1))
+
+    @override_settings(HISTORICO_CONVERSA={'JANELA': 1})
+    def test_resumo_de_turnos_simultaneos(self):
+        conversa = Conversa.objects.create(curso=self.curso)
+        for pergunta in ('O que é uma função?', 'E um loop?'):
+            conversa.interacoes.create(curso=self.curso, pergunta=pergunta, resposta='R')
+        # Dois turnos com a mesma conversa carregada antes de qualquer resumo
+        atualizar_resumo(Conversa.objects.get(id=conversa.id))
+        atualizar_resumo(conversa)
+        conversa.refresh_from_db()
+        self.assertEqual(conversa.resumo, 'Perguntas anteriores do aluno: O que é uma função?')
+        self.assertEqual(conversa.interacoes_resumidas, 1)
+
+        # Um resumo calculado sobre valores já desatualizados não é gravado
+        conversa.interacoes.create(curso=self.curso, pergunta='E uma classe?', resposta='R')
+        with mock.patch.object(Conversa.objects, 'filter', wraps=Conversa.objects.filter) as filtro:
+            def concorrente(*args, **kwargs):
+                if 'interacoes_resumidas' in kwargs:
+                    Conversa.objects.all().update(interacoes_resumidas=2, resumo='Outro turno')
+                return Conversa.objects.all().filter(*args, **kwargs)
+            filtro.side_effect = concorrente
+            atualizar_resumo(conversa)
+        conversa.refresh_from_db()
+        self.assertEqual((conversa.resumo, conversa.interacoes_resumidas), ('Outro turno', 2))
+
+    def test_conversa_anonima(self):
+        anonimo = APIClient()
+        chave = anonimo.post(self.url, {'pergunta': 'O que é uma função?'}, format='json').data['conversa_id']
+        response = anonimo.post(self.url, {'pergunta': 'E um loop?', 'conversa_id': chave}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(Conversa.objects.get().usuario)
+
+
+class ContagemTokensTestCase(TestCase):
+    """
+    A contagem local de tokens usa o tokenizador do modelo, carregado na
+    inicialização; sem vocabulário, cai para a estimativa em português sem
+    tentar carregá-lo de novo a cada interação.
+    """
+
+    def setUp(self):
+        tokens.get_encoder.cache_clear()
+        self.addCleanup(tokens.get_encoder.cache_clear)
+        indisponiveis = set(tokens._indisponiveis)
+        self.addCleanup(lambda: tokens._indisponiveis.clear() or tokens._indisponiveis.update(indisponiveis))
+
+    def test_estimativa_sem_tokenizador(self):
+        with mock.patch.object(tokens, 'get_encoder', return_value=None):
+            # "Olá" (1) "," (1) "mundo" (2) "!" (1)
+            self.assertEqual(tokens.contar_tokens('Olá, mundo!', 'gpt-4o-mini'), 5)
+            self.assertEqual(tokens.contar_tokens('', 'gpt-4o-mini'), 0)
+
+    def test_contagem_com_tokenizador(self):
+        encoder = mock.Mock()
+        encoder.encode.side_effect = lambda texto, disallowed_special: texto.split()
+        with mock.patch.object(tokens, 'get_encoder', return_value=encoder):
+            self.assertEqual(tokens.contar_tokens('um dois três <|endoftext|>', 'gpt-4o-mini'), 4)
+        encoder.encode.assert_called_once_with('um dois três <|endoftext|>', disallowed_special=())
+
+    def test_codificacao_do_modelo(self):
+        with mock.patch.object(tokens.tiktoken, 'get_encoding', side_effect=lambda nome: nome) as get_encoding:
+            self.assertEqual(tokens.get_encoder('gpt-4o-mini'), 'o200k_base')
+            # Modelos desconhecidos do tiktoken (ex.: DeepSeek) usam a codificação padrão
+            self.assertEqual(tokens.get_encoder('deepseek-chat'), tokens.CODIFICACAO_PADRAO)
+            tokens.get_encoder('gpt-4o-mini')
+        self.assertEqual(get_encoding.call_count, 2)
+
+    def test_falha_na_carga_nao_se_repete(self):
+        with mock.patch.object(tokens.tiktoken, 'get_encoding', side_effect=OSError('sem rede')) as get_encoding:
+            self.assertEqual(tokens.carregar_tokenizadores(), {'o200k_base': False, 'cl100k_base': False})
+            # Nas interações, as codificações que falharam na inicialização não são tentadas de novo
+            self.assertIsNone(tokens.get_encoder('gpt-4o-mini'))
+            self.assertIsNone(tokens.get_encoder('deepseek-chat'))
+            self.assertEqual(tokens.contar_tokens('Olá, mundo!', 'gpt-4o-mini'), 5)
+        self.assertEqual(get_encoding.call_count, 2)
+
+    @override_settings(CONTAGEM_TOKENS={'DIRETORIO_CACHE': '/opt/tiktoken', 'CODIFICACOES': ('cl100k_base',)})
+    def test_carga_na_inicializacao(self):
+        with mock.patch.dict(os.environ), mock.patch.object(tokens.tiktoken, 'get_encoding') as get_encoding:
+            os.environ.pop('TIKTOKEN_CACHE_DIR', None)
+            self.assertEqual(tokens.carregar_tokenizadores(), {'cl100k_base': True})
+            self.assertEqual(os.environ['TIKTOKEN_CACHE_DIR'], '/opt/tiktoken')
+        get_encoding.assert_called_once_with('cl100k_base')
+
+    @override_settings(CONTAGEM_TOKENS={'CODIFICACOES': ('cl100k_base',)})
+    def test_inicializacao_nao_baixa_vocabularios(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio, True)
+        with mock.patch.dict(os.environ, {'TIKTOKEN_CACHE_DIR': diretorio}), \
+                mock.patch.dict(tokens.tiktoken.registry.ENCODINGS, clear=True), \
+                mock.patch.object(tokens.tiktoken_load, 'read_file', side_effect=OSError('sem rede')) as read_file:
+            self.assertEqual(tokens.carregar_tokenizadores(), {'cl100k_base': False})
+            self.assertIsNone(tokens.get_encoder('gpt-4'))
+            read_file.assert_not_called()
+
+            # O comando baixar_tokenizadores é o único que acessa a rede
+            self.assertEqual(tokens.carregar_tokenizadores(baixar=True), {'cl100k_base': False})
+            read_file.assert_called_once()
+
+    def test_uso_informado_pelo_provedor(self):
+        mensagem = AIMessage(content='Resposta', usage_metadata={
+            'input_tokens': 12, 'output_tokens': 30, 'total_tokens': 42
+        })
+        self.assertEqual(tokens.uso_da_mensagem(mensagem), (12, 30))
+        self.assertIsNone(tokens.uso_da_mensagem(AIMessage(content='Resposta')))
+
+
+class LimiteTaxaTestCase(CursoTestCase):
+    """
+    Os limites de taxa das configurações e os orçamentos diários recusam as
+    perguntas acima da capacidade com 429, e as reservas são ajustadas ao
+    consumo real depois da chamada.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.url = f'/api/cursos/{self.curso.id}/perguntar/'
+
+    def _config(self, **campos):
+        return criar_configuracao(max_tokens=500, **campos)
+
+    def _perguntar(self, pergunta):
+        return APIClient().post(self.url, {'pergunta': pergunta}, format='json')
+
+    @override_settings(LIMITE_TAXA={'ESPERA_MAXIMA': 0})
+    def test_limite_de_requisicoes(self):
+        self._config(limite_requisicoes_minuto=1)
+        with provedor_falso():
+            self.assertEqual(self._perguntar('Primeira pergunta').status_code, 200)
+            response = self._perguntar('Segunda pergunta')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(Interacao.objects.count(), 1)
+
+    @override_settings(LIMITE_TAXA={'ESPERA_TRAVA': 0.05})
+    def test_trava_ocupada_recusa(self):
+        config = self._config(limite_requisicoes_minuto=10)
+        caches['default'].add(f'limite:config:{config.pk}:lock', 1)
+        with self.assertRaises(rate_limit.LimiteExcedido):
+            rate_limit.reservar(config, 10)
+        self.assertEqual(self._perguntar('Pergunta com a trava ocupada').status_code, 429)
+
+    def test_reserva_de_orcamento_atomica(self):
+        self.curso.orcamento_tokens_diario = 1000
+        chaves = rate_limit.reservar_orcamento(self.curso, None, 600)
+        with self.assertRaises(rate_limit.OrcamentoExcedido):
+            rate_limit.reservar_orcamento(self.curso, None, 600)
+        self.assertEqual(caches['default'].get(chaves[0]), 600)
+        rate_limit.ajustar_orcamento(chaves, -400)
+        self.assertEqual(caches['default'].get(chaves[0]), 200)
+
+    def test_reserva_ajustada_ao_consumo(self):
+        config = self._config(limite_tokens_minuto=2000)
+        Curso.objects.filter(id=self.curso.id).update(orcamento_tokens_diario=5000)
+        with provedor_falso():
+            self.assertEqual(self._perguntar('Pergunta sobre orçamento').status_code, 200)
+            interacao = Interacao.objects.get()
+            usados = interacao.tokens_prompt + interacao.tokens_resposta
+            # O orçamento e o bucket ficam com o consumo real, não com o prompt mais o max_tokens
+            self.assertEqual(caches['default'].get(rate_limit._chave_orcamento('curso', self.curso.id)), usados)
+            self.assertGreaterEqual(caches['default'].get(f'limite:config:{config.pk}')['tokens'], 2000 - usados)
+
+            # Sem orçamento para a reserva, a pergunta é recusada e nada é descontado
+            Curso.objects.filter(id=self.curso.id).update(orcamento_tokens_diario=usados + 100)
+            response = self._perguntar('Outra pergunta sobre orçamento')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(caches['default'].get(rate_limit._chave_orcamento('curso', self.curso.id)), usados)
+
+
+class RoteamentoTestCase(CursoTestCase):
+    """
+    As perguntas passam para a próxima configuração quando o provedor falha,
+    e as latências recentes (EWMA) pesam na ordem das configurações.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.openai = criar_configuracao(nome='OpenAI')
+        cls.deepseek = criar_configuracao(nome='DeepSeek', provedor='deepseek', modelo='deepseek-chat')
+
+    def setUp(self):
+        router.clear()
+
+    def _perguntar(self, status_openai, pergunta):
+        with provedor_falso(status=status_openai) as falho, \
+                provedor_falso(resposta='Resposta do DeepSeek.', variavel='DEEPSEEK_API_BASE'):
+            resultado = process_question(self.curso.id, pergunta, configuracao_id=self.openai.id)
+        return resultado, falho.server.chamadas
+
+    def test_erro_transitorio_passa_para_a_proxima(self):
+        resultado, chamadas = self._perguntar(500, 'Pergunta com o provedor fora do ar')
+        self.assertEqual(resultado['resposta'], 'Resposta do DeepSeek.')
+        self.assertEqual(Interacao.objects.get().provedor, 'deepseek')
+        self.assertEqual(chamadas, 1)
+        self.assertEqual(router.estado()['circuitos']['openai']['falhas'], 1)
+
+    def test_erro_permanente_passa_para_a_proxima(self):
+        # Uma credencial inválida não cai na resposta simulada nem conta no circuit breaker
+        resultado, chamadas = self._perguntar(401, 'Pergunta com credencial inválida')
+        self.assertEqual(resultado['resposta'], 'Resposta do DeepSeek.')
+        self.assertEqual(Interacao.objects.get().resultado, 'ok')
+        self.assertEqual(chamadas, 1)
+        self.assertEqual(router.estado()['circuitos']['openai']['falhas'], 0)
+
+    def test_circuit_breaker_abre_e_meio_abre(self):
+        with provedor_falso(status=500) as falho, provedor_falso(variavel='DEEPSEEK_API_BASE'), \
+                mock.patch.object(router, 'falhas_para_abrir', 2), mock.patch.object(router, 'segundos_aberto', 0.2):
+            for i in range(2):
+                process_question(self.curso.id, f'Pergunta {i}', configuracao_id=self.openai.id)
+            self.assertEqual(router.estado()['circuitos']['openai']['estado'], 'aberto')
+
+            # Com o circuito aberto, o provedor não é chamado
+            process_question(self.curso.id, 'Pergunta com o circuito aberto', configuracao_id=self.openai.id)
+            self.assertEqual(falho.server.chamadas, 2)
+
+            # Passada a espera, uma requisição de teste passa e, com sucesso, fecha o circuito
+            time.sleep(0.25)
+            self.assertEqual(router.estado()['circuitos']['openai']['estado'], 'meio-aberto')
+            falho.server.status = 200
+            process_question(self.curso.id, 'Pergunta de teste do circuito', configuracao_id=self.openai.id)
+        self.assertEqual(falho.server.chamadas, 3)
+        self.assertEqual(router.estado()['circuitos']['openai']['estado'], 'fechado')
+        self.assertEqual(list(Interacao.objects.order_by('id').values_list('provedor', flat=True)),
+                         ['deepseek', 'deepseek', 'deepseek', 'openai'])
+
+    def test_meio_aberto_deixa_passar_uma_requisicao(self):
+        breaker = CircuitBreaker(falhas_para_abrir=1, segundos_aberto=0.05)
+        breaker.falha()
+        self.assertFalse(breaker.permite())
+        time.sleep(0.06)
+        self.assertTrue(breaker.permite())
+        self.assertFalse(breaker.permite())
+        # A requisição de teste falhou: o circuito volta a abrir
+        breaker.falha()
+        self.assertEqual(breaker.estado, 'aberto')
+
+    def test_ultima_tentativa_possivel_aguarda_o_limite(self):
+        # Com o circuito do DeepSeek aberto, a tentativa na OpenAI é a última e aguarda na fila
+        with override_settings(ROTEAMENTO={'TENTATIVAS': 2}):
+            plano = ProviderRouter.from_settings().plano([self.openai, self.deepseek])
+        self.assertFalse(langchain_utils._esperar(plano, 0, set()))
+        for _ in range(router.falhas_para_abrir):
+            router.registrar_falha(self.deepseek, TimeoutError())
+        self.assertTrue(langchain_utils._esperar(plano, 0, set()))
+        self.assertTrue(langchain_utils._esperar([self.openai, self.openai], 0, {self.openai.pk}))
+
+    def test_ewma_e_ordem(self):
+        router.registrar_sucesso(self.openai, 1.0)
+        router.registrar_sucesso(self.openai, 2.0)
+        self.assertAlmostEqual(router.latencia(self.openai), 0.2 * 2.0 + 0.8 * 1.0)
+
+        router.registrar_sucesso(self.deepseek, 0.01)
+        primeiras = [router.ordenar([self.openai, self.deepseek])[0] for _ in range(100)]
+        self.assertGreater(primeiras.count(self.deepseek), 90)
+        # A configuração solicitada vem sempre primeiro
+        self.assertEqual(router.ordenar([self.openai, self.deepseek], self.openai.pk)[0], self.openai)
+
+
+@override_settings(ROTEAMENTO={'HEDGE_AMOSTRAGEM': 0})
+class HedgeTestCase(CursoTestCase):
+    """
+    Com hedge ativo, a pergunta também vai para outra configuração se o
+    primeiro token não chegar dentro do atraso; a chamada perdedora é
+    cancelada e os tokens dela ficam como descartados.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.openai = criar_configuracao(nome='OpenAI', hedge_ativo=True)
+        criar_configuracao(nome='DeepSeek', provedor='deepseek', modelo='deepseek-chat')
+
+    def setUp(self):
+        router.clear()
+
+    def _perguntar(self, latencia_openai, pergunta, latencia_deepseek=0):
+        with provedor_falso(latencia_openai, resposta='Resposta da OpenAI.'), \
+                provedor_falso(latencia_deepseek, resposta='Resposta do DeepSeek.',
+                               variavel='DEEPSEEK_API_BASE') as alternativo, \
+                mock.patch.object(router, 'hedge_atraso_padrao', 0.2):
+            inicio = time.monotonic()
+            resultado = process_question(self.curso.id, pergunta, configuracao_id=self.openai.id)
+            return resultado, time.monotonic() - inicio, alternativo.server.chamadas
+
+    def test_hedge_disparado_apos_o_atraso(self):
+        resultado, duracao, chamadas = self._perguntar(3, 'Pergunta com o provedor lento')
+        self.assertEqual(resultado['resposta'], 'Resposta do DeepSeek.')
+        # A chamada original (3s) foi cancelada em vez de aguardada
+        self.assertLess(duracao, 2)
+        self.assertEqual(chamadas, 1)
+        interacao = Interacao.objects.get()
+        self.assertEqual(interacao.provedor, 'deepseek')
+        self.assertGreater(interacao.tokens_descartados, 0)
+        hedge = router.estado()['hedge'][self.openai.pk]
+        self.assertEqual((hedge['chamadas'], hedge['hedges'], hedge['vitorias_hedge']), (1, 1, 1))
+        self.assertEqual(hedge['tokens_descartados'], interacao.tokens_descartados)
+
+    def test_sem_hedge_quando_o_primeiro_token_chega_a_tempo(self):
+        resultado, _, chamadas = self._perguntar(0, 'Pergunta com o provedor rápido')
+        self.assertEqual(resultado['resposta'], 'Resposta da OpenAI.')
+        self.assertEqual(chamadas, 0)
+        self.assertEqual(Interacao.objects.get().tokens_descartados, 0)
+        self.assertEqual(router.estado()['hedge'][self.openai.pk]['hedges'], 0)
+
+    def test_primario_vence_depois_do_hedge(self):
+        resultado, _, _ = self._perguntar(0.5, 'Pergunta com o hedge mais lento', latencia_deepseek=2)
+        self.assertEqual(resultado['resposta'], 'Resposta da OpenAI.')
+        interacao = Interacao.objects.get()
+        self.assertEqual(interacao.provedor, 'openai')
+        # O prompt enviado ao hedge cancelado também conta como descartado
+        self.assertGreater(interacao.tokens_descartados, 0)
+        hedge = router.estado()['hedge'][self.openai.pk]
+        self.assertEqual((hedge['chamadas'], hedge['hedges'], hedge['vitorias_hedge']), (1, 1, 0))
+        self.assertEqual(hedge['tokens_descartados'], interacao.tokens_descartados)
+
+
+class LoteTestCase(CursoConfiguradoTestCase):
+    """
+    Os itens do lote são respondidos pelo provedor; os recusados pelo limite
+    de taxa são repetidos um número limitado de vezes e os lotes abandonados
+    no meio do processamento podem ser retomados.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.lote = batch_jobs.criar_lote('FAQ', self.curso, batch_jobs.ler_jsonl([
+            '{"request_id": "a", "pergunta": "O que é uma função?"}',
+            '{"request_id": "b", "pergunta": "O que é um loop?"}',
+        ]))
+
+    def test_itens_respondidos(self):
+        with provedor_falso():
+            async_to_sync(batch_jobs.aprocessar_lote)(self.lote.id)
+        self.lote.refresh_from_db()
+        self.assertEqual((self.lote.status, self.lote.concluidos, self.lote.falhas), ('concluido', 2, 0))
+        self.assertEqual(
+            list(self.lote.itens.values_list('status', 'interacao__resposta')),
+            [('concluido', 'Resposta do provedor falso.')] * 2
+        )
+
+    def test_limite_de_taxa_com_tentativas_limitadas(self):
+        recusa = rate_limit.LimiteExcedido('Limite atingido.', retry_after=0.01)
+        with mock.patch('api.batch_jobs.agerar_resposta', side_effect=recusa) as gerar:
+            async_to_sync(batch_jobs.aprocessar_lote)(self.lote.id, concorrencia=1)
+        self.assertEqual(gerar.call_count, 2 * batch_jobs.TENTATIVAS_LIMITE)
+        self.lote.refresh_from_db()
+        self.assertEqual((self.lote.status, self.lote.concluidos, self.lote.falhas), ('concluido', 0, 2))
+        self.assertIn('Limite de taxa excedido', self.lote.itens.first().erro)
+
+        # Os itens com erro são repetidos com repetir_erros
+        with provedor_falso():
+            async_to_sync(batch_jobs.aprocessar_lote)(self.lote.id, repetir_erros=True)
+        self.lote.refresh_from_db()
+        self.assertEqual((self.lote.concluidos, self.lote.falhas), (2, 0))
+
+    def test_erro_ao_gravar_marca_o_lote(self):
+        with provedor_falso(), \
+                mock.patch('api.batch_jobs._gravar_bloco', side_effect=OperationalError('disk I/O error')):
+            async_to_sync(batch_jobs.aprocessar_lote)(self.lote.id, tamanho_bloco=1)
+        self.lote.refresh_from_db()
+        self.assertEqual((self.lote.status, self.lote.erro), ('erro', 'disk I/O error'))
+        self.assertEqual(self.lote.itens.filter(status='pendente').count(), 2)
+
+    def test_comando_nao_processa_lote_em_andamento(self):
+        Lote.objects.filter(id=self.lote.id).update(status='processando', sinal_vida=timezone.now())
+        with mock.patch('api.management.commands.processar_lote.processar_lote') as processar:
+            with self.assertRaisesMessage(CommandError, 'em outro processo'):
+                call_command('processar_lote', lote=self.lote.id, stdout=io.StringIO())
+            processar.assert_not_called()
+
+            Lote.objects.filter(id=self.lote.id).update(
+                sinal_vida=timezone.now() - timedelta(seconds=batch_jobs.LOTE_ABANDONADO + 1)
+            )
+            call_command('processar_lote', lote=self.lote.id, stdout=io.StringIO())
+        processar.assert_called_once_with(self.lote.id, repetir_erros=False)
+
+    def test_lote_abandonado_retomado(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('analista'))
+        url = f'/api/lotes/{self.lote.id}/processar/'
+        Lote.objects.filter(id=self.lote.id).update(status='processando', sinal_vida=timezone.now())
+        with mock.patch('api.batch_jobs.threading.Thread') as thread:
+            self.assertEqual(client.post(url).status_code, 409)
+            Lote.objects.filter(id=self.lote.id).update(
+                sinal_vida=timezone.now() - timedelta(seconds=batch_jobs.LOTE_ABANDONADO + 1)
+            )
+            response = client.post(url)
+        self.assertEqual(response.status_code, 202)
+        thread.return_value.start.assert_called_once()
+        self.lote.refresh_from_db()
+        self.assertGreater(self.lote.sinal_vida, timezone.now() - timedelta(seconds=5))
+
+
+class QueryCountTestCase(TestCase):
+    """
+    Os endpoints de listagem e detalhe devem executar um número constante de
+    consultas, qualquer que seja o número de linhas na página.
+    """
+
+    # Linhas criadas por cenário: mais que uma página (PAGE_SIZE = 10)
+    LINHAS = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('admin', password='senha')
+        cls.categoria = Categoria.objects.create(nome='Programação')
+        cls.config = ConfiguracaoIA.objects.create(nome='Config', chave_api='sk-teste')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def criar_linhas(self, inicio, fim):
+        for i in range(inicio, fim):
+            categoria = Categoria.objects.create(nome=f'Categoria {i}')
+            curso = Curso.objects.create(
+                titulo=f'Curso {i}', descricao='Descrição', categoria=categoria, carga_horaria=10
+            )
+            config = ConfiguracaoIA.objects.create(nome=f'Config {i}', chave_api='sk-teste')
+            conversa = Conversa.objects.create(curso=curso, usuario=self.usuario)
+            interacao = Interacao.objects.create(
+                curso=curso, configuracao_ia=config, conversa=conversa,
+                pergunta=f'Pergunta {i}', resposta='Resposta'
+            )
+            lote = Lote.objects.create(nome=f'Lote {i}', curso=curso, configuracao_ia=config, usuario=self.usuario)
+            ItemLote.objects.create(
+                lote=self.lote(), request_id=str(i), curso=curso, pergunta=f'Pergunta {i}', interacao=interacao
+            )
+            User.objects.create_user(f'usuario{i}')
+
+    def lote(self):
+        if not hasattr(self, '_lote'):
+            curso = Curso.objects.create(
+                titulo='Curso do lote', descricao='Descrição', categoria=self.categoria, carga_horaria=10
+            )
+            self._lote = Lote.objects.create(nome='Lote', curso=curso)
+        return self._lote
+
+    def contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(consultas)
+
+    def assertConsultasConstantes(self, url, esperado):
+        """
+        Mede as consultas com uma linha e com a página cheia: os números
+        devem ser iguais e iguais ao esperado.
+        """
+        self.criar_linhas(0, 1)
+        poucas = self.contar_consultas(url)
+        self.criar_linhas(1, self.LINHAS)
+        muitas = self.contar_consultas(url)
+        self.assertEqual(poucas, muitas, f"{url}: {poucas} consultas com 1 linha, {muitas} com a página cheia")
+        self.assertEqual(muitas, esperado, f"{url}: {muitas} consultas, esperado {esperado}")
+
+    # Listagens: contagem da paginação + página (com cursor, só a página)
+
+    def test_lista_categorias(self):
+        self.assertConsultasConstantes('/api/categorias/', 2)
+
+    def test_lista_cursos(self):
+        self.assertConsultasConstantes('/api/cursos/', 1)
+
+    def test_lista_cursos_filtrada(self):
+        self.assertConsultasConstantes('/api/cursos/?nivel=B&ativo=true&search=Curso&ordering=titulo', 1)
+
+    def test_lista_configuracoes(self):
+        self.assertConsultasConstantes('/api/configuracoes-ia/', 2)
+
+    def test_lista_interacoes(self):
+        self.assertConsultasConstantes('/api/interacoes/', 1)
+
+    def test_lista_interacoes_por_curso(self):
+        curso = Curso.objects.create(titulo='Filtro', descricao='d', categoria=self.categoria, carga_horaria=1)
+        Interacao.objects.bulk_create([
+            Interacao(curso=curso, configuracao_ia=self.config, pergunta=f'P{i}', resposta='R')
+            for i in range(self.LINHAS)
+        ])
+        self.assertConsultasConstantes(f'/api/interacoes/?curso={curso.id}', 1)
+
+    def test_lista_lotes(self):
+        self.assertConsultasConstantes('/api/lotes/', 2)
+
+    def test_itens_do_lote(self):
+        # Lote + contagem da paginação + página
+        self.assertConsultasConstantes(f'/api/lotes/{self.lote().id}/itens/', 3)
+
+    def test_lista_usuarios(self):
+        self.assertConsultasConstantes('/api/usuarios/', 2)
+
+    # Detalhes: uma consulta
+
+    def test_detalhe_curso(self):
+        self.criar_linhas(0, 1)
+        curso = Curso.objects.first()
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/cursos/{curso.id}/')
+
+    def test_detalhe_interacao(self):
+        self.criar_linhas(0, 1)
+        interacao = Interacao.objects.first()
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/interacoes/{interacao.id}/')
+
+    def test_detalhe_categoria(self):
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/categorias/{self.categoria.id}/')
+
+    def test_detalhe_configuracao(self):
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/configuracoes-ia/{self.config.id}/')
+
+    def test_detalhe_lote(self):
+        lote = self.lote()
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/lotes/{lote.id}/')
+
+
+class CursorPaginationTestCase(CursoTestCase):
+    """
+    A paginação por cursor percorre todas as linhas sem repetir nem pular e,
+    com datas distintas, não usa OFFSET (com datas iguais, o DRF desempata
+    com um OFFSET limitado às linhas empatadas).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.usuario = User.objects.create_user('admin')
+        Interacao.objects.bulk_create([
+            Interacao(curso=cls.curso, pergunta=f'P{i}', resposta='R') for i in range(25)
+        ])
+        cls.esperado = list(Interacao.objects.values_list('id', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def percorrer(self, url, sem_offset=True):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as consultas:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            if sem_offset:
+                self.assertFalse(any('OFFSET' in q['sql'] for q in consultas), consultas.captured_queries)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_percorre_todas_as_interacoes(self):
+        self.assertEqual(self.percorrer('/api/interacoes/'), self.esperado)
+
+    def test_percorre_interacoes_do_curso(self):
+        self.assertEqual(self.percorrer(f'/api/interacoes/?curso={self.curso.id}'), self.esperado)
+
+    def test_datas_iguais(self):
+        Interacao.objects.update(data_criacao=Interacao.objects.first().data_criacao)
+        ids = self.percorrer('/api/interacoes/', sem_offset=False)
+        self.assertEqual(sorted(ids), sorted(self.esperado))
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+class BuscaTextualTestCase(TestCase):
+    """
+    A busca de interações e cursos usa o índice textual: flexões da mesma
+    palavra casam, os resultados vêm por relevância e o índice acompanha
+    as alterações.
+    """
+
+    def setUp(self):
+        usuario = User.objects.create_user('admin')
+        self.client = APIClient()
+        self.client.force_authenticate(usuario)
+        self.categoria = Categoria.objects.create(nome='Programação')
+        self.python = Curso.objects.create(
+            titulo='Python para iniciantes', descricao='Funções e decoradores', categoria=self.categoria,
+            carga_horaria=10
+        )
+        self.web = Curso.objects.create(
+            titulo='Desenvolvimento web', descricao='HTML e CSS', categoria=self.categoria, carga_horaria=10
+        )
+        self.titulo = Interacao.objects.create(
+            curso=self.web, pergunta='Como usar decoradores?', resposta='Envolvendo a função.'
+        )
+        self.resposta = Interacao.objects.create(
+            curso=self.web, pergunta='O que é CSS?', resposta='Folhas de estilo; decoradores não se aplicam.'
+        )
+        self.outra = Interacao.objects.create(curso=self.web, pergunta='O que é HTML?', resposta='Marcação.')
+
+    def ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_flexoes_e_relevancia(self):
+        # "decorador" casa com "decoradores"; o termo na pergunta pesa mais que na resposta
+        self.assertEqual(self.ids('/api/interacoes/?search=decorador'), [self.titulo.id, self.resposta.id])
+
+    def test_todos_os_termos(self):
+        self.assertEqual(self.ids('/api/interacoes/?search=decoradores estilo'), [self.resposta.id])
+
+    def test_titulo_do_curso(self):
+        self.assertEqual(
+            sorted(self.ids('/api/interacoes/?search=desenvolvimento')),
+            sorted([self.titulo.id, self.resposta.id, self.outra.id])
+        )
+
+    def test_ordenacao_explicita(self):
+        self.assertEqual(
+            self.ids('/api/interacoes/?search=decorador&ordering=data_criacao'), [self.titulo.id, self.resposta.id]
+        )
+        self.assertEqual(
+            self.ids('/api/interacoes/?search=decorador&ordering=-data_criacao'), [self.resposta.id, self.titulo.id]
+        )
+
+    def test_cursos(self):
+        self.assertEqual(self.ids('/api/cursos/?search=funcao'), [self.python.id])
+        self.assertEqual(sorted(self.ids('/api/cursos/?search=programar')), sorted([self.python.id, self.web.id]))
+
+    def test_indice_acompanha_alteracoes(self):
+        self.web.titulo = 'Front-end'
+        self.web.save()
+        self.assertEqual(self.ids('/api/cursos/?search=desenvolvimento'), [])
+        self.categoria.nome = 'Design'
+        self.categoria.save()
+        self.assertEqual(sorted(self.ids('/api/cursos/?search=design')), sorted([self.python.id, self.web.id]))
+
+    def test_exclusao_sai_do_indice(self):
+        def linhas(tabela):
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COUNT(*) FROM {tabela}")
+                return cursor.fetchone()[0]
+
+        self.titulo.delete()
+        self.assertEqual(self.ids('/api/interacoes/?search=decorador'), [self.resposta.id])
+        self.assertEqual(linhas('api_interacao_busca'), 2)
+
+        # As interações do curso saem do índice junto com ele (cascata)
+        self.web.delete()
+        self.assertEqual(self.ids('/api/cursos/?search=desenvolvimento'), [])
+        self.assertEqual(linhas('api_curso_busca'), 1)
+        self.assertEqual(linhas('api_interacao_busca'), 0)
+
+    def test_migracao_indexa_registros_existentes(self):
+        migracao = importlib.import_module('api.migrations.0011_busca_textual')
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM api_curso_busca")
+            cursor.execute("DELETE FROM api_interacao_busca")
+        migracao.indexar_existentes(apps, mock.Mock(connection=connection), tamanho_bloco=2)
+        self.assertEqual(self.ids('/api/interacoes/?search=decorador'), [self.titulo.id, self.resposta.id])
+        self.assertEqual(self.ids('/api/cursos/?search=funcao'), [self.python.id])
+
+    def test_paginacao_por_relevancia(self):
+        Interacao.objects.bulk_create([
+            Interacao(curso=self.python, pergunta=f'Decoradores {i}', resposta='decoradores ' * (i % 5))
+            for i in range(25)
+        ])
+        full_text.reindexar(Interacao.objects.all())
+        ids, url = [], '/api/interacoes/?search=decoradores'
+        while url:
+            response = self.client.get(url)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(len(ids), 27)
+        self.assertEqual(len(set(ids)), 27)
+
+
+class EscritaAdiadaTestCase(CursoTestCase):
+    """
+    Com a gravação adiada, a interação volta ao chamador antes do INSERT,
+    entra no histórico da conversa enquanto está pendente e é gravada em
+    bloco no flush ou recuperada do diário em disco.
+    """
+
+    def setUp(self):
+        self.diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.diretorio, True)
+        self.buffer = InteracaoBuffer(self.diretorio, automatico=False)
+        for modulo in ('api.langchain_utils', 'api.conversation_memory'):
+            patcher = mock.patch(f'{modulo}.write_behind', self.buffer)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_resposta_antes_da_gravacao(self):
+        resultado = process_question(self.curso.id, 'Quais são os conceitos básicos de Python?')
+        self.assertEqual(resultado['interacao_id'], resultado['interacao_uuid'])
+        self.assertFalse(Interacao.objects.exists())
+
+        # O próximo turno abre a conversa e já vê a interação pendente
+        self.assertEqual(resultado['conversa_id'], resultado['interacao_uuid'])
+        conversa = obter_conversa(self.curso, resultado['conversa_id'])
+        self.assertIn('conceitos básicos', carregar_historico(conversa))
+
+        self.buffer.flush()
+        interacao = Interacao.objects.get(uuid=resultado['interacao_uuid'])
+        self.assertEqual(interacao.conversa_id, conversa.id)
+        self.assertEqual(self.buffer.pendentes(conversa.id), [])
+        # Só o lock do processo fica no diretório
+        self.assertEqual(os.listdir(self.diretorio), [f'interacoes-{self.buffer.token}.lock'])
+        self.assertEqual(carregar_historico(conversa).count('Aluno: Quais são'), 1)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin'))
+        response = client.get(f"/api/interacoes/{resultado['interacao_id']}/")
+        self.assertEqual(response.data['id'], interacao.id)
+        self.assertEqual(client.get('/api/interacoes/?search=conceitos').data['results'][0]['id'], interacao.id)
+
+    def test_data_de_criacao_preservada(self):
+        criada_em = timezone.now() - timedelta(hours=1)
+        self.buffer.adicionar(Interacao(curso=self.curso, pergunta='P', resposta='R', data_criacao=criada_em))
+        self.buffer.flush()
+        self.assertEqual(Interacao.objects.get().data_criacao, criada_em)
+
+    def test_recupera_diario_de_processo_encerrado(self):
+        interacao = Interacao(curso=self.curso, pergunta='Pergunta perdida', resposta='R')
+        diario = os.path.join(self.diretorio, 'interacoes-999999999-0.jsonl')
+        with open(diario, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(serializers.serialize('jsonl', [interacao]).rstrip('\n') + '\n')
+            arquivo.write('{"model": "api.interacao", "fi')  # linha cortada pela queda do processo
+        shutil.copy(diario, diario + '.copia')
+
+        self.assertEqual(self.buffer.recuperar(), 1)
+        self.assertFalse(os.path.exists(diario))
+        # Recuperar o mesmo diário de novo não duplica a interação
+        os.rename(diario + '.copia', diario)
+        self.buffer.recuperar()
+        self.assertEqual(Interacao.objects.filter(uuid=interacao.uuid).count(), 1)
+
+    def diario(self, buffer, pergunta):
+        buffer.adicionar(Interacao(curso=self.curso, pergunta=pergunta, resposta='R'))
+        return os.path.join(self.diretorio, f'interacoes-{buffer.token}-0.jsonl')
+
+    def test_recuperacao_pelo_lock_e_nao_pelo_pid(self):
+        # Dois processos com o mesmo pid (contêiner reiniciado): vale o lock de cada token
+        ativo = InteracaoBuffer(self.diretorio, automatico=False)
+        diario_ativo = self.diario(ativo, 'Processo vivo')
+        encerrado = InteracaoBuffer(self.diretorio, automatico=False)
+        diario_encerrado = self.diario(encerrado, 'Processo morto')
+        encerrado._lock_processo.close()  # o lock é liberado quando o processo morre
+
+        self.assertEqual(self.buffer.recuperar(), 1)
+        self.assertEqual(list(Interacao.objects.values_list('pergunta', flat=True)), ['Processo morto'])
+        self.assertFalse(os.path.exists(diario_encerrado))
+        self.assertFalse(os.path.exists(os.path.join(self.diretorio, f'interacoes-{encerrado.token}.lock')))
+        self.assertTrue(os.path.exists(diario_ativo))
+
+        ativo.parar()
+        self.assertEqual(Interacao.objects.count(), 2)
+        self.assertEqual(os.listdir(self.diretorio), [])
+
+    def test_bloco_recusado_vai_para_quarentena(self):
+        existente = Interacao.objects.create(curso=self.curso, pergunta='Já gravada', resposta='R')
+        # UUID repetido: o banco recusa o bloco inteiro em qualquer tentativa
+        self.buffer.adicionar(Interacao(curso=self.curso, pergunta='Repetida', resposta='R', uuid=existente.uuid))
+        self.buffer.adicionar(Interacao(curso=self.curso, pergunta='Mesmo bloco', resposta='R'))
+        self.buffer.flush()
+        self.buffer.adicionar(Interacao(curso=self.curso, pergunta='Bloco seguinte', resposta='R'))
+        self.buffer.flush()
+
+        self.assertEqual(Interacao.objects.count(), 3)
+        quarentena = os.path.join(self.diretorio, f'quarentena-{self.buffer.token}-0.jsonl')
+        with open(quarentena, encoding='utf-8') as arquivo:
+            recusadas = [objeto.object for objeto in serializers.deserialize('jsonl', arquivo)]
+        self.assertEqual([i.pergunta for i in recusadas], ['Repetida'])
+        self.assertFalse(any(nome.startswith('interacoes-') and nome.endswith('.jsonl')
+                             for nome in os.listdir(self.diretorio)))
+
+    def test_erro_transitorio_nao_trava_os_blocos_seguintes(self):
+        buffer = InteracaoBuffer(self.diretorio, tentativas=2, automatico=False)
+        gravar = buffer._gravar
+
+        def gravar_com_falha(interacoes):
+            if any(i.pergunta == 'Sem conexão' for i in interacoes):
+                raise OperationalError('database is locked')
+            gravar(interacoes)
+
+        buffer._gravar = gravar_com_falha
+        self.diario(buffer, 'Sem conexão')
+        buffer.flush()
+        self.assertEqual(len(buffer._blocos), 1)
+        self.diario(buffer, 'Depois')
+        buffer.flush()
+
+        self.assertEqual(list(Interacao.objects.values_list('pergunta', flat=True)), ['Depois'])
+        self.assertEqual(buffer._blocos, [])
+        self.assertTrue(os.path.exists(os.path.join(self.diretorio, f'quarentena-{buffer.token}-0.jsonl')))
+
+
+class PrefixoPromptTestCase(TestCase):
+    """
+    O bloco do curso no prompt é renderizado uma vez por curso, vem primeiro
+    (mensagem de sistema) e é refeito quando o curso ou a categoria mudam.
+    """
+
+    def setUp(self):
+        prefixos.invalidar()
+        self.categoria = Categoria.objects.create(nome='Programação')
+        Curso.objects.create(titulo='Python', descricao='Funções', nivel='I', categoria=self.categoria, carga_horaria=1)
+
+    def curso(self):
+        return Curso.objects.select_related('categoria').get()
+
+    def test_bloco_do_curso_em_cache(self):
+        primeiro = montar_inputs(self.curso(), 'P1', '')
+        segundo = montar_inputs(self.curso(), 'P2', '', 'Aluno: P1')
+        self.assertIs(primeiro['prefixo_curso'], segundo['prefixo_curso'])
+        self.assertIn('Nível: Intermediário', primeiro['prefixo_curso'])
+
+        sistema, aluno = PROMPT_CURSO.format_messages(**segundo)
+        self.assertEqual(sistema.type, 'system')
+        self.assertEqual(sistema.content, primeiro['prefixo_curso'])
+        self.assertIn('Pergunta do aluno: P2', aluno.content)
+        self.assertNotIn('Python', aluno.content)
+
+    def test_invalidado_ao_salvar(self):
+        antes = montar_inputs(self.curso(), 'P', '')['prefixo_curso']
+        curso = self.curso()
+        curso.descricao = 'Decoradores'
+        curso.save()
+        self.assertIn('Decoradores', montar_inputs(self.curso(), 'P', '')['prefixo_curso'])
+
+        self.categoria.nome = 'Linguagens'
+        self.categoria.save()
+        depois = montar_inputs(self.curso(), 'P', '')['prefixo_curso']
+        self.assertIn('Categoria: Linguagens', depois)
+        self.assertNotEqual(antes, depois)
+
+
+    def test_tokens_por_curso_e_modelo(self):
+        curso = self.curso()
+        inputs = montar_inputs(curso, 'P', '')
+        with mock.patch('api.course_prompt.contar_tokens', side_effect=lambda texto, modelo: len(texto)) as contar:
+            # Cópia do texto (não o mesmo objeto) também acerta: a chave é o curso e o modelo
+            for texto in (inputs['prefixo_curso'], ''.join(inputs['prefixo_curso'])):
+                self.assertEqual(prefixos.tokens(curso.pk, texto, 'gpt-4o-mini'), len(inputs['prefixo_curso']))
+            prefixos.tokens(curso.pk, inputs['prefixo_curso'], 'deepseek-chat')
+            self.assertEqual(contar.call_count, 2)
+            self.assertEqual(len(prefixos._tokens[curso.pk]), 2)
+
+            # Alterar o curso descarta as contagens junto com o bloco
+            curso.descricao = 'Decoradores'
+            curso.save()
+            self.assertNotIn(curso.pk, prefixos._tokens)
+            novo = montar_inputs(self.curso(), 'P', '')['prefixo_curso']
+            self.assertEqual(prefixos.tokens(curso.pk, novo, 'gpt-4o-mini'), len(novo))
+            self.assertEqual(contar.call_count, 3)
+
+
+class MateriaisCursoTestCase(CursoTestCase):
+    """
+    Os trechos dos materiais mais similares à pergunta entram no contexto do
+    prompt, e o índice de cada curso acompanha as alterações dos materiais.
+    """
+
+    def setUp(self):
+        # Os materiais são criados em cada teste para que os índices em memória acompanhem o banco
+        self.outro = Curso.objects.create(titulo='Redes', descricao='d', categoria=self.categoria, carga_horaria=1)
+        self.decoradores = MaterialCurso.objects.create(
+            curso=self.curso, titulo='Decoradores',
+            conteudo='Um decorador recebe uma função e devolve outra função que a envolve.',
+        )
+        MaterialCurso.objects.create(
+            curso=self.curso, titulo='Listas',
+            conteudo='Listas são sequências mutáveis; use append para adicionar elementos ao final.',
+        )
+        MaterialCurso.objects.create(
+            curso=self.outro, titulo='Roteadores',
+            conteudo='Um roteador encaminha pacotes entre redes diferentes usando tabelas de rotas.',
+        )
+
+    def test_dividir_com_sobreposicao(self):
+        texto = ' '.join(f'palavra{i}' for i in range(300))
+        trechos = retrieval.dividir(texto, 200, 50)
+        self.assertGreater(len(trechos), 1)
+        self.assertTrue(all(len(trecho) <= 200 for trecho in trechos))
+        # Cada trecho começa com palavras do fim do anterior, sem cortar palavras
+        for anterior, seguinte in zip(trechos, trechos[1:]):
+            self.assertIn(seguinte.split()[0], anterior.split())
+        self.assertEqual(trechos[-1].split()[-1], 'palavra299')
+
+    def test_recupera_trechos_do_curso(self):
+        recuperados = retrieval.recuperar(self.curso.id, 'Como funciona um decorador de funções?')
+        self.assertEqual(recuperados[0][1], 'Decoradores')
+        self.assertNotIn('Roteadores', [titulo for _, titulo, _ in recuperados])
+        self.assertEqual(retrieval.recuperar(self.curso.id, 'fotossíntese das plantas'), [])
+
+    def test_indice_atualizado_ao_alterar_material(self):
+        retrieval.recuperar(self.curso.id, 'decorador')
+        self.decoradores.conteudo = 'Geradores produzem valores sob demanda com yield.'
+        self.decoradores.save()
+        self.assertEqual(retrieval.recuperar(self.curso.id, 'gerador com yield')[0][2], self.decoradores.conteudo)
+
+        self.decoradores.delete()
+        self.assertEqual(retrieval.recuperar(self.curso.id, 'gerador com yield'), [])
+
+    def test_trechos_no_contexto_da_pergunta(self):
+        criar_configuracao()
+        contextos = []
+
+        def buscar_cache(curso, config, pergunta, contexto, contexto_cliente):
+            contextos.append(contexto)
+            return {'resposta': 'Resposta em cache', 'cache': 'exato'}
+
+        with mock.patch('api.langchain_utils._buscar_cache', side_effect=buscar_cache):
+            resultado = process_question(self.curso.id, 'O que faz um decorador?', contexto='Aula 3')
+
+        self.assertTrue(resultado['cache_hit'])
+        self.assertTrue(contextos[0].startswith('Trechos dos materiais do curso:\n[Decoradores] Um decorador'))
+        self.assertTrue(contextos[0].endswith('Aula 3'))
+
+    def test_similaridade_com_materiais(self):
+        criar_configuracao()
+        cache = AnswerCache(MemoryCacheBackend(100, 60), similaridade=True)
+        with provedor_falso() as provedor, \
+                mock.patch('api.langchain_utils.answer_cache', cache):
+            primeira = process_question(self.curso.id, 'Como funciona um decorador de funções?')
+            parafrase = process_question(self.curso.id, 'Como funciona o decorador de funções?')
+            continuacao = process_question(self.curso.id, 'Como funciona um decorador de funções?',
+                                           conversa_id=primeira['conversa_id'])
+            com_contexto = process_question(self.curso.id, 'Como funciona um decorador de funções?',
+                                            contexto='Aula 3')
+        self.assertFalse(primeira['cache_hit'])
+        self.assertEqual(Interacao.objects.get(uuid=parafrase['interacao_uuid']).cache, 'similar')
+        # Com histórico ou contexto do cliente, a resposta depende deles: nada de similaridade
+        self.assertFalse(continuacao['cache_hit'])
+        self.assertFalse(com_contexto['cache_hit'])
+        self.assertEqual(provedor.server.chamadas, 3)
+        self.assertEqual(
+            list(Interacao.objects.order_by('data_criacao').values_list('sem_contexto', flat=True)),
+            [True, True, False, False]
+        )
+
+    def test_endpoint_buscar(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('aluno'))
+        response = client.get('/api/materiais/buscar/', {'curso': self.curso.id, 'q': 'adicionar elementos na lista'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['trechos'][0]['material'], 'Listas')
+        self.assertEqual(client.get('/api/materiais/buscar/', {'q': 'lista'}).status_code, 400)
+
+
+class MetricasTestCase(CursoTestCase):
+    """
+    As etapas do pipeline de perguntas alimentam os histogramas e contadores
+    expostos em /metrics no formato do Prometheus.
+    """
+
+    def test_histograma_cumulativo(self):
+        histograma = metrics.Histograma('teste_segundos', 'Teste.', ('etapa',), buckets=(0.1, 1))
+        for valor in (0.05, 0.1, 0.5, 3):
+            histograma.observar(valor, 'x')
+        self.assertEqual(list(histograma.linhas()), [
+            'teste_segundos_bucket{etapa="x",le="0.1"} 2',
+            'teste_segundos_bucket{etapa="x",le="1"} 3',
+            'teste_segundos_bucket{etapa="x",le="+Inf"} 4',
+            'teste_segundos_sum{etapa="x"} 3.65',
+            'teste_segundos_count{etapa="x"} 4',
+        ])
+
+    def test_resposta_simulada(self):
+        simuladas = metrics.simuladas.valor()
+        perguntas = metrics.duracao_pergunta.contagem('sincrono')
+        gravacoes = metrics.etapas.contagem('gravacao')
+        process_question(self.curso.id, 'O que é Python?')
+        self.assertEqual(metrics.simuladas.valor(), simuladas + 1)
+        self.assertEqual(metrics.duracao_pergunta.contagem('sincrono'), perguntas + 1)
+        self.assertEqual(metrics.etapas.contagem('gravacao'), gravacoes + 1)
+        self.assertGreater(metrics.tokens.valor('simulado', 'simulado', 'resposta'), 0)
+
+    def test_provedor_cache_e_primeiro_token(self):
+        config = criar_configuracao()
+        rotulos = (config.provedor, config.modelo)
+        chamadas = metrics.latencia_provedor.contagem(*rotulos)
+        primeiros = metrics.primeiro_token.contagem(*rotulos)
+        acertos = metrics.cache.valor('exato')
+        prompt = metrics.tokens.valor(*rotulos, 'prompt')
+
+        with provedor_falso():
+            process_question(self.curso.id, 'Pergunta nova sobre métricas', configuracao_id=config.id)
+            process_question(self.curso.id, 'Pergunta nova sobre métricas', configuracao_id=config.id)
+            list(stream_question(self.curso.id, 'Outra pergunta sobre métricas', configuracao_id=config.id))
+
+        self.assertEqual(metrics.latencia_provedor.contagem(*rotulos), chamadas + 2)
+        self.assertEqual(metrics.primeiro_token.contagem(*rotulos), primeiros + 1)
+        self.assertEqual(metrics.cache.valor('exato'), acertos + 1)
+        self.assertGreater(metrics.tokens.valor(*rotulos, 'prompt'), prompt)
+
+    def test_endpoint(self):
+        process_question(self.curso.id, 'O que é Python?')
+        with override_settings(DEBUG=True):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        corpo = response.content.decode()
+        self.assertIn('# TYPE cognicursos_pergunta_segundos histogram', corpo)
+        self.assertIn('cognicursos_pergunta_segundos_bucket{modo="sincrono",le="+Inf"}', corpo)
+        self.assertIn('cognicursos_respostas_simuladas_total ', corpo)
+
+        with override_settings(METRICAS={'TOKEN': 'segredo'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer segredo').status_code, 200)
+
+    def test_endpoint_restrito_sem_token(self):
+        # Fora do DEBUG e sem token, o /metrics não é público
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        with override_settings(METRICAS={'IPS_PERMITIDOS': ('10.0.0.5',)}):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.6').status_code, 401)
+
+        self.client.force_login(User.objects.create_user('aluno'))
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class DesempenhoInteracaoTestCase(CursoTestCase):
+    """
+    Cada interação registra o resultado, o provedor que respondeu e as
+    latências, resumidas em percentis pelo endpoint interacoes/desempenho.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.config = criar_configuracao(ativo=False)
+
+    def test_resposta_simulada(self):
+        process_question(self.curso.id, 'O que é Python?')
+        interacao = Interacao.objects.get()
+        self.assertEqual(interacao.resultado, 'simulada')
+        self.assertEqual(interacao.provedor, '')
+        self.assertIsNotNone(interacao.latencia_total)
+        self.assertIsNone(interacao.latencia_provedor)
+
+    def test_provedor_cache_e_stream(self):
+        ConfiguracaoIA.objects.filter(id=self.config.id).update(ativo=True)
+        resposta = ' '.join(['palavra'] * 20)
+        with provedor_falso(resposta=resposta):
+            process_question(self.curso.id, 'Pergunta sobre latência')
+            process_question(self.curso.id, 'Pergunta sobre latência')
+            list(stream_question(self.curso.id, 'Pergunta em streaming'))
+            stream = stream_question(self.curso.id, 'Pergunta cancelada')
+            next(stream)
+            stream.close()
+
+        gerada, cache, streaming, cancelada = Interacao.objects.order_by('id')
+        self.assertEqual((gerada.resultado, gerada.cache, gerada.provedor, gerada.modelo),
+                         ('ok', '', 'openai', 'gpt-4o-mini'))
+        self.assertIsNotNone(gerada.latencia_provedor)
+        self.assertGreaterEqual(gerada.latencia_total, gerada.latencia_provedor)
+        self.assertEqual((cache.resultado, cache.cache), ('ok', 'exato'))
+        self.assertIsNone(cache.latencia_provedor)
+        self.assertEqual(streaming.resultado, 'ok')
+        self.assertLessEqual(streaming.latencia_primeiro_token, streaming.latencia_provedor)
+        self.assertEqual(cancelada.resultado, 'cancelada')
+
+    def test_indice_de_similaridade_ignora_respostas_simuladas(self):
+        Interacao.objects.create(curso=self.curso, configuracao_ia=self.config, pergunta='P1', resposta='R',
+                                 resultado='simulada', sem_contexto=True)
+        Interacao.objects.create(curso=self.curso, configuracao_ia=self.config, pergunta='P2', resposta='R',
+                                 sem_contexto=True)
+        cache = AnswerCache(MemoryCacheBackend(10, 60), similaridade=True)
+        self.assertEqual(len(cache._indice(self.curso.id, self.config)), 1)
+
+    def test_endpoint_desempenho(self):
+        outro = criar_configuracao(nome='Outra', provedor='deepseek', modelo='deepseek-chat')
+        linhas = [
+            Interacao(curso=self.curso, configuracao_ia=self.config, pergunta='P', resposta='R',
+                      latencia_total=i / 100, latencia_provedor=i / 200)
+            for i in range(1, 101)
+        ]
+        linhas.append(Interacao(curso=self.curso, configuracao_ia=self.config, pergunta='P', resposta='R',
+                                cache='exato', latencia_total=0.001))
+        linhas.append(Interacao(curso=self.curso, configuracao_ia=outro, pergunta='P', resposta='R',
+                                resultado='simulada', latencia_total=2.0))
+        linhas.append(Interacao(curso=self.curso, configuracao_ia=outro, pergunta='P', resposta='R',
+                                latencia_total=5.0, data_criacao=timezone.now() - timedelta(days=2)))
+        Interacao.objects.bulk_create(linhas)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('analista'))
+        grupos = client.get('/api/interacoes/desempenho/').json()['grupos']
+        self.assertEqual([g['configuracao_nome'] for g in grupos], ['Fake', 'Outra'])
+        fake, outra = grupos
+        self.assertEqual(fake['interacoes'], 101)
+        self.assertEqual(fake['acertos_cache'], 1)
+        self.assertEqual(fake['latencia_total'], {'p50': 0.5, 'p95': 0.95, 'p99': 0.99, 'amostras': 100})
+        self.assertEqual(fake['latencia_provedor']['p50'], 0.25)
+        self.assertEqual(outra['resultados'], {'simulada': 1})
+
+        por_dia = client.get('/api/interacoes/desempenho/', {'agrupar': 'curso', 'intervalo': 'dia', 'horas': 72}).json()
+        self.assertEqual([g['interacoes'] for g in por_dia['grupos']], [1, 102])
+        self.assertEqual(por_dia['grupos'][0]['curso_titulo'], 'Python')
+        self.assertEqual(client.get('/api/interacoes/desempenho/', {'agrupar': 'usuario'}).status_code, 400)
+
+
+class LoggingEstruturadoTestCase(TestCase):
+    """
+    Os registros saem em JSON com o ID da requisição, que o middleware
+    atribui a cada requisição e devolve no cabeçalho X-Request-ID.
+    """
+
+    def registro(self, nivel=logging.INFO, **extra):
+        registro = logging.LogRecord('api.teste', nivel, __file__, 1, 'Curso %s respondido', (3,), None)
+        registro.__dict__.update(extra)
+        RequestIdFilter().filter(registro)
+        return registro
+
+    def test_formato_json(self):
+        self.addCleanup(limpar_request_id, definir_request_id('abc123'))
+        dados = json.loads(JSONFormatter().format(self.registro(resultado='ok', latencia_total=0.5)))
+        self.assertEqual(dados['msg'], 'Curso 3 respondido')
+        self.assertEqual(dados['nivel'], 'INFO')
+        self.assertEqual(dados['request_id'], 'abc123')
+        self.assertEqual((dados['resultado'], dados['latencia_total']), ('ok', 0.5))
+        self.assertNotIn('args', dados)
+
+    def test_amostragem_por_requisicao(self):
+        filtro = AmostragemFilter(taxa=0.5)
+        decisoes = set()
+        self.addCleanup(limpar_request_id, definir_request_id(None))
+        for i in range(50):
+            definir_request_id(f'req-{i}')
+            decisao = filtro.filter(self.registro())
+            # A mesma requisição tem sempre a mesma decisão, e avisos passam sempre
+            self.assertEqual(filtro.filter(self.registro(logging.DEBUG)), decisao)
+            self.assertTrue(filtro.filter(self.registro(logging.WARNING)))
+            decisoes.add(decisao)
+        self.assertEqual(decisoes, {True, False})
+        self.assertFalse(AmostragemFilter(taxa=0).filter(self.registro()))
+
+    def test_middleware_request_id(self):
+        response = self.client.get('/api/cursos/')
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+        response = self.client.get('/api/cursos/', HTTP_X_REQUEST_ID='proxy-42')
+        self.assertEqual(response['X-Request-ID'], 'proxy-42')
+        response = self.client.get('/api/cursos/', HTTP_X_REQUEST_ID='inválido com espaços')
+        self.assertNotEqual(response['X-Request-ID'], 'inválido com espaços')
+        # O ID não sobra no contexto depois da requisição
+        self.assertIsNone(request_id.get())
+
+    def test_request_id_no_log_da_resposta(self):
+        registros = []
+        coletor = logging.Handler()
+        coletor.emit = registros.append
+        coletor.addFilter(RequestIdFilter())
+        logger = logging.getLogger('django.request')
+        logger.addHandler(coletor)
+        self.addCleanup(logger.removeHandler, coletor)
+
+        self.client.get('/api/cursos/999999/', HTTP_X_REQUEST_ID='erro-404')
+        self.assertEqual(registros[-1].status_code, 404)
+        self.assertEqual(registros[-1].request_id, 'erro-404')
+
+    def test_request_id_no_streaming(self):
+        def gerar():
+            yield request_id.get() or '-'
+            yield request_id.get() or '-'
+
+        async def agerar():
+            yield request_id.get() or '-'
+
+        middleware = RequestIdMiddleware(lambda request: StreamingHttpResponse(gerar()))
+        response = middleware(RequestFactory().get('/', HTTP_X_REQUEST_ID='sync-1'))
+        self.assertIsNone(request_id.get())
+        self.assertEqual(b''.join(response.streaming_content), b'sync-1sync-1')
+        self.assertIsNone(request_id.get())
+
+        async def get_response(request):
+            return StreamingHttpResponse(agerar())
+
+        async def consumir():
+            response = await RequestIdMiddleware(get_response)(RequestFactory().get('/', HTTP_X_REQUEST_ID='async-1'))
+            self.assertIsNone(request_id.get())
+            return b''.join([parte async for parte in response.streaming_content])
+
+        self.assertEqual(async_to_sync(consumir)(), b'async-1')
+
+
+class CacheCatalogoTestCase(TestCase):
+    """
+    Cursos e categorias respondem com ETag/Last-Modified, devolvem 304 sem
+    consultar o banco e deixam de usar o cache quando o catálogo muda.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nome='Programação')
+        cls.curso = Curso.objects.create(
+            titulo='Python', descricao='Básico', categoria=cls.categoria, carga_horaria=10
+        )
+
+    def setUp(self):
+        # A versão fica no cache do Django, que não volta com o rollback dos testes
+        catalog_cache.invalidar()
+
+    def test_etag_e_304(self):
+        for url in ('/api/cursos/', f'/api/cursos/{self.curso.id}/', '/api/categorias/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'].startswith('W/"'))
+            self.assertIn('Last-Modified', response)
+            with CaptureQueriesContext(connection) as consultas:
+                condicional = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(condicional.status_code, 304)
+            self.assertEqual(condicional['ETag'], response['ETag'])
+            self.assertEqual(len(consultas), 0)
+            condicional = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(condicional.status_code, 304)
+
+    def test_pagina_em_cache(self):
+        primeira = self.client.get('/api/cursos/?ordering=titulo')
+        with CaptureQueriesContext(connection) as consultas:
+            segunda = self.client.get('/api/cursos/?ordering=titulo')
+        self.assertEqual(len(consultas), 0)
+        self.assertEqual(segunda.json(), primeira.json())
+        # Outros parâmetros são outra página, com outro ETag
+        outra = self.client.get('/api/cursos/?ordering=-titulo')
+        self.assertNotEqual(outra['ETag'], primeira['ETag'])
+
+    def test_invalidacao_por_signals(self):
+        etag = self.client.get('/api/cursos/')['ETag']
+        self.curso.titulo = 'Python avançado'
+        self.curso.save()
+        response = self.client.get('/api/cursos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['titulo'], 'Python avançado')
+
+        # O nome da categoria aparece na listagem de cursos
+        etag = response['ETag']
+        self.categoria.nome = 'Desenvolvimento'
+        self.categoria.save()
+        response = self.client.get('/api/cursos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json()['results'][0]['categoria_nome'], 'Desenvolvimento')
+
+        Curso.objects.filter(id=self.curso.id).first().delete()
+        self.assertEqual(self.client.get('/api/cursos/').json()['results'], [])
+
+    @override_settings(CACHE_CATALOGO={'ATIVO': False})
+    def test_desativado(self):
+        response = self.client.get('/api/cursos/')
+        self.assertNotIn('ETag', response)
+
+
+class SerializacaoRapidaTestCase(TestCase):
+    """
+    As listagens montadas com .values() devem sair iguais às do serializer,
+    e ?fields=/?exclude= devem escolher os campos da resposta.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('admin', password='senha')
+        categoria = Categoria.objects.create(nome='Programação')
+        cls.curso = Curso.objects.create(
+            titulo='Python', descricao='Decoradores e geradores', categoria=categoria, carga_horaria=10
+        )
+        config = ConfiguracaoIA.objects.create(nome='Config', chave_api='sk-teste')
+        for i in range(12):
+            Interacao.objects.create(
+                curso=cls.curso, configuracao_ia=config if i % 2 else None,
+                pergunta=f'Pergunta sobre decoradores {i}', resposta='Resposta ' * 50,
+                latencia_total=0.25 if i % 3 else None,
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def paginas(self, url):
+        """
+        Percorre a listagem pelos links next e retorna os resultados.
+        """
+        resultados = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            resultados.extend(response.json()['results'])
+            url = response.json()['next']
+        return resultados
+
+    def test_igual_ao_serializer(self):
+        for url in ('/api/interacoes/', '/api/interacoes/?search=decoradores', '/api/cursos/?ordering=titulo'):
+            catalog_cache.invalidar()
+            rapido = self.paginas(url)
+            with self.settings(SERIALIZACAO_RAPIDA={'ATIVO': False}):
+                catalog_cache.invalidar()
+                self.assertEqual(rapido, self.paginas(url), url)
+        self.assertEqual(len(self.paginas('/api/interacoes/')), 12)
+
+    def test_campos_esparsos(self):
+        response = self.client.get('/api/interacoes/?exclude=resposta,pergunta')
+        item = response.json()['results'][0]
+        self.assertNotIn('resposta', item)
+        self.assertNotIn('pergunta', item)
+        self.assertIn('curso_titulo', item)
+
+        response = self.client.get('/api/interacoes/?fields=id,uuid')
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'uuid'])
+        # O detalhe (serializer) aceita os mesmos parâmetros
+        interacao = Interacao.objects.first()
+        response = self.client.get(f'/api/interacoes/{interacao.id}/?fields=id,resposta')
+        self.assertEqual(response.json(), {'id': interacao.id, 'resposta': interacao.resposta})
+
+        response = self.client.get('/api/interacoes/?fields=id,chave_api')
+        self.assertEqual(response.status_code, 400)
+
+    def test_renderer(self):
+        dados = {
+            'data': timezone.now(), 'valor': Decimal('1.50'), 'uuid': uuid.uuid4(),
+            'texto': 'ação', 1: [None, True, 0.1],
+        }
+        self.assertEqual(
+            json.loads(JSONRapidoRenderer().render(dados)),
+            json.loads(JSONRenderer().render(dados)),
+        )
+
+
+class SincronizacaoCatalogoTestCase(TestCase):
+    """
+    Os endpoints sincronizar criam ou atualizam em massa pela chave_externa,
+    com um número constante de consultas e tudo ou nada.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_user('admin', password='senha')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+        catalog_cache.invalidar()
+
+    def sincronizar(self, recurso, itens):
+        return self.client.post(f'/api/{recurso}/sincronizar/', {'itens': itens}, format='json')
+
+    def cursos(self, inicio, fim, **extra):
+        return [
+            dict({'chave_externa': f'lms-{i}', 'titulo': f'Curso {i}', 'descricao': 'Descrição',
+                  'categoria_externa': 'cat-1', 'carga_horaria': 10}, **extra)
+            for i in range(inicio, fim)
+        ]
+
+    def test_upsert(self):
+        response = self.sincronizar('categorias', [{'chave_externa': 'cat-1', 'nome': 'Programação'}])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['criados'], 1)
+
+        response = self.sincronizar('cursos', self.cursos(0, 3))
+        self.assertEqual((response.json()['criados'], response.json()['atualizados']), (3, 0))
+        curso = Curso.objects.get(chave_externa='lms-1')
+        self.assertEqual(response.json()['ids']['lms-1'], curso.id)
+        self.assertEqual(self.client.get('/api/cursos/?search=curso').json()['results'][0]['categoria_nome'], 'Programação')
+
+        # Reenviar: o alterado é atualizado, os iguais ficam como estão
+        itens = self.cursos(0, 3)
+        itens[1]['titulo'] = 'Curso renomeado'
+        response = self.sincronizar('cursos', itens + self.cursos(3, 4))
+        self.assertEqual(
+            [response.json()[chave] for chave in ('criados', 'atualizados', 'inalterados')], [1, 1, 2]
+        )
+        curso.refresh_from_db()
+        self.assertEqual(curso.titulo, 'Curso renomeado')
+        self.assertEqual(Curso.objects.count(), 4)
+        self.assertEqual(self.client.get('/api/cursos/?search=renomeado').json()['results'][0]['id'], curso.id)
+
+        # Renomear a categoria atualiza a busca dos cursos dela
+        self.sincronizar('categorias', [{'chave_externa': 'cat-1', 'nome': 'Desenvolvimento'}])
+        self.assertEqual(len(self.client.get('/api/cursos/?search=desenvolvimento').json()['results']), 4)
+
+    def test_consultas_constantes(self):
+        categoria = Categoria.objects.create(nome='Programação', chave_externa='cat-1')
+        contagens = []
+        for fim in (2, 40):
+            itens = self.cursos(0, fim, categoria=categoria.id)
+            for item in itens:
+                del item['categoria_externa']
+            with CaptureQueriesContext(connection) as consultas:
+                response = self.sincronizar('cursos', itens)
+            self.assertEqual(response.status_code, 200, response.content)
+            contagens.append(len(consultas))
+        self.assertEqual(contagens[0], contagens[1])
+
+    def test_criacao_simultanea_atualiza(self):
+        # Outra sincronização criou lms-1 depois da leitura dos existentes: o INSERT vira UPDATE
+        categoria = Categoria.objects.create(nome='Programação', chave_externa='cat-1')
+        curso = Curso.objects.create(
+            titulo='Antigo', descricao='d', categoria=categoria, carga_horaria=1, chave_externa='lms-1'
+        )
+        with mock.patch('django.db.models.query.QuerySet.in_bulk', return_value={}):
+            response = self.sincronizar('cursos', self.cursos(0, 2))
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Curso.objects.count(), 2)
+        self.assertEqual(response.json()['ids']['lms-1'], curso.id)
+        curso.refresh_from_db()
+        self.assertEqual((curso.titulo, curso.carga_horaria), ('Curso 1', 10))
+
+    def test_erros_nao_gravam_nada(self):
+        Categoria.objects.create(nome='Programação', chave_externa='cat-1')
+        itens = self.cursos(0, 3)
+        itens[2]['carga_horaria'] = 'muitas'
+        response = self.sincronizar('cursos', itens)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['itens'][:2], [{}, {}])
+        self.assertIn('carga_horaria', response.json()['itens'][2])
+
+        for itens in (self.cursos(0, 2, categoria_externa='inexistente'), self.cursos(0, 2) + self.cursos(1, 2),
+                      self.cursos(0, 1, categoria=1)):
+            self.assertEqual(self.sincronizar('cursos', itens).status_code, 400)
+        self.assertFalse(Curso.objects.exists())
+
+
+class ExportacaoInteracoesTestCase(CursoConfiguradoTestCase):
+    """
+    A exportação em streaming traz as interações com os campos da API, em
+    NDJSON ou CSV, com os filtros do endpoint e do comando.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.usuario = User.objects.create_user('admin', password='senha')
+        outro = Curso.objects.create(titulo='Java', descricao='d', categoria=cls.categoria, carga_horaria=1)
+        for i in range(5):
+            Interacao.objects.create(
+                curso=cls.curso, configuracao_ia=cls.config if i % 2 else None,
+                pergunta=f'Pergunta, "{i}"', resposta='Linha 1\nLinha 2',
+            )
+        Interacao.objects.create(curso=outro, pergunta='Outra', resposta='Resposta')
+        Interacao.objects.filter(pergunta='Outra').update(data_criacao=timezone.now() - timedelta(days=10))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def exportar(self, query=''):
+        response = self.client.get(f'/api/interacoes/exportar/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    @override_settings(EXPORTACAO_INTERACOES={'TAMANHO_BLOCO': 2})
+    def test_ndjson_igual_a_api(self):
+        response, conteudo = self.exportar()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        exportadas = [json.loads(linha) for linha in conteudo.splitlines()]
+        api = self.client.get('/api/interacoes/?ordering=data_criacao').json()['results']
+        self.assertEqual(sorted(exportadas, key=lambda i: i['id']), sorted(api, key=lambda i: i['id']))
+
+    def test_filtros_e_campos(self):
+        _, conteudo = self.exportar(f'?curso={self.curso.id}&exclude=resposta')
+        linhas = [json.loads(linha) for linha in conteudo.splitlines()]
+        self.assertEqual(len(linhas), 5)
+        self.assertNotIn('resposta', linhas[0])
+
+        desde = (timezone.now() - timedelta(days=1)).date().isoformat()
+        _, conteudo = self.exportar(f'?desde={desde}&fields=id,pergunta')
+        self.assertEqual(len(conteudo.splitlines()), 5)
+
+        for query in ('?formato=xml', '?curso=abc', '?desde=ontem', '?fields=senha'):
+            self.assertEqual(self.client.get(f'/api/interacoes/exportar/{query}').status_code, 400, query)
+
+    def test_csv(self):
+        response, conteudo = self.exportar('?formato=csv&fields=id,pergunta,resposta,configuracao_nome')
+        linhas = list(csv.reader(io.StringIO(conteudo)))
+        # Na ordem dos campos da API
+        self.assertEqual(linhas[0], ['id', 'configuracao_nome', 'pergunta', 'resposta'])
+        self.assertEqual(len(linhas), 7)
+        primeira = Interacao.objects.order_by('id').first()
+        self.assertEqual(linhas[1], [str(primeira.id), '', primeira.pergunta, primeira.resposta])
+
+    def test_async_e_comando(self):
+        sincrono = b''.join(exportar(Interacao.objects.all(), 'csv'))
+
+        async def consumir():
+            return b''.join([bloco async for bloco in exportar_async(exportar(Interacao.objects.all(), 'csv'))])
+
+        self.assertEqual(async_to_sync(consumir)(), sincrono)
+
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, 'interacoes.csv')
+            call_command('exportar_interacoes', formato='csv', saida=caminho, stdout=io.StringIO())
+            with open(caminho, 'rb') as arquivo:
+                self.assertEqual(arquivo.read(), sincrono)
+
+
+class RetencaoInteracoesTestCase(CursoConfiguradoTestCase):
+    """
+    As interações antigas vão para segmentos comprimidos, saem da tabela e
+    da busca, e o detalhe delas continua disponível pelo id ou pelo UUID.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.usuario = User.objects.create_user('admin', password='senha')
+        for i in range(7):
+            Interacao.objects.create(
+                curso=cls.curso, configuracao_ia=cls.config if i % 2 else None,
+                pergunta=f'Pergunta sobre decoradores {i}', resposta='Resposta ' * 100,
+            )
+        Interacao.objects.update(data_criacao=timezone.now() - timedelta(days=400))
+        cls.recente = Interacao.objects.create(curso=cls.curso, pergunta='Decoradores recentes', resposta='Resposta')
+        lote = Lote.objects.create(nome='Lote', curso=cls.curso)
+        ItemLote.objects.create(lote=lote, request_id='1', curso=cls.curso, pergunta='P',
+                                interacao=Interacao.objects.order_by('id').first())
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def test_arquivar(self):
+        antigas = {
+            interacao.id: self.client.get(f'/api/interacoes/{interacao.id}/').json()
+            for interacao in Interacao.objects.exclude(id=self.recente.id)
+        }
+
+        self.assertEqual(retention.arquivar(dias=365, tamanho_bloco=3, pausa=0), 7)
+        self.assertEqual(list(Interacao.objects.values_list('id', flat=True)), [self.recente.id])
+        self.assertEqual(SegmentoArquivo.objects.count(), 3)
+        self.assertEqual(InteracaoArquivada.objects.count(), 7)
+        self.assertIsNone(ItemLote.objects.get().interacao)
+        segmento = SegmentoArquivo.objects.first()
+        self.assertLess(len(segmento.dados), segmento.tamanho_original)
+
+        # O detalhe vem do arquivo, igual ao de antes, pelo id ou pelo UUID
+        for interacao_id, antes in antigas.items():
+            self.assertEqual(self.client.get(f'/api/interacoes/{interacao_id}/').json(), antes)
+        antes = antigas[min(antigas)]
+        self.assertEqual(self.client.get(f"/api/interacoes/{antes['uuid']}/").json(), antes)
+        response = self.client.get(f"/api/interacoes/{antes['id']}/?fields=id,configuracao_nome")
+        self.assertEqual(response.json(), {'id': antes['id']})
+        self.assertEqual(self.client.get('/api/interacoes/999999/').status_code, 404)
+
+        # Listagens e busca só têm a tabela principal
+        resultados = self.client.get('/api/interacoes/?search=decoradores').json()['results']
+        self.assertEqual([item['id'] for item in resultados], [self.recente.id])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM api_interacao_busca")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        # Sem mais nada antigo, uma nova execução não faz nada
+        self.assertEqual(retention.arquivar(dias=365), 0)
+
+    def test_conversa_ativa_continua_resumida_do_ponto_certo(self):
+        conversa = Conversa.objects.create(curso=self.curso, resumo='Resumo', interacoes_resumidas=3)
+        antigas = [
+            Interacao.objects.create(curso=self.curso, conversa=conversa, pergunta=f'Turno {i}', resposta='R')
+            for i in range(4)
+        ]
+        Interacao.objects.filter(id__in=[i.id for i in antigas]).update(data_criacao=timezone.now() - timedelta(days=400))
+        for i in range(4, 8):
+            Interacao.objects.create(curso=self.curso, conversa=conversa, pergunta=f'Turno {i}', resposta='R')
+
+        retention.arquivar(dias=365, pausa=0)
+        conversa.refresh_from_db()
+        # Restam os turnos 4 a 7, nenhum deles resumido
+        self.assertEqual(conversa.interacoes_resumidas, 0)
+        conversa.interacoes.create(curso=self.curso, pergunta='Turno 8', resposta='R')
+        atualizar_resumo(conversa)
+        self.assertEqual(conversa.resumo, 'Resumo; Turno 4')
+        self.assertEqual(conversa.interacoes_resumidas, 1)
+
+    def test_comando(self):
+        saida = io.StringIO()
+        call_command('arquivar_interacoes', dias=365, max_blocos=1, bloco=5, pausa=0, stdout=saida)
+        self.assertIn('5 interações arquivadas', saida.getvalue())
+        self.assertEqual(Interacao.objects.count(), 3)
@@ -0,0 +1,172 @@
+"""
+Contagem de tokens para as interações.
+
+O uso real informado pelo provedor na resposta tem prioridade; esta contagem
+local é usada quando o provedor não informa o uso (ou quando a resposta é
+simulada).
+
+Os vocabulários do tiktoken ficam em CONTAGEM_TOKENS['DIRETORIO_CACHE']
+(exportado como TIKTOKEN_CACHE_DIR), preenchido no deploy com
+`manage.py baixar_tokenizadores`, e são carregados na inicialização do
+servidor (ver wsgi.py e asgi.py), e não na primeira interação. O servidor
+só lê o diretório de cache: os downloads ficam com o comando. Se os
+vocabulários não estiverem disponíveis, a contagem cai para uma
+aproximação calibrada para textos em português.
+"""
+import logging
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import tiktoken
+    from tiktoken import load as tiktoken_load
+except ImportError:  # pragma: no cover - tiktoken está em requirements.txt
+    tiktoken = tiktoken_load = None
+
+logger = logging.getLogger(__name__)
+
+# Codificação usada para modelos sem tokenizador próprio no tiktoken (ex.: DeepSeek)
+CODIFICACAO_PADRAO = "cl100k_base"
+
+CONFIG_PADRAO = {
+    'DIRETORIO_CACHE': None,
+    # o200k_base: família gpt-4o e modelos "o"; cl100k_base: gpt-4, gpt-3.5 e o padrão
+    'CODIFICACOES': ('o200k_base', CODIFICACAO_PADRAO),
+}
+
+_RE_PARTES = re.compile(r"\w+|[^\w\s]")
+
+# Codificações que não puderam ser carregadas na inicialização
+_indisponiveis = set()
+
+_somente_cache_lock = threading.Lock()
+
+
+def _config():
+    return dict(CONFIG_PADRAO, **getattr(settings, 'CONTAGEM_TOKENS', {}))
+
+
+def configurar_cache():
+    """
+    Aponta o tiktoken para o diretório dos vocabulários, se configurado e se
+    TIKTOKEN_CACHE_DIR não foi definido no ambiente.
+    """
+    diretorio = _config()['DIRETORIO_CACHE']
+    if diretorio:
+        os.environ.setdefault("TIKTOKEN_CACHE_DIR", str(diretorio))
+
+
+@contextmanager
+def _somente_cache():
+    """
+    Impede o tiktoken de baixar vocabulários: sem o arquivo no diretório de
+    cache, a carga falha com FileNotFoundError em vez de acessar a rede.
+    """
+    with _somente_cache_lock:
+        ler = tiktoken_load.read_file
+
+        def sem_download(caminho):
+            if "://" in caminho:
+                raise FileNotFoundError(
+                    f"{caminho} não está em {os.environ.get('TIKTOKEN_CACHE_DIR', 'cache do tiktoken')} "
+                    "(rode manage.py baixar_tokenizadores)"
+                )
+            return ler(caminho)
+
+        tiktoken_load.read_file = sem_download
+        try:
+            yield
+        finally:
+            tiktoken_load.read_file = ler
+
+
+def carregar_tokenizadores(baixar=False):
+    """
+    Carrega as codificações de CONTAGEM_TOKENS['CODIFICACOES'], que o
+    tiktoken mantém em memória: depois disso, get_encoder não lê
+    vocabulários. Só lê o diretório de cache; com `baixar`, o tiktoken baixa
+    os arquivos ausentes (é assim que o comando baixar_tokenizadores os
+    grava). Retorna {codificação: carregada}.
+    """
+    configurar_cache()
+    carregadas = {}
+    for nome in _config()['CODIFICACOES']:
+        carregadas[nome] = False
+        if tiktoken is None:
+            continue
+        try:
+            if baixar:
+                tiktoken.get_encoding(nome)
+            else:
+                with _somente_cache():
+                    tiktoken.get_encoding(nome)
+        except Exception as e:
+            # Não é tentado de novo a cada interação (ver get_encoder)
+            _indisponiveis.add(nome)
+            logger.warning("Vocabulário %s do tiktoken indisponível, usando estimativa: %s", nome, e)
+        else:
+            _indisponiveis.discard(nome)
+            carregadas[nome] = True
+    return carregadas
+
+
+@lru_cache(maxsize=None)
+def get_encoder(modelo=None):
+    """
+    Retorna o tokenizador do modelo, ou None se não puder ser carregado.
+    O resultado (inclusive a falha) fica em cache para não repetir o custo
+    de carregamento a cada interação; codificações que falharam em
+    carregar_tokenizadores não são tentadas de novo.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        nome = tiktoken.encoding_name_for_model(modelo or "")
+    except KeyError:
+        nome = CODIFICACAO_PADRAO
+    if nome in _indisponiveis:
+        return None
+    configurar_cache()
+    try:
+        with _somente_cache():
+            return tiktoken.get_encoding(nome)
+    except Exception as e:
+        logger.warning("Tokenizador indisponível para o modelo %s, usando estimativa: %s", modelo, e)
+        return None
+
+
+def estimar_tokens(texto):
+    """
+    Aproximação sem tokenizador: palavras em português viram, em média, um
+    token a cada quatro caracteres, e cada sinal de pontuação é um token.
+    """
+    return sum(math.ceil(len(parte) / 4) for parte in _RE_PARTES.findall(texto))
+
+
+def contar_tokens(texto, modelo=None):
+    """
+    Conta os tokens de um texto com o tokenizador do modelo.
+    """
+    if not texto:
+        return 0
+    encoder = get_encoder(modelo)
+    if encoder is None:
+        return estimar_tokens(texto)
+    return len(encoder.encode(texto, disallowed_special=()))
+
+
+def uso_da_mensagem(mensagem):
+    """
+    Extrai (tokens_prompt, tokens_resposta) do uso informado pelo provedor
+    em uma mensagem LangChain, ou None se o provedor não informou.
+    """
+    uso = getattr(mensagem, "usage_metadata", None)
+    if not uso:
+        return None
+    return uso.get("input_tokens", 0), uso.get("output_tokens", 0)
@@ -1,18 +1,109 @@
+import json
+from datetime import timedelta
+
 from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework import viewsets, permissions, filters, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Categoria, Curso, ConfiguracaoIA, Interacao
+from . import metrics, retention
+from .catalog_cache import CatalogoCacheMixin
+from .fast_serialization import ListaRapidaMixin, campos_pedidos, selecionar_campos
+from .filters import BuscaTextualFilter
+from .models import Categoria, Curso, ConfiguracaoIA, Interacao, Lote, MaterialCurso
+from .pagination import CursoCursorPagination, InteracaoCursorPagination
 from .serializers import (
-    CategoriaSerializer, CursoSerializer, 
-    ConfiguracaoIASerializer, InteracaoSerializer,
+    CategoriaSerializer, CategoriaSincronizacaoSerializer, CursoSerializer,
+    CursoSincronizacaoSerializer, ConfiguracaoIASerializer, InteracaoSerializer,
+    ItemLoteSerializer, LoteSerializer, MaterialCursoSerializer,
     PerguntaSerializer, UserSerializer
 )
-from .langchain_utils import process_question
+from .answer_cache import answer_cache
+from .batch_jobs import iniciar_processamento
+from .catalog_sync import max_itens, sincronizar_categorias, sincronizar_cursos
+from .interaction_export import FORMATOS, campos_disponiveis, exportar, exportar_async, filtrar, ler_data
+from .latency_report import AGRUPAMENTOS, INTERVALOS, resumo_desempenho
+from .retrieval import recuperar
+from .router import router
+from .langchain_utils import (
+    aprocess_question, astream_question, process_question, stream_question
+)
 
 # Create your views here.
 
+def _sse_response(conteudo):
+    """
+    Cria uma resposta Server-Sent Events sem buffer intermediário.
+    """
+    response = StreamingHttpResponse(conteudo, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _erro_response(response_class, result):
+    """
+    Converte o erro de process_question em resposta HTTP: 429 (com
+    Retry-After) para limites e orçamentos excedidos, 400 para os demais.
+    """
+    response = response_class(
+        {'error': result['error']},
+        status=result.get('status', status.HTTP_400_BAD_REQUEST)
+    )
+    if result.get('retry_after'):
+        response['Retry-After'] = str(result['retry_after'])
+    return response
+
+def _sse_format(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def _sse(eventos):
+    """
+    Formata os eventos (evento, dados) no protocolo SSE. Fechar este gerador
+    fecha também o gerador de eventos, que então salva a resposta parcial.
+    """
+    try:
+        for evento, dados in eventos:
+            yield _sse_format(evento, dados)
+    finally:
+        eventos.close()
+
+async def _asse(eventos):
+    """
+    Versão assíncrona de _sse.
+    """
+    try:
+        async for evento, dados in eventos:
+            yield _sse_format(evento, dados)
+    finally:
+        await eventos.aclose()
+
+def _sincronizar(request, serializer_class, sincronizar):
+    """
+    Valida a lista de itens (o corpo ou a chave "itens") de uma vez e
+    grava com `sincronizar` (ver catalog_sync.py). Qualquer item inválido
+    recusa a requisição inteira, sem gravar nada.
+    """
+    itens = request.data.get('itens') if isinstance(request.data, dict) else request.data
+    if not isinstance(itens, list) or not itens:
+        return Response({'error': "Envie uma lista de itens."}, status=status.HTTP_400_BAD_REQUEST)
+    if len(itens) > max_itens():
+        return Response(
+            {'error': f"No máximo {max_itens()} itens por requisição."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    serializer = serializer_class(data=itens, many=True)
+    if not serializer.is_valid():
+        return Response({'itens': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(sincronizar(serializer.validated_data))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 # Listar e Criar Usuários
 class UserListCreateView(generics.ListCreateAPIView):
     queryset = User.objects.all()
@@ -24,7 +115,7 @@ class UserRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = UserSerializer
 
 
-class CategoriaViewSet(viewsets.ModelViewSet):
+class CategoriaViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
     """
     API endpoint para visualizar e editar categorias.
     """
@@ -34,15 +125,23 @@ class CategoriaViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['nome', 'descricao']
     ordering_fields = ['nome', 'data_criacao']
+    
+    @action(detail=False, methods=['post'])
+    def sincronizar(self, request):
+        """
+        Cria ou atualiza categorias em massa pela chave_externa.
+        """
+        return _sincronizar(request, CategoriaSincronizacaoSerializer, sincronizar_categorias)
 
-class CursoViewSet(viewsets.ModelViewSet):
+class CursoViewSet(CatalogoCacheMixin, ListaRapidaMixin, viewsets.ModelViewSet):
     """
     API endpoint para visualizar e editar cursos.
     """
-    queryset = Curso.objects.all()
+    queryset = Curso.objects.select_related('categoria')
     serializer_class = CursoSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = CursoCursorPagination
+    filter_backends = [BuscaTextualFilter, filters.OrderingFilter]
     search_fields = ['titulo', 'descricao', 'categoria__nome']
     ordering_fields = ['titulo', 'data_publicacao', 'carga_horaria', 'nivel']
     
@@ -50,7 +149,7 @@ class CursoViewSet(viewsets.ModelViewSet):
         """
         Permite filtrar cursos por categoria e nível.
         """
-        queryset = Curso.objects.all()
+        queryset = Curso.objects.select_related('categoria')
         categoria_id = self.request.query_params.get('categoria', None)
         nivel = self.request.query_params.get('nivel', None)
         ativo = self.request.query_params.get('ativo', None)
@@ -65,6 +164,14 @@ class CursoViewSet(viewsets.ModelViewSet):
             
         return queryset
     
+    @action(detail=False, methods=['post'])
+    def sincronizar(self, request):
+        """
+        Cria ou atualiza cursos em massa pela chave_externa, com a categoria
+        pelo id ou pela chave externa dela.
+        """
+        return _sincronizar(request, CursoSincronizacaoSerializer, sincronizar_cursos)
+    
     @action(detail=True, methods=['post'], permission_classes=[permissions.AllowAny])
     def perguntar(self, request, pk=None):
         """
@@ -75,26 +182,83 @@ class CursoViewSet(viewsets.ModelViewSet):
         
         if serializer.is_valid():
             # Substituir o curso_id do serializer pelo ID do curso da URL
-            curso_id = curso.id
-            pergunta = serializer.validated_data['pergunta']
-            configuracao_id = serializer.validated_data.get('configuracao_id')
-            contexto = serializer.validated_data.get('contexto', '')
+            params = {
+                'curso_id': curso.id,
+                'pergunta': serializer.validated_data['pergunta'],
+                'configuracao_id': serializer.validated_data.get('configuracao_id'),
+                'contexto': serializer.validated_data.get('contexto', ''),
+                'conversa_id': serializer.validated_data.get('conversa_id'),
+                'usuario_id': request.user.id if request.user.is_authenticated else None
+            }
+            
+            # Modo streaming: enviar os tokens à medida que são gerados. Sob
+            # ASGI, um iterador síncrono seria consumido inteiro antes de
+            # enviar o primeiro byte, então o stream é o assíncrono
+            if serializer.validated_data.get('stream'):
+                if isinstance(request._request, ASGIRequest):
+                    return _sse_response(_asse(astream_question(**params)))
+                return _sse_response(_sse(stream_question(**params)))
             
             # Processar a pergunta
-            result = process_question(
-                curso_id=curso_id,
-                pergunta=pergunta,
-                configuracao_id=configuracao_id,
-                contexto=contexto
-            )
+            result = process_question(**params)
             
             if 'error' in result:
-                return Response({'error': result['error']}, status=status.HTTP_400_BAD_REQUEST)
+                return _erro_response(Response, result)
             
             return Response(result)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@csrf_exempt
+@require_POST
+async def perguntar_async(request, pk):
+    """
+    Versão assíncrona do endpoint perguntar, para uso sob ASGI: a requisição
+    não ocupa uma thread enquanto aguarda o provedor de IA.
+    """
+    if not await Curso.objects.filter(pk=pk).aexists():
+        raise Http404("Curso não encontrado.")
+    
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({'error': 'JSON inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = PerguntaSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    user = await request.auser()
+    params = {
+        'curso_id': pk,
+        'pergunta': serializer.validated_data['pergunta'],
+        'configuracao_id': serializer.validated_data.get('configuracao_id'),
+        'contexto': serializer.validated_data.get('contexto', ''),
+        'conversa_id': serializer.validated_data.get('conversa_id'),
+        'usuario_id': user.id if user.is_authenticated else None
+    }
+    
+    if serializer.validated_data.get('stream'):
+        return _sse_response(_asse(astream_question(**params)))
+    
+    result = await aprocess_question(**params)
+    
+    if 'error' in result:
+        return _erro_response(JsonResponse, result)
+    
+    return JsonResponse(result, json_dumps_params={'ensure_ascii': False})
+
+@require_GET
+def metricas(request):
+    """
+    Métricas do processo no formato de exposição do Prometheus (ver metrics.py).
+    """
+    if not metrics.ativo():
+        raise Http404
+    if not metrics.autorizado(request):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.registro.expor(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 class ConfiguracaoIAViewSet(viewsets.ModelViewSet):
     """
     API endpoint para gerenciar configurações de IA.
@@ -105,15 +269,25 @@ class ConfiguracaoIAViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['nome', 'descricao', 'modelo']
     ordering_fields = ['nome', 'data_criacao']
+    
+    @action(detail=False, methods=['get'])
+    def roteamento(self, request):
+        """
+        Estado do roteamento neste processo: latências, circuit breakers e
+        métricas de hedge (taxa de hedge e percentis de latência até o
+        primeiro token com e sem hedge) por configuração.
+        """
+        return Response(router.estado())
 
-class InteracaoViewSet(viewsets.ReadOnlyModelViewSet):
+class InteracaoViewSet(ListaRapidaMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint para visualizar interações com IA.
     """
-    queryset = Interacao.objects.all()
+    queryset = Interacao.objects.select_related('curso', 'configuracao_ia')
     serializer_class = InteracaoSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = InteracaoCursorPagination
+    filter_backends = [BuscaTextualFilter, filters.OrderingFilter]
     search_fields = ['pergunta', 'resposta', 'curso__titulo']
     ordering_fields = ['data_criacao']
     
@@ -121,10 +295,192 @@ class InteracaoViewSet(viewsets.ReadOnlyModelViewSet):
         """
         Permite filtrar interações por curso.
         """
-        queryset = Interacao.objects.all()
+        queryset = Interacao.objects.select_related('curso', 'configuracao_ia')
+        curso_id = self.request.query_params.get('curso', None)
+        
+        if curso_id:
+            queryset = queryset.filter(curso_id=curso_id)
+            
+        return queryset
+    
+    def get_object(self):
+        """
+        Aceita o id ou o UUID da interação (com a gravação adiada, o
+        interacao_id devolvido pelo endpoint perguntar é o UUID).
+        """
+        if not self.kwargs['pk'].isdigit():
+            self.lookup_field = 'uuid'
+            self.lookup_url_kwarg = 'pk'
+        return super().get_object()
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        As interações já arquivadas (ver retention.py) vêm do arquivo.
+        """
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            arquivada = retention.buscar(kwargs['pk'])
+            if arquivada is None:
+                raise
+        nomes = campos_pedidos(request, campos_disponiveis())
+        if nomes is not None:
+            arquivada = {nome: arquivada[nome] for nome in nomes if nome in arquivada}
+        return Response(arquivada)
+    
+    @action(detail=False, methods=['get'])
+    def cache(self, request):
+        """
+        Estatísticas do cache de respostas (acertos, tokens e tempo economizados).
+        """
+        if answer_cache is None:
+            return Response({'ativo': False})
+        return Response(dict(answer_cache.stats(), ativo=True))
+    
+    @action(detail=False, methods=['get'])
+    def desempenho(self, request):
+        """
+        Percentis (p50, p95, p99) das latências e contagens por resultado das
+        interações das últimas ?horas= (padrão 24), agrupadas por
+        ?agrupar=configuracao|curso e, com ?intervalo=hora|dia, por janela.
+        Aceita os filtros ?curso= e ?configuracao=.
+        """
+        agrupar = request.query_params.get('agrupar', 'configuracao')
+        intervalo = request.query_params.get('intervalo') or None
+        horas = request.query_params.get('horas', '24')
+        if agrupar not in AGRUPAMENTOS or (intervalo and intervalo not in INTERVALOS) or not horas.isdigit():
+            return Response(
+                {'error': f"Parâmetros inválidos: agrupar ({', '.join(AGRUPAMENTOS)}), "
+                          f"intervalo ({', '.join(INTERVALOS)}) e horas (inteiro)."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        desde = timezone.now() - timedelta(hours=int(horas))
+        queryset = Interacao.objects.filter(data_criacao__gte=desde)
+        curso_id = request.query_params.get('curso')
+        configuracao_id = request.query_params.get('configuracao')
+        if curso_id:
+            queryset = queryset.filter(curso_id=curso_id)
+        if configuracao_id:
+            queryset = queryset.filter(configuracao_ia_id=configuracao_id)
+        
+        return Response({
+            'desde': desde,
+            'agrupar': agrupar,
+            'intervalo': intervalo,
+            'grupos': resumo_desempenho(queryset, agrupar, intervalo),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def exportar(self, request):
+        """
+        Exporta as interações em streaming, em NDJSON ou CSV
+        (?formato=ndjson|csv), sem paginação. Aceita os filtros ?curso=,
+        ?configuracao=, ?desde= e ?ate= (data ou data e hora ISO 8601) e
+        ?fields=/?exclude=.
+        """
+        params = request.query_params
+        formato = params.get('formato', 'ndjson')
+        try:
+            if formato not in FORMATOS:
+                raise ValueError(f"Formato inválido: use {', '.join(FORMATOS)}.")
+            ids = {nome: params.get(nome) or None for nome in ('curso', 'configuracao')}
+            if any(valor is not None and not valor.isdigit() for valor in ids.values()):
+                raise ValueError("Os filtros curso e configuracao devem ser ids.")
+            queryset = filtrar(
+                Interacao.objects.all(), **ids,
+                desde=ler_data(params['desde']) if params.get('desde') else None,
+                ate=ler_data(params['ate'], fim=True) if params.get('ate') else None,
+            )
+            campos = selecionar_campos(campos_disponiveis(), params.get('fields'), params.get('exclude'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        conteudo = exportar(queryset, formato, campos)
+        if isinstance(request._request, ASGIRequest):
+            conteudo = exportar_async(conteudo)
+        response = StreamingHttpResponse(conteudo, content_type=FORMATOS[formato])
+        response['Content-Disposition'] = f'attachment; filename="interacoes.{formato}"'
+        return response
+
+class MaterialCursoViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint para os materiais dos cursos, usados como contexto das perguntas.
+    """
+    queryset = MaterialCurso.objects.all()
+    serializer_class = MaterialCursoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['titulo', 'data_atualizacao']
+    
+    def get_queryset(self):
+        """
+        Permite filtrar materiais por curso.
+        """
+        queryset = MaterialCurso.objects.all()
         curso_id = self.request.query_params.get('curso', None)
         
         if curso_id:
             queryset = queryset.filter(curso_id=curso_id)
             
         return queryset
+    
+    @action(detail=False, methods=['get'])
+    def buscar(self, request):
+        """
+        Trechos dos materiais de um curso mais similares ao texto (?curso=&q=),
+        os mesmos que entrariam no contexto de uma pergunta.
+        """
+        curso_id = request.query_params.get('curso', '')
+        texto = request.query_params.get('q', '')
+        if not curso_id.isdigit() or not texto:
+            return Response(
+                {'error': 'Informe o curso e o texto da busca (parâmetros curso e q).'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        trechos = [
+            {'material': titulo, 'texto': trecho, 'similaridade': round(similaridade, 4)}
+            for similaridade, titulo, trecho in recuperar(int(curso_id), texto)
+        ]
+        return Response({'curso': int(curso_id), 'trechos': trechos})
+
+class LoteViewSet(viewsets.ModelViewSet):
+    """
+    API endpoint para lotes de perguntas respondidas em segundo plano.
+    """
+    queryset = Lote.objects.all()
+    serializer_class = LoteSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['data_criacao', 'status']
+    
+    def perform_create(self, serializer):
+        serializer.save(usuario=self.request.user)
+    
+    @action(detail=True, methods=['post'])
+    def processar(self, request, pk=None):
+        """
+        Inicia (ou retoma) o processamento do lote em segundo plano.
+        """
+        lote = self.get_object()
+        if not iniciar_processamento(lote):
+            return Response(
+                {'error': f'O lote está {lote.get_status_display().lower()}.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        lote.refresh_from_db()
+        return Response(self.get_serializer(lote).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def itens(self, request, pk=None):
+        """
+        Lista os itens do lote, com a resposta dos já concluídos.
+        """
+        itens = self.get_object().itens.select_related('interacao')
+        status_item = request.query_params.get('status')
+        if status_item:
+            itens = itens.filter(status=status_item)
+        page = self.paginate_queryset(itens)
+        serializer = ItemLoteSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
@@ -0,0 +1,372 @@
+"""
+Gravação adiada (write-behind) das interações.
+
+Com ESCRITA_ADIADA['ATIVO'], as interações não são gravadas durante a
+requisição: entram em um buffer em memória e uma thread de fundo as grava em
+blocos com bulk_create, a cada INTERVALO segundos ou quando o buffer chega a
+TAMANHO_LOTE interações. A resposta sai sem esperar o banco (o
+`interacao_id` devolvido é sempre o UUID da interação; o endpoint de
+interações aceita o UUID e o id numérico).
+
+Para não perder interações se o processo morrer, cada uma também é anexada
+a um arquivo JSONL no DIRETORIO, apagado depois que o bloco é gravado. Os
+arquivos levam um token aleatório de cada processo, que mantém um lock
+(flock) no arquivo .lock do token enquanto vive: os diários cujo lock está
+livre são de processos que terminaram e são regravados quando o buffer de
+outro processo inicia (o UUID único impede duplicatas). Comparar pids não
+serve em contêineres, onde o pid se repete a cada reinício. No encerramento
+normal do processo, o que estiver no buffer é gravado.
+
+Um bloco que o banco recusa (por exemplo, o curso foi excluído) não trava
+os seguintes: as interações são gravadas uma a uma e as recusadas vão para
+um arquivo quarentena-*.jsonl no DIRETORIO, que pode ser corrigido e
+carregado com `manage.py loaddata`. Os demais erros são tentados de novo a
+cada flush, até TENTATIVAS vezes; depois disso o bloco também vai para a
+quarentena.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core import serializers
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from . import full_text
+from .models import Interacao
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PADRAO = {
+    'ATIVO': False,
+    'TAMANHO_LOTE': 100,
+    'INTERVALO': 1.0,
+    'DIRETORIO': None,
+    'FSYNC': False,
+    'TENTATIVAS': 5,
+}
+
+# Diários (interacoes-<token do processo>-<sequência>.jsonl) e o lock de cada processo
+_RE_ARQUIVO = re.compile(r"^interacoes-(\w+)-(\d+)\.jsonl$")
+_RE_LOCK = re.compile(r"^interacoes-(\w+)\.lock$")
+
+# Erros que se repetiriam em qualquer nova tentativa
+ERROS_PERMANENTES = (IntegrityError, DataError)
+
+
+def _travar(arquivo):
+    """
+    Abre `arquivo` e tenta o lock exclusivo sem esperar. Retorna o arquivo
+    aberto e travado, ou None se outro processo mantém o lock.
+    """
+    lock = open(arquivo, 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def _desfazer_ids(interacoes):
+    # O bulk_create desfeito pode ter atribuído ids
+    for interacao in interacoes:
+        interacao.pk = None
+        interacao._state.adding = True
+
+
+class InteracaoBuffer:
+    """
+    Buffer das interações a gravar, com o diário em disco do bloco atual.
+    """
+
+    def __init__(self, diretorio, tamanho_lote=100, intervalo=1.0, fsync=False, tentativas=5, automatico=True):
+        self.diretorio = Path(diretorio)
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.fsync = fsync
+        self.tentativas = tentativas
+        self.automatico = automatico
+        self.token = uuid.uuid4().hex
+        # Lock mantido enquanto o processo vive (ver recuperar)
+        self._lock_processo = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._diario = None
+        self._sequencia = 0
+        # Blocos já retirados do buffer e ainda não gravados: (arquivo, interações)
+        self._blocos = []
+        # Tentativas que falharam, por arquivo do bloco
+        self._falhas = {}
+        self._por_conversa = {}
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(CONFIG_PADRAO, **getattr(settings, 'ESCRITA_ADIADA', {}))
+        if not conf['ATIVO']:
+            return None
+        return cls(
+            diretorio=conf['DIRETORIO'] or Path(settings.BASE_DIR) / 'escrita_adiada',
+            tamanho_lote=conf['TAMANHO_LOTE'],
+            intervalo=conf['INTERVALO'],
+            fsync=conf['FSYNC'],
+            tentativas=conf['TENTATIVAS'],
+        )
+
+    def _arquivo(self, sequencia):
+        return self.diretorio / f"interacoes-{self.token}-{sequencia}.jsonl"
+
+    def _arquivo_lock(self, token):
+        return self.diretorio / f"interacoes-{token}.lock"
+
+    def _abrir_diretorio(self):
+        # Chamado com self._lock: o lock do processo vem antes do primeiro diário
+        if self._lock_processo is None:
+            self.diretorio.mkdir(parents=True, exist_ok=True)
+            if fcntl is not None:
+                # O .lock só aparece com o nome final depois de travado
+                temporario = self.diretorio / f".interacoes-{self.token}.lock"
+                lock = _travar(temporario)
+                os.replace(temporario, self._arquivo_lock(self.token))
+                self._lock_processo = lock
+
+    def adicionar(self, interacao):
+        """
+        Coloca a interação (ainda sem id) na fila de gravação.
+        """
+        linha = serializers.serialize('jsonl', [interacao])
+        with self._lock:
+            if self._diario is None:
+                self._abrir_diretorio()
+                self._diario = open(self._arquivo(self._sequencia), 'a', encoding='utf-8')
+            self._diario.write(linha if linha.endswith("\n") else linha + "\n")
+            self._diario.flush()
+            if self.fsync:
+                os.fsync(self._diario.fileno())
+            self._buffer.append(interacao)
+            if interacao.conversa_id:
+                self._por_conversa.setdefault(interacao.conversa_id, []).append(interacao)
+            cheio = len(self._buffer) >= self.tamanho_lote
+        if self.automatico:
+            self.iniciar()
+            if cheio:
+                self._acordar.set()
+
+    def pendentes(self, conversa_id):
+        """
+        Interações da conversa que ainda não foram gravadas, da mais antiga
+        para a mais recente.
+        """
+        with self._lock:
+            return list(self._por_conversa.get(conversa_id, ()))
+
+    def _procurar(self, chave):
+        for interacao in self._buffer:
+            if interacao.uuid == chave:
+                return interacao
+        for _, interacoes in self._blocos:
+            for interacao in interacoes:
+                if interacao.uuid == chave:
+                    return interacao
+        return None
+
+    def pendente(self, chave):
+        """
+        A interação com o UUID `chave`, se ainda não foi gravada, ou None.
+        """
+        with self._lock:
+            return self._procurar(chave)
+
+    def vincular(self, chave, conversa_id):
+        """
+        Coloca na conversa a interação pendente que a abriu (ver
+        conversation_memory.obter_conversa). Retorna False se ela já foi gravada.
+        """
+        with self._lock:
+            interacao = self._procurar(chave)
+            if interacao is None:
+                return False
+            interacao.conversa_id = conversa_id
+            self._por_conversa.setdefault(conversa_id, []).append(interacao)
+            return True
+
+    def _separar_bloco(self):
+        with self._lock:
+            if self._buffer:
+                self._diario.close()
+                self._blocos.append((self._arquivo(self._sequencia), self._buffer))
+                self._buffer = []
+                self._diario = None
+                self._sequencia += 1
+            return list(self._blocos)
+
+    def _gravar(self, interacoes):
+        with transaction.atomic():
+            Interacao.objects.bulk_create(interacoes)
+            full_text.indexar(interacoes)
+
+    def _quarentena(self, arquivo, interacoes):
+        """
+        Grava uma a uma as interações do bloco recusado; as que o banco
+        recusar de novo vão para o arquivo de quarentena.
+        """
+        recusadas = []
+        for interacao in interacoes:
+            try:
+                self._gravar([interacao])
+            except Exception as e:
+                _desfazer_ids([interacao])
+                recusadas.append(interacao)
+                logger.error("Interação adiada %s recusada: %s", interacao.uuid, e)
+        if recusadas:
+            quarentena = arquivo.with_name(arquivo.name.replace("interacoes-", "quarentena-", 1))
+            with open(quarentena, 'a', encoding='utf-8') as saida:
+                saida.write(serializers.serialize('jsonl', recusadas).rstrip("\n") + "\n")
+            logger.error("%s interações adiadas movidas para %s", len(recusadas), quarentena.name)
+
+    def _concluir(self, arquivo, interacoes):
+        arquivo.unlink(missing_ok=True)
+        with self._lock:
+            self._blocos = [bloco for bloco in self._blocos if bloco[0] != arquivo]
+            self._falhas.pop(arquivo, None)
+            for interacao in interacoes:
+                pendentes = self._por_conversa.get(interacao.conversa_id)
+                if pendentes and interacao in pendentes:
+                    pendentes.remove(interacao)
+                    if not pendentes:
+                        del self._por_conversa[interacao.conversa_id]
+
+    def flush(self):
+        """
+        Grava tudo o que está no buffer. Um bloco que falhar por erro
+        transitório fica para a próxima tentativa (e continua no diário em
+        disco); um bloco recusado pelo banco vai para a quarentena. Os
+        demais blocos são gravados em qualquer caso.
+        """
+        with self._flush_lock:
+            for arquivo, interacoes in self._separar_bloco():
+                try:
+                    self._gravar(interacoes)
+                except Exception as e:
+                    _desfazer_ids(interacoes)
+                    falhas = self._falhas.get(arquivo, 0) + 1
+                    logger.error("Erro ao gravar %s interações adiadas (tentativa %s): %s",
+                                 len(interacoes), falhas, e)
+                    if not isinstance(e, ERROS_PERMANENTES) and falhas < self.tentativas:
+                        self._falhas[arquivo] = falhas
+                        continue
+                    self._quarentena(arquivo, interacoes)
+                self._concluir(arquivo, interacoes)
+                logger.debug("%s interações adiadas gravadas", len(interacoes))
+
+    def _tokens_encerrados(self):
+        """
+        Tokens dos processos que terminaram, cada um com o lock do token já
+        travado por este processo (None para os diários sem arquivo .lock,
+        de versões anteriores). Sem fcntl (Windows), nada é recuperado.
+        """
+        if fcntl is None:
+            return {}
+        vistos, tokens = {self.token}, {}
+        for arquivo in sorted(self.diretorio.iterdir()):
+            encontrado = _RE_ARQUIVO.match(arquivo.name) or _RE_LOCK.match(arquivo.name)
+            if not encontrado or encontrado.group(1) in vistos:
+                continue
+            token = encontrado.group(1)
+            vistos.add(token)
+            arquivo_lock = self._arquivo_lock(token)
+            if not arquivo_lock.exists():
+                tokens[token] = None
+                continue
+            lock = _travar(arquivo_lock)
+            if lock is not None:
+                tokens[token] = lock
+        return tokens
+
+    def recuperar(self):
+        """
+        Grava as interações dos diários deixados por processos que
+        terminaram sem gravá-las. Retorna quantas foram recuperadas.
+        """
+        if not self.diretorio.is_dir():
+            return 0
+        total = 0
+        for token, lock in self._tokens_encerrados().items():
+            try:
+                for arquivo in sorted(self.diretorio.glob(f"interacoes-{token}-*.jsonl")):
+                    total += self._recuperar_arquivo(arquivo)
+                if lock is not None:
+                    self._arquivo_lock(token).unlink(missing_ok=True)
+            finally:
+                if lock is not None:
+                    lock.close()
+        return total
+
+    def _recuperar_arquivo(self, arquivo):
+        with open(arquivo, encoding='utf-8') as diario:
+            # Uma última linha incompleta (processo morto no meio da escrita) é descartada
+            linhas = [linha for linha in diario if linha.endswith("\n")]
+        interacoes = [objeto.object for objeto in serializers.deserialize('jsonl', linhas)]
+        try:
+            with transaction.atomic():
+                Interacao.objects.bulk_create(interacoes, ignore_conflicts=True)
+                full_text.reindexar(Interacao.objects.filter(uuid__in=[i.uuid for i in interacoes]))
+        except ERROS_PERMANENTES as e:
+            logger.error("Erro ao recuperar %s: %s", arquivo.name, e)
+            gravadas = set(Interacao.objects.filter(uuid__in=[i.uuid for i in interacoes]).values_list('uuid', flat=True))
+            self._quarentena(arquivo, [i for i in interacoes if i.uuid not in gravadas])
+        arquivo.unlink()
+        logger.info("%s interações recuperadas de %s", len(interacoes), arquivo.name)
+        return len(interacoes)
+
+    def _executar(self):
+        try:
+            self.recuperar()
+        except Exception as e:
+            logger.error("Erro ao recuperar interações adiadas: %s", e)
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            self.flush()
+            close_old_connections()
+
+    def iniciar(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name="escrita-adiada", daemon=True)
+                self._thread.start()
+                atexit.register(self.parar)
+
+    def parar(self):
+        """
+        Encerra a thread de fundo e grava o que restou no buffer.
+        """
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.intervalo + 5)
+        self.flush()
+        with self._lock:
+            # Com blocos ainda não gravados, o lock é liberado na saída e outro processo os recupera
+            if self._lock_processo is not None and not self._buffer and not self._blocos:
+                self._arquivo_lock(self.token).unlink(missing_ok=True)
+                self._lock_processo.close()
+                self._lock_processo = None
+
+
+write_behind = InteracaoBuffer.from_settings()
@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cognicursos.settings")
 
 application = get_asgi_application()
+
+# Os tokenizadores são carregados aqui, e não na primeira interação de cada processo.
+# Só do diretório de cache: os downloads ficam com manage.py baixar_tokenizadores
+from api.tokens import carregar_tokenizadores  # noqa: E402
+
+carregar_tokenizadores()
@@ -10,11 +10,22 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+load_dotenv(BASE_DIR / ".env")
+
+
+def _env_bool(nome, padrao=False):
+    return os.getenv(nome, str(padrao)).strip().lower() in ("1", "true", "sim", "yes")
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -46,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.RequestIdMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -79,11 +91,100 @@ WSGI_APPLICATION = "cognicursos.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# Perfil do banco, escolhido pela variável de ambiente BANCO:
+# - "sqlite" (padrão): um único nó. Com WAL, as leituras não esperam a
+#   escrita em andamento; os escritores esperam o lock por até
+#   SQLITE_BUSY_TIMEOUT segundos em vez de falhar com "database is locked".
+# - "postgres": vários nós, com conexões persistentes (CONN_MAX_AGE) ou,
+#   com POSTGRES_POOL=true, o pool de conexões do psycopg (psycopg[pool]).
+BANCO = os.getenv("BANCO", "sqlite")
+
+if BANCO == "postgres":
+    # O psycopg não está em requirements.txt: o perfil padrão é o SQLite
+    if find_spec("psycopg") is None or (_env_bool("POSTGRES_POOL") and find_spec("psycopg_pool") is None):
+        raise ImproperlyConfigured(
+            'BANCO=postgres requer o psycopg: pip install "psycopg[binary,pool]"'
+        )
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB", "cognicursos"),
+            "USER": os.getenv("POSTGRES_USER", "cognicursos"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+    if _env_bool("POSTGRES_POOL"):
+        # O pool substitui as conexões persistentes (o Django não aceita os dois)
+        DATABASES["default"]["OPTIONS"] = {
+            "pool": {
+                "min_size": int(os.getenv("POSTGRES_POOL_MIN", "2")),
+                "max_size": int(os.getenv("POSTGRES_POOL_MAX", "20")),
+                "timeout": int(os.getenv("POSTGRES_POOL_TIMEOUT", "10")),
+            }
+        }
+    else:
+        DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("CONN_MAX_AGE", "60"))
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": int(os.getenv("CONN_MAX_AGE", "60")),
+            "OPTIONS": {
+                # busy_timeout: quanto um escritor espera pelo lock. As transações
+                # ficam em DEFERRED: com IMMEDIATE, também as de leitura (e os
+                # select_for_update, que no SQLite não travam nada) pegariam o
+                # lock de escrita e deixariam de rodar em paralelo no WAL
+                "timeout": float(os.getenv("SQLITE_BUSY_TIMEOUT", "20")),
+            },
+        }
     }
+
+# PRAGMAs aplicados a cada nova conexão SQLite (ver api/signals.py)
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    # Com WAL, NORMAL só sincroniza o disco nos checkpoints (seguro contra
+    # falha do processo; uma queda de energia pode perder as últimas transações)
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": -20000,  # 20 MB por conexão
+    "temp_store": "MEMORY",
+}
+
+
+# Logging (api/structured_logging.py). LOG_NIVEL vale para os loggers da
+# API: o padrão WARNING deixa o ambiente local e os testes sem o registro
+# por interação; em produção, use INFO. Bibliotecas de terceiros só
+# registram avisos. LOG_FORMATO "json"
+# gera uma linha JSON por registro; "texto", uma linha legível. Com
+# LOG_AMOSTRAGEM < 1, só essa fração das requisições registra DEBUG e INFO
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "request_id": {"()": "api.structured_logging.RequestIdFilter"},
+        "amostragem": {
+            "()": "api.structured_logging.AmostragemFilter",
+            "taxa": float(os.getenv("LOG_AMOSTRAGEM", "1.0")),
+        },
+    },
+    "formatters": {
+        "json": {"()": "api.structured_logging.JSONFormatter"},
+        "texto": {"format": "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"},
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": os.getenv("LOG_FORMATO", "json"),
+            "filters": ["request_id", "amostragem"],
+        },
+    },
+    "root": {"handlers": ["console"], "level": "WARNING"},
+    "loggers": {
+        "api": {"handlers": ["console"], "level": os.getenv("LOG_NIVEL", "WARNING"), "propagate": False},
+    },
 }
 
 
@@ -134,5 +235,181 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # Usa o orjson quando instalado (api/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.JSONRapidoRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Listagens de cursos e interações montadas com .values() em vez do
+# serializer linha a linha (api/fast_serialization.py). Os parâmetros
+# ?fields= e ?exclude= valem com ou sem o caminho rápido.
+SERIALIZACAO_RAPIDA = {
+    'ATIVO': True,
+}
+
+# Cache de respostas do endpoint perguntar
+CACHE_RESPOSTAS = {
+    'ATIVO': True,
+    # 'memoria' (no processo, com descarte LRU) ou 'django' (usa CACHES[ALIAS])
+    'BACKEND': 'memoria',
+    'ALIAS': 'default',
+    'TTL': 60 * 60 * 24,
+    'MAX_ENTRADAS': 5000,
+    # Reutilizar respostas de perguntas parafraseadas (similaridade TF-IDF)
+    'SIMILARIDADE': False,
+    'LIMIAR_SIMILARIDADE': 0.85,
+    # Perguntas por curso no índice de similaridade (as mais antigas saem)
+    'HISTORICO_SIMILARIDADE': 1000,
+}
+
+# Histórico de conversa enviado ao modelo: últimos turnos na íntegra e
+# turnos mais antigos condensados em um resumo acumulado
+HISTORICO_CONVERSA = {
+    'JANELA': 4,
+    'MAX_CARACTERES_TURNO': 1000,
+    'MAX_CARACTERES_RESUMO': 1500,
+    # Reescrever o resumo com o próprio modelo (uma chamada extra a cada turno resumido)
+    'RESUMO_LLM': False,
+}
+
+# Cache HTTP do catálogo (api/catalog_cache.py): listagens e detalhes de
+# cursos e categorias com ETag/Last-Modified e páginas serializadas em cache,
+# invalidadas a cada save ou exclusão de Curso ou Categoria. Com mais de um
+# worker, ALIAS deve apontar para um cache compartilhado.
+CACHE_CATALOGO = {
+    'ATIVO': True,
+    'ALIAS': 'default',
+    # Validade, em segundos, das páginas em cache (as de versões antigas expiram sozinhas)
+    'TTL': 60 * 10,
+}
+
+# Exportação das interações em NDJSON/CSV (api/interaction_export.py)
+EXPORTACAO_INTERACOES = {
+    # Linhas lidas do banco e codificadas por bloco enviado
+    'TAMANHO_BLOCO': 2000,
+}
+
+# Retenção das interações (api/retention.py): o comando arquivar_interacoes
+# move as interações mais antigas que DIAS para segmentos comprimidos
+RETENCAO_INTERACOES = {
+    'DIAS': 180,
+    # Interações por segmento do arquivo (e por transação)
+    'TAMANHO_BLOCO': 1000,
+    # Pausa, em segundos, entre os blocos
+    'PAUSA': 0.1,
+    # Nível do zlib (1 a 9)
+    'NIVEL_COMPRESSAO': 6,
+}
+
+# Sincronização em massa de cursos e categorias (api/catalog_sync.py)
+SINCRONIZACAO_CATALOGO = {
+    # Itens aceitos por requisição
+    'MAX_ITENS': 5000,
+    # Linhas por INSERT/UPDATE do bulk_create e bulk_update
+    'TAMANHO_BLOCO': 500,
+}
+
+# Contagem local de tokens (api/tokens.py), usada quando o provedor não
+# informa o uso. Os vocabulários do tiktoken ficam em DIRETORIO_CACHE,
+# preenchido no deploy com "manage.py baixar_tokenizadores"
+CONTAGEM_TOKENS = {
+    'DIRETORIO_CACHE': os.getenv("TIKTOKEN_CACHE_DIR", str(BASE_DIR / "tiktoken_cache")),
+    # Carregadas na inicialização do servidor (wsgi.py e asgi.py)
+    'CODIFICACOES': ('o200k_base', 'cl100k_base'),
+}
+
+# Limites de taxa por configuração de IA e orçamentos diários de tokens.
+# Os limites de cada configuração (requisições e tokens por minuto) e o
+# orçamento diário de cada curso ficam nos próprios modelos. Com mais de um
+# worker, ALIAS deve apontar para um cache compartilhado.
+LIMITE_TAXA = {
+    'ALIAS': 'default',
+    # Tempo máximo, em segundos, que uma requisição aguarda na fila
+    'ESPERA_MAXIMA': 10,
+    # Tempo máximo, em segundos, aguardando a trava do bucket (depois disso, 429)
+    'ESPERA_TRAVA': 2.0,
+    # Orçamento diário de tokens por usuário autenticado (None = sem limite)
+    'ORCAMENTO_DIARIO_USUARIO': None,
+}
+
+# Roteamento entre as configurações de IA ativas (api/router.py)
+# A escolha é ponderada pelo campo peso de cada configuração e pela latência
+# média recente; erros transitórios passam a pergunta para a próxima
+# configuração antes de recorrer à resposta simulada.
+ROTEAMENTO = {
+    # Total de tentativas por pergunta, somando todas as configurações
+    'TENTATIVAS': 3,
+    # Fator da média móvel exponencial das latências
+    'ALFA_EWMA': 0.2,
+    # Falhas consecutivas que abrem o circuit breaker de um provedor
+    'FALHAS_PARA_ABRIR': 5,
+    # Segundos até o circuito aberto deixar passar uma requisição de teste
+    'SEGUNDOS_ABERTO': 30,
+    # Latências recentes guardadas por configuração (percentis e métricas de hedge)
+    'AMOSTRAS_LATENCIA': 500,
+    # Com hedge ativo, amostras necessárias antes de usar o percentil da
+    # configuração; até lá, o hedge é disparado após HEDGE_ATRASO_PADRAO segundos
+    'HEDGE_AMOSTRAS_MINIMAS': 20,
+    'HEDGE_ATRASO_PADRAO': 2.0,
+    # Fração das chamadas vencidas pelo hedge em que a chamada original só é
+    # cancelada após o primeiro token (no máximo HEDGE_OBSERVACAO_MAXIMA
+    # segundos), para medir a redução da latência de cauda
+    'HEDGE_AMOSTRAGEM': 0.1,
+    'HEDGE_OBSERVACAO_MAXIMA': 30,
+}
+
+# Busca textual de cursos e interações (FTS5 no SQLite, tsvector no
+# PostgreSQL). Desativada, ou em outros bancos, a busca usa icontains
+BUSCA_TEXTUAL = {
+    'ATIVO': True,
+}
+
+# Gravação adiada das interações: a resposta sai sem esperar o INSERT e uma
+# thread de fundo grava as interações em blocos (bulk_create). Cada
+# interação também vai para um diário JSONL em DIRETORIO (padrão:
+# BASE_DIR / 'escrita_adiada'), regravado se o processo morrer antes
+ESCRITA_ADIADA = {
+    'ATIVO': False,
+    # Interações por bloco e segundos máximos entre gravações
+    'TAMANHO_LOTE': 100,
+    'INTERVALO': 1.0,
+    'DIRETORIO': None,
+    # Forçar o diário para o disco a cada interação (mais durável, mais lento)
+    'FSYNC': False,
+    # Flushes com erro transitório antes de um bloco ir para a quarentena
+    'TENTATIVAS': 5,
+}
+
+# Materiais dos cursos usados como contexto das perguntas (api/retrieval.py).
+# Cada material é dividido em trechos de TAMANHO_TRECHO caracteres e os
+# TOP_K trechos mais similares à pergunta entram no contexto do prompt
+MATERIAIS_CURSO = {
+    'ATIVO': True,
+    # Posições do embedding; ao mudar, rode "manage.py indexar_materiais"
+    'DIMENSOES': 256,
+    'TAMANHO_TRECHO': 800,
+    'SOBREPOSICAO': 150,
+    'TOP_K': 4,
+    # Similaridade (produto interno, de 0 a 1) mínima de um trecho
+    'SIMILARIDADE_MINIMA': 0.1,
+    # Limite de caracteres dos trechos somados no contexto
+    'MAX_CARACTERES': 3000,
+    # Segundos até recarregar os vetores de um curso do banco
+    'TTL_INDICE': 300,
+}
+
+# Métricas no formato do Prometheus em /metrics (api/metrics.py), por processo
+METRICAS = {
+    'ATIVO': True,
+    # Se definido, o /metrics exige o cabeçalho "Authorization: Bearer <TOKEN>";
+    # sem ele, fora do DEBUG, só usuários staff e os IPs abaixo acessam
+    'TOKEN': os.getenv("METRICAS_TOKEN") or None,
+    # IPs (REMOTE_ADDR) liberados sem token. Atrás de um proxy reverso no mesmo
+    # host, todas as requisições chegam de 127.0.0.1: prefira o token
+    'IPS_PERMITIDOS': tuple(ip.strip() for ip in os.getenv("METRICAS_IPS", "").split(",") if ip.strip()),
+    # Limites dos buckets dos histogramas, em segundos
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
 }
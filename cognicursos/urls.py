@@ -31,6 +31,8 @@ router.register(r'categorias', views.CategoriaViewSet)
 router.register(r'cursos', views.CursoViewSet)
 router.register(r'configuracoes-ia', views.ConfiguracaoIAViewSet)
 router.register(r'interacoes', views.InteracaoViewSet)
+router.register(r'lotes', views.LoteViewSet)
+router.register(r'materiais', views.MaterialCursoViewSet)
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -38,4 +40,6 @@ urlpatterns = [
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
     path('api/usuarios/', UserListCreateView.as_view(), name='user-list-create'),
     path('api/usuarios/<int:pk>/', UserRetrieveUpdateDeleteView.as_view(), name='user-detail'),
+    path('api/cursos/<int:pk>/perguntar-async/', views.perguntar_async, name='curso-perguntar-async'),
+    path('metrics', views.metricas, name='metricas'),
 ]